@@ -5,6 +5,8 @@ Page({
     activities: [],
     societies: [],
     selectedSocietyId: '',
+    nextCursor: null,
+    loadingMore: false,
     loading: true
   },
   _navigatingToDetail: false,
@@ -32,17 +34,27 @@ Page({
     this.setData({ selectedSocietyId: societyId, loading: true });
     this.fetchActivities();
   },
-  fetchActivities(cb) {
-    const query = this.data.selectedSocietyId ? `?society_id=${this.data.selectedSocietyId}` : '';
+  onReachBottom() {
+    if (this.data.nextCursor && !this.data.loadingMore) {
+      this.fetchActivities(null, true);
+    }
+  },
+  fetchActivities(cb, append) {
+    const params = [];
+    if (this.data.selectedSocietyId) params.push(`society_id=${this.data.selectedSocietyId}`);
+    if (append && this.data.nextCursor) params.push(`cursor=${encodeURIComponent(this.data.nextCursor)}`);
+    const query = params.length ? `?${params.join('&')}` : '';
+    if (append) this.setData({ loadingMore: true });
     wx.request({
       url: app.globalData.baseUrl + '/api/mp/activities' + query,
       success: (res) => {
         if(res.data.success) {
-          this.setData({ activities: res.data.data });
+          const list = append ? this.data.activities.concat(res.data.data) : res.data.data;
+          this.setData({ activities: list, nextCursor: res.data.next_cursor || null });
         }
       },
       complete: () => {
-        this.setData({ loading: false });
+        this.setData({ loading: false, loadingMore: false });
         if(cb) cb();
       }
     });
@@ -13,6 +13,8 @@ Page({
     activities: [],
     filteredActivities: [],
     filterStatus: 'all',
+    nextCursor: null,
+    loadingMore: false,
     loading: true
   },
   onShow() {
@@ -28,15 +30,22 @@ Page({
     }
     this.fetchData();
   },
-  fetchData() {
-    this.setData({loading: true});
+  onReachBottom() {
+    if (this.data.nextCursor && !this.data.loadingMore) {
+      this.fetchData(true);
+    }
+  },
+  fetchData(append) {
+    const query = append && this.data.nextCursor ? `?cursor=${encodeURIComponent(this.data.nextCursor)}` : '';
+    this.setData(append ? {loadingMore: true} : {loading: true});
     wx.request({
-      url: app.globalData.baseUrl + '/api/mp/my_activities',
+      url: app.globalData.baseUrl + '/api/mp/my_activities' + query,
       method: 'GET',
       header: { 'Authorization': app.globalData.token },
       success: (res) => {
         if(res.data.success){
-          this.setData({ activities: res.data.data }, () => {
+          const list = append ? this.data.activities.concat(res.data.data) : res.data.data;
+          this.setData({ activities: list, nextCursor: res.data.next_cursor || null }, () => {
             this.applyFilter();
           });
         } else {
@@ -46,7 +55,7 @@ Page({
         }
       },
       complete: () => {
-        this.setData({loading: false});
+        this.setData({loading: false, loadingMore: false});
       }
     })
   },
@@ -2,20 +2,29 @@ const app = getApp();
 Page({
   data: {
     notifications: [],
+    nextCursor: null,
+    loadingMore: false,
     loading: true
   },
   onShow() {
     this.fetchData();
   },
-  fetchData() {
-    this.setData({ loading: true });
+  onReachBottom() {
+    if (this.data.nextCursor && !this.data.loadingMore) {
+      this.fetchData(true);
+    }
+  },
+  fetchData(append) {
+    const query = append && this.data.nextCursor ? `?cursor=${encodeURIComponent(this.data.nextCursor)}` : '';
+    this.setData(append ? { loadingMore: true } : { loading: true });
     wx.request({
-      url: app.globalData.baseUrl + '/api/mp/notifications',
+      url: app.globalData.baseUrl + '/api/mp/notifications' + query,
       method: 'GET',
       header: { 'Authorization': app.globalData.token },
       success: (res) => {
         if(res.data.success){
-          this.setData({ notifications: res.data.data });
+          const list = append ? this.data.notifications.concat(res.data.data) : res.data.data;
+          this.setData({ notifications: list, nextCursor: res.data.next_cursor || null });
           if (app.updateUnreadCount) app.updateUnreadCount();
         } else {
             if(res.data.need_login) {
@@ -33,7 +42,7 @@ Page({
         }
       },
       complete: () => {
-        this.setData({ loading: false });
+        this.setData({ loading: false, loadingMore: false });
         wx.stopPullDownRefresh();
       }
     });
@@ -0,0 +1,104 @@
+"""
+出站 LLM 请求对比：每次 requests.post 新建连接，与共享连接池的 LLMClient。
+
+用法：
+    python scripts/benchmark_llm_client.py                   # 本地启动模拟 Ark 服务并对比
+    python scripts/benchmark_llm_client.py --requests 200 --concurrency 8
+    python scripts/benchmark_llm_client.py --url https://.../chat/completions --api-key xxx   # 对真实接口（消耗额度）
+
+脚本依次执行：
+    1. 直接 requests.post 与 LLMClient.post 各发出同样数量的非流式对话请求，比较耗时与新建连接数；
+    2. 熔断演示：模拟上游变慢（超过请求超时），统计实际发出的请求与被熔断直接拒绝的请求。
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from scripts.mock_ark_server import start_mock_server
+from src.utils.llm_client import CircuitOpenError, LLMClient
+
+
+def _payload(model):
+    return {'model': model, 'messages': [{'role': 'user', 'content': '你好'}], 'temperature': 0.7}
+
+
+def _run(post, url, headers, model, total, concurrency):
+    def one(_):
+        started = time.perf_counter()
+        response = post(url, json=_payload(model), headers=headers, timeout=(5, 30))
+        response.raise_for_status()
+        response.json()
+        return (time.perf_counter() - started) * 1000
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        samples = list(executor.map(one, range(total)))
+    return samples, time.perf_counter() - started
+
+
+def _report(label, samples, elapsed, connections=None):
+    extra = f"  新建连接 {connections}" if connections is not None else ''
+    print(f"{label:<22} 总耗时 {elapsed:6.2f}s  中位数 {statistics.median(samples):7.1f}ms  "
+          f"p90 {sorted(samples)[int(len(samples) * 0.9) - 1]:7.1f}ms{extra}")
+
+
+def _breaker_demo(url, headers, model, state):
+    client = LLMClient(pool_size=4, failure_threshold=3, reset_seconds=2)
+    state.latency = 1.0
+    sent = rejected = 0
+    started = time.perf_counter()
+    for _ in range(20):
+        try:
+            client.post(url, json=_payload(model), headers=headers, timeout=(1, 0.3))
+            sent += 1
+        except CircuitOpenError:
+            rejected += 1
+        except requests.exceptions.RequestException:
+            sent += 1
+    print(f"上游变慢（1s > 超时0.3s）：20 次调用耗时 {time.perf_counter() - started:.2f}s，"
+          f"实际发出 {sent} 次，熔断直接拒绝 {rejected} 次")
+
+    state.latency = 0.0
+    time.sleep(2.1)
+    client.post(url, json=_payload(model), headers=headers, timeout=(1, 5))
+    print(f"上游恢复后半开探测成功，熔断状态: {client.snapshot()[model]['breaker']['state']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='对比直接 requests.post 与共享连接池的 LLMClient')
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--url', default='', help='不填则本地启动模拟 Ark 服务')
+    parser.add_argument('--api-key', default=os.environ.get('ARK_API_KEY', ''))
+    parser.add_argument('--model', default='mock-model')
+    parser.add_argument('--port', type=int, default=18080)
+    args = parser.parse_args()
+
+    state = None
+    url = args.url
+    if not url:
+        _, state = start_mock_server(port=args.port, latency=0.02)
+        url = f'http://127.0.0.1:{args.port}/api/v3/chat/completions'
+    headers = {'Content-Type': 'application/json', 'Authorization': f'Bearer {args.api_key or "mock"}'}
+
+    before = state.connections if state else None
+    samples, elapsed = _run(requests.post, url, headers, args.model, args.requests, args.concurrency)
+    _report('直接 requests.post', samples, elapsed, state.connections - before if state else None)
+
+    client = LLMClient(pool_size=args.concurrency)
+    before = state.connections if state else None
+    samples, elapsed = _run(client.post, url, headers, args.model, args.requests, args.concurrency)
+    _report('LLMClient（连接池）', samples, elapsed, state.connections - before if state else None)
+
+    if state:
+        _breaker_demo(url, headers, args.model, state)
+
+
+if __name__ == '__main__':
+    main()
@@ -7,6 +7,7 @@ DOMAIN="reg.cqaibase.cn"
 APP_DIR="/var/www/reg/current"
 STORAGE_DIR="/var/www/reg/storage"
 ACTIVITY_DOCS_DIR="${STORAGE_DIR}/activity_docs"
+POSTER_STORE_DIR="${STORAGE_DIR}/posters"
 SERVICE_NAME="reg"
 DB_NAME="reg_db"
 DB_USER="reg_user"
@@ -156,6 +157,9 @@ fi"
 echo "[5.0/8] 确保持久化资料目录配置"
 ssh ${SERVER_USER}@${SERVER_IP} "if grep -q '^ACTIVITY_DOCS_DIR=' ${APP_DIR}/.env; then sed -i \"s|^ACTIVITY_DOCS_DIR=.*|ACTIVITY_DOCS_DIR=${ACTIVITY_DOCS_DIR}|\" ${APP_DIR}/.env; else echo \"ACTIVITY_DOCS_DIR=${ACTIVITY_DOCS_DIR}\" >> ${APP_DIR}/.env; fi"
 
+echo "[5.0.1/8] 确保海报存储目录配置"
+ssh ${SERVER_USER}@${SERVER_IP} "mkdir -p ${POSTER_STORE_DIR} && if grep -q '^POSTER_STORE_DIR=' ${APP_DIR}/.env; then sed -i \"s|^POSTER_STORE_DIR=.*|POSTER_STORE_DIR=${POSTER_STORE_DIR}|\" ${APP_DIR}/.env; else echo \"POSTER_STORE_DIR=${POSTER_STORE_DIR}\" >> ${APP_DIR}/.env; fi"
+
 echo "[5.1/8] 同步 Gemini API Key（仅当本地环境变量已设置）"
 if [[ -n "${GEMINI_API_KEY}" ]]; then
   ssh ${SERVER_USER}@${SERVER_IP} "if grep -q '^GEMINI_API_KEY=' ${APP_DIR}/.env; then sed -i \"s|^GEMINI_API_KEY=.*|GEMINI_API_KEY=${GEMINI_API_KEY}|\" ${APP_DIR}/.env; else echo \"GEMINI_API_KEY=${GEMINI_API_KEY}\" >> ${APP_DIR}/.env; fi"
@@ -200,6 +204,15 @@ sync_remote_env_key "DIGITAL_HUMAN_SCALE" "${DIGITAL_HUMAN_SCALE}"
 sync_remote_env_key "DIGITAL_HUMAN_MOVE_H" "${DIGITAL_HUMAN_MOVE_H}"
 sync_remote_env_key "DIGITAL_HUMAN_MOVE_V" "${DIGITAL_HUMAN_MOVE_V}"
 
+echo "[5.3/8] 升级数据库结构并写入结构版本戳（工作进程启动时只校验版本号）"
+ssh ${SERVER_USER}@${SERVER_IP} "cd ${APP_DIR}; source venv/bin/activate; FLASK_APP=wsgi.py flask db-upgrade"
+
+echo "[5.4/8] 迁移活动表中的旧海报二进制到海报存储（幂等）"
+ssh ${SERVER_USER}@${SERVER_IP} "cd ${APP_DIR}; source venv/bin/activate; FLASK_APP=wsgi.py flask migrate-poster-blobs"
+
+echo "[5.5/8] 回填后台统计图表的每日汇总（幂等）"
+ssh ${SERVER_USER}@${SERVER_IP} "cd ${APP_DIR}; source venv/bin/activate; FLASK_APP=wsgi.py flask backfill-daily-metrics"
+
 echo "[6/8] 重写并重载 systemd 服务"
 ssh ${SERVER_USER}@${SERVER_IP} "sudo tee /etc/systemd/system/${SERVICE_NAME}.service > /dev/null << EOF
 [Unit]
@@ -223,6 +236,29 @@ EOF
 sudo systemctl daemon-reload && sudo systemctl enable ${SERVICE_NAME}.service
 sudo systemctl restart ${SERVICE_NAME}.service"
 
+echo "[6.0.1/8] 重写并重载 AI 对话流式服务（gevent worker，Nginx 单独转发 /utils/api/ai_chat）"
+ssh ${SERVER_USER}@${SERVER_IP} "sudo tee /etc/systemd/system/${SERVICE_NAME}-stream.service > /dev/null << EOF
+[Unit]
+Description=Gunicorn gevent service for reg.cqaibase.cn AI chat streams
+After=network.target
+
+[Service]
+User=${SERVER_USER}
+Group=www-data
+WorkingDirectory=${APP_DIR}
+Environment=PYTHONUNBUFFERED=1
+Environment=TZ=UTC
+EnvironmentFile=${APP_DIR}/.env
+ExecStart=${APP_DIR}/venv/bin/gunicorn -k gevent --workers 2 --worker-connections 500 --bind 127.0.0.1:8083 --timeout 120 stream_wsgi:app
+Restart=always
+RestartSec=3
+
+[Install]
+WantedBy=multi-user.target
+EOF
+sudo systemctl daemon-reload && sudo systemctl enable ${SERVICE_NAME}-stream.service
+sudo systemctl restart ${SERVICE_NAME}-stream.service"
+
 echo "[6.1/8] 校验PostgreSQL会话时区"
 ssh ${SERVER_USER}@${SERVER_IP} "cd ${APP_DIR}; source venv/bin/activate; python - << 'PY'
 import os
@@ -249,11 +285,27 @@ with engine.connect() as conn:
 PY"
 
 echo "[7/8] 检查并配置 Nginx 站点与自动任务"
-ssh ${SERVER_USER}@${SERVER_IP} "if [ ! -f /etc/nginx/sites-available/reg ]; then sudo tee /etc/nginx/sites-available/reg > /dev/null << 'EOF'
+ssh ${SERVER_USER}@${SERVER_IP} "sudo mkdir -p /etc/nginx/snippets && sudo tee /etc/nginx/snippets/reg_ai_stream.conf > /dev/null << 'EOF'
+location = /utils/api/ai_chat {
+    proxy_pass http://127.0.0.1:8083;
+    proxy_http_version 1.1;
+    proxy_set_header Connection '';
+    proxy_buffering off;
+    proxy_cache off;
+    proxy_read_timeout 300s;
+    proxy_send_timeout 300s;
+    proxy_set_header Host \$host;
+    proxy_set_header X-Real-IP \$remote_addr;
+    proxy_set_header X-Forwarded-For \$proxy_add_x_forwarded_for;
+    proxy_set_header X-Forwarded-Proto \$scheme;
+}
+EOF
+if [ ! -f /etc/nginx/sites-available/reg ]; then sudo tee /etc/nginx/sites-available/reg > /dev/null << 'EOF'
 server {
     listen 80;
     server_name reg.cqaibase.cn;
   client_max_body_size 80m;
+    include snippets/reg_ai_stream.conf;
 
     location / {
     proxy_read_timeout 300s;
@@ -268,11 +320,33 @@ server {
 EOF
 sudo ln -sf /etc/nginx/sites-available/reg /etc/nginx/sites-enabled/reg
 fi
+# 已有站点（含 certbot 改写后的 443 server 块）补上流式接口的转发
+if ! grep -q 'reg_ai_stream.conf' /etc/nginx/sites-available/reg; then
+  sudo sed -i '/server_name reg.cqaibase.cn;/a\\    include snippets/reg_ai_stream.conf;' /etc/nginx/sites-available/reg
+fi
 sudo nginx -t && sudo systemctl reload nginx
 
 # 检查并部署定时任务
 (crontab -l 2>/dev/null | grep -v 'send_reminders.py' || true) | crontab -
-(crontab -l 2>/dev/null; echo \"0 12 * * * /var/www/reg/current/venv/bin/python /var/www/reg/current/scripts/send_reminders.py >> /var/www/reg/current/logs/cron.log 2>&1\") | crontab -"
+(crontab -l 2>/dev/null; echo \"0 12 * * * /var/www/reg/current/venv/bin/python /var/www/reg/current/scripts/send_reminders.py >> /var/www/reg/current/logs/cron.log 2>&1\") | crontab -
+(crontab -l 2>/dev/null | grep -v 'dispatch-activity-reminders' || true) | crontab -
+(crontab -l 2>/dev/null; echo \"* * * * * cd /var/www/reg/current && FLASK_APP=wsgi.py /var/www/reg/current/venv/bin/flask dispatch-activity-reminders >> /var/www/reg/current/logs/cron.log 2>&1\") | crontab -
+(crontab -l 2>/dev/null | grep -v 'reconcile-activity-seats' || true) | crontab -
+(crontab -l 2>/dev/null; echo \"*/10 * * * * cd /var/www/reg/current && FLASK_APP=wsgi.py /var/www/reg/current/venv/bin/flask reconcile-activity-seats >> /var/www/reg/current/logs/cron.log 2>&1\") | crontab -
+(crontab -l 2>/dev/null | grep -v 'rebuild-activity-stats' || true) | crontab -
+(crontab -l 2>/dev/null; echo \"30 3 * * * cd /var/www/reg/current && FLASK_APP=wsgi.py /var/www/reg/current/venv/bin/flask rebuild-activity-stats >> /var/www/reg/current/logs/cron.log 2>&1\") | crontab -
+(crontab -l 2>/dev/null | grep -v 'reindex-activity-search' || true) | crontab -
+(crontab -l 2>/dev/null; echo \"40 3 * * * cd /var/www/reg/current && FLASK_APP=wsgi.py /var/www/reg/current/venv/bin/flask reindex-activity-search >> /var/www/reg/current/logs/cron.log 2>&1\") | crontab -
+(crontab -l 2>/dev/null | grep -v 'rebuild-leaderboards' || true) | crontab -
+(crontab -l 2>/dev/null; echo \"50 3 * * * cd /var/www/reg/current && FLASK_APP=wsgi.py /var/www/reg/current/venv/bin/flask rebuild-leaderboards >> /var/www/reg/current/logs/cron.log 2>&1\") | crontab -
+(crontab -l 2>/dev/null | grep -v 'reconcile-unread-counters' || true) | crontab -
+(crontab -l 2>/dev/null; echo \"*/10 * * * * cd /var/www/reg/current && FLASK_APP=wsgi.py /var/www/reg/current/venv/bin/flask reconcile-unread-counters >> /var/www/reg/current/logs/cron.log 2>&1\") | crontab -
+(crontab -l 2>/dev/null | grep -v 'rollup-daily-metrics' || true) | crontab -
+(crontab -l 2>/dev/null; echo \"*/10 * * * * cd /var/www/reg/current && FLASK_APP=wsgi.py /var/www/reg/current/venv/bin/flask rollup-daily-metrics >> /var/www/reg/current/logs/cron.log 2>&1\") | crontab -
+(crontab -l 2>/dev/null | grep -v 'prefetch-activity-weather' || true) | crontab -
+(crontab -l 2>/dev/null; echo \"*/30 * * * * cd /var/www/reg/current && FLASK_APP=wsgi.py /var/www/reg/current/venv/bin/flask prefetch-activity-weather >> /var/www/reg/current/logs/cron.log 2>&1\") | crontab -
+(crontab -l 2>/dev/null | grep -v 'compact-ai-chat-history' || true) | crontab -
+(crontab -l 2>/dev/null; echo \"*/5 * * * * cd /var/www/reg/current && FLASK_APP=wsgi.py /var/www/reg/current/venv/bin/flask compact-ai-chat-history >> /var/www/reg/current/logs/cron.log 2>&1\") | crontab -"
 
 echo "[8/8] 申请免费 SSL（DNS 生效后）"
 A_RECORDS="$(dig +short ${DOMAIN} A | tr '\n' ' ' | xargs)"
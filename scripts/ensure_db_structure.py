@@ -89,6 +89,7 @@ def ensure_db_structure(app, db):
         ('activities', 'society_id', 'INTEGER'),
         ('points_history', 'society_id', 'INTEGER'),
         ('message', 'target_society_id', 'INTEGER'),
+        ('activities', 'poster_hash', 'VARCHAR(64)'),
     ]
 
     for table_name, col_name, col_type in alter_plans:
@@ -317,3 +318,21 @@ def ensure_db_structure(app, db):
             conn.execute(text(create_weather_cache_sql))
             conn.execute(text("CREATE INDEX IF NOT EXISTS idx_weather_daily_cache_city_date ON weather_daily_cache (city_adcode, weather_date)"))
         app.logger.info('已创建 weather_daily_cache 表')
+
+    # 5) AI 聊天历史：会话滚动摘要字段与按会话分页的索引
+    if 'ai_chat_session' in table_names:
+        timestamp_type = 'TIMESTAMP' if dialect == 'postgresql' else 'DATETIME'
+        for column_name, column_type in (('summary', 'TEXT'), ('summary_until_id', 'INTEGER'), ('summarized_at', timestamp_type)):
+            if not _column_exists(inspector, 'ai_chat_session', column_name):
+                with engine.begin() as conn:
+                    conn.execute(text(f"ALTER TABLE ai_chat_session ADD COLUMN {column_name} {column_type}"))
+                app.logger.info(f'已补齐 ai_chat_session.{column_name} 字段')
+            else:
+                app.logger.info(f'字段 ai_chat_session.{column_name} 已存在，跳过补齐')
+    if 'ai_chat_history' in table_names:
+        with engine.begin() as conn:
+            conn.execute(text("CREATE INDEX IF NOT EXISTS idx_ai_chat_history_session_user_ts ON ai_chat_history (session_id, user_id, timestamp)"))
+
+    # 6) 活动全文检索索引（PostgreSQL tsvector+GIN / SQLite FTS5），首次部署时回填
+    from src.utils.activity_search import ensure_activity_search_index
+    ensure_activity_search_index(app)
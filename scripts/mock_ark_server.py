@@ -0,0 +1,208 @@
+"""
+本地模拟的火山方舟（Ark）服务，用于联调与压测出站 LLM 请求，不消耗真实额度。
+
+用法：
+    python scripts/mock_ark_server.py                          # 监听 127.0.0.1:18080
+    python scripts/mock_ark_server.py --latency 0.5 --token-delay 0.05 --error-rate 0.1
+
+然后把应用指向它：
+    VOLCANO_API_URL=http://127.0.0.1:18080/api/v3/chat/completions
+    ARK_IMAGE_API_URL=http://127.0.0.1:18080/api/v3/images/generations
+
+支持的接口：
+    POST /api/v3/chat/completions     普通与流式（"stream": true，SSE 分块返回）对话
+    POST /api/v3/images/generations   返回本服务上的一张占位图片链接
+    GET  /mock.png                    占位图片
+    GET  /stats                       已接受的 TCP 连接数与请求数（用于观察连接复用）
+    POST /control                     运行中调整 latency / token_delay / error_rate
+"""
+import argparse
+import base64
+import json
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 1x1 像素 PNG
+PLACEHOLDER_PNG = base64.b64decode(
+    'iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8/5+hHgAHggJ/PchI7wAAAABJRU5ErkJggg=='
+)
+DEFAULT_REPLY = '你好，我是模拟的团小智。这是一段用于联调和压测的固定回复，会被拆成若干片段按流式返回。'
+
+
+class MockArkState(object):
+    def __init__(self, latency=0.0, token_delay=0.02, error_rate=0.0, reply=DEFAULT_REPLY, chunk_chars=4):
+        self.latency = latency
+        self.token_delay = token_delay
+        self.error_rate = error_rate
+        self.reply = reply
+        self.chunk_chars = chunk_chars
+        self.connections = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def count(self, connection=False):
+        with self._lock:
+            if connection:
+                self.connections += 1
+            else:
+                self.requests += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'connections': self.connections,
+                'requests': self.requests,
+                'latency': self.latency,
+                'token_delay': self.token_delay,
+                'error_rate': self.error_rate
+            }
+
+
+class MockArkHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # 响应头与响应体分两次写出，keep-alive 连接上需关闭 Nagle，否则与客户端延迟确认叠加出约 40ms 的等待
+    disable_nagle_algorithm = True
+    state = None
+
+    def setup(self):
+        super().setup()
+        self.state.count(connection=True)
+
+    def log_message(self, format, *args):
+        pass
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        try:
+            return json.loads(raw or b'{}')
+        except ValueError:
+            return {}
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data):
+        self.wfile.write(f'{len(data):x}\r\n'.encode('ascii') + data + b'\r\n')
+        self.wfile.flush()
+
+    def _simulate_upstream(self):
+        """返回 False 表示本次模拟为服务端错误（已写出响应）。"""
+        self.state.count()
+        if self.state.latency:
+            time.sleep(self.state.latency)
+        if self.state.error_rate and random.random() < self.state.error_rate:
+            self._send_json(500, {'error': {'code': 'InternalServiceError', 'message': 'mock upstream error'}})
+            return False
+        return True
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self._send_json(200, self.state.snapshot())
+        elif self.path == '/mock.png':
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/png')
+            self.send_header('Content-Length', str(len(PLACEHOLDER_PNG)))
+            self.end_headers()
+            self.wfile.write(PLACEHOLDER_PNG)
+        else:
+            self._send_json(404, {'error': {'message': 'not found'}})
+
+    def do_POST(self):
+        payload = self._read_json()
+        if self.path == '/control':
+            for field in ('latency', 'token_delay', 'error_rate'):
+                if field in payload:
+                    setattr(self.state, field, float(payload[field]))
+            self._send_json(200, self.state.snapshot())
+        elif self.path.endswith('/chat/completions'):
+            if self._simulate_upstream():
+                self._chat(payload)
+        elif self.path.endswith('/images/generations'):
+            if self._simulate_upstream():
+                host = self.headers.get('Host') or f'127.0.0.1:{self.server.server_address[1]}'
+                self._send_json(200, {'model': payload.get('model'), 'data': [{'url': f'http://{host}/mock.png'}]})
+        else:
+            self._send_json(404, {'error': {'message': 'not found'}})
+
+    def _chat(self, payload):
+        model = payload.get('model') or 'mock-model'
+        reply = self.state.reply
+        if not payload.get('stream'):
+            self._send_json(200, {
+                'id': 'mock-chat',
+                'object': 'chat.completion',
+                'model': model,
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': reply}, 'finish_reason': 'stop'}],
+                'usage': {'prompt_tokens': 0, 'completion_tokens': len(reply), 'total_tokens': len(reply)}
+            })
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        step = max(1, self.state.chunk_chars)
+        for start in range(0, len(reply), step):
+            if self.state.token_delay:
+                time.sleep(self.state.token_delay)
+            chunk = {
+                'id': 'mock-chat',
+                'object': 'chat.completion.chunk',
+                'model': model,
+                'choices': [{'index': 0, 'delta': {'content': reply[start:start + step]}}]
+            }
+            self._write_chunk(f'data: {json.dumps(chunk, ensure_ascii=False)}\n\n'.encode('utf-8'))
+        self._write_chunk(b'data: [DONE]\n\n')
+        self._write_chunk(b'')
+
+
+class MockArkServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # 客户端超时断开属于压测的正常情况，不打印堆栈
+        if isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            return
+        super().handle_error(request, client_address)
+
+
+def start_mock_server(host='127.0.0.1', port=18080, **state_options):
+    """在后台线程启动模拟服务，返回 (server, state)；server.shutdown() 停止。"""
+    state = MockArkState(**state_options)
+    handler = type('BoundMockArkHandler', (MockArkHandler,), {'state': state})
+    server = MockArkServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, name='mock-ark', daemon=True).start()
+    return server, state
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地模拟的火山方舟（Ark）服务')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=18080)
+    parser.add_argument('--latency', type=float, default=0.0, help='返回响应头前的延迟（秒）')
+    parser.add_argument('--token-delay', type=float, default=0.02, help='流式返回时每个片段的间隔（秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回 500 的比例（0~1）')
+    args = parser.parse_args()
+
+    server, _ = start_mock_server(
+        args.host, args.port, latency=args.latency, token_delay=args.token_delay, error_rate=args.error_rate
+    )
+    print(f"模拟 Ark 服务已启动: http://{args.host}:{args.port}/api/v3/chat/completions（Ctrl+C 退出）")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -7,7 +7,7 @@ import pytz
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from src import create_app, db
 from src.models import Activity, Registration, User
-from src.utils.wechat_api import send_subscribe_message
+from src.utils.wechat_api import send_many
 from src.utils.time_helpers import display_datetime
 
 app = create_app()
@@ -36,27 +36,26 @@ def run_reminders():
             loc = activity.location[:20] if getattr(activity, 'location', None) else "详见活动详情页面"
             
             regs = activity.registrations.filter_by(status='registered').all()
-            for r in regs:
-                user = r.user
-                if user.wx_openid:
-                    # Different accounts might have slightly different keys, we use a generic payload
-                    payload = {
-                        "name1": {"value": org_name[:10]},
-                        "date3": {"value": start_str},
-                        "thing4": {"value": title},
-                        "thing6": {"value": loc},
-                        "thing7": {"value": "活动快开始啦，请准时参加哦"}
-                    }
-                    try:
-                        res = send_subscribe_message(
-                            user.wx_openid,
-                            "16S-vnKCWw7x2xqKi86K_mme2paucmkIl0-hkDXAkfA",
-                            f"pages/activity/activity?id={activity.id}",
-                            payload
-                        )
-                        app.logger.info(f"Reminded user {user.id} for activity {activity.id}: {res}")
-                    except Exception as e:
-                        app.logger.error(f"Failed to remind user {user.id}: {e}")
+            users = [r.user for r in regs if r.user.wx_openid]
+            # Different accounts might have slightly different keys, we use a generic payload
+            payload = {
+                "name1": {"value": org_name[:10]},
+                "date3": {"value": start_str},
+                "thing4": {"value": title},
+                "thing6": {"value": loc},
+                "thing7": {"value": "活动快开始啦，请准时参加哦"}
+            }
+            results = send_many([{
+                'openid': user.wx_openid,
+                'template_id': "16S-vnKCWw7x2xqKi86K_mme2paucmkIl0-hkDXAkfA",
+                'page': f"pages/activity/activity?id={activity.id}",
+                'data': payload
+            } for user in users])
+            for user, res in zip(users, results):
+                if res.get('success'):
+                    app.logger.info(f"Reminded user {user.id} for activity {activity.id}: {res}")
+                else:
+                    app.logger.error(f"Failed to remind user {user.id}: {res}")
 
 if __name__ == '__main__':
     run_reminders()
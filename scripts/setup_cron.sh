@@ -2,3 +2,30 @@
 # Remove old reminder cron and add new
 (crontab -l | grep -v 'send_reminders.py') | crontab -
 (crontab -l 2>/dev/null; echo "0 12 * * * /var/www/reg/current/venv/bin/python /var/www/reg/current/scripts/send_reminders.py >> /var/www/reg/current/logs/cron.log 2>&1") | crontab -
+# 活动名额计数对账（每10分钟）
+(crontab -l | grep -v 'reconcile-activity-seats') | crontab -
+(crontab -l 2>/dev/null; echo "*/10 * * * * cd /var/www/reg/current && FLASK_APP=wsgi.py /var/www/reg/current/venv/bin/flask reconcile-activity-seats >> /var/www/reg/current/logs/cron.log 2>&1") | crontab -
+# 活动统计读模型全量重建（每日凌晨，修正绕过ORM的批量写入）
+(crontab -l | grep -v 'rebuild-activity-stats') | crontab -
+(crontab -l 2>/dev/null; echo "30 3 * * * cd /var/www/reg/current && FLASK_APP=wsgi.py /var/www/reg/current/venv/bin/flask rebuild-activity-stats >> /var/www/reg/current/logs/cron.log 2>&1") | crontab -
+# 活动开始前提醒（每分钟按开始时间窗扫描，唯一键去重）
+(crontab -l | grep -v 'dispatch-activity-reminders') | crontab -
+(crontab -l 2>/dev/null; echo "* * * * * cd /var/www/reg/current && FLASK_APP=wsgi.py /var/www/reg/current/venv/bin/flask dispatch-activity-reminders >> /var/www/reg/current/logs/cron.log 2>&1") | crontab -
+# 用户未读计数对账（每10分钟）
+(crontab -l | grep -v 'reconcile-unread-counters') | crontab -
+(crontab -l 2>/dev/null; echo "*/10 * * * * cd /var/www/reg/current && FLASK_APP=wsgi.py /var/www/reg/current/venv/bin/flask reconcile-unread-counters >> /var/www/reg/current/logs/cron.log 2>&1") | crontab -
+# 活动全文检索索引全量重建（每日凌晨，修正绕过ORM的批量写入）
+(crontab -l | grep -v 'reindex-activity-search') | crontab -
+(crontab -l 2>/dev/null; echo "40 3 * * * cd /var/www/reg/current && FLASK_APP=wsgi.py /var/www/reg/current/venv/bin/flask reindex-activity-search >> /var/www/reg/current/logs/cron.log 2>&1") | crontab -
+# 积分排行榜全量重建（每日凌晨，修正绕过ORM的积分写入）
+(crontab -l | grep -v 'rebuild-leaderboards') | crontab -
+(crontab -l 2>/dev/null; echo "50 3 * * * cd /var/www/reg/current && FLASK_APP=wsgi.py /var/www/reg/current/venv/bin/flask rebuild-leaderboards >> /var/www/reg/current/logs/cron.log 2>&1") | crontab -
+# 后台统计图表每日汇总（每10分钟重算最近两天）
+(crontab -l | grep -v 'rollup-daily-metrics') | crontab -
+(crontab -l 2>/dev/null; echo "*/10 * * * * cd /var/www/reg/current && FLASK_APP=wsgi.py /var/www/reg/current/venv/bin/flask rollup-daily-metrics >> /var/www/reg/current/logs/cron.log 2>&1") | crontab -
+# 近期活动天气预取（每30分钟刷新一次，详情页只读缓存）
+(crontab -l | grep -v 'prefetch-activity-weather') | crontab -
+(crontab -l 2>/dev/null; echo "*/30 * * * * cd /var/www/reg/current && FLASK_APP=wsgi.py /var/www/reg/current/venv/bin/flask prefetch-activity-weather >> /var/www/reg/current/logs/cron.log 2>&1") | crontab -
+# AI聊天历史压缩（每5分钟把较早消息折叠进会话摘要，并执行历史条数上限）
+(crontab -l | grep -v 'compact-ai-chat-history') | crontab -
+(crontab -l 2>/dev/null; echo "*/5 * * * * cd /var/www/reg/current && FLASK_APP=wsgi.py /var/www/reg/current/venv/bin/flask compact-ai-chat-history >> /var/www/reg/current/logs/cron.log 2>&1") | crontab -
@@ -1,6 +1,7 @@
 import os
 import logging
 from logging.handlers import RotatingFileHandler
+import click
 import pytz
 from flask import Flask, session, g, request
 from flask_sqlalchemy import SQLAlchemy
@@ -126,8 +127,17 @@ def create_app(config_name=None):
         from src.models import ActivityCheckin, Message, Notification, NotificationRead
         from src.models import AIChatHistory, AIChatSession, AIUserPreferences
         
-        # 确保模型与当前app关联
-        db.create_all()
+        # 活动统计读模型：在 flush 时增量维护
+        from src.utils.activity_stats import register_activity_stats_listeners
+        register_activity_stats_listeners()
+        from src.utils.unread_counters import register_unread_counter_listeners
+        register_unread_counter_listeners()
+        from src.utils.activity_search import register_activity_search_listeners
+        register_activity_search_listeners()
+        from src.utils.leaderboard import register_leaderboard_listeners
+        register_leaderboard_listeners()
+        from src.utils.site_context import register_site_context_listeners
+        register_site_context_listeners()
         
         # 设置用户加载函数
         @login_manager.user_loader
@@ -302,23 +312,10 @@ def create_app(config_name=None):
     # 注册全局上下文处理器
     register_context_processors(app)
     
-    # 调用确保数据库结构的脚本
+    # 数据库结构：版本戳为最新时只查询一次版本号；补齐逻辑见 flask db-upgrade
     with app.app_context():
-        try:
-            # 注释掉以下两行，因为它们是为本地SQLite设计的，在连接PostgreSQL时会引发问题
-            # from scripts.ensure_db_structure import ensure_db_structure
-            # ensure_db_structure()
-            # 改为仅执行"序列健康检查"（对PostgreSQL安全）
-            try:
-                from scripts.ensure_db_structure import ensure_db_structure
-                ensure_db_structure(app, db)
-                app.logger.info("已执行数据库结构与序列健康检查")
-            except Exception as inner_e:
-                app.logger.warning(f"执行序列健康检查时出现问题: {inner_e}")
-        except ImportError:
-            app.logger.warning("未找到确保数据库结构的脚本，跳过初始化")
-        except Exception as e:
-            app.logger.error(f"初始化数据库结构时出错: {e}")
+        from src.utils.schema_version import check_schema_on_boot
+        check_schema_on_boot(app)
     
     return app
 
@@ -459,6 +456,122 @@ def register_commands(app):
         db.create_all()
         app.logger.info('已初始化数据库表')
 
+    @app.cli.command('db-upgrade')
+    @click.option('--force', is_flag=True, help='版本已是最新时也重新执行结构补齐')
+    def db_upgrade_command(force):
+        """补齐数据库结构并写入结构版本戳（部署时在重启服务前执行）"""
+        from src.utils.schema_version import upgrade_schema
+        previous, current = upgrade_schema(app, force=force)
+        if previous == current and not force:
+            message = f'数据库结构版本 {current} 已是最新，无需升级'
+        else:
+            message = f'数据库结构已升级: {previous} -> {current}'
+        app.logger.info(message)
+        print(message)
+
+    @app.cli.command('reconcile-activity-seats')
+    def reconcile_activity_seats_command():
+        """按报名记录对账活动名额计数（建议由cron定时执行）"""
+        from src.utils.seat_reservation import reconcile_activity_seats
+        corrected = reconcile_activity_seats()
+        app.logger.info(f'活动名额计数对账完成，修正 {corrected} 条')
+        print(f'活动名额计数对账完成，修正 {corrected} 条')
+
+    @app.cli.command('reconcile-unread-counters')
+    def reconcile_unread_counters_command():
+        """按通知/已读/消息记录分组重算用户未读计数"""
+        from src.utils.unread_counters import reconcile_unread_counters
+        corrected = reconcile_unread_counters()
+        app.logger.info(f'未读计数对账完成，修正 {corrected} 个用户')
+        print(f'未读计数对账完成，修正 {corrected} 个用户')
+
+    @app.cli.command('dispatch-activity-reminders')
+    def dispatch_activity_reminders_command():
+        """按活动开始时间窗批量生成开始前提醒（由cron每分钟执行）"""
+        from src.utils.activity_reminders import dispatch_activity_start_reminders
+        created = dispatch_activity_start_reminders()
+        if created:
+            app.logger.info(f'活动开始提醒已生成 {created} 条')
+        print(f'活动开始提醒已生成 {created} 条')
+
+    @app.cli.command('migrate-poster-blobs')
+    def migrate_poster_blobs_command():
+        """将 activities.poster_data 中的旧海报迁移到内容寻址存储（可重复执行）"""
+        from src.utils.poster_store import drain_legacy_poster_blobs
+        migrated = drain_legacy_poster_blobs()
+        app.logger.info(f'海报迁移完成，共迁移 {migrated} 张')
+        print(f'海报迁移完成，共迁移 {migrated} 张')
+
+    @app.cli.command('reindex-activity-search')
+    def reindex_activity_search_command():
+        """全量重建活动全文检索索引"""
+        from src.utils.activity_search import reindex_activity_search
+        indexed = reindex_activity_search()
+        app.logger.info(f'活动检索索引重建完成，共 {indexed} 个活动')
+        print(f'活动检索索引重建完成，共 {indexed} 个活动')
+
+    @app.cli.command('rebuild-leaderboards')
+    def rebuild_leaderboards_command():
+        """按数据库全量重建全站与各社团积分排行榜"""
+        from src.utils.leaderboard import rebuild_leaderboards
+        total = rebuild_leaderboards()
+        app.logger.info(f'积分排行榜重建完成，共 {total} 个榜单')
+        print(f'积分排行榜重建完成，共 {total} 个榜单')
+
+    @app.cli.command('rollup-daily-metrics')
+    def rollup_daily_metrics_command():
+        """增量汇总最近两天的每日统计（定时任务调用）"""
+        from src.utils.daily_metrics import rollup_recent_daily_metrics
+        total = rollup_recent_daily_metrics()
+        app.logger.info(f'每日统计汇总完成，写入 {total} 行')
+        print(f'每日统计汇总完成，写入 {total} 行')
+
+    @app.cli.command('backfill-daily-metrics')
+    def backfill_daily_metrics_command():
+        """从最早的记录开始补齐全部历史每日统计"""
+        from src.utils.daily_metrics import backfill_daily_metrics
+        total = backfill_daily_metrics()
+        app.logger.info(f'每日统计回填完成，写入 {total} 行')
+        print(f'每日统计回填完成，写入 {total} 行')
+
+    @app.cli.command('prefetch-activity-weather')
+    def prefetch_activity_weather_command():
+        """刷新近期活动的天气缓存（定时任务调用）"""
+        from src.utils.weather_prefetch import prefetch_activity_weather
+        total = prefetch_activity_weather()
+        app.logger.info(f'活动天气预取完成，写入 {total} 条缓存')
+        print(f'活动天气预取完成，写入 {total} 条缓存')
+
+    @app.cli.command('compact-ai-chat-history')
+    def compact_ai_chat_history_command():
+        """把AI聊天会话的较早消息折叠进摘要，并按保留上限删除旧消息（定时任务调用）"""
+        from src.utils.chat_history import compact_chat_histories
+        compacted, removed = compact_chat_histories()
+        app.logger.info(f'AI聊天历史压缩完成，更新摘要 {compacted} 个会话，删除 {removed} 条旧消息')
+        print(f'AI聊天历史压缩完成，更新摘要 {compacted} 个会话，删除 {removed} 条旧消息')
+
+    @app.cli.command('run-ai-workers')
+    def run_ai_workers_command():
+        """以独立进程运行后台AI任务工作线程池（Ctrl+C 退出）"""
+        import time
+        from src.utils.ai_jobs import AIJobWorkerPool
+        pool = AIJobWorkerPool(app, app.config.get('AI_JOB_WORKERS', 2)).start()
+        app.logger.info(f'AI任务工作进程已启动: {pool.worker_id}')
+        print(f'AI任务工作进程已启动: {pool.worker_id}')
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pool.stop(timeout=30)
+
+    @app.cli.command('rebuild-activity-stats')
+    def rebuild_activity_stats_command():
+        """一次分组聚合重建全部活动统计读模型"""
+        from src.utils.activity_stats import rebuild_activity_stats
+        total = rebuild_activity_stats()
+        app.logger.info(f'活动统计重建完成，共 {total} 个活动')
+        print(f'活动统计重建完成，共 {total} 个活动')
+
 def register_template_functions(app):
     """注册模板函数"""
     # 从utils.time_helpers导入时间处理函数
@@ -15,12 +15,13 @@ DB_PATH = os.path.join(INSTANCE_PATH, 'cqnu_association.db')
 LOG_PATH = os.path.join(BASE_DIR, 'logs')
 UPLOAD_FOLDER = os.environ.get('PERSISTENT_STORAGE_PATH', os.path.join(BASE_DIR, 'static', 'uploads', 'posters'))
 ACTIVITY_DOCS_DIR = os.environ.get('ACTIVITY_DOCS_DIR', os.path.join(os.path.dirname(BASE_DIR), 'storage', 'activity_docs'))
+POSTER_STORE_DIR = os.environ.get('POSTER_STORE_DIR', os.path.join(os.path.dirname(BASE_DIR), 'storage', 'posters'))
 SESSION_FILE_DIR = os.path.join(BASE_DIR, 'flask_session')
 
 # 确保目录存在并设置权限
 def ensure_directories():
     """确保必要的目录存在并设置正确的权限"""
-    global UPLOAD_FOLDER, ACTIVITY_DOCS_DIR
+    global UPLOAD_FOLDER, ACTIVITY_DOCS_DIR, POSTER_STORE_DIR
     
     # 确保instance目录存在
     if not os.path.exists(INSTANCE_PATH):
@@ -97,12 +98,28 @@ def ensure_directories():
             print(f"使用回退活动资料目录: {ACTIVITY_DOCS_DIR}")
         except Exception as e2:
             print(f"创建回退活动资料目录失败: {e2}")
+
+    # 确保海报存储目录存在（同样独立于代码目录）
+    try:
+        if not os.path.exists(POSTER_STORE_DIR):
+            os.makedirs(POSTER_STORE_DIR, exist_ok=True)
+            print(f"已创建海报存储目录: {POSTER_STORE_DIR}")
+    except Exception as e:
+        print(f"创建海报存储目录失败: {e}")
+        fallback_posters = os.path.join(UPLOAD_FOLDER, 'poster_store')
+        try:
+            os.makedirs(fallback_posters, exist_ok=True)
+            POSTER_STORE_DIR = fallback_posters
+            print(f"使用回退海报存储目录: {POSTER_STORE_DIR}")
+        except Exception as e2:
+            print(f"创建回退海报存储目录失败: {e2}")
             
     # 打印当前工作目录和权限信息
     print(f"当前工作目录: {os.getcwd()}")
     print(f"BASE_DIR: {BASE_DIR}")
     print(f"UPLOAD_FOLDER: {UPLOAD_FOLDER}")
     print(f"ACTIVITY_DOCS_DIR: {ACTIVITY_DOCS_DIR}")
+    print(f"POSTER_STORE_DIR: {POSTER_STORE_DIR}")
 
 # 创建并设置目录权限
 ensure_directories()
@@ -132,6 +149,15 @@ class Config(object):
     # 上传文件配置
     UPLOAD_FOLDER = UPLOAD_FOLDER
     ACTIVITY_DOCS_DIR = ACTIVITY_DOCS_DIR
+    # 海报内容寻址存储（按SHA-256存放，后端可插拔）
+    POSTER_STORE_BACKEND = os.environ.get('POSTER_STORE_BACKEND', 'local')
+    POSTER_STORE_DIR = POSTER_STORE_DIR
+    # 海报缩略图/WebP衍生图缓存目录，未设置时使用 POSTER_STORE_DIR/derived
+    POSTER_DERIVATIVE_DIR = os.environ.get('POSTER_DERIVATIVE_DIR')
+    # 活动全文检索实现：auto 按数据库选择（PostgreSQL tsvector / SQLite FTS5），like 为不建索引的兜底
+    ACTIVITY_SEARCH_BACKEND = os.environ.get('ACTIVITY_SEARCH_BACKEND', 'auto')
+    # 活动推荐模型在进程内的刷新周期（秒），过期后后台重建
+    RECOMMENDATION_REFRESH_SECONDS = int(os.environ.get('RECOMMENDATION_REFRESH_SECONDS', 600))
     ALLOWED_EXTENSIONS = {
         'pdf',
         'doc', 'docx',
@@ -217,6 +243,34 @@ class Config(object):
     else:
         CACHE_TYPE = 'SimpleCache'
     CACHE_DEFAULT_TIMEOUT = int(os.environ.get('CACHE_TIMEOUT', 300))
+
+    # 积分排行榜：配置 REDIS_URL 时用 Redis 有序集合，否则用进程内有序列表（超过该秒数强制重建）
+    LEADERBOARD_REDIS_URL = _redis_url
+    LEADERBOARD_MAX_AGE = int(os.environ.get('LEADERBOARD_MAX_AGE', 300))
+    # 后台分布图（积分分布、标签热度）按社团范围缓存的秒数
+    DISTRIBUTION_CACHE_SECONDS = int(os.environ.get('DISTRIBUTION_CACHE_SECONDS', 60))
+    # 后台AI异步任务：Web进程内工作线程数；单独运行 flask run-ai-workers 时可关闭进程内线程
+    AI_JOB_INPROCESS_WORKERS = os.environ.get('AI_JOB_INPROCESS_WORKERS', 'true').lower() == 'true'
+    AI_JOB_WORKERS = int(os.environ.get('AI_JOB_WORKERS', 2))
+    AI_JOB_LEASE_SECONDS = int(os.environ.get('AI_JOB_LEASE_SECONDS', 120))
+    AI_JOB_POLL_SECONDS = int(os.environ.get('AI_JOB_POLL_SECONDS', 3))
+    # 各类任务的全局并发上限覆盖，如 {'ai_poster': 1}
+    AI_JOB_CONCURRENCY = {}
+    # AI 对话站内数据上下文快照的存活上限，以及管理员统计的缓存秒数
+    SITE_CONTEXT_CACHE_SECONDS = int(os.environ.get('SITE_CONTEXT_CACHE_SECONDS', 600))
+    SITE_CONTEXT_ADMIN_STATS_SECONDS = int(os.environ.get('SITE_CONTEXT_ADMIN_STATS_SECONDS', 60))
+
+    # 天气进程内一级缓存的最大条目数（每个 worker 各一份）
+    WEATHER_LOCAL_CACHE_SIZE = int(os.environ.get('WEATHER_LOCAL_CACHE_SIZE', 128))
+
+    # 数据库结构版本落后时是否在启动时自动补齐（生产环境默认关闭，由部署脚本执行 flask db-upgrade）
+    SCHEMA_AUTO_UPGRADE = os.environ.get('SCHEMA_AUTO_UPGRADE', 'true').lower() == 'true'
+
+    # 微信服务端接口：连接池大小、超时，批量发送订阅消息的并发线程数与每进程每秒发送上限
+    WECHAT_HTTP_POOL_SIZE = int(os.environ.get('WECHAT_HTTP_POOL_SIZE', 10))
+    WECHAT_HTTP_TIMEOUT = int(os.environ.get('WECHAT_HTTP_TIMEOUT', 5))
+    WECHAT_SEND_CONCURRENCY = int(os.environ.get('WECHAT_SEND_CONCURRENCY', 8))
+    WECHAT_SEND_QPS = float(os.environ.get('WECHAT_SEND_QPS', 20))
     
     # Flask-Limiter配置
     RATELIMIT_STORAGE_URI = _redis_url if _redis_url else "memory://"
@@ -277,6 +331,18 @@ class Config(object):
     # AI API配置
     VOLCANO_API_KEY = os.environ.get('VOLCANO_API_KEY', os.environ.get('ARK_API_KEY', ''))
     VOLCANO_API_URL = os.environ.get('VOLCANO_API_URL', 'https://ark.cn-beijing.volces.com/api/v3/chat/completions')
+    ARK_IMAGE_API_URL = os.environ.get('ARK_IMAGE_API_URL', 'https://ark.cn-beijing.volces.com/api/v3/images/generations')
+    # 出站 LLM 请求：每进程保留的 keep-alive 连接数，连续失败多少次后熔断、熔断多少秒后放行探测请求
+    LLM_HTTP_POOL_SIZE = int(os.environ.get('LLM_HTTP_POOL_SIZE', 20))
+    LLM_BREAKER_FAILURES = int(os.environ.get('LLM_BREAKER_FAILURES', 5))
+    LLM_BREAKER_RESET_SECONDS = int(os.environ.get('LLM_BREAKER_RESET_SECONDS', 30))
+    # LLM 生成结果缓存：按接口设置缓存秒数，未列出或为 0 的接口不缓存（见 utils.llm_cache）
+    LLM_CACHE_ENABLED = os.environ.get('LLM_CACHE_ENABLED', 'true').lower() == 'true'
+    LLM_CACHE_TTLS = {
+        'education_ai': int(os.environ.get('LLM_CACHE_EDUCATION_SECONDS', 7 * 86400)),
+        'activity_description': int(os.environ.get('LLM_CACHE_ACTIVITY_DESCRIPTION_SECONDS', 86400)),
+        'message_reply_draft': int(os.environ.get('LLM_CACHE_REPLY_DRAFT_SECONDS', 86400)),
+    }
     # 文本模型统一配置（悬浮窗AI对话、后台AI文案/解析共用）
     AI_TEXT_MODEL = os.environ.get('AI_TEXT_MODEL', 'ep-20260320185026-9cc4w')
     
@@ -296,6 +362,20 @@ class Config(object):
     AI_CHAT_ENABLED = True
     AI_CHAT_CONNECT_TIMEOUT = float(os.environ.get('AI_CHAT_CONNECT_TIMEOUT', 10))
     AI_CHAT_READ_TIMEOUT = float(os.environ.get('AI_CHAT_READ_TIMEOUT', 180))
+    # AI 对话流：单用户同时进行的流数、单 worker 承载的流总数（gevent 入口见 stream_wsgi.py），
+    # 用户名额的存活秒数（生成期间随心跳续期）、无输出时的心跳间隔与转发缓冲的片段数
+    AI_STREAM_REDIS_URL = _redis_url
+    AI_STREAM_MAX_PER_USER = int(os.environ.get('AI_STREAM_MAX_PER_USER', 2))
+    AI_STREAM_MAX_PER_WORKER = int(os.environ.get('AI_STREAM_MAX_PER_WORKER', 200))
+    AI_STREAM_SLOT_SECONDS = int(os.environ.get('AI_STREAM_SLOT_SECONDS', 300))
+    AI_STREAM_HEARTBEAT_SECONDS = float(os.environ.get('AI_STREAM_HEARTBEAT_SECONDS', 15))
+    AI_STREAM_BUFFER_CHUNKS = int(os.environ.get('AI_STREAM_BUFFER_CHUNKS', 64))
+    # AI 聊天历史（见 utils.chat_history）：历史接口每页条数、发给模型的最近消息条数，
+    # 未摘要的旧消息超过多少条时由 flask compact-ai-chat-history 折叠进摘要、摘要的最大字数
+    AI_CHAT_HISTORY_PAGE_SIZE = int(os.environ.get('AI_CHAT_HISTORY_PAGE_SIZE', 50))
+    AI_CHAT_PROMPT_MESSAGES = int(os.environ.get('AI_CHAT_PROMPT_MESSAGES', 12))
+    AI_CHAT_COMPACT_BATCH = int(os.environ.get('AI_CHAT_COMPACT_BATCH', 20))
+    AI_CHAT_SUMMARY_MAX_CHARS = int(os.environ.get('AI_CHAT_SUMMARY_MAX_CHARS', 1500))
 
     # 邮件配置（用于邮箱验证、通知）
     MAIL_PRIMARY_SERVER = os.environ.get('MAIL_PRIMARY_SERVER', 'smtp.mailersend.net')
@@ -347,6 +427,7 @@ class ProductionConfig(Config):
     SESSION_REFRESH_EACH_REQUEST = False
     REMEMBER_COOKIE_REFRESH_EACH_REQUEST = False
     PREFERRED_URL_SCHEME = 'https'
+    SCHEMA_AUTO_UPGRADE = os.environ.get('SCHEMA_AUTO_UPGRADE', 'false').lower() == 'true'
     
     @classmethod
     def init_app(cls, app):
@@ -5,7 +5,7 @@ from datetime import datetime
 import json
 import pytz
 from sqlalchemy import Column, Integer, String, Text, Boolean, DateTime, Date, ForeignKey, Float, Table, func, UniqueConstraint, Index
-from sqlalchemy.orm import relationship, backref
+from sqlalchemy.orm import relationship, backref, deferred
 from sqlalchemy.ext.declarative import declarative_base
 from src import db
 
@@ -207,7 +207,8 @@ class Activity(db.Model):
     
     # 海报图片
     poster_image = Column(String(255))  # 存储海报图片文件名
-    poster_data = Column(db.LargeBinary)  # 存储海报图片二进制数据
+    poster_data = deferred(Column(db.LargeBinary))  # 旧版海报二进制（已迁移至内容寻址存储，仅兼容未迁移数据）
+    poster_hash = Column(String(64), index=True)  # 海报内容SHA-256，对应海报存储中的对象
     poster_mimetype = Column(String(50))  # 存储海报图片MIME类型
     
     # 签到相关
@@ -231,20 +232,34 @@ class Activity(db.Model):
     documents = relationship('ActivityDocument', backref='activity', lazy='dynamic', cascade='all, delete-orphan')
     
     # 海报属性方法 - 不再定义数据库字段，而是通过属性方法提供兼容性
+    @property
+    def poster_version(self):
+        """海报版本号：有内容摘要时使用摘要前缀（URL随内容变化，可长期缓存），否则回退更新时间戳"""
+        if self.poster_hash:
+            return self.poster_hash[:16]
+        version_dt = self.updated_at or self.created_at
+        return int(version_dt.timestamp()) if version_dt else 0
+
     @property
     def poster_url(self):
         """提供向后兼容的poster_url属性"""
-        if not self.poster_image:
+        if not self.poster_image and not self.poster_hash:
             return None
-        # 如果存在poster_data，优先使用数据库中的图片
-        if hasattr(self, 'poster_data') and self.poster_data:
-            return f"/poster/{self.id}"
+        # 海报已写入内容寻址存储时，统一走 /poster/<id>
+        if self.poster_hash:
+            return f"/poster/{self.id}?v={self.poster_version}"
         # 返回相对路径，模板中可以与url_for一起使用
         elif 'banner' in self.poster_image:
             return f"/static/img/{self.poster_image}"
         else:
             return f"/static/uploads/posters/{self.poster_image}"
     
+    def poster_thumb_url(self, width=640):
+        """列表场景使用的海报缩略图地址（固定宽度档位，格式由 Accept 协商）"""
+        if self.poster_hash:
+            return f"/poster/{self.id}?w={width}&v={self.poster_version}"
+        return self.poster_url
+
     @property
     def poster(self):
         """提供向后兼容的poster属性"""
@@ -276,6 +291,82 @@ class Registration(db.Model):
         return f'<Registration {self.user_id} {self.activity_id}>'
 
 
+# 活动名额计数（报名时以条件UPDATE预留名额，定时按报名记录对账）
+class ActivitySeat(db.Model):
+    __tablename__ = 'activity_seats'
+    activity_id = Column(Integer, ForeignKey('activities.id', ondelete='CASCADE'), primary_key=True)
+    capacity = Column(Integer, nullable=False, default=0)  # 0表示不限制，与 Activity.max_participants 同步
+    reserved = Column(Integer, nullable=False, default=0)  # 已占用名额（registered + attended）
+    reconciled_at = Column(DateTime)  # 最近一次对账时间
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+    def __repr__(self):
+        return f'<ActivitySeat {self.activity_id} {self.reserved}/{self.capacity}>'
+
+
+# 活动统计读模型（报名/签到/队伍/评价变更时增量维护，详情页单行读取）
+class ActivityStats(db.Model):
+    __tablename__ = 'activity_stats'
+    activity_id = Column(Integer, ForeignKey('activities.id', ondelete='CASCADE'), primary_key=True)
+    registered_count = Column(Integer, nullable=False, default=0)  # status=registered
+    attended_count = Column(Integer, nullable=False, default=0)  # status=attended（已签到）
+    cancelled_count = Column(Integer, nullable=False, default=0)
+    team_count = Column(Integer, nullable=False, default=0)
+    review_count = Column(Integer, nullable=False, default=0)
+    rating_sum = Column(Integer, nullable=False, default=0)
+    content_quality_sum = Column(Integer, nullable=False, default=0)
+    content_quality_count = Column(Integer, nullable=False, default=0)
+    organization_sum = Column(Integer, nullable=False, default=0)
+    organization_count = Column(Integer, nullable=False, default=0)
+    facility_sum = Column(Integer, nullable=False, default=0)
+    facility_count = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+    @property
+    def total_registered(self):
+        return (self.registered_count or 0) + (self.attended_count or 0)
+
+    @staticmethod
+    def _avg(total, count):
+        return float(total or 0) / count if count else 0
+
+    @property
+    def average_rating(self):
+        return self._avg(self.rating_sum, self.review_count)
+
+    @property
+    def avg_content_quality(self):
+        return self._avg(self.content_quality_sum, self.content_quality_count)
+
+    @property
+    def avg_organization(self):
+        return self._avg(self.organization_sum, self.organization_count)
+
+    @property
+    def avg_facility(self):
+        return self._avg(self.facility_sum, self.facility_count)
+
+    def __repr__(self):
+        return f'<ActivityStats {self.activity_id}>'
+
+
+# 每日统计汇总（定时任务按天增量汇总，后台图表按日期范围单次读取）
+class DailyMetric(db.Model):
+    __tablename__ = 'daily_metrics'
+    id = Column(Integer, primary_key=True)
+    metric_date = Column(Date, nullable=False)
+    society_id = Column(Integer, nullable=False, default=0)  # 0 表示全站
+    metric = Column(String(32), nullable=False)  # activities_created / registrations / students_joined / users_joined
+    value = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+    # 唯一键列顺序即图表查询顺序：metric + society_id 等值，metric_date 范围
+    __table_args__ = (UniqueConstraint('metric', 'society_id', 'metric_date', name='uq_daily_metric'),)
+
+    def __repr__(self):
+        return f'<DailyMetric {self.metric_date} {self.society_id} {self.metric}={self.value}>'
+
+
 class ActivityTeam(db.Model):
     __tablename__ = 'activity_teams'
     id = Column(Integer, primary_key=True)
@@ -438,6 +529,59 @@ class Notification(db.Model):
     def __repr__(self):
         return f'<Notification {self.title}>'
 
+# 活动开始提醒发送台账（唯一键去重，每个用户每个活动每档提醒只发一次）
+class ActivityReminder(db.Model):
+    __tablename__ = 'activity_reminders'
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    activity_id = Column(Integer, ForeignKey('activities.id', ondelete='CASCADE'), nullable=False, index=True)
+    reminder_kind = Column(String(20), nullable=False)  # start_1d / start_3h / start_1h
+    batch_token = Column(String(32), index=True)  # 同一次扫描写入的台账行，用于批量生成对应通知
+    created_at = Column(DateTime, default=func.now())
+
+    __table_args__ = (UniqueConstraint('user_id', 'activity_id', 'reminder_kind', name='uq_activity_reminder'),)
+
+    def __repr__(self):
+        return f'<ActivityReminder {self.user_id} {self.activity_id} {self.reminder_kind}>'
+
+
+# 新活动微信订阅消息群发批次
+class ActivityNoticeDispatch(db.Model):
+    __tablename__ = 'activity_notice_dispatches'
+    id = Column(Integer, primary_key=True)
+    activity_id = Column(Integer, ForeignKey('activities.id', ondelete='CASCADE'), nullable=False, index=True)
+    created_by = Column(Integer, ForeignKey('users.id', ondelete='SET NULL'), nullable=True)
+    status = Column(String(16), nullable=False, default='queued')  # queued / running / done / failed
+    total = Column(Integer, nullable=False, default=0)
+    sent = Column(Integer, nullable=False, default=0)
+    failed = Column(Integer, nullable=False, default=0)
+    message = Column(String(255))
+    created_at = Column(DateTime, default=func.now())
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+
+    def __repr__(self):
+        return f'<ActivityNoticeDispatch {self.id} activity={self.activity_id} {self.status}>'
+
+
+# 群发批次中每个接收人的发送结果
+class ActivityNoticeRecipient(db.Model):
+    __tablename__ = 'activity_notice_recipients'
+    id = Column(Integer, primary_key=True)
+    dispatch_id = Column(Integer, ForeignKey('activity_notice_dispatches.id', ondelete='CASCADE'), nullable=False)
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    status = Column(String(16), nullable=False, default='pending')  # pending / sending / sent / failed
+    error = Column(String(255))
+    sent_at = Column(DateTime)
+
+    __table_args__ = (
+        UniqueConstraint('dispatch_id', 'user_id', name='uq_activity_notice_recipient'),
+        Index('idx_activity_notice_recipient_status', 'dispatch_id', 'status'),
+    )
+
+    def __repr__(self):
+        return f'<ActivityNoticeRecipient {self.dispatch_id} {self.user_id} {self.status}>'
+
 # 通知阅读记录模型
 class NotificationRead(db.Model):
     __tablename__ = 'notification_read'
@@ -456,6 +600,20 @@ class NotificationRead(db.Model):
     def __repr__(self):
         return f'<NotificationRead {self.user_id} {self.notification_id}>'
 
+# 用户未读计数（通知/消息写入与已读时增量维护，未读接口只需按主键读取一行）
+class UserUnreadCounter(db.Model):
+    __tablename__ = 'user_unread_counters'
+    user_id = Column(Integer, ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    notification_unread = Column(Integer, nullable=False, default=0)
+    message_unread = Column(Integer, nullable=False, default=0)
+    notification_expires_at = Column(DateTime)  # 已计入未读的通知中最早的过期时间，到期后需重算
+    stale = Column(Boolean, nullable=False, default=False)  # 批量删除等无法增量处理的变更后置为True，下次读取时重算
+    reconciled_at = Column(DateTime)
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+    def __repr__(self):
+        return f'<UserUnreadCounter {self.user_id} n={self.notification_unread} m={self.message_unread}>'
+
 # AI聊天历史记录模型
 class AIChatHistory(db.Model):
     __tablename__ = 'ai_chat_history'
@@ -465,6 +623,10 @@ class AIChatHistory(db.Model):
     role = Column(String(50), nullable=False)  # 'user' 或 'assistant'
     content = Column(Text, nullable=False)
     timestamp = Column(DateTime, default=func.now())
+
+    __table_args__ = (
+        Index('idx_ai_chat_history_session_user_ts', 'session_id', 'user_id', 'timestamp'),
+    )
     
     def __repr__(self):
         return f'<AIChatHistory {self.id}>'
@@ -476,6 +638,10 @@ class AIChatSession(db.Model):
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
     created_at = Column(DateTime, default=func.now())
     updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+    # 较早对话的滚动摘要（见 utils.chat_history），summary_until_id 为已折叠进摘要的最后一条历史记录ID
+    summary = Column(Text)
+    summary_until_id = Column(Integer)
+    summarized_at = Column(DateTime)
     
     # 关系
     history = relationship('AIChatHistory', backref='session', lazy='dynamic', cascade='all, delete-orphan')
@@ -522,6 +688,34 @@ class AIUserPreferences(db.Model):
         return f'<AIUserPreferences {self.user_id}>'
 
 
+# 后台AI异步任务（文案/解析/海报），由 src.utils.ai_jobs 的工作线程租约执行
+class AIJob(db.Model):
+    __tablename__ = 'ai_jobs'
+    id = Column(String(64), primary_key=True)  # 对外的 job_id
+    queue = Column(String(32), nullable=False)  # ai_text / ai_parse / ai_poster
+    owner_id = Column(Integer, ForeignKey('users.id', ondelete='SET NULL'), nullable=True)
+    status = Column(String(16), nullable=False, default='queued')  # queued / running / success / failed
+    payload = Column(Text)  # 任务参数（JSON）
+    result = Column(Text)  # 状态查询接口返回的内容（JSON）
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False, default=1)
+    available_at = Column(DateTime, nullable=False, default=func.now())  # 重试退避：早于该时间不领取
+    lease_owner = Column(String(96))
+    lease_expires_at = Column(DateTime)
+    created_at = Column(DateTime, default=func.now())
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+    expires_at = Column(DateTime, nullable=False)  # 超过该时间的记录由清理任务删除
+
+    __table_args__ = (
+        Index('idx_ai_jobs_claim', 'queue', 'status', 'available_at'),
+        Index('idx_ai_jobs_lease', 'status', 'lease_expires_at'),
+        Index('idx_ai_jobs_expires', 'expires_at'),
+    )
+
+    def __repr__(self):
+        return f'<AIJob {self.id} {self.queue} {self.status}>'
+
+
 class WeatherDailyCache(db.Model):
     __tablename__ = 'weather_daily_cache'
     id = Column(Integer, primary_key=True)
@@ -540,3 +734,14 @@ class WeatherDailyCache(db.Model):
 
     def __repr__(self):
         return f'<WeatherDailyCache {self.city_adcode} {self.weather_date} {self.extensions}>'
+
+
+class SchemaVersion(db.Model):
+    """数据库结构版本戳（单行，id 固定为 1），由 flask db-upgrade 写入。"""
+    __tablename__ = 'schema_version'
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    applied_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+    def __repr__(self):
+        return f'<SchemaVersion {self.version}>'
@@ -7,8 +7,6 @@ from datetime import datetime, timedelta
 import hashlib
 import json
 import re
-import io
-import threading
 import uuid
 import time
 from io import BytesIO  # 添加BytesIO导入
@@ -16,7 +14,6 @@ import csv
 import qrcode
 from PIL import Image, ImageDraw, ImageFont
 import base64
-import pandas as pd  # 添加pandas导入
 import tempfile  # 添加tempfile导入
 import zipfile  # 添加zipfile导入
 import pytz
@@ -39,6 +36,19 @@ from src.forms import ActivityForm  # 添加ActivityForm导入
 from flask_wtf.csrf import generate_csrf, validate_csrf
 from src.utils import get_compatible_paginate
 from src.utils.input_safety import sanitize_plain_text, sanitize_rich_html
+from src.utils.seat_reservation import try_reserve_seat, release_seat, occupies_seat, reconcile_activity_seats
+from src.utils.activity_stats import get_activity_stats
+from src.utils.poster_store import save_poster_bytes, set_activity_poster, read_activity_poster
+from src.utils.poster_derivatives import get_poster_derivative, warm_poster_derivatives_async
+from src.utils.pagination import keyset_paginate, coalesce_datetime
+from src.utils.unread_counters import mark_unread_counters_stale
+from src.utils.daily_metrics import read_daily_series, read_monthly_series
+from src.utils.histogram import histogram, bucket_labels, cached_distribution
+from src.utils.streaming_export import XlsxStreamWriter, export_response, stream_rows
+from src.utils.ai_jobs import register_job_kind, enqueue_job, get_job_result
+from src.utils.activity_notices import create_activity_notice_dispatch, dispatch_progress, latest_dispatch
+from src.utils.llm_client import CircuitOpenError, get_llm_client
+from src.utils.llm_cache import cache_status_header, cached_completion, get_cached_completion, llm_cache_key, refresh_requested
 
 # 创建蓝图
 admin_bp = Blueprint('admin', __name__)
@@ -389,6 +399,8 @@ def delete_society(society_id):
             deleted_points += PointsHistory.query.filter(PointsHistory.society_id == society.id).delete(synchronize_session=False) or 0
 
         deleted_messages = Message.query.filter(Message.target_society_id == society.id).delete(synchronize_session=False) or 0
+        if deleted_messages:
+            mark_unread_counters_stale()
 
         cleared_admin_bindings = User.query.filter(User.managed_society_id == society.id).update(
             {User.managed_society_id: None}, synchronize_session=False
@@ -533,16 +545,19 @@ def _format_review_time_for_display(dt):
         localized = dt.astimezone(beijing_tz)
     return localized.strftime('%Y-%m-%d %H:%M')
 
+def _ark_text_model():
+    return current_app.config.get(
+        'AI_TEXT_MODEL',
+        current_app.config.get('VOLCANO_MODEL', 'ep-20260320185026-9cc4w')
+    )
+
 def _call_ark_chat_completion(system_prompt, user_prompt, temperature=0.6, max_tokens=1200, timeout_seconds=45, max_retries=1):
     api_key = os.environ.get("ARK_API_KEY") or current_app.config.get('VOLCANO_API_KEY')
     if not api_key:
         raise ValueError('未配置ARK_API_KEY，无法使用AI生成能力')
 
     url = current_app.config.get('VOLCANO_API_URL', "https://ark.cn-beijing.volces.com/api/v3/chat/completions")
-    text_model = current_app.config.get(
-        'AI_TEXT_MODEL',
-        current_app.config.get('VOLCANO_MODEL', 'ep-20260320185026-9cc4w')
-    )
+    text_model = _ark_text_model()
 
     payload = {
         "model": text_model,
@@ -561,10 +576,13 @@ def _call_ark_chat_completion(system_prompt, user_prompt, temperature=0.6, max_t
     total_attempts = max(1, int(max_retries) + 1)
     for attempt in range(1, total_attempts + 1):
         try:
-            response = requests.post(url, headers=headers, json=payload, timeout=(8, timeout_seconds))
+            response = get_llm_client().post(url, headers=headers, json=payload, timeout=(8, timeout_seconds))
             response.raise_for_status()
             data = response.json()
             return data['choices'][0]['message']['content'].strip()
+        except CircuitOpenError:
+            # 熔断期间重试没有意义，直接失败
+            raise
         except requests.exceptions.Timeout as e:
             last_exception = e
             logger.warning(f"ARK文本请求超时，第{attempt}/{total_attempts}次: read_timeout={timeout_seconds}s")
@@ -593,6 +611,23 @@ def _call_ark_chat_completion(system_prompt, user_prompt, temperature=0.6, max_t
         raise last_exception
     raise ValueError('ARK文本请求失败：未知错误')
 
+def _ark_completion_cache_key(system_prompt, user_prompt, temperature, max_tokens):
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+    return llm_cache_key(_ark_text_model(), messages, temperature, max_tokens=max_tokens)
+
+def _cached_ark_chat_completion(endpoint, system_prompt, user_prompt, temperature=0.6, max_tokens=1200, refresh=False):
+    """按 LLM_CACHE_TTLS[endpoint] 缓存的文本生成，返回 (内容, 缓存状态)。"""
+    key = _ark_completion_cache_key(system_prompt, user_prompt, temperature, max_tokens)
+    return cached_completion(
+        endpoint,
+        key,
+        lambda: _call_ark_chat_completion(system_prompt, user_prompt, temperature=temperature, max_tokens=max_tokens),
+        refresh=refresh
+    )
+
 def _extract_json_block(raw_text):
     text = (raw_text or '').strip()
     if not text:
@@ -761,9 +796,7 @@ def _attach_ai_poster_from_url(activity, image_url):
         timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
         filename = f"activity_{activity.id}_ai_{timestamp}.{extension}"
 
-        activity.poster_image = filename
-        activity.poster_data = raw_bytes
-        activity.poster_mimetype = mime_type
+        set_activity_poster(activity, raw_bytes, mime_type, filename)
         return True
 
     response = requests.get(image_url, timeout=60)
@@ -783,9 +816,7 @@ def _attach_ai_poster_from_url(activity, image_url):
     timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
     filename = f"activity_{activity.id}_ai_{timestamp}.{extension}"
 
-    activity.poster_image = filename
-    activity.poster_data = response.content
-    activity.poster_mimetype = mime_type
+    set_activity_poster(activity, response.content, mime_type, filename)
     return True
 
 def _find_available_font(size):
@@ -826,9 +857,17 @@ def _build_share_poster_image(activity, detail_url):
     top_panel_height = target_height - bottom_panel_height
 
     source_image = None
-    if activity.poster_data:
-        source_image = Image.open(BytesIO(activity.poster_data)).convert('RGB')
-    else:
+    if activity.poster_hash:
+        # 分享图宽1080，直接使用1280档衍生图，避免每次解码数MB原图
+        try:
+            derivative_path, _ = get_poster_derivative(activity.poster_hash, 1280, 'jpeg')
+            source_image = Image.open(derivative_path).convert('RGB')
+        except Exception as e:
+            logger.warning(f"读取海报衍生图失败，回退原图: activity_id={activity.id}, error={e}")
+    poster_bytes = read_activity_poster(activity) if source_image is None else None
+    if poster_bytes:
+        source_image = Image.open(BytesIO(poster_bytes)).convert('RGB')
+    elif source_image is None:
         static_folder = current_app.static_folder or ''
         candidate_paths = []
         poster_name = str(activity.poster_image or '').strip()
@@ -912,301 +951,228 @@ AI_POSTER_JOB_TTL_SECONDS = 30 * 60
 AI_PARSE_JOB_TTL_SECONDS = 15 * 60
 AI_TEXT_JOB_TTL_SECONDS = 20 * 60
 
+# (system_prompt, user_prompt, temperature, max_tokens)
+def _activity_description_request(title):
+    system_prompt = "你是高校活动运营助手，只输出简洁、可直接发布的活动文案。"
+    user_prompt = (
+        f"活动标题：{title}\n"
+        "请输出一段活动描述，包含：活动亮点、参与对象、流程要点、收获价值。"
+        "要求：中文、150-280字、自然口语化、不要使用Markdown标题。"
+    )
+    return system_prompt, user_prompt, 0.7, 800
 
-def _text_job_dir(app):
-    base_dir = app.config.get('INSTANCE_PATH') or app.instance_path or tempfile.gettempdir()
-    job_dir = os.path.join(base_dir, 'ai_text_jobs')
-    os.makedirs(job_dir, exist_ok=True)
-    return job_dir
 
+def _message_reply_draft_request(message):
+    sender = db.session.get(User, message.sender_id) if message.sender_id else None
+    sender_info = None
+    if sender:
+        sender_info = db.session.execute(db.select(StudentInfo).filter_by(user_id=sender.id)).scalar_one_or_none()
 
-def _text_job_path(app, job_id):
-    safe_job_id = re.sub(r'[^a-zA-Z0-9_-]', '', str(job_id or ''))
-    if not safe_job_id:
-        raise ValueError('无效任务ID')
-    return os.path.join(_text_job_dir(app), f'{safe_job_id}.json')
+    sender_name = (
+        sender_info.real_name if sender_info and sender_info.real_name
+        else (sender.username if sender else '同学')
+    )
+    sender_student_id = sender_info.student_id if sender_info else ''
 
+    system_prompt = "你是高校社团管理后台助手，请生成专业、友好、可直接发送的中文回复。"
+    user_prompt = (
+        f"收到的消息主题：{message.subject or ''}\n"
+        f"发件人：{sender_name}"
+        f"{f'（学号：{sender_student_id}）' if sender_student_id else ''}\n"
+        f"消息内容：\n{(message.content or '').strip()}\n\n"
+        "请输出一段回复正文，要求：\n"
+        "1) 先表示已收到并理解问题\n"
+        "2) 给出明确处理建议或下一步\n"
+        "3) 语气简洁礼貌，不要空话\n"
+        "4) 120-220字\n"
+        "5) 不要使用Markdown标题"
+    )
+    return system_prompt, user_prompt, 0.5, 700
 
-def _write_text_job(app, job_id, payload):
-    file_path = _text_job_path(app, job_id)
-    temp_path = f'{file_path}.tmp'
-    with open(temp_path, 'w', encoding='utf-8') as f:
-        json.dump(payload, f, ensure_ascii=False)
-    os.replace(temp_path, file_path)
 
+def _message_reply_draft_result(message, reply_content):
+    return {
+        'reply_subject': f"回复：{message.subject}" if message.subject else "回复：你的反馈",
+        'reply_content': reply_content,
+        'receiver_id': message.sender_id
+    }
 
-def _read_text_job(app, job_id):
-    file_path = _text_job_path(app, job_id)
-    if not os.path.exists(file_path):
-        return None
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except Exception:
-        return None
 
+def _run_text_job(job_id, payload):
+    job_kind = payload.get('job_kind')
+    result_data = {}
 
-def _cleanup_expired_text_jobs(app):
-    job_dir = _text_job_dir(app)
-    now_ts = datetime.utcnow().timestamp()
-    for filename in os.listdir(job_dir):
-        if not filename.endswith('.json'):
-            continue
-        path = os.path.join(job_dir, filename)
-        try:
-            if now_ts - os.path.getmtime(path) > AI_TEXT_JOB_TTL_SECONDS:
-                os.remove(path)
-        except Exception:
-            continue
-
-
-def _run_async_text_job(app, job_id, job_kind, payload):
-    with app.app_context():
-        try:
-            current_payload = _read_text_job(app, job_id) or {}
-            current_payload.update({
-                'job_id': job_id,
-                'status': 'running',
-                'success': True,
-                'done': False,
-                'updated_at': datetime.utcnow().isoformat() + 'Z'
-            })
-            _write_text_job(app, job_id, current_payload)
+    if job_kind == 'activity_description':
+        title = (payload.get('title') or '').strip()
+        system_prompt, user_prompt, temperature, max_tokens = _activity_description_request(title)
+        content, cache_status = _cached_ark_chat_completion(
+            job_kind, system_prompt, user_prompt, temperature, max_tokens, refresh=payload.get('refresh')
+        )
+        result_data = {'description': content, 'cache_status': cache_status}
 
-            result_data = {}
+    elif job_kind == 'review_cluster_summary':
+        activity_id = int(payload.get('activity_id'))
+        activity = db.get_or_404(Activity, activity_id)
+        reviews = ActivityReview.query.filter_by(activity_id=activity_id).order_by(ActivityReview.created_at.desc()).all()
 
-            if job_kind == 'activity_description':
-                title = (payload.get('title') or '').strip()
-                system_prompt = "你是高校活动运营助手，只输出简洁、可直接发布的活动文案。"
-                user_prompt = (
-                    f"活动标题：{title}\n"
-                    "请输出一段活动描述，包含：活动亮点、参与对象、流程要点、收获价值。"
-                    "要求：中文、150-280字、自然口语化、不要使用Markdown标题。"
+        if not reviews:
+            result_data = {'summary': '该活动暂无评价数据，暂无法生成聚类总结。'}
+        else:
+            review_lines = []
+            for idx, review in enumerate(reviews[:120], start=1):
+                review_text = (review.review or '').replace('\n', ' ').strip()
+                if len(review_text) > 180:
+                    review_text = review_text[:180] + '…'
+                review_lines.append(
+                    f"{idx}. 总评{review.rating}/5，内容{review.content_quality or '-'}，组织{review.organization or '-'}，设施{review.facility or '-'}，反馈：{review_text}"
                 )
-                content = _call_ark_chat_completion(system_prompt, user_prompt, temperature=0.7, max_tokens=800)
-                result_data = {'description': content}
-
-            elif job_kind == 'review_cluster_summary':
-                activity_id = int(payload.get('activity_id'))
-                activity = db.get_or_404(Activity, activity_id)
-                reviews = ActivityReview.query.filter_by(activity_id=activity_id).order_by(ActivityReview.created_at.desc()).all()
 
-                if not reviews:
-                    result_data = {'summary': '该活动暂无评价数据，暂无法生成聚类总结。'}
-                else:
-                    review_lines = []
-                    for idx, review in enumerate(reviews[:120], start=1):
-                        review_text = (review.review or '').replace('\n', ' ').strip()
-                        if len(review_text) > 180:
-                            review_text = review_text[:180] + '…'
-                        review_lines.append(
-                            f"{idx}. 总评{review.rating}/5，内容{review.content_quality or '-'}，组织{review.organization or '-'}，设施{review.facility or '-'}，反馈：{review_text}"
-                        )
+            system_prompt = "你是高校活动评价分析助手，擅长把大量反馈聚类并输出行动建议。"
+            user_prompt = (
+                f"活动标题：{activity.title}\n"
+                f"评价总数：{len(reviews)}\n"
+                f"评价样本：\n" + "\n".join(review_lines) + "\n\n"
+                "请输出：\n"
+                "1) 评价主题聚类（3-6类，每类含‘主题名、占比估计、典型反馈、优先级’）\n"
+                "2) Top3 优点\n"
+                "3) Top3 问题\n"
+                "4) 可执行改进清单（按高/中/低优先级）\n"
+                "要求：中文，结构清晰，直接可用于运营复盘。"
+            )
+            summary = _call_ark_chat_completion(system_prompt, user_prompt, temperature=0.3, max_tokens=1600)
+            result_data = {'summary': summary}
 
-                    system_prompt = "你是高校活动评价分析助手，擅长把大量反馈聚类并输出行动建议。"
-                    user_prompt = (
-                        f"活动标题：{activity.title}\n"
-                        f"评价总数：{len(reviews)}\n"
-                        f"评价样本：\n" + "\n".join(review_lines) + "\n\n"
-                        "请输出：\n"
-                        "1) 评价主题聚类（3-6类，每类含‘主题名、占比估计、典型反馈、优先级’）\n"
-                        "2) Top3 优点\n"
-                        "3) Top3 问题\n"
-                        "4) 可执行改进清单（按高/中/低优先级）\n"
-                        "要求：中文，结构清晰，直接可用于运营复盘。"
-                    )
-                    summary = _call_ark_chat_completion(system_prompt, user_prompt, temperature=0.3, max_tokens=1600)
-                    result_data = {'summary': summary}
-
-            elif job_kind == 'retrospective_report':
-                activity_id = int(payload.get('activity_id'))
-                activity = db.get_or_404(Activity, activity_id)
-                reviews = ActivityReview.query.filter_by(activity_id=activity_id).all()
-                registrations = Registration.query.filter_by(activity_id=activity_id).all()
-
-                total_registered = len(registrations)
-                attended_count = sum(1 for r in registrations if r.status == 'attended')
-                cancelled_count = sum(1 for r in registrations if r.status == 'cancelled')
-                no_show_count = max(total_registered - attended_count - cancelled_count, 0)
-                attendance_rate = (attended_count / total_registered * 100.0) if total_registered else 0.0
-
-                avg_rating = (sum((r.rating or 0) for r in reviews) / len(reviews)) if reviews else 0.0
-                avg_content = (sum((r.content_quality or 0) for r in reviews) / len(reviews)) if reviews else 0.0
-                avg_organization = (sum((r.organization or 0) for r in reviews) / len(reviews)) if reviews else 0.0
-                avg_facility = (sum((r.facility or 0) for r in reviews) / len(reviews)) if reviews else 0.0
-
-                sample_reviews = []
-                for idx, review in enumerate(reviews[:40], start=1):
-                    text_sample = (review.review or '').replace('\n', ' ').strip()
-                    if len(text_sample) > 160:
-                        text_sample = text_sample[:160] + '…'
-                    sample_reviews.append(f"{idx}. {text_sample}")
-
-                system_prompt = "你是高校活动运营复盘顾问，擅长产出可执行复盘报告。"
-                user_prompt = (
-                    f"活动：{activity.title}\n"
-                    f"状态：{activity.status}\n"
-                    f"时间：{display_datetime(activity.start_time, None, '%Y-%m-%d %H:%M')} - {display_datetime(activity.end_time, None, '%Y-%m-%d %H:%M')}\n"
-                    f"地点：{activity.location or '未设置'}\n"
-                    f"积分：{activity.points or 0}\n"
-                    f"报名人数：{total_registered}\n"
-                    f"到场人数：{attended_count}\n"
-                    f"取消人数：{cancelled_count}\n"
-                    f"疑似未到场人数：{no_show_count}\n"
-                    f"到场率：{attendance_rate:.1f}%\n"
-                    f"评价数：{len(reviews)}\n"
-                    f"平均总评分：{avg_rating:.2f}\n"
-                    f"内容均分：{avg_content:.2f}\n"
-                    f"组织均分：{avg_organization:.2f}\n"
-                    f"设施均分：{avg_facility:.2f}\n"
-                    f"评价样本：\n{chr(10).join(sample_reviews) if sample_reviews else '暂无评价样本'}\n\n"
-                    "请生成复盘报告，包含：\n"
-                    "1) 活动目标达成评估\n"
-                    "2) 数据结论（报名/到场/评分）\n"
-                    "3) 关键问题与根因\n"
-                    "4) 下一次活动优化方案（会前/会中/会后）\n"
-                    "5) 下次可量化KPI建议（3-5条）\n"
-                    "要求：中文、结构清晰、可执行、不要空泛。"
-                )
-                report = _call_ark_chat_completion(system_prompt, user_prompt, temperature=0.35, max_tokens=1900)
-                result_data = {'report': report}
-
-            elif job_kind == 'message_reply_draft':
-                message_id = int(payload.get('message_id'))
-                message = db.get_or_404(Message, message_id)
-                sender = db.session.get(User, message.sender_id) if message.sender_id else None
-                sender_info = None
-                if sender:
-                    sender_info = db.session.execute(db.select(StudentInfo).filter_by(user_id=sender.id)).scalar_one_or_none()
-
-                sender_name = (
-                    sender_info.real_name if sender_info and sender_info.real_name
-                    else (sender.username if sender else '同学')
-                )
-                sender_student_id = sender_info.student_id if sender_info else ''
-
-                system_prompt = "你是高校社团管理后台助手，请生成专业、友好、可直接发送的中文回复。"
-                user_prompt = (
-                    f"收到的消息主题：{message.subject or ''}\n"
-                    f"发件人：{sender_name}"
-                    f"{f'（学号：{sender_student_id}）' if sender_student_id else ''}\n"
-                    f"消息内容：\n{(message.content or '').strip()}\n\n"
-                    "请输出一段回复正文，要求：\n"
-                    "1) 先表示已收到并理解问题\n"
-                    "2) 给出明确处理建议或下一步\n"
-                    "3) 语气简洁礼貌，不要空话\n"
-                    "4) 120-220字\n"
-                    "5) 不要使用Markdown标题"
-                )
-                reply_content = _call_ark_chat_completion(system_prompt, user_prompt, temperature=0.5, max_tokens=700)
-                reply_subject = f"回复：{message.subject}" if message.subject else "回复：你的反馈"
-                result_data = {
-                    'reply_subject': reply_subject,
-                    'reply_content': reply_content,
-                    'receiver_id': message.sender_id
-                }
-            else:
-                raise ValueError('不支持的任务类型')
+    elif job_kind == 'retrospective_report':
+        activity_id = int(payload.get('activity_id'))
+        activity = db.get_or_404(Activity, activity_id)
+        reviews = ActivityReview.query.filter_by(activity_id=activity_id).all()
+        registrations = Registration.query.filter_by(activity_id=activity_id).all()
 
-            done_payload = {
-                'job_id': job_id,
-                'status': 'success',
-                'success': True,
-                'done': True,
-                'message': 'AI任务已完成',
-                'updated_at': datetime.utcnow().isoformat() + 'Z'
-            }
-            done_payload.update(result_data)
-            _write_text_job(app, job_id, done_payload)
+        total_registered = len(registrations)
+        attended_count = sum(1 for r in registrations if r.status == 'attended')
+        cancelled_count = sum(1 for r in registrations if r.status == 'cancelled')
+        no_show_count = max(total_registered - attended_count - cancelled_count, 0)
+        attendance_rate = (attended_count / total_registered * 100.0) if total_registered else 0.0
 
-        except Exception as e:
-            logger.error(f"异步文本任务失败 job_id={job_id}, kind={job_kind}: {e}")
-            if isinstance(e, requests.exceptions.Timeout):
-                fail_message = 'AI任务超时，请稍后重试'
-            elif isinstance(e, requests.exceptions.HTTPError):
-                detail = _extract_ark_error_message(getattr(e, 'response', None)) if getattr(e, 'response', None) is not None else ''
-                fail_message = f"任务失败: {detail or str(e)}"
-            else:
-                fail_message = f'任务失败: {str(e)}'
+        avg_rating = (sum((r.rating or 0) for r in reviews) / len(reviews)) if reviews else 0.0
+        avg_content = (sum((r.content_quality or 0) for r in reviews) / len(reviews)) if reviews else 0.0
+        avg_organization = (sum((r.organization or 0) for r in reviews) / len(reviews)) if reviews else 0.0
+        avg_facility = (sum((r.facility or 0) for r in reviews) / len(reviews)) if reviews else 0.0
 
-            _write_text_job(app, job_id, {
-                'job_id': job_id,
-                'status': 'failed',
-                'success': False,
-                'done': True,
-                'message': fail_message,
-                'updated_at': datetime.utcnow().isoformat() + 'Z'
-            })
+        sample_reviews = []
+        for idx, review in enumerate(reviews[:40], start=1):
+            text_sample = (review.review or '').replace('\n', ' ').strip()
+            if len(text_sample) > 160:
+                text_sample = text_sample[:160] + '…'
+            sample_reviews.append(f"{idx}. {text_sample}")
 
+        system_prompt = "你是高校活动运营复盘顾问，擅长产出可执行复盘报告。"
+        user_prompt = (
+            f"活动：{activity.title}\n"
+            f"状态：{activity.status}\n"
+            f"时间：{display_datetime(activity.start_time, None, '%Y-%m-%d %H:%M')} - {display_datetime(activity.end_time, None, '%Y-%m-%d %H:%M')}\n"
+            f"地点：{activity.location or '未设置'}\n"
+            f"积分：{activity.points or 0}\n"
+            f"报名人数：{total_registered}\n"
+            f"到场人数：{attended_count}\n"
+            f"取消人数：{cancelled_count}\n"
+            f"疑似未到场人数：{no_show_count}\n"
+            f"到场率：{attendance_rate:.1f}%\n"
+            f"评价数：{len(reviews)}\n"
+            f"平均总评分：{avg_rating:.2f}\n"
+            f"内容均分：{avg_content:.2f}\n"
+            f"组织均分：{avg_organization:.2f}\n"
+            f"设施均分：{avg_facility:.2f}\n"
+            f"评价样本：\n{chr(10).join(sample_reviews) if sample_reviews else '暂无评价样本'}\n\n"
+            "请生成复盘报告，包含：\n"
+            "1) 活动目标达成评估\n"
+            "2) 数据结论（报名/到场/评分）\n"
+            "3) 关键问题与根因\n"
+            "4) 下一次活动优化方案（会前/会中/会后）\n"
+            "5) 下次可量化KPI建议（3-5条）\n"
+            "要求：中文、结构清晰、可执行、不要空泛。"
+        )
+        report = _call_ark_chat_completion(system_prompt, user_prompt, temperature=0.35, max_tokens=1900)
+        result_data = {'report': report}
+
+    elif job_kind == 'message_reply_draft':
+        message_id = int(payload.get('message_id'))
+        message = db.get_or_404(Message, message_id)
+        system_prompt, user_prompt, temperature, max_tokens = _message_reply_draft_request(message)
+        reply_content, cache_status = _cached_ark_chat_completion(
+            job_kind, system_prompt, user_prompt, temperature, max_tokens, refresh=payload.get('refresh')
+        )
+        result_data = dict(_message_reply_draft_result(message, reply_content), cache_status=cache_status)
+    else:
+        raise ValueError('不支持的任务类型')
 
-def _enqueue_text_job(job_kind, payload):
-    app_ref = current_app._get_current_object()
-    _cleanup_expired_text_jobs(app_ref)
-    job_id = f"text_{uuid.uuid4().hex}"
-    _write_text_job(app_ref, job_id, {
+    done_payload = {
         'job_id': job_id,
-        'owner_id': current_user.id,
-        'job_kind': job_kind,
-        'status': 'queued',
+        'status': 'success',
         'success': True,
-        'done': False,
-        'message': '任务已提交',
+        'done': True,
+        'message': 'AI任务已完成',
         'updated_at': datetime.utcnow().isoformat() + 'Z'
-    })
-    worker = threading.Thread(
-        target=_run_async_text_job,
-        args=(app_ref, job_id, job_kind, payload),
-        daemon=True
-    )
-    worker.start()
-    return job_id
-
+    }
+    done_payload.update(result_data)
+    return done_payload
 
-def _parse_job_dir(app):
-    base_dir = app.config.get('INSTANCE_PATH') or app.instance_path or tempfile.gettempdir()
-    job_dir = os.path.join(base_dir, 'ai_parse_jobs')
-    os.makedirs(job_dir, exist_ok=True)
-    return job_dir
 
+def _text_job_failure(job_id, e):
+    if isinstance(e, requests.exceptions.Timeout):
+        fail_message = 'AI任务超时，请稍后重试'
+    elif isinstance(e, requests.exceptions.HTTPError):
+        detail = _extract_ark_error_message(getattr(e, 'response', None)) if getattr(e, 'response', None) is not None else ''
+        fail_message = f"任务失败: {detail or str(e)}"
+    else:
+        fail_message = f'任务失败: {str(e)}'
 
-def _parse_job_path(app, job_id):
-    safe_job_id = re.sub(r'[^a-zA-Z0-9_-]', '', str(job_id or ''))
-    if not safe_job_id:
-        raise ValueError('无效任务ID')
-    return os.path.join(_parse_job_dir(app), f'{safe_job_id}.json')
+    return {
+        'job_id': job_id,
+        'status': 'failed',
+        'success': False,
+        'done': True,
+        'message': fail_message,
+        'updated_at': datetime.utcnow().isoformat() + 'Z'
+    }
 
 
-def _write_parse_job(app, job_id, payload):
-    file_path = _parse_job_path(app, job_id)
-    temp_path = f'{file_path}.tmp'
-    with open(temp_path, 'w', encoding='utf-8') as f:
-        json.dump(payload, f, ensure_ascii=False)
-    os.replace(temp_path, file_path)
+register_job_kind('ai_text', _run_text_job, _text_job_failure, concurrency=3, ttl_seconds=AI_TEXT_JOB_TTL_SECONDS)
 
 
-def _read_parse_job(app, job_id):
-    file_path = _parse_job_path(app, job_id)
-    if not os.path.exists(file_path):
-        return None
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except Exception:
+def _cached_text_job_response(job_kind, request_args, build_result):
+    """异步文本任务提交前先查 LLM 缓存：命中时直接返回已完成的结果，不再排队。未命中返回 None。"""
+    system_prompt, user_prompt, temperature, max_tokens = request_args
+    content = get_cached_completion(job_kind, _ark_completion_cache_key(system_prompt, user_prompt, temperature, max_tokens))
+    if content is None:
         return None
+    payload = {
+        'job_id': None,
+        'job_kind': job_kind,
+        'status': 'success',
+        'success': True,
+        'done': True,
+        'message': 'AI任务已完成',
+        'cache_status': 'hit',
+        'updated_at': datetime.utcnow().isoformat() + 'Z'
+    }
+    payload.update(build_result(content))
+    response = jsonify(payload)
+    response.headers['Cache-Status'] = cache_status_header('hit')
+    return response
 
 
-def _cleanup_expired_parse_jobs(app):
-    job_dir = _parse_job_dir(app)
-    now_ts = datetime.utcnow().timestamp()
-    for filename in os.listdir(job_dir):
-        if not filename.endswith('.json'):
-            continue
-        path = os.path.join(job_dir, filename)
-        try:
-            if now_ts - os.path.getmtime(path) > AI_PARSE_JOB_TTL_SECONDS:
-                os.remove(path)
-        except Exception:
-            continue
+def _enqueue_text_job(job_kind, payload):
+    job_id = f"text_{uuid.uuid4().hex}"
+    return enqueue_job('ai_text', job_id, dict(payload, job_kind=job_kind), owner_id=current_user.id, initial_result={
+        'job_id': job_id,
+        'job_kind': job_kind,
+        'status': 'queued',
+        'success': True,
+        'done': False,
+        'message': '任务已提交',
+        'updated_at': datetime.utcnow().isoformat() + 'Z'
+    })
 
 
 def _parse_activity_content_with_ai(raw_content):
@@ -1241,46 +1207,38 @@ def _parse_activity_content_with_ai(raw_content):
     return _normalize_activity_ai_payload(parsed_json)
 
 
-def _run_async_parse_job(app, job_id, raw_content):
-    with app.app_context():
-        try:
-            current_payload = _read_parse_job(app, job_id) or {}
-            current_payload.update({
-                'job_id': job_id,
-                'status': 'running',
-                'success': True,
-                'done': False,
-                'updated_at': datetime.utcnow().isoformat() + 'Z'
-            })
-            _write_parse_job(app, job_id, current_payload)
+def _run_parse_job(job_id, payload):
+    normalized = _parse_activity_content_with_ai(payload.get('content') or '')
+    return {
+        'job_id': job_id,
+        'status': 'success',
+        'success': True,
+        'done': True,
+        'data': normalized,
+        'message': 'AI已自动填充表单',
+        'updated_at': datetime.utcnow().isoformat() + 'Z'
+    }
 
-            normalized = _parse_activity_content_with_ai(raw_content)
-            _write_parse_job(app, job_id, {
-                'job_id': job_id,
-                'status': 'success',
-                'success': True,
-                'done': True,
-                'data': normalized,
-                'message': 'AI已自动填充表单',
-                'updated_at': datetime.utcnow().isoformat() + 'Z'
-            })
-        except Exception as e:
-            logger.error(f"异步解析活动内容失败 job_id={job_id}: {e}")
-            if isinstance(e, requests.exceptions.Timeout):
-                fail_message = 'AI解析超时，请稍后重试'
-            elif isinstance(e, requests.exceptions.HTTPError):
-                detail = _extract_ark_error_message(getattr(e, 'response', None)) if getattr(e, 'response', None) is not None else ''
-                fail_message = f"解析失败: {detail or str(e)}"
-            else:
-                fail_message = f'解析失败: {str(e)}'
-            _write_parse_job(app, job_id, {
-                'job_id': job_id,
-                'status': 'failed',
-                'success': False,
-                'done': True,
-                'message': fail_message,
-                'updated_at': datetime.utcnow().isoformat() + 'Z'
-            })
+
+def _parse_job_failure(job_id, e):
+    if isinstance(e, requests.exceptions.Timeout):
+        fail_message = 'AI解析超时，请稍后重试'
+    elif isinstance(e, requests.exceptions.HTTPError):
+        detail = _extract_ark_error_message(getattr(e, 'response', None)) if getattr(e, 'response', None) is not None else ''
+        fail_message = f"解析失败: {detail or str(e)}"
+    else:
+        fail_message = f'解析失败: {str(e)}'
+    return {
+        'job_id': job_id,
+        'status': 'failed',
+        'success': False,
+        'done': True,
+        'message': fail_message,
+        'updated_at': datetime.utcnow().isoformat() + 'Z'
+    }
+
+
+register_job_kind('ai_parse', _run_parse_job, _parse_job_failure, concurrency=3, ttl_seconds=AI_PARSE_JOB_TTL_SECONDS)
 
 
 def _poster_quality_profile(quality):
@@ -1387,127 +1345,76 @@ def _ark_payload_candidates(model_name, prompt, profile):
     return uniq
 
 
-def _poster_job_dir(app):
-    base_dir = app.config.get('INSTANCE_PATH') or app.instance_path or tempfile.gettempdir()
-    job_dir = os.path.join(base_dir, 'ai_poster_jobs')
-    os.makedirs(job_dir, exist_ok=True)
-    return job_dir
-
-
-def _poster_job_path(app, job_id):
-    safe_job_id = re.sub(r'[^a-zA-Z0-9_-]', '', str(job_id or ''))
-    if not safe_job_id:
-        raise ValueError('无效任务ID')
-    return os.path.join(_poster_job_dir(app), f'{safe_job_id}.json')
+def _run_poster_job(job_id, payload):
+    title = (payload.get('title') or '').strip()
+    description = (payload.get('description') or '').strip()
+    requirements = (payload.get('requirements') or '').strip()
+    model_value = (payload.get('model') or 'ark:doubao-seedream-5-0-260128').strip()
+    quality = (payload.get('quality') or 'high').strip().lower()
 
+    prompt = (
+        f"高校活动海报，主题：{title}。"
+        f"活动简介：{description[:220]}。"
+        "视觉要求：现代、青春、清晰排版、主体突出、适合校园宣传。"
+    )
+    if requirements:
+        prompt += f" 额外要求：{requirements}。"
 
-def _write_poster_job(app, job_id, payload):
-    file_path = _poster_job_path(app, job_id)
-    temp_path = f'{file_path}.tmp'
-    with open(temp_path, 'w', encoding='utf-8') as f:
-        json.dump(payload, f, ensure_ascii=False)
-    os.replace(temp_path, file_path)
+    provider, _, model_name = model_value.partition(':')
+    provider = provider.strip().lower()
+    model_name = model_name.strip()
+    if provider != 'ark' or not model_name:
+        raise ValueError('暂不支持该图片模型提供商')
 
+    profile, normalized_quality = _poster_quality_profile(quality)
+    image_url = _generate_poster_via_ark(prompt, model_name, normalized_quality)
 
-def _read_poster_job(app, job_id):
-    file_path = _poster_job_path(app, job_id)
-    if not os.path.exists(file_path):
-        return None
+    image_data_url = ''
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except Exception:
-        return None
-
-
-def _cleanup_expired_poster_jobs(app):
-    job_dir = _poster_job_dir(app)
-    now_ts = datetime.utcnow().timestamp()
-    for filename in os.listdir(job_dir):
-        if not filename.endswith('.json'):
-            continue
-        path = os.path.join(job_dir, filename)
-        try:
-            if now_ts - os.path.getmtime(path) > AI_POSTER_JOB_TTL_SECONDS:
-                os.remove(path)
-        except Exception:
-            continue
-
+        data_timeout = 18 if normalized_quality in ('high', 'ultra') else 12
+        image_data_url = _convert_image_url_to_data_url(image_url, timeout=data_timeout)
+    except Exception as convert_error:
+        logger.warning(f"异步海报任务转dataURL失败，将回退外链预览: {convert_error}")
 
-def _run_async_poster_job(app, job_id, payload):
-    with app.app_context():
-        try:
-            current_payload = _read_poster_job(app, job_id) or {}
-            current_payload.update({
-                'status': 'running',
-                'updated_at': datetime.utcnow().isoformat() + 'Z'
-            })
-            _write_poster_job(app, job_id, current_payload)
-
-            title = (payload.get('title') or '').strip()
-            description = (payload.get('description') or '').strip()
-            requirements = (payload.get('requirements') or '').strip()
-            model_value = (payload.get('model') or 'ark:doubao-seedream-5-0-260128').strip()
-            quality = (payload.get('quality') or 'high').strip().lower()
-
-            prompt = (
-                f"高校活动海报，主题：{title}。"
-                f"活动简介：{description[:220]}。"
-                "视觉要求：现代、青春、清晰排版、主体突出、适合校园宣传。"
-            )
-            if requirements:
-                prompt += f" 额外要求：{requirements}。"
+    done_payload = {
+        'job_id': job_id,
+        'status': 'success',
+        'success': True,
+        'done': True,
+        'image_url': image_url,
+        'image_data_url': image_data_url,
+        'prompt': prompt,
+        'model': model_value,
+        'model_used': model_value,
+        'quality': normalized_quality,
+        'quality_label': profile.get('label', ''),
+        'fallback': bool(not image_data_url and image_url),
+        'message': 'AI海报已生成' + ('（已本地化预览）' if image_data_url else '（外链预览）'),
+        'updated_at': datetime.utcnow().isoformat() + 'Z'
+    }
+    return done_payload
 
-            provider, _, model_name = model_value.partition(':')
-            provider = provider.strip().lower()
-            model_name = model_name.strip()
-            if provider != 'ark' or not model_name:
-                raise ValueError('暂不支持该图片模型提供商')
 
-            profile, normalized_quality = _poster_quality_profile(quality)
-            image_url = _generate_poster_via_ark(prompt, model_name, normalized_quality)
+def _poster_job_failure(job_id, e):
+    if isinstance(e, requests.exceptions.Timeout):
+        fail_message = 'AI生图超时，请稍后重试'
+    elif isinstance(e, requests.exceptions.HTTPError):
+        detail = _extract_ark_error_message(getattr(e, 'response', None)) if getattr(e, 'response', None) is not None else ''
+        fail_message = f"生成海报失败: {detail or str(e)}"
+    else:
+        fail_message = f'生成海报失败: {str(e)}'
+    return {
+        'job_id': job_id,
+        'status': 'failed',
+        'success': False,
+        'done': True,
+        'message': fail_message,
+        'updated_at': datetime.utcnow().isoformat() + 'Z'
+    }
 
-            image_data_url = ''
-            try:
-                data_timeout = 18 if normalized_quality in ('high', 'ultra') else 12
-                image_data_url = _convert_image_url_to_data_url(image_url, timeout=data_timeout)
-            except Exception as convert_error:
-                logger.warning(f"异步海报任务转dataURL失败，将回退外链预览: {convert_error}")
 
-            done_payload = {
-                'job_id': job_id,
-                'status': 'success',
-                'success': True,
-                'done': True,
-                'image_url': image_url,
-                'image_data_url': image_data_url,
-                'prompt': prompt,
-                'model': model_value,
-                'model_used': model_value,
-                'quality': normalized_quality,
-                'quality_label': profile.get('label', ''),
-                'fallback': bool(not image_data_url and image_url),
-                'message': 'AI海报已生成' + ('（已本地化预览）' if image_data_url else '（外链预览）'),
-                'updated_at': datetime.utcnow().isoformat() + 'Z'
-            }
-            _write_poster_job(app, job_id, done_payload)
-        except Exception as e:
-            logger.error(f"异步海报任务失败 job_id={job_id}: {e}")
-            if isinstance(e, requests.exceptions.Timeout):
-                fail_message = 'AI生图超时，请稍后重试'
-            elif isinstance(e, requests.exceptions.HTTPError):
-                detail = _extract_ark_error_message(getattr(e, 'response', None)) if getattr(e, 'response', None) is not None else ''
-                fail_message = f"生成海报失败: {detail or str(e)}"
-            else:
-                fail_message = f'生成海报失败: {str(e)}'
-            _write_poster_job(app, job_id, {
-                'job_id': job_id,
-                'status': 'failed',
-                'success': False,
-                'done': True,
-                'message': fail_message,
-                'updated_at': datetime.utcnow().isoformat() + 'Z'
-            })
+# 生图耗时长、上游限流严格，单独限制并发
+register_job_kind('ai_poster', _run_poster_job, _poster_job_failure, concurrency=1, ttl_seconds=AI_POSTER_JOB_TTL_SECONDS)
 
 
 def _generate_poster_via_ark(prompt, model_name, quality='high'):
@@ -1516,7 +1423,7 @@ def _generate_poster_via_ark(prompt, model_name, quality='high'):
         raise ValueError('未配置ARK_API_KEY，无法生成海报')
 
     profile, normalized_quality = _poster_quality_profile(quality)
-    image_api = "https://ark.cn-beijing.volces.com/api/v3/images/generations"
+    image_api = current_app.config.get('ARK_IMAGE_API_URL', "https://ark.cn-beijing.volces.com/api/v3/images/generations")
     payload_candidates = _ark_payload_candidates(model_name, prompt, profile)
 
     headers = {
@@ -1526,7 +1433,7 @@ def _generate_poster_via_ark(prompt, model_name, quality='high'):
 
     last_error_message = ''
     for index, image_payload in enumerate(payload_candidates):
-        response = requests.post(image_api, headers=headers, json=image_payload, timeout=profile['timeout'])
+        response = get_llm_client().post(image_api, headers=headers, json=image_payload, timeout=profile['timeout'])
         if response.ok:
             result = response.json()
             data_list = result.get('data') or []
@@ -1637,14 +1544,14 @@ def ai_generate_activity_description():
         if not title:
             return jsonify({'success': False, 'message': '请先输入活动标题'}), 400
 
-        system_prompt = "你是高校活动运营助手，只输出简洁、可直接发布的活动文案。"
-        user_prompt = (
-            f"活动标题：{title}\n"
-            "请输出一段活动描述，包含：活动亮点、参与对象、流程要点、收获价值。"
-            "要求：中文、150-280字、自然口语化、不要使用Markdown标题。"
+        system_prompt, user_prompt, temperature, max_tokens = _activity_description_request(title)
+        content, cache_status = _cached_ark_chat_completion(
+            'activity_description', system_prompt, user_prompt, temperature, max_tokens,
+            refresh=refresh_requested(payload)
         )
-        content = _call_ark_chat_completion(system_prompt, user_prompt, temperature=0.7, max_tokens=800)
-        return jsonify({'success': True, 'description': content})
+        response = jsonify({'success': True, 'description': content})
+        response.headers['Cache-Status'] = cache_status_header(cache_status)
+        return response
     except Exception as e:
         logger.error(f"AI生成活动描述失败: {e}")
         return jsonify({'success': False, 'message': f'生成失败: {str(e)}'}), 500
@@ -1660,7 +1567,15 @@ def ai_generate_activity_description_async():
         if not title:
             return jsonify({'success': False, 'message': '请先输入活动标题'}), 400
 
-        job_id = _enqueue_text_job('activity_description', {'title': title})
+        refresh = refresh_requested(payload)
+        if not refresh:
+            cached_response = _cached_text_job_response(
+                'activity_description', _activity_description_request(title), lambda content: {'description': content}
+            )
+            if cached_response is not None:
+                return cached_response
+
+        job_id = _enqueue_text_job('activity_description', {'title': title, 'refresh': refresh})
         return jsonify({'success': True, 'done': False, 'job_id': job_id, 'message': '任务已提交，正在生成文案'})
     except Exception as e:
         logger.error(f"提交活动描述异步任务失败: {e}")
@@ -1676,11 +1591,8 @@ def ai_parse_activity_content():
         if not raw_content:
             return jsonify({'success': False, 'message': '请先粘贴活动内容'}), 400
 
-        app_ref = current_app._get_current_object()
-        _cleanup_expired_parse_jobs(app_ref)
-
         job_id = f"parse_{uuid.uuid4().hex}"
-        _write_parse_job(app_ref, job_id, {
+        enqueue_job('ai_parse', job_id, {'content': raw_content}, owner_id=current_user.id, initial_result={
             'job_id': job_id,
             'status': 'queued',
             'success': True,
@@ -1689,13 +1601,6 @@ def ai_parse_activity_content():
             'updated_at': datetime.utcnow().isoformat() + 'Z'
         })
 
-        worker = threading.Thread(
-            target=_run_async_parse_job,
-            args=(app_ref, job_id, raw_content),
-            daemon=True
-        )
-        worker.start()
-
         return jsonify({
             'success': True,
             'job_id': job_id,
@@ -1711,8 +1616,7 @@ def ai_parse_activity_content():
 @admin_required
 def ai_parse_activity_content_status(job_id):
     try:
-        _cleanup_expired_parse_jobs(current_app)
-        payload = _read_parse_job(current_app, job_id)
+        payload = get_job_result(job_id, owner_id=current_user.id)
         if not payload:
             return jsonify({'success': False, 'message': '任务不存在或已过期'}), 404
         response = jsonify(payload)
@@ -1792,11 +1696,8 @@ def ai_generate_activity_poster_async():
         if not title:
             return jsonify({'success': False, 'message': '请先输入活动标题'}), 400
 
-        app = current_app._get_current_object()
-        _cleanup_expired_poster_jobs(app)
-
         job_id = uuid.uuid4().hex
-        _write_poster_job(app, job_id, {
+        enqueue_job('ai_poster', job_id, payload, owner_id=current_user.id, initial_result={
             'job_id': job_id,
             'status': 'pending',
             'success': True,
@@ -1806,13 +1707,6 @@ def ai_generate_activity_poster_async():
             'updated_at': datetime.utcnow().isoformat() + 'Z'
         })
 
-        worker = threading.Thread(
-            target=_run_async_poster_job,
-            args=(app, job_id, payload),
-            daemon=True
-        )
-        worker.start()
-
         return jsonify({
             'success': True,
             'job_id': job_id,
@@ -1827,13 +1721,10 @@ def ai_generate_activity_poster_async():
 @admin_required
 def ai_generate_activity_poster_async_status(job_id):
     try:
-        app = current_app._get_current_object()
-        _cleanup_expired_poster_jobs(app)
-
         if not re.fullmatch(r'[A-Za-z0-9_-]{8,64}', str(job_id or '')):
             return jsonify({'success': False, 'message': '任务ID无效'}), 400
 
-        data = _read_poster_job(app, job_id)
+        data = get_job_result(job_id, owner_id=current_user.id)
         if not data:
             return jsonify({'success': False, 'message': '任务不存在或已过期'}), 404
 
@@ -1892,7 +1783,7 @@ def handle_poster_upload(file_data, activity_id):
         activity_id: 活动ID
     
     Returns:
-        dict: 包含文件名、二进制数据和MIME类型的字典
+        dict: 包含文件名、海报内容摘要和MIME类型的字典
     """
     try:
         if not file_data or not hasattr(file_data, 'filename') or not file_data.filename:
@@ -1941,38 +1832,21 @@ def handle_poster_upload(file_data, activity_id):
         
         logger.info(f"生成的唯一文件名: {unique_filename}")
         
-        # 保存到文件系统 (同时保留这部分，确保向后兼容)
-        try:
-            # 确保上传目录存在
-            upload_dir = current_app.config['UPLOAD_FOLDER']
-            if not os.path.exists(upload_dir):
-                os.makedirs(upload_dir, exist_ok=True)
-                logger.info(f"创建上传目录: {upload_dir}")
-            
-            # 保存文件
-            file_path = os.path.join(upload_dir, unique_filename)
-            file_data.save(file_path)
-            logger.info(f"海报文件已保存到: {file_path}")
-            
-            # 设置文件权限为可读
-            try:
-                os.chmod(file_path, 0o644)
-                logger.info(f"设置文件权限为644: {file_path}")
-            except Exception as e:
-                logger.warning(f"无法设置文件权限: {e}")
-        except Exception as e:
-            logger.warning(f"保存文件到文件系统失败: {e}")
-        
-        # 读取二进制数据 (先保存文件再读取是为了确保文件指针位置正确)
+        # 写入海报内容寻址存储（同一图片只保存一份，activities表只记录摘要）
         file_data.seek(0)
         binary_data = file_data.read()
-        logger.info(f"已读取二进制数据，大小: {len(binary_data)} 字节")
+        if not binary_data:
+            logger.warning("上传的海报文件为空")
+            return None
+        poster_hash = save_poster_bytes(binary_data)
+        logger.info(f"海报已写入存储: hash={poster_hash}, 大小: {len(binary_data)} 字节")
+        warm_poster_derivatives_async(poster_hash)
         
-        # 返回文件信息 (包含文件名、二进制数据和MIME类型)
+        # 返回文件信息 (包含文件名、内容摘要和MIME类型)
         logger.info(f"活动海报已处理: {unique_filename}")
         return {
             'filename': unique_filename,
-            'data': binary_data,
+            'hash': poster_hash,
             'mimetype': mime_type
         }
         
@@ -2222,8 +2096,6 @@ def dashboard():
 @admin_required
 def activities(status='all'):
     try:
-        from src.utils import get_compatible_paginate
-
         per_page_options = [10, 20, 50, 100]
         requested_per_page = request.args.get('per_page', 10, type=int)
         per_page = requested_per_page if requested_per_page in per_page_options else 10
@@ -2289,15 +2161,14 @@ def activities(status='all'):
         elif status == 'draft':
             query = query.filter(Activity.status == 'draft')
         
-        # 排序
-        query = query.order_by(Activity.created_at.desc())
-
-        # 使用兼容性分页查询
-        activities = get_compatible_paginate(db, query, page=page, per_page=per_page, error_out=False)
+        # 按 (创建时间, id) 键集分页：上一页/下一页走游标，跳页走 OFFSET，总数短期缓存
+        sort_keys = [(coalesce_datetime(Activity.created_at), True), (Activity.id, True)]
+        cursor = None if jump_page else request.args.get('cursor')
+        activities = keyset_paginate(query, sort_keys, page=page, per_page=per_page, cursor=cursor)
 
         if activities.pages > 0 and page > activities.pages:
             page = activities.pages
-            activities = get_compatible_paginate(db, query, page=page, per_page=per_page, error_out=False)
+            activities = keyset_paginate(query, sort_keys, page=page, per_page=per_page)
         
         # 优化：使用子查询一次性获取所有活动的报名人数
         activity_ids = [activity.id for activity in activities.items]
@@ -2476,7 +2347,8 @@ def create_activity():
                         
                         # 更新海报信息
                         activity.poster_image = poster_info['filename']
-                        activity.poster_data = poster_info['data']
+                        activity.poster_hash = poster_info['hash']
+                        activity.poster_data = None
                         activity.poster_mimetype = poster_info['mimetype']
                         logger.info(f"活动海报信息已更新: {poster_info['filename']}")
                         
@@ -2783,7 +2655,8 @@ def edit_activity(id):
                             
                             # 更新海报信息
                             activity.poster_image = poster_info['filename']
-                            activity.poster_data = poster_info['data']
+                            activity.poster_hash = poster_info['hash']
+                            activity.poster_data = None
                             activity.poster_mimetype = poster_info['mimetype']
                             logger.info(f"编辑活动: 海报信息已更新: {poster_info['filename']}")
                             
@@ -2945,8 +2818,6 @@ def download_activity_document_admin(activity_id, doc_id):
 @admin_required
 def students():
     try:
-        from src.utils import get_compatible_paginate
-
         per_page_options = [10, 20, 50, 100]
         requested_per_page = request.args.get('per_page', 20, type=int)
         per_page = requested_per_page if requested_per_page in per_page_options else 20
@@ -2983,13 +2854,14 @@ def students():
                 )
             )
         
-        # 使用兼容性分页
-        query = query.order_by(StudentInfo.id.desc())
-        students = get_compatible_paginate(db, query, page=page, per_page=per_page, error_out=False)
+        # 按 id 键集分页：上一页/下一页走游标，跳页走 OFFSET，总数短期缓存
+        sort_keys = [(StudentInfo.id, True)]
+        cursor = None if jump_page else request.args.get('cursor')
+        students = keyset_paginate(query, sort_keys, page=page, per_page=per_page, cursor=cursor)
 
         if students.pages > 0 and page > students.pages:
             page = students.pages
-            students = get_compatible_paginate(db, query, page=page, per_page=per_page, error_out=False)
+            students = keyset_paginate(query, sort_keys, page=page, per_page=per_page)
         
         # 确保所有学生记录都有qq和has_selected_tags字段的值，并标记是否为管理员
         for student in students.items:
@@ -3059,6 +2931,7 @@ def delete_student(id):
         NotificationRead.query.filter_by(user_id=user.id).delete(synchronize_session=False)
         Notification.query.filter_by(created_by=user.id).delete(synchronize_session=False)
         Message.query.filter(or_(Message.sender_id == user.id, Message.receiver_id == user.id)).delete(synchronize_session=False)
+        mark_unread_counters_stale()
         Registration.query.filter_by(user_id=user.id).delete(synchronize_session=False)
         ActivityReview.query.filter_by(user_id=user.id).delete(synchronize_session=False)
         ActivityCheckin.query.filter_by(user_id=user.id).delete(synchronize_session=False)
@@ -3443,89 +3316,21 @@ def statistics():
         # 获取当前时间
         now = get_localized_now()
         
-        # 获取最近7天的日期范围
-        end_date = now
+        # 最近7天的活动、报名、新增学生数据来自 daily_metrics 汇总表（定时任务增量汇总），单次范围查询
+        end_date = now.date()
         start_date = end_date - timedelta(days=6)
-        
-        # 确保时间是规范化的
-        start_date = normalize_datetime_for_db(start_date)
-        end_date = normalize_datetime_for_db(end_date)
-        
         scope_id = _current_scope_society_id()
 
-        # 获取最近7天的活动数据
-        daily_activities_stmt = db.select(
-            func.date(Activity.created_at).label('date'),
-            func.count(Activity.id).label('count')
-        ).filter(
-            Activity.created_at.between(start_date, end_date)
-        ).group_by(
-            func.date(Activity.created_at)
+        days, series = read_daily_series(
+            ('activities_created', 'registrations', 'students_joined'), start_date, end_date, scope_id
         )
-        if scope_id:
-            daily_activities_stmt = daily_activities_stmt.filter(Activity.society_id == scope_id)
-        daily_activities = db.session.execute(daily_activities_stmt).all()
-        
-        # 获取最近7天的注册数据
-        daily_registrations_stmt = db.select(
-            func.date(Registration.register_time).label('date'),
-            func.count(Registration.id).label('count')
-        ).filter(
-            Registration.register_time.between(start_date, end_date)
-        )
-        if scope_id:
-            daily_registrations_stmt = daily_registrations_stmt.join(Activity, Registration.activity_id == Activity.id).filter(Activity.society_id == scope_id)
-        daily_registrations_stmt = daily_registrations_stmt.group_by(
-            func.date(Registration.register_time)
-        )
-        daily_registrations = db.session.execute(daily_registrations_stmt).all()
-        
-        # 获取最近7天的用户注册数据
-        daily_users_stmt = db.select(
-            func.date(User.created_at).label('date'),
-            func.count(User.id).label('count')
-        ).join(StudentInfo, StudentInfo.user_id == User.id).filter(
-            User.created_at.between(start_date, end_date)
-        )
-        if scope_id:
-            daily_users_stmt = daily_users_stmt.filter(
-                or_(
-                    StudentInfo.society_id == scope_id,
-                    StudentInfo.joined_societies.any(Society.id == scope_id)
-                )
-            )
-        daily_users_stmt = daily_users_stmt.group_by(
-            func.date(User.created_at)
-        )
-        daily_users = db.session.execute(daily_users_stmt).all()
-        
-        # 将查询结果转换为字典格式，方便前端使用
-        date_format = '%Y-%m-%d'
-        
-        # 创建包含所有日期的字典
-        date_range = [(start_date + timedelta(days=i)).strftime(date_format) for i in range(7)]
-        
-        activities_data = {date: 0 for date in date_range}
-        for item in daily_activities:
-            date_str = item.date.strftime(date_format) if hasattr(item.date, 'strftime') else str(item.date)
-            activities_data[date_str] = item.count
-            
-        registrations_data = {date: 0 for date in date_range}
-        for item in daily_registrations:
-            date_str = item.date.strftime(date_format) if hasattr(item.date, 'strftime') else str(item.date)
-            registrations_data[date_str] = item.count
-            
-        users_data = {date: 0 for date in date_range}
-        for item in daily_users:
-            date_str = item.date.strftime(date_format) if hasattr(item.date, 'strftime') else str(item.date)
-            users_data[date_str] = item.count
-        
+
         # 准备图表数据
         chart_data = {
-            'labels': date_range,
-            'activities': [activities_data[date] for date in date_range],
-            'registrations': [registrations_data[date] for date in date_range],
-            'users': [users_data[date] for date in date_range]
+            'labels': [day.strftime('%Y-%m-%d') for day in days],
+            'activities': series['activities_created'],
+            'registrations': series['registrations'],
+            'users': series['students_joined']
         }
         
         # 获取活动类型分布
@@ -3632,46 +3437,12 @@ def api_statistics():
             'data': [active_students, inactive_students]
         }
         
-        # 月度活动和报名统计
-        months = []
-        activities_count = []
-        registrations_count = []
-        
-        for i in range(5, -1, -1):
-            # 获取过去6个月的数据
-            current_month = normalize_datetime_for_db(datetime.now()).replace(day=1) - timedelta(days=i*30)
-            month_start = current_month.replace(day=1)
-            if current_month.month == 12:
-                month_end = current_month.replace(year=current_month.year+1, month=1, day=1)
-            else:
-                month_end = current_month.replace(month=current_month.month+1, day=1)
-            
-            # 月份标签
-            month_label = current_month.strftime('%Y-%m')
-            months.append(month_label)
-            
-            # 活动数量
-            monthly_activities_stmt = db.select(func.count()).select_from(Activity).filter(
-                Activity.created_at.between(month_start, month_end)
-            )
-            if scope_id:
-                monthly_activities_stmt = monthly_activities_stmt.filter(Activity.society_id == scope_id)
-            monthly_activities = db.session.execute(monthly_activities_stmt).scalar() or 0
-            activities_count.append(monthly_activities)
-            
-            # 报名数量
-            monthly_registrations_stmt = db.select(func.count()).select_from(Registration).filter(
-                Registration.register_time.between(month_start, month_end)
-            )
-            if scope_id:
-                monthly_registrations_stmt = monthly_registrations_stmt.join(Activity, Registration.activity_id == Activity.id).filter(Activity.society_id == scope_id)
-            monthly_registrations = db.session.execute(monthly_registrations_stmt).scalar() or 0
-            registrations_count.append(monthly_registrations)
-        
+        # 月度活动和报名统计（按自然月汇总 daily_metrics，单次范围查询）
+        months, monthly = read_monthly_series(('activities_created', 'registrations'), 6, scope_id)
         monthly_stats = {
             'labels': months,
-            'activities': activities_count,
-            'registrations': registrations_count
+            'activities': monthly['activities_created'],
+            'registrations': monthly['registrations']
         }
         
         return jsonify({
@@ -3800,10 +3571,11 @@ def activity_registrations(id):
                 'members': members,
             })
         
-        # 统计报名状态
-        registered_count = db.session.execute(db.select(func.count()).select_from(Registration).filter_by(activity_id=id, status='registered')).scalar()
-        cancelled_count = db.session.execute(db.select(func.count()).select_from(Registration).filter_by(activity_id=id, status='cancelled')).scalar()
-        attended_count = db.session.execute(db.select(func.count()).select_from(Registration).filter_by(activity_id=id, status='attended')).scalar()
+        # 统计报名状态（读取活动统计读模型）
+        stats = get_activity_stats(id)
+        registered_count = stats.registered_count or 0
+        cancelled_count = stats.cancelled_count or 0
+        attended_count = stats.attended_count or 0
         
         # 修复签到状态统计 - 确保报名统计准确性
         # 这里处理签到后的状态计数，让前端能正确显示
@@ -3837,18 +3609,8 @@ def export_activity_registrations(id):
         is_team_mode = (getattr(activity, 'registration_mode', 'individual') or 'individual') == 'team'
         include_cancelled = (request.args.get('include_cancelled') or '').strip().lower() in ('1', 'true', 'yes', 'on')
         
-        # 获取报名学生列表
-        query = Registration.query.filter_by(activity_id=id)
-        if not include_cancelled:
-            query = query.filter(Registration.status != 'cancelled')
-
-        registrations = query.join(
-            User, Registration.user_id == User.id
-        ).join(
-            StudentInfo, User.id == StudentInfo.user_id
-        ).outerjoin(
-            ActivityTeam, Registration.team_id == ActivityTeam.id
-        ).add_columns(
+        # 获取报名学生列表（服务器端游标分批读取，不整体载入内存）
+        stmt = db.select(
             Registration.id.label('registration_id'),
             Registration.user_id,
             Registration.register_time,
@@ -3866,74 +3628,72 @@ def export_activity_registrations(id):
             StudentInfo.major,
             StudentInfo.phone,
             StudentInfo.points
-        ).all()
+        ).join(
+            User, Registration.user_id == User.id
+        ).join(
+            StudentInfo, User.id == StudentInfo.user_id
+        ).outerjoin(
+            ActivityTeam, Registration.team_id == ActivityTeam.id
+        ).filter(Registration.activity_id == id)
+        if not include_cancelled:
+            stmt = stmt.filter(Registration.status != 'cancelled')
 
         # 以队伍为单位排序：先队伍，再队员；无队伍记录放在最后
-        registrations = sorted(
-            registrations,
-            key=lambda reg: (
-                1 if not reg.team_id else 0,
-                str(reg.team_name or ''),
-                str(reg.team_code or ''),
-                reg.register_time or datetime.min,
-                str(reg.real_name or ''),
-                str(reg.student_id or '')
-            )
+        stmt = stmt.order_by(
+            case((Registration.team_id.is_(None), 1), else_=0),
+            func.coalesce(ActivityTeam.name, ''),
+            func.coalesce(ActivityTeam.team_code, ''),
+            coalesce_datetime(Registration.register_time),
+            func.coalesce(StudentInfo.real_name, ''),
+            func.coalesce(StudentInfo.student_id, ''),
+            Registration.id
         )
+
+        headers = ['报名ID', '姓名', '学号', '年级', '学院', '专业', '手机号', '报名时间', '状态', '积分', '备注', '签到状态', '签到时间']
+        if is_team_mode:
+            headers += ['队伍名称', '团队码']
+
+        def _rows():
+            for reg in stream_rows(stmt):
+                # 将UTC时间转换为北京时间
+                register_time_bj = localize_time(reg.register_time)
+                check_in_time_bj = localize_time(reg.check_in_time) if reg.check_in_time else None
+                remark_text = (reg.remark or '').strip()
+                if reg.team_id and reg.leader_user_id and reg.user_id == reg.leader_user_id:
+                    remark_text = f"{remark_text}；队长" if remark_text else '队长'
+
+                row = [
+                    reg.registration_id,
+                    reg.real_name,
+                    reg.student_id,
+                    reg.grade,
+                    reg.college,
+                    reg.major,
+                    reg.phone,
+                    register_time_bj.strftime('%Y-%m-%d %H:%M:%S') if register_time_bj else '',
+                    '已报名' if reg.status == 'registered' else '已取消' if reg.status == 'cancelled' else '已参加',
+                    reg.points or 0,
+                    remark_text,
+                    '已签到' if reg.check_in_time else '未签到',
+                    check_in_time_bj.strftime('%Y-%m-%d %H:%M:%S') if check_in_time_bj else ''
+                ]
+                if is_team_mode:
+                    row += [reg.team_name or '', reg.team_code or '']
+                yield row
         
-        # 创建Excel文件
-        output = io.BytesIO()
-        writer = pd.ExcelWriter(output, engine='openpyxl')
-        
-        # 转换为DataFrame
-        data = []
-        for reg in registrations:
-            # 将UTC时间转换为北京时间
-            register_time_bj = localize_time(reg.register_time)
-            check_in_time_bj = localize_time(reg.check_in_time) if reg.check_in_time else None
-            remark_text = (reg.remark or '').strip()
-            if reg.team_id and reg.leader_user_id and reg.user_id == reg.leader_user_id:
-                remark_text = f"{remark_text}；队长" if remark_text else '队长'
-            
-            row = {
-                '报名ID': reg.registration_id,
-                '姓名': reg.real_name,
-                '学号': reg.student_id,
-                '年级': reg.grade,
-                '学院': reg.college,
-                '专业': reg.major,
-                '手机号': reg.phone,
-                '报名时间': register_time_bj.strftime('%Y-%m-%d %H:%M:%S') if register_time_bj else '',
-                '状态': '已报名' if reg.status == 'registered' else '已取消' if reg.status == 'cancelled' else '已参加',
-                '积分': reg.points or 0,
-                '备注': remark_text,
-                '签到状态': '已签到' if reg.check_in_time else '未签到',
-                '签到时间': check_in_time_bj.strftime('%Y-%m-%d %H:%M:%S') if check_in_time_bj else ''
-            }
-            if is_team_mode:
-                row['队伍名称'] = reg.team_name or ''
-                row['团队码'] = reg.team_code or ''
-            data.append(row)
-        
-        df = pd.DataFrame(data)
-        df.to_excel(writer, sheet_name='报名信息', index=False)
-        
-        # 保存Excel
-        writer.close()
-        output.seek(0)
-        
-        # 记录操作日志
+        # 记录操作日志（先提交日志，再开始流式读取，避免提交关闭服务器端游标）
         log_action('export_registrations', f"导出活动({activity.title})的报名信息，包含已取消={include_cancelled}")
         
         # 使用北京时间作为文件名
         beijing_now = get_beijing_time()
         
-        # 返回Excel文件
-        return send_file(
-            output,
-            as_attachment=True,
-            download_name=f"{activity.title}_报名信息_{beijing_now.strftime('%Y%m%d%H%M%S')}.xlsx",
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        # 返回导出文件（?format=csv 时导出 CSV）
+        return export_response(
+            request.args.get('format'),
+            f"{activity.title}_报名信息_{beijing_now.strftime('%Y%m%d%H%M%S')}",
+            '报名信息',
+            headers,
+            _rows()
         )
     except Exception as e:
         logger.error(f"Error exporting activity registrations: {e}")
@@ -4092,13 +3852,17 @@ def disband_activity_team(activity_id, team_id):
     ).scalars().all()
 
     affected_count = 0
+    released_seats = 0
     for reg in member_regs:
         # 管理员解散队伍时，队员报名一并取消，避免“无队伍但仍占用名额”。
+        if occupies_seat(reg.status):
+            released_seats += 1
         reg.status = 'cancelled'
         reg.check_in_time = None
         reg.team_id = None
         affected_count += 1
 
+    release_seat(activity_id, released_seats)
     db.session.delete(team)
     db.session.commit()
     log_action('disband_activity_team', f'活动{activity_id} 解散队伍{team_id}，并取消{affected_count}名成员报名')
@@ -4109,20 +3873,21 @@ def disband_activity_team(activity_id, team_id):
 @admin_required
 def export_students():
     try:
-        # 获取所有学生信息
-        students_query = User.query.join(Role).filter(Role.name == 'Student').join(
-            StudentInfo, User.id == StudentInfo.user_id
-        )
-        if _current_scope_society_id():
-            scope_id = _current_scope_society_id()
-            students_query = students_query.filter(
-                or_(
-                    StudentInfo.society_id == scope_id,
-                    StudentInfo.joined_societies.any(Society.id == scope_id)
-                )
-            )
+        scope_id = _current_scope_society_id()
+        points_column = StudentInfo.points
+        scoped_points = None
+        if scope_id:
+            # 社团视角的积分：一次分组汇总本社团积分流水后关联，不再逐个学生查询
+            scoped_points = db.select(
+                PointsHistory.student_id,
+                func.sum(PointsHistory.points).label('points')
+            ).filter(
+                PointsHistory.society_id == scope_id
+            ).group_by(PointsHistory.student_id).subquery()
+            points_column = func.coalesce(scoped_points.c.points, 0)
 
-        students = students_query.add_columns(
+        # 获取所有学生信息（服务器端游标分批读取，不整体载入内存）
+        stmt = db.select(
             User.id,
             User.username,
             User.email,
@@ -4134,61 +3899,57 @@ def export_students():
             StudentInfo.major,
             StudentInfo.phone,
             StudentInfo.qq,
-            StudentInfo.points
-        ).all()
-        
-        # 创建Excel文件
-        output = io.BytesIO()
-        writer = pd.ExcelWriter(output, engine='openpyxl')
-        
-        # 转换为DataFrame
-        data = []
-        for student in students:
-            # 将UTC时间转换为北京时间
-            beijing_created_at = localize_time(student.created_at)
-            scoped_points = student.points or 0
-            if _current_scope_society_id():
-                scoped_points = db.session.execute(
-                    db.select(func.coalesce(func.sum(PointsHistory.points), 0)).filter(
-                        PointsHistory.student_id == student.id,
-                        PointsHistory.society_id == _current_scope_society_id()
-                    )
-                ).scalar() or 0
-            
-            data.append({
-                '用户ID': student.id,
-                '用户名': student.username,
-                '邮箱': student.email,
-                '姓名': student.real_name,
-                '学号': student.student_id,
-                '年级': student.grade,
-                '学院': student.college,
-                '专业': student.major,
-                '手机号': student.phone,
-                'QQ': student.qq,
-                '积分': scoped_points,
-                '注册时间': beijing_created_at.strftime('%Y-%m-%d %H:%M:%S')
-            })
-        
-        df = pd.DataFrame(data)
-        df.to_excel(writer, sheet_name='学生信息', index=False)
-        
-        # 保存Excel
-        writer.close()
-        output.seek(0)
+            points_column.label('points')
+        ).join(
+            Role, User.role_id == Role.id
+        ).join(
+            StudentInfo, User.id == StudentInfo.user_id
+        ).filter(Role.name == 'Student')
+        if scoped_points is not None:
+            stmt = stmt.outerjoin(scoped_points, scoped_points.c.student_id == StudentInfo.id)
+        if scope_id:
+            stmt = stmt.filter(
+                or_(
+                    StudentInfo.society_id == scope_id,
+                    StudentInfo.joined_societies.any(Society.id == scope_id)
+                )
+            )
+        stmt = stmt.order_by(User.id)
+
+        headers = ['用户ID', '用户名', '邮箱', '姓名', '学号', '年级', '学院', '专业', '手机号', 'QQ', '积分', '注册时间']
+
+        def _rows():
+            for student in stream_rows(stmt):
+                # 将UTC时间转换为北京时间
+                beijing_created_at = localize_time(student.created_at)
+                yield [
+                    student.id,
+                    student.username,
+                    student.email,
+                    student.real_name,
+                    student.student_id,
+                    student.grade,
+                    student.college,
+                    student.major,
+                    student.phone,
+                    student.qq,
+                    student.points or 0,
+                    beijing_created_at.strftime('%Y-%m-%d %H:%M:%S') if beijing_created_at else ''
+                ]
         
-        # 记录操作日志
+        # 记录操作日志（先提交日志，再开始流式读取，避免提交关闭服务器端游标）
         log_action('export_students', '导出所有学生信息')
         
         # 使用北京时间作为文件名
         beijing_now = get_beijing_time()
         
-        # 返回Excel文件
-        return send_file(
-            output,
-            as_attachment=True,
-            download_name=f"学生信息_{beijing_now.strftime('%Y%m%d%H%M%S')}.xlsx",
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        # 返回导出文件（?format=csv 时导出 CSV）
+        return export_response(
+            request.args.get('format'),
+            f"学生信息_{beijing_now.strftime('%Y%m%d%H%M%S')}",
+            '学生信息',
+            headers,
+            _rows()
         )
     except Exception as e:
         logger.error(f"Error exporting students: {e}")
@@ -4214,12 +3975,24 @@ def export_society_admins():
         admins = db.session.execute(
             db.select(User).filter(User.role_id == admin_role.id).order_by(User.id.asc())
         ).scalars().all()
+        societies = {society.id: society for society in db.session.execute(db.select(Society)).scalars().all()}
+
+        # 全部管理员发布的活动按 (发布人, 创建时间倒序) 一次流式读取，与管理员列表顺序归并
+        activities_stmt = db.select(
+            Activity.id,
+            Activity.title,
+            Activity.status,
+            Activity.society_id,
+            Activity.start_time,
+            Activity.end_time,
+            Activity.created_at,
+            Activity.created_by
+        ).join(
+            User, Activity.created_by == User.id
+        ).filter(
+            User.role_id == admin_role.id
+        ).order_by(Activity.created_by.asc(), Activity.created_at.desc(), Activity.id.desc())
 
-        output = io.BytesIO()
-        writer = pd.ExcelWriter(output, engine='openpyxl')
-
-        summary_rows = []
-        activity_rows = []
         beijing_tz = pytz.timezone('Asia/Shanghai')
 
         def format_system_time_for_export(dt):
@@ -4230,63 +4003,69 @@ def export_society_admins():
                 dt = pytz.utc.localize(dt)
             return dt.astimezone(beijing_tz).strftime('%Y-%m-%d %H:%M:%S')
 
-        for admin_user in admins:
-            managed_society = db.session.get(Society, admin_user.managed_society_id) if admin_user.managed_society_id else None
-
-            created_activities = db.session.execute(
-                db.select(Activity).filter(Activity.created_by == admin_user.id).order_by(Activity.created_at.desc())
-            ).scalars().all()
-
-            activity_names = [a.title for a in created_activities if getattr(a, 'title', None)]
-            latest_activity_at = created_activities[0].created_at if created_activities else None
-
-            summary_rows.append({
-                '管理员用户ID': admin_user.id,
-                '用户名': admin_user.username,
-                '邮箱': admin_user.email,
-                '是否总管理员': '是' if bool(getattr(admin_user, 'is_super_admin', False)) else '否',
-                '账号状态': '启用' if bool(getattr(admin_user, 'active', False)) else '禁用',
-                '管理社团ID': getattr(admin_user, 'managed_society_id', None) or '',
-                '管理社团名称': managed_society.name if managed_society else '',
-                '管理社团编码': managed_society.code if managed_society else '',
-                '管理社团状态': ('启用' if managed_society and managed_society.is_active else ('停用' if managed_society else '未绑定')),
-                '发布活动数量': len(created_activities),
-                '最近发布活动时间': format_system_time_for_export(latest_activity_at),
-                '发布活动名称列表': '\n'.join(activity_names),
-                '最近登录时间': format_system_time_for_export(admin_user.last_login),
-                '注册时间': format_system_time_for_export(admin_user.created_at)
-            })
-
-            for activity in created_activities:
-                activity_society = db.session.get(Society, getattr(activity, 'society_id', None)) if getattr(activity, 'society_id', None) else None
-                activity_rows.append({
-                    '管理员用户ID': admin_user.id,
-                    '管理员用户名': admin_user.username,
-                    '管理员邮箱': admin_user.email,
-                    '活动ID': activity.id,
-                    '活动名称': activity.title,
-                    '活动状态': activity.status,
-                    '所属社团': activity_society.name if activity_society else '',
-                    '活动开始时间': localize_time(activity.start_time).strftime('%Y-%m-%d %H:%M:%S') if activity.start_time else '',
-                    '活动结束时间': localize_time(activity.end_time).strftime('%Y-%m-%d %H:%M:%S') if activity.end_time else '',
-                    '活动创建时间': format_system_time_for_export(activity.created_at)
-                })
-
-        pd.DataFrame(summary_rows).to_excel(writer, sheet_name='社团管理员概览', index=False)
-        pd.DataFrame(activity_rows).to_excel(writer, sheet_name='管理员发布活动明细', index=False)
+        writer = XlsxStreamWriter()
+        summary_sheet = writer.add_sheet('社团管理员概览', [
+            '管理员用户ID', '用户名', '邮箱', '是否总管理员', '账号状态', '管理社团ID', '管理社团名称', '管理社团编码',
+            '管理社团状态', '发布活动数量', '最近发布活动时间', '发布活动名称列表', '最近登录时间', '注册时间'
+        ])
+        activity_sheet = writer.add_sheet('管理员发布活动明细', [
+            '管理员用户ID', '管理员用户名', '管理员邮箱', '活动ID', '活动名称', '活动状态', '所属社团',
+            '活动开始时间', '活动结束时间', '活动创建时间'
+        ])
 
-        writer.close()
-        output.seek(0)
+        activity_rows = iter(stream_rows(activities_stmt))
+        pending = next(activity_rows, None)
+        for admin_user in admins:
+            managed_society = societies.get(admin_user.managed_society_id) if admin_user.managed_society_id else None
+
+            activity_names = []
+            activity_count = 0
+            latest_activity_at = None
+            while pending is not None and pending.created_by <= admin_user.id:
+                activity = pending
+                pending = next(activity_rows, None)
+                if activity.created_by != admin_user.id:
+                    continue
+                activity_count += 1
+                if activity_count == 1:
+                    latest_activity_at = activity.created_at
+                if activity.title:
+                    activity_names.append(activity.title)
+                activity_society = societies.get(activity.society_id) if activity.society_id else None
+                activity_sheet.append([
+                    admin_user.id,
+                    admin_user.username,
+                    admin_user.email,
+                    activity.id,
+                    activity.title,
+                    activity.status,
+                    activity_society.name if activity_society else '',
+                    localize_time(activity.start_time).strftime('%Y-%m-%d %H:%M:%S') if activity.start_time else '',
+                    localize_time(activity.end_time).strftime('%Y-%m-%d %H:%M:%S') if activity.end_time else '',
+                    format_system_time_for_export(activity.created_at)
+                ])
+
+            summary_sheet.append([
+                admin_user.id,
+                admin_user.username,
+                admin_user.email,
+                '是' if bool(getattr(admin_user, 'is_super_admin', False)) else '否',
+                '启用' if bool(getattr(admin_user, 'active', False)) else '禁用',
+                getattr(admin_user, 'managed_society_id', None) or '',
+                managed_society.name if managed_society else '',
+                managed_society.code if managed_society else '',
+                ('启用' if managed_society and managed_society.is_active else ('停用' if managed_society else '未绑定')),
+                activity_count,
+                format_system_time_for_export(latest_activity_at),
+                '\n'.join(activity_names),
+                format_system_time_for_export(admin_user.last_login),
+                format_system_time_for_export(admin_user.created_at)
+            ])
 
         log_action('export_society_admins', '导出社团管理员信息与发布活动明细')
 
         beijing_now = get_beijing_time()
-        return send_file(
-            output,
-            as_attachment=True,
-            download_name=f"社团管理员信息_{beijing_now.strftime('%Y%m%d%H%M%S')}.xlsx",
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
+        return writer.response(f"社团管理员信息_{beijing_now.strftime('%Y%m%d%H%M%S')}.xlsx")
     except Exception as e:
         logger.error(f"Error exporting society admins: {e}", exc_info=True)
         flash('导出社团管理员信息时出错', 'danger')
@@ -4570,7 +4349,7 @@ def import_backup():
                 # 清除所有中间表和关联表
                 tables_to_clear = [
                     "activity_tags", "student_tags", "points_history", 
-                    "activity_checkins", "activity_reviews", "registrations", 
+                    "activity_checkins", "activity_reviews", "registrations", "activity_seats", 
                     "system_logs", "messages", "announcements", 
                     "ai_chat_history", "ai_user_preferences"
                 ]
@@ -4625,6 +4404,10 @@ def import_backup():
                             setattr(reg, key, value)
                         db.session.add(reg)
                 
+                # 按导入的报名记录重建名额计数，与导入数据同一事务提交
+                db.session.flush()
+                reconcile_activity_seats(commit=False)
+                
                 # 提交所有更改
                 db.session.commit()
                 flash('备份数据导入成功！系统数据已恢复', 'success')
@@ -4661,6 +4444,15 @@ def update_registration_status(id):
             flash('无效的状态值', 'danger')
             return redirect(url_for('admin.activity_registrations', id=registration.activity_id))
         
+        # 进入占用名额的状态时预留名额（满员则拒绝），离开时释放
+        if not occupies_seat(old_status) and occupies_seat(new_status):
+            if not try_reserve_seat(activity, registration.user_id):
+                db.session.rollback()
+                flash('该活动名额已满，无法恢复报名', 'warning')
+                return redirect(url_for('admin.activity_registrations', id=registration.activity_id))
+        elif occupies_seat(old_status) and not occupies_seat(new_status):
+            release_seat(registration.activity_id)
+        
         # 处理积分变更
         student_info = StudentInfo.query.join(User).filter(User.id == registration.user_id).first()
         
@@ -4898,80 +4690,58 @@ def delete_tag(id):
 @admin_required
 def api_statistics_ext():
     try:
+        scope_id = _current_scope_society_id()
+        scope_filter = or_(
+            StudentInfo.society_id == scope_id,
+            StudentInfo.joined_societies.any(Society.id == scope_id)
+        ) if scope_id else None
+
         # 标签热度 - 改为统计学生选择的标签而非活动标签
-        from src.models import Tag, StudentInfo, student_tags
-        
-        tag_stats_stmt = db.select(
-            Tag.name, 
-            func.count(student_tags.c.student_id).label('count')
-        ).outerjoin(
-            student_tags, Tag.id == student_tags.c.tag_id
-        ).group_by(Tag.id)
-        
-        tag_stats = db.session.execute(tag_stats_stmt).all()
-        
-        tag_heat = {
-            'labels': [t[0] for t in tag_stats],
-            'data': [t[1] for t in tag_stats]
-        }
+        def _tag_heat():
+            if scope_filter is None:
+                tag_stats_stmt = db.select(
+                    Tag.name,
+                    func.count(student_tags.c.student_id).label('count')
+                ).outerjoin(
+                    student_tags, Tag.id == student_tags.c.tag_id
+                )
+            else:
+                tag_stats_stmt = db.select(
+                    Tag.name,
+                    func.count(StudentInfo.id).label('count')
+                ).outerjoin(
+                    student_tags, Tag.id == student_tags.c.tag_id
+                ).outerjoin(
+                    StudentInfo, and_(StudentInfo.id == student_tags.c.student_id, scope_filter)
+                )
+            tag_stats = db.session.execute(tag_stats_stmt.group_by(Tag.id, Tag.name)).all()
+            return {
+                'labels': [t[0] for t in tag_stats],
+                'data': [t[1] for t in tag_stats]
+            }
+
+        tag_heat = cached_distribution('tag_heat', scope_id, _tag_heat)
         
-        # 积分分布
-        from src.models import StudentInfo
+        # 积分分布（数据库侧单次分组分桶）
         points_bins = [0, 10, 30, 50, 100, 200, 500, 1000]
-        bin_labels = [f'{points_bins[i]}-{points_bins[i+1]-1}' for i in range(len(points_bins)-1)] + [f'{points_bins[-1]}+']
-        bin_counts = [0] * len(bin_labels)  # 修正：使用bin_labels的长度
-        
-        student_info_stmt = db.select(StudentInfo)
-        students = db.session.execute(student_info_stmt).scalars().all()
-        
-        for stu in students:
-            points = stu.points or 0  # 处理None值
-            
-            # 检查最后一个区间（特殊情况）
-            if points >= points_bins[-1]:
-                bin_counts[-1] += 1
-                continue
-                
-            # 检查其他区间
-            for i in range(len(points_bins) - 1):
-                if points_bins[i] <= points < points_bins[i+1]:
-                    bin_counts[i] += 1
-                    break
-        
-        points_dist = {
-            'labels': bin_labels,
-            'data': bin_counts
-        }
+
+        def _points_dist():
+            return {
+                'labels': bucket_labels(points_bins),
+                'data': histogram(
+                    func.coalesce(StudentInfo.points, 0), points_bins, StudentInfo,
+                    filters=[scope_filter] if scope_filter is not None else []
+                )
+            }
+
+        points_dist = cached_distribution('points_dist', scope_id, _points_dist)
         
         # 添加注册趋势数据（每日新注册用户数）
         try:
-            now = get_localized_now()
-            days_ago_30 = now - timedelta(days=30)
-            
-            registration_trend_stmt = db.select(
-                func.date(User.created_at).label('date'),
-                func.count(User.id).label('count')
-            ).filter(
-                User.created_at >= days_ago_30
-            ).group_by(
-                func.date(User.created_at)
-            )
-            
-            registration_trend = db.session.execute(registration_trend_stmt).all()
-            
-            # 将结果转换为前端可用的格式
-            reg_dates = [(days_ago_30 + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(31)]
-            reg_counts = [0] * 31
-            
-            for item in registration_trend:
-                date_str = item.date.strftime('%Y-%m-%d') if hasattr(item.date, 'strftime') else str(item.date)
-                try:
-                    date_obj = datetime.strptime(date_str, '%Y-%m-%d')
-                    day_diff = (date_obj - days_ago_30).days
-                    if 0 <= day_diff < 31:
-                        reg_counts[day_diff] = item.count
-                except:
-                    pass
+            today = get_localized_now().date()
+            days, series = read_daily_series(('users_joined',), today - timedelta(days=30), today)
+            reg_dates = [day.strftime('%Y-%m-%d') for day in days]
+            reg_counts = series['users_joined']
             
             registration_trend_data = {
                 'labels': reg_dates,
@@ -5236,24 +5006,30 @@ def ai_activity_retrospective_report_async(id):
 @admin_required
 def ai_text_job_status(job_id):
     try:
-        _cleanup_expired_text_jobs(current_app)
-        payload = _read_text_job(current_app, job_id)
+        # 只能查询自己提交的任务；他人的任务与不存在的任务一样返回 404
+        payload = get_job_result(job_id, owner_id=current_user.id)
         if not payload:
             return jsonify({'success': False, 'message': '任务不存在或已过期'}), 404
 
-        owner_id = payload.get('owner_id')
-        if owner_id and int(owner_id) != current_user.id:
-            return jsonify({'success': False, 'message': '无权查看该任务'}), 403
-
         response = jsonify(payload)
         response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
         response.headers['Pragma'] = 'no-cache'
         response.headers['Expires'] = '0'
+        if payload.get('cache_status'):
+            response.headers['Cache-Status'] = cache_status_header(payload['cache_status'])
         return response
     except Exception as e:
         logger.error(f"查询AI文本任务状态失败: {e}")
         return jsonify({'success': False, 'message': f'查询失败: {str(e)}'}), 500
 
+@admin_bp.route('/ai/llm-stats', methods=['GET'])
+@admin_required
+def ai_llm_stats():
+    """当前 worker 的出站 LLM 请求统计：按模型的延迟、错误率与熔断状态。"""
+    response = jsonify({'success': True, 'pid': os.getpid(), 'models': get_llm_client().snapshot()})
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
 @admin_bp.route('/api/qrcode/checkin/<int:id>')
 @admin_required
 def generate_checkin_qrcode(id):
@@ -6068,6 +5844,7 @@ def delete_notification(id):
         db.session.execute(
             db.delete(Notification).where(Notification.id.in_(duplicate_ids))
         )
+        mark_unread_counters_stale()
         db.session.commit()
         _invalidate_home_page_caches()
         
@@ -6145,7 +5922,13 @@ def messages():
             ))
         
         logger.info("执行分页查询")
-        messages = query.order_by(Message.created_at.desc()).paginate(page=page, per_page=10)
+        messages = keyset_paginate(
+            query,
+            [(coalesce_datetime(Message.created_at), True), (Message.id, True)],
+            page=page,
+            per_page=10,
+            cursor=request.args.get('cursor')
+        )
         logger.info(f"查询到消息数量: {len(messages.items) if messages else 0}")
         
         # 检查每条消息的详细信息
@@ -6251,6 +6034,7 @@ def mark_all_messages_read_admin():
             Message.receiver_id == current_user.id,
             Message.is_read == False
         ).update({Message.is_read: True}, synchronize_session=False)
+        mark_unread_counters_stale([current_user.id])
         db.session.commit()
         flash(f'已标记 {updated} 条未读消息', 'success')
     except Exception as e:
@@ -6285,39 +6069,14 @@ def ai_generate_message_reply_draft(id):
         if message.receiver_id != current_user.id:
             return jsonify({'success': False, 'message': '仅可为收到的消息生成回复草稿'}), 403
 
-        sender = db.session.get(User, message.sender_id) if message.sender_id else None
-        sender_info = None
-        if sender:
-            sender_info = db.session.execute(db.select(StudentInfo).filter_by(user_id=sender.id)).scalar_one_or_none()
-
-        sender_name = (
-            sender_info.real_name if sender_info and sender_info.real_name
-            else (sender.username if sender else '同学')
-        )
-        sender_student_id = sender_info.student_id if sender_info else ''
-
-        system_prompt = "你是高校社团管理后台助手，请生成专业、友好、可直接发送的中文回复。"
-        user_prompt = (
-            f"收到的消息主题：{message.subject or ''}\n"
-            f"发件人：{sender_name}"
-            f"{f'（学号：{sender_student_id}）' if sender_student_id else ''}\n"
-            f"消息内容：\n{(message.content or '').strip()}\n\n"
-            "请输出一段回复正文，要求：\n"
-            "1) 先表示已收到并理解问题\n"
-            "2) 给出明确处理建议或下一步\n"
-            "3) 语气简洁礼貌，不要空话\n"
-            "4) 120-220字\n"
-            "5) 不要使用Markdown标题"
+        system_prompt, user_prompt, temperature, max_tokens = _message_reply_draft_request(message)
+        reply_content, cache_status = _cached_ark_chat_completion(
+            'message_reply_draft', system_prompt, user_prompt, temperature, max_tokens,
+            refresh=refresh_requested(request.get_json(silent=True))
         )
-        reply_content = _call_ark_chat_completion(system_prompt, user_prompt, temperature=0.5, max_tokens=700)
-        reply_subject = f"回复：{message.subject}" if message.subject else "回复：你的反馈"
-
-        return jsonify({
-            'success': True,
-            'reply_subject': reply_subject,
-            'reply_content': reply_content,
-            'receiver_id': message.sender_id
-        })
+        response = jsonify(dict(_message_reply_draft_result(message, reply_content), success=True))
+        response.headers['Cache-Status'] = cache_status_header(cache_status)
+        return response
     except Exception as e:
         logger.error(f"AI生成回复草稿失败: {e}")
         return jsonify({'success': False, 'message': f'生成失败: {str(e)}'}), 500
@@ -6332,7 +6091,16 @@ def ai_generate_message_reply_draft_async(id):
         if message.receiver_id != current_user.id:
             return jsonify({'success': False, 'message': '仅可为收到的消息生成回复草稿'}), 403
 
-        job_id = _enqueue_text_job('message_reply_draft', {'message_id': id})
+        refresh = refresh_requested(request.get_json(silent=True))
+        if not refresh:
+            cached_response = _cached_text_job_response(
+                'message_reply_draft', _message_reply_draft_request(message),
+                lambda content: _message_reply_draft_result(message, content)
+            )
+            if cached_response is not None:
+                return cached_response
+
+        job_id = _enqueue_text_job('message_reply_draft', {'message_id': id, 'refresh': refresh})
         return jsonify({'success': True, 'done': False, 'job_id': job_id, 'message': '任务已提交，正在生成回复草稿'})
     except Exception as e:
         logger.error(f"提交AI回复草稿异步任务失败: {e}")
@@ -6999,6 +6767,7 @@ def edit_announcement(id):
                         Notification.content == old_content
                     )
                 ).delete(synchronize_session=False)
+                mark_unread_counters_stale()
                 
                 db.session.commit()
                 _invalidate_home_page_caches()
@@ -7066,6 +6835,7 @@ def delete_announcement(id):
                 Notification.content == announcement.content
             )
         ).delete(synchronize_session=False)
+        mark_unread_counters_stale()
         
         # 删除公告
         db.session.delete(announcement)
@@ -7088,26 +6858,34 @@ def notify_new_activity_subs(id):
         return redirect(url_for('admin.activity_view', id=id))
         
     try:
-        import subprocess, sys, os
-        from threading import Thread
-        
         # 权限校验
         activity = db.get_or_404(Activity, id)
         if not _scope_guard_activity(activity):
             return jsonify({'success': False, 'msg': '无权限操作该社团的活动'})
-            
-        script_path = os.path.abspath(os.path.join(current_app.root_path, '..', 'scripts', 'publish_activity_notice.py'))
-        
-        # 异步调用之前写的提醒脚本
-        def run_script():
-            subprocess.Popen([sys.executable, script_path, str(id)])
-            
-        Thread(target=run_script).start()
-        
-        return jsonify({'success': True, 'msg': '已加入后台群发队列'})
+
+        dispatch, created = create_activity_notice_dispatch(activity, created_by=current_user.id)
+        if created:
+            log_action('notify_new_activity_subs', f'活动({activity.title})发起微信订阅消息群发，目标 {dispatch.total} 人')
+        msg = '已加入后台群发队列' if created else '该活动已有群发任务在进行中'
+        if created and dispatch.total == 0:
+            msg = '没有可推送的用户'
+        return jsonify({'success': True, 'msg': msg, 'progress': dispatch_progress(dispatch)})
     except Exception as e:
+        db.session.rollback()
+        logger.error(f"提交活动通知群发失败: {e}")
         return jsonify({'success': False, 'msg': str(e)})
 
+
+@admin_bp.route('/activity/<int:id>/notify_subs/status', methods=['GET'])
+@admin_required
+def notify_new_activity_subs_status(id):
+    activity = db.get_or_404(Activity, id)
+    if not _scope_guard_activity(activity):
+        return jsonify({'success': False, 'msg': '无权限查看该社团的活动'}), 403
+    response = jsonify({'success': True, 'progress': dispatch_progress(latest_dispatch(id))})
+    response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, max-age=0'
+    return response
+
 @admin_bp.route('/activity/<int:id>/view')
 @admin_required
 def activity_view(id):
@@ -7120,25 +6898,17 @@ def activity_view(id):
 
         active_statuses = ['registered', 'attended']
         
-        # 获取报名统计
-        registrations_count = db.session.execute(
+        # 获取报名与签到统计（读取活动统计读模型）
+        stats = get_activity_stats(id)
+        registrations_count = stats.total_registered
+        # 签到数沿用原口径：已签到 + 仍为已报名但有签到时间的记录（后者为少量历史数据，单独计数）
+        checkins_count = (stats.attended_count or 0) + (db.session.execute(
             db.select(func.count()).select_from(Registration).filter(
                 Registration.activity_id == id,
-                Registration.status.in_(active_statuses)
-            )
-        ).scalar()
-        
-        # 获取签到统计
-        checkins_count = db.session.execute(
-            db.select(func.count()).select_from(Registration).filter(
-                Registration.activity_id == id,
-                Registration.status.in_(active_statuses),
-                or_(
-                    Registration.status == 'attended',
-                    Registration.check_in_time.is_not(None)
-                )
+                Registration.status == 'registered',
+                Registration.check_in_time.is_not(None)
             )
-        ).scalar()
+        ).scalar() or 0)
         
         # 获取报名学生列表
         registrations = Registration.query.filter(
@@ -7402,6 +7172,7 @@ def approve_request(log_id):
                             Notification.content == old_content
                         )
                     ).delete(synchronize_session=False)
+                    mark_unread_counters_stale()
 
                     _sync_published_announcements_to_notifications()
             elif req_action == 'delete':
@@ -7430,6 +7201,7 @@ def approve_request(log_id):
                             Notification.content == ann.content
                         )
                     ).delete(synchronize_session=False)
+                    mark_unread_counters_stale()
                     db.session.delete(ann)
 
         details['status'] = 'approved'
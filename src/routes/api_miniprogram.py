@@ -1,6 +1,9 @@
-from src.routes.student import _ensure_activity_start_reminders
 from flask import Blueprint, jsonify, request, current_app
 from src.utils.time_helpers import display_datetime
+from src.utils.seat_reservation import try_reserve_seat, release_seat
+from src.utils.unread_counters import get_unread_counts
+from src.utils.pagination import keyset_paginate, coalesce_datetime
+from src.utils.llm_client import get_llm_client
 from src.models import Activity, User, StudentInfo, Registration
 from src import db
 import pytz
@@ -18,6 +21,19 @@ def _to_unix_ms(dt):
         dt = dt.astimezone(pytz.utc)
     return int(dt.timestamp() * 1000)
 
+
+MP_PAGE_SIZE = 20
+MP_PAGE_SIZE_MAX = 50
+
+
+def _mp_page(query, sort_keys):
+    """小程序列表按游标分批加载：?limit=&cursor=，返回 (本批数据, 下一批游标)。"""
+    limit = request.args.get('limit', MP_PAGE_SIZE, type=int) or MP_PAGE_SIZE
+    limit = max(1, min(limit, MP_PAGE_SIZE_MAX))
+    cursor = request.args.get('cursor') or None
+    page = keyset_paginate(query, sort_keys, per_page=limit, cursor=cursor, with_total=False)
+    return page.items, page.next_cursor
+
 @api_mp_bp.route('/login', methods=['POST'])
 def mp_login():
     data = request.json or {}
@@ -89,10 +105,12 @@ def get_activities():
         if society_id:
             query = query.filter_by(society_id=society_id)
             
-        activities = query.order_by(Activity.start_time.desc()).all()
+        activities, next_cursor = _mp_page(
+            query, [(coalesce_datetime(Activity.start_time), True), (Activity.id, True)]
+        )
         data = []
         for a in activities:
-            poster_full_url = a.poster_url
+            poster_full_url = a.poster_thumb_url(640)
             if poster_full_url and not poster_full_url.startswith('http'):
                 poster_full_url = f"{request.host_url.rstrip('/')}{poster_full_url}"
                 
@@ -107,7 +125,7 @@ def get_activities():
                 'current_participants': a.registrations.filter_by(status='registered').count(),
                 'points': a.points
             })
-        return jsonify({'success': True, 'data': data})
+        return jsonify({'success': True, 'data': data, 'next_cursor': next_cursor, 'has_more': next_cursor is not None})
     except Exception as e:
         return jsonify({'success': False, 'msg': str(e)})
 
@@ -181,16 +199,14 @@ def require_token(f):
 @require_token
 def my_activities():
     user = request.mp_user
-    try:
-        _ensure_activity_start_reminders(user.id)
-    except Exception as e:
-        current_app.logger.error(f"Failed to generate reminders in my_activities: {e}")
-    user = request.mp_user
-    regs = Registration.query.filter_by(user_id=user.id).order_by(Registration.register_time.desc()).all()
+    regs, next_cursor = _mp_page(
+        Registration.query.filter_by(user_id=user.id),
+        [(coalesce_datetime(Registration.register_time), True), (Registration.id, True)]
+    )
     data = []
     for r in regs:
         a = r.activity
-        poster_full_url = a.poster_url
+        poster_full_url = a.poster_thumb_url(640)
         if poster_full_url and not poster_full_url.startswith('http'):
             poster_full_url = f"{request.host_url.rstrip('/')}{poster_full_url}"
         data.append({
@@ -205,7 +221,7 @@ def my_activities():
             'current_participants': a.registrations.filter_by(status='registered').count(),
             'points': a.points
         })
-    return jsonify({'success': True, 'data': data})
+    return jsonify({'success': True, 'data': data, 'next_cursor': next_cursor, 'has_more': next_cursor is not None})
 
 @api_mp_bp.route('/activities/<int:id>/cancel', methods=['POST'])
 @require_token
@@ -218,6 +234,8 @@ def cancel_activity(id):
         if reg.status == 'attended':
             return jsonify({'success': False, 'msg': '已签到无法取消'})
         
+        if reg.status == 'registered':
+            release_seat(id)
         reg.status = 'cancelled'
         db.session.commit()
         return jsonify({'success': True, 'msg': '取消报名成功'})
@@ -241,26 +259,23 @@ def register_activity(id):
     existing = Registration.query.filter_by(user_id=user.id, activity_id=id).first()
     if existing:
         if existing.status == 'cancelled':
-            if a.max_participants > 0:
-                current_count = Registration.query.filter_by(activity_id=id, status='registered').count() + Registration.query.filter_by(activity_id=id, status='attended').count()
-                if current_count >= a.max_participants:
-                    return jsonify({'success': False, 'msg': '名额已满'})
             existing.status = 'registered'
             from src.routes.student import _create_registration_success_notification
             _create_registration_success_notification(user.id, a)
+            if not try_reserve_seat(a, user.id):
+                db.session.rollback()
+                return jsonify({'success': False, 'msg': '名额已满'})
             db.session.commit()
             return jsonify({'success': True, 'msg': '重新报名成功'})
         return jsonify({'success': False, 'msg': '您已经报名过该活动啦'})
 
-    if a.max_participants > 0:
-        current_count = Registration.query.filter_by(activity_id=id, status='registered').count() + Registration.query.filter_by(activity_id=id, status='attended').count()
-        if current_count >= a.max_participants:
-            return jsonify({'success': False, 'msg': '名额已满'})
-
     new_reg = Registration(user_id=user.id, activity_id=id)
     db.session.add(new_reg)
     from src.routes.student import _create_registration_success_notification
     _create_registration_success_notification(user.id, a)
+    if not try_reserve_seat(a, user.id):
+        db.session.rollback()
+        return jsonify({'success': False, 'msg': '名额已满'})
     db.session.commit()
     return jsonify({'success': True, 'msg': '报名成功！'})
 
@@ -395,34 +410,8 @@ def wx_login():
 @api_mp_bp.route('/notifications/unread_count', methods=['GET'])
 @require_token
 def get_unread_count():
-    from src.models import Notification, NotificationRead
     user = request.mp_user
-    now = datetime.utcnow()
-
-    deleted_ids_subq = db.select(NotificationRead.notification_id).filter(
-        NotificationRead.user_id == user.id,
-        NotificationRead.is_deleted.is_(True)
-    )
-
-    read_ids_subq = db.select(NotificationRead.notification_id).filter(
-        NotificationRead.user_id == user.id,
-        NotificationRead.is_deleted.is_(False)
-    )
-
-    unread_count = db.session.execute(
-        db.select(db.func.count(Notification.id)).filter(
-            db.or_(
-                Notification.is_public == True,
-                db.and_(Notification.is_public == False, Notification.created_by == user.id)
-            ),
-            db.or_(Notification.expiry_date == None, Notification.expiry_date >= now),
-            Notification.title.isnot(None),
-            Notification.content.isnot(None),
-            ~Notification.id.in_(deleted_ids_subq),
-            ~Notification.id.in_(read_ids_subq)
-        )
-    ).scalar() or 0
-    
+    unread_count, _ = get_unread_counts(user.id)
     return jsonify({'success': True, 'unread_count': unread_count})
 
 @api_mp_bp.route('/notifications', methods=['GET'])
@@ -431,11 +420,6 @@ def get_unread_count():
 def mp_notifications():
     from src.models import Notification, NotificationRead
     user = request.mp_user
-    # 触发活动前提醒生成
-    try:
-        _ensure_activity_start_reminders(user.id)
-    except Exception as e:
-        current_app.logger.error(f'Failed to generate reminders: {e}')
     now = datetime.utcnow()
 
     deleted_ids = db.session.execute(
@@ -445,21 +429,28 @@ def mp_notifications():
         )
     ).scalars().all()
 
-    notifications = Notification.query.filter(
-        db.or_(
-            Notification.is_public == True,
-            db.and_(Notification.is_public == False, Notification.created_by == user.id)
+    notifications, next_cursor = _mp_page(
+        Notification.query.filter(
+            db.or_(
+                Notification.is_public == True,
+                db.and_(Notification.is_public == False, Notification.created_by == user.id)
+            ),
+            db.or_(Notification.expiry_date == None, Notification.expiry_date >= now),
+            Notification.title.isnot(None),
+            Notification.content.isnot(None),
+            ~Notification.id.in_(deleted_ids) if deleted_ids else True
         ),
-        db.or_(Notification.expiry_date == None, Notification.expiry_date >= now),
-        Notification.title.isnot(None),
-        Notification.content.isnot(None),
-        ~Notification.id.in_(deleted_ids) if deleted_ids else True
-    ).order_by(Notification.created_at.desc()).limit(20).all()
+        [(coalesce_datetime(Notification.created_at), True), (Notification.id, True)]
+    )
     
-    # 找到所有的已读记录
-    # (考虑到性能可以用in_，不过这里记录不多)
-    reads = NotificationRead.query.filter_by(user_id=user.id).all()
-    read_ids = [r.notification_id for r in reads if not r.is_deleted]
+    # 只查本批通知的已读记录
+    read_ids = []
+    if notifications:
+        reads = NotificationRead.query.filter(
+            NotificationRead.user_id == user.id,
+            NotificationRead.notification_id.in_([n.id for n in notifications])
+        ).all()
+        read_ids = [r.notification_id for r in reads if not r.is_deleted]
     
     data = []
     for n in notifications:
@@ -471,7 +462,7 @@ def mp_notifications():
             'time': display_datetime(n.created_at, '%Y-%m-%d %H:%M') if n.created_at else '未知时间',
             'is_read': n.id in read_ids
         })
-    return jsonify({'success': True, 'data': data})
+    return jsonify({'success': True, 'data': data, 'next_cursor': next_cursor, 'has_more': next_cursor is not None})
 
 
 from werkzeug.security import generate_password_hash
@@ -795,7 +786,6 @@ def mp_profile():
 def mp_ai_chat():
     from flask import current_app, request, jsonify
     import os
-    import requests
     
     user = request.mp_user
     data = request.get_json(silent=True) or {}
@@ -858,7 +848,7 @@ def mp_ai_chat():
     }
 
     try:
-        resp = requests.post(url, json=payload, headers=headers, timeout=40)
+        resp = get_llm_client().post(url, json=payload, headers=headers, timeout=40)
         if resp.status_code == 200:
             result = resp.json()
             answer = result['choices'][0]['message']['content']
@@ -4,7 +4,8 @@ from src.models import db, Activity, ActivityCheckin, Registration, StudentInfo,
 from datetime import datetime, timezone, timedelta
 import logging
 from src.utils.time_helpers import get_localized_now
-from sqlalchemy import func, select
+from src.utils.seat_reservation import try_reserve_seat, release_seat, occupies_seat
+from sqlalchemy import select
 from sqlalchemy.exc import IntegrityError
 from src.routes.utils import admin_required, student_required
 from src import limiter
@@ -200,10 +201,8 @@ def checkin_statistics(activity_id):
 def register_activity(activity_id):
     """用户报名活动"""
     try:
-        # 获取并锁定活动信息，避免并发超额报名
-        activity = db.session.execute(
-            db.select(Activity).where(Activity.id == activity_id).with_for_update()
-        ).scalar_one_or_none()
+        # 名额由计数行条件更新保证不超额，无需锁定活动整行
+        activity = db.session.get(Activity, activity_id)
         if not activity:
             flash('活动不存在', 'warning')
             return redirect(url_for('main.activity_detail', activity_id=activity_id))
@@ -236,18 +235,6 @@ def register_activity(activity_id):
             flash('您已经报名了此活动', 'info')
             return redirect(url_for('main.activity_detail', activity_id=activity_id))
         
-        # 检查活动人数限制
-        if activity.max_participants > 0:
-            count_stmt = db.select(func.count()).select_from(Registration).filter(
-                Registration.activity_id == activity_id,
-                Registration.status.in_(['registered', 'attended'])
-            )
-            current_count = db.session.execute(count_stmt).scalar()
-            
-            if current_count >= activity.max_participants:
-                flash('该活动报名人数已满', 'warning')
-                return redirect(url_for('main.activity_detail', activity_id=activity_id))
-        
         # 创建报名记录
         registration = Registration(
             user_id=current_user.id,
@@ -257,6 +244,13 @@ def register_activity(activity_id):
         )
         
         db.session.add(registration)
+
+        # 检查活动人数限制（条件更新名额计数，满员则回滚）
+        if not try_reserve_seat(activity, current_user.id):
+            db.session.rollback()
+            flash('该活动报名人数已满', 'warning')
+            return redirect(url_for('main.activity_detail', activity_id=activity_id))
+
         db.session.commit()
         
         flash('报名成功！', 'success')
@@ -300,6 +294,8 @@ def unregister_activity(activity_id):
             return redirect(url_for('student.my_activities'))
         
         # 删除报名记录
+        if occupies_seat(registration.status):
+            release_seat(activity_id)
         db.session.delete(registration)
         db.session.commit()
         
@@ -7,6 +7,8 @@ from flask import Blueprint, render_template, redirect, url_for, flash, request,
 from flask_login import current_user
 
 from src.routes.utils import log_action
+from src.utils.llm_cache import cache_status_header, get_cached_completion, llm_cache_key, refresh_requested, store_generated
+from src.utils.llm_client import get_llm_client
 
 logger = logging.getLogger(__name__)
 
@@ -377,7 +379,17 @@ def gemini_api():
             'temperature': 0.7,
         }
 
-        response = requests.post(url, json=payload, headers=headers, timeout=30)
+        # 相同的讲解提示词直接返回缓存结果（见 utils.llm_cache）
+        refresh = refresh_requested(data)
+        cache_key = llm_cache_key(payload['model'], payload['messages'], payload['temperature'])
+        if not refresh:
+            cached = get_cached_completion('education_ai', cache_key)
+            if cached is not None:
+                result = jsonify({'success': True, 'content': cached})
+                result.headers['Cache-Status'] = cache_status_header('hit')
+                return result
+
+        response = get_llm_client().post(url, json=payload, headers=headers, timeout=30)
         if response.status_code != 200:
             return jsonify({'success': False, 'content': f'AI服务暂时不可用，请稍后再试。错误码：{response.status_code}'}), 502
 
@@ -387,7 +399,10 @@ def gemini_api():
             return jsonify({'success': False, 'content': 'AI响应格式错误，请稍后再试'}), 502
 
         ai_response = choices[0].get('message', {}).get('content', '')
-        return jsonify({'success': True, 'content': ai_response})
+        cache_status = store_generated('education_ai', cache_key, ai_response, refresh)
+        result = jsonify({'success': True, 'content': ai_response})
+        result.headers['Cache-Status'] = cache_status_header(cache_status)
+        return result
     except requests.Timeout:
         return jsonify({'success': False, 'content': 'AI服务响应超时，请稍后再试'}), 504
     except requests.ConnectionError:
@@ -1,4 +1,4 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app, abort, send_from_directory, g, session, jsonify, make_response
+from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app, abort, send_from_directory, send_file, g, session, jsonify, make_response
 from flask_login import login_required, current_user
 from datetime import datetime, timedelta
 import logging
@@ -11,7 +11,11 @@ import traceback
 import pytz
 from flask_wtf import FlaskForm
 import os
+import mimetypes
 from src.utils import get_compatible_paginate
+from src.utils.poster_store import get_poster_store, set_activity_poster
+from src.utils.poster_derivatives import snap_width, negotiate_format, get_poster_derivative
+from src.utils.activity_search import activity_search_clause, ranked_activity_search
 
 logger = logging.getLogger(__name__)
 
@@ -141,26 +145,17 @@ def home_activities_api():
             poster_url = url_for('static', filename='img/landscape.jpg')
 
             poster_name = (getattr(activity, 'poster_image', None) or '').strip()
-            poster_data = getattr(activity, 'poster_data', None)
-            if poster_data:
-                # 优先使用数据库中的二进制海报，避免静态路径与上传目录不一致造成404。
-                poster_url = url_for('main.poster_image', activity_id=activity.id)
+            if activity.poster_hash:
+                # 优先使用海报存储，避免静态路径与上传目录不一致造成404。
+                poster_url = url_for('main.poster_image', activity_id=activity.id, w=640)
             elif poster_name:
                 poster_path = os.path.join(upload_folder, poster_name)
                 if os.path.isfile(poster_path):
                     poster_url = url_for('main.uploaded_file', filename=poster_name)
 
-            # 为图片URL增加版本号，避免CDN长缓存导致更新后仍命中旧图
-            version_dt = getattr(activity, 'updated_at', None) or getattr(activity, 'created_at', None)
-            if version_dt:
-                try:
-                    poster_version = int(version_dt.timestamp())
-                except Exception:
-                    poster_version = int(time.time())
-            else:
-                poster_version = int(time.time())
-
-            poster_url = f"{poster_url}?v={poster_version}"
+            # 为图片URL增加版本号（内容摘要），避免CDN长缓存导致更新后仍命中旧图
+            separator = '&' if '?' in poster_url else '?'
+            poster_url = f"{poster_url}{separator}v={activity.poster_version or int(time.time())}"
 
             activities.append({
                 'id': activity.id,
@@ -202,11 +197,9 @@ def process_activity_poster(activity, static_folder):
             setattr(activity, 'poster_image', "landscape.jpg")
             return
             
-        # 检查数据库中是否有二进制海报数据
-        if hasattr(activity, 'poster_data') and activity.poster_data:
-            logger.info(f"活动ID={activity.id}在数据库中有二进制海报数据，大小: {len(activity.poster_data)} 字节")
-            # 如果有二进制数据，优先使用数据库中的图片
-            # 确保poster_image字段与文件名一致
+        # 检查海报存储中是否已有海报
+        if getattr(activity, 'poster_hash', None):
+            logger.info(f"活动ID={activity.id}已有存储海报: hash={activity.poster_hash}")
             return
             
         # 检查文件是否存在
@@ -234,13 +227,14 @@ def process_activity_poster(activity, static_folder):
                         poster_path = os.path.join(poster_dir, new_poster)
                         if os.path.exists(poster_path):
                             logger.info(f"海报文件存在: {poster_path}")
-                            # 尝试读取文件内容并更新数据库中的二进制数据
+                            # 尝试读取文件内容并写入海报存储
                             try:
-                                if hasattr(activity, 'poster_data') and not activity.poster_data:
-                                    with open(poster_path, 'rb') as f:
-                                        binary_data = f.read()
-                                        setattr(activity, 'poster_data', binary_data)
-                                        logger.info(f"已从文件读取海报数据并更新到数据库，大小: {len(binary_data)} 字节")
+                                with open(poster_path, 'rb') as f:
+                                    binary_data = f.read()
+                                if binary_data:
+                                    mime_type = mimetypes.guess_type(poster_path)[0] or 'image/png'
+                                    set_activity_poster(activity, binary_data, mime_type)
+                                    logger.info(f"已从文件读取海报数据并写入海报存储，大小: {len(binary_data)} 字节")
                             except Exception as e:
                                 logger.warning(f"读取海报文件失败: {e}")
                             return
@@ -294,13 +288,9 @@ def activities():
         
         # 搜索功能 - 只有当搜索查询不为空时才过滤
         if search_query:
-            query = query.filter(
-                or_(
-                    Activity.title.ilike(f'%{search_query}%'),
-                    Activity.description.ilike(f'%{search_query}%'),
-                    Activity.location.ilike(f'%{search_query}%')
-                )
-            )
+            search_clause = activity_search_clause(search_query)
+            if search_clause is not None:
+                query = query.filter(search_clause)
         
         # 根据状态筛选 - 使用北京时间进行状态判定
         from src.utils.time_helpers import get_localized_now
@@ -439,13 +429,15 @@ def activity_detail(activity_id):
         # 判断当前用户是否为学生
         is_student = current_user.is_authenticated and current_user.is_student
         
-        # 获取天气数据
+        # 获取天气数据：只读后台预取的缓存，未命中时由前端异步加载
         weather_data = None
+        weather_async_url = None
         try:
-            from src.utils.weather_api import get_activity_weather
+            from src.utils.weather_api import activity_weather_target, get_activity_weather
             if activity.start_time:
-                weather_data = get_activity_weather(activity.start_time)
-                logger.info(f"获取活动天气数据成功: {weather_data.get('description', 'N/A') if weather_data else 'None'}")
+                weather_data = get_activity_weather(activity.start_time, cache_only=True)
+                if not weather_data and activity_weather_target(activity.start_time):
+                    weather_async_url = url_for('main.activity_weather', activity_id=activity.id)
         except Exception as e:
             logger.warning(f"获取天气数据失败: {e}")
             weather_data = None
@@ -464,12 +456,27 @@ def activity_detail(activity_id):
                               safe_less_than=safe_less_than,
                               safe_greater_than=safe_greater_than,
                               safe_compare=safe_compare,
-                              weather_data=weather_data)
+                              weather_data=weather_data,
+                              weather_async_url=weather_async_url)
     except Exception as e:
         logger.error(f"Error in activity_detail: {str(e)}")
         flash('加载活动详情时发生错误，请稍后再试', 'danger')
         return redirect(url_for('main.index'))
 
+
+@main_bp.route('/activity/<int:activity_id>/weather')
+@limiter.limit('60/minute')
+def activity_weather(activity_id):
+    """活动天气卡片（详情页缓存未命中时异步请求，可能访问第三方天气接口）。"""
+    from src.utils.weather_api import get_activity_weather
+
+    activity = db.get_or_404(Activity, activity_id)
+    weather_data = get_activity_weather(activity.start_time) if activity.start_time else None
+    if not weather_data:
+        return jsonify({'success': False, 'html': ''})
+    template = 'student/activity_weather_card.html' if request.args.get('layout') == 'student' else 'main/activity_weather_card.html'
+    return jsonify({'success': True, 'html': render_template(template, weather_data=weather_data)})
+
 @main_bp.route('/about')
 def about():
     """关于页面"""
@@ -506,25 +513,20 @@ def terms():
 def search():
     try:
         from src import db
-        from src.models import Activity, Tag
+        from src.models import Tag
         
-        query = request.args.get('q', '')
-        if not query:
-            return render_template('main/search.html', activities=[], query='')
-        
-        activities = Activity.query.filter(
-            or_(
-                Activity.title.ilike(f'%{query}%'),
-                Activity.description.ilike(f'%{query}%'),
-                Activity.location.ilike(f'%{query}%')
-            )
-        ).order_by(Activity.created_at.desc()).all()
+        query = (request.args.get('q', '') or '').strip()
+        page = request.args.get('page', 1, type=int)
+        stmt = ranked_activity_search(query) if query else None
+        if stmt is None:
+            return render_template('main/search.html', activities=[], pagination=None, query=query)
         
-        return render_template('main/search.html', activities=activities, query=query)
+        pagination = get_compatible_paginate(db, stmt, page=page, per_page=20, error_out=False)
+        return render_template('main/search.html', activities=pagination.items, pagination=pagination, query=query)
     except Exception as e:
         logger.error(f"Error in search: {e}")
         flash('搜索时发生错误', 'danger')
-        return render_template('main/search.html', activities=[], query='')
+        return render_template('main/search.html', activities=[], pagination=None, query='')
 
 @main_bp.route('/uploads/<path:filename>')
 def uploaded_file(filename):
@@ -579,23 +581,67 @@ def public_notifications_api():
 
 @main_bp.route('/poster/<int:activity_id>')
 def poster_image(activity_id):
-    """直接从数据库获取海报图片"""
+    """从海报存储获取活动海报图片（未迁移的旧数据回退到数据库二进制列）"""
     try:
         from src.models import Activity
         
-        # 获取活动信息
-        activity = db.get_or_404(Activity, activity_id)
+        # 仅查询海报元数据，不加载二进制列
+        row = db.session.execute(
+            db.select(Activity.poster_hash, Activity.poster_mimetype)
+            .filter(Activity.id == activity_id)
+        ).first()
+        if row is None:
+            return redirect(url_for('static', filename='img/landscape.jpg'))
+        poster_hash, mime_type = row
+        mime_type = mime_type or 'image/png'
         
-        # 检查活动是否有图片数据
-        if not activity.poster_data:
+        if poster_hash:
+            # ?w= 请求固定宽度档位的衍生图，格式按 Accept 协商（WebP/JPEG）
+            width = snap_width(request.args.get('w'))
+            derivative = None
+            if width:
+                fmt = negotiate_format(request.accept_mimetypes)
+                try:
+                    derivative = get_poster_derivative(poster_hash, width, fmt)
+                except Exception as e:
+                    logger.warning(f"生成海报衍生图失败，回退原图: activity_id={activity_id}, error={e}")
+            
+            if derivative:
+                derivative_path, mime_type = derivative
+                etag = f"{poster_hash}-w{width}-{fmt}"
+            else:
+                etag = poster_hash
+            
+            if request.if_none_match.contains(etag):
+                response = current_app.response_class(status=304, mimetype=mime_type)
+            elif derivative:
+                response = send_file(derivative_path, mimetype=mime_type, conditional=False, etag=False)
+            else:
+                store = get_poster_store()
+                response = current_app.response_class(
+                    store.iter_chunks(poster_hash),
+                    mimetype=mime_type,
+                    direct_passthrough=True
+                )
+                response.content_length = store.size(poster_hash)
+            response.set_etag(etag)
+            # 内容寻址：URL中的版本号与摘要一致时内容永不变化，可长期缓存
+            if request.args.get('v') == poster_hash[:16]:
+                response.headers.set('Cache-Control', 'public, max-age=31536000, immutable')
+            else:
+                response.headers.set('Cache-Control', 'public, max-age=300, s-maxage=1800, stale-while-revalidate=300')
+            response.headers.set('Vary', 'Accept, Accept-Encoding' if width else 'Accept-Encoding')
+            return response
+        
+        # 尚未迁移的旧海报：从数据库二进制列读取
+        poster_data = db.session.execute(
+            db.select(Activity.poster_data).filter(Activity.id == activity_id)
+        ).scalar()
+        if not poster_data:
             # 如果没有图片数据，重定向到默认图片
             return redirect(url_for('static', filename='img/landscape.jpg'))
         
-        # 获取MIME类型，默认为image/png
-        mime_type = activity.poster_mimetype or 'image/png'
-        
-        # 返回图片数据
-        response = make_response(activity.poster_data)
+        response = make_response(poster_data)
         response.headers.set('Content-Type', mime_type)
         # 允许温和缓存；前端通过 ?v=updated_at 进行版本切换以立即刷新新海报
         response.headers.set('Cache-Control', 'public, max-age=300, s-maxage=1800, stale-while-revalidate=300')
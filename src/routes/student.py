@@ -5,15 +5,20 @@ from datetime import datetime, timedelta
 import logging
 import json
 import io
+from types import SimpleNamespace
 from functools import wraps
 from src.routes.utils import log_action, random_string
-from sqlalchemy import func, desc, or_, and_, not_
+from sqlalchemy import func, or_, and_, not_
 from sqlalchemy.exc import IntegrityError
 from wtforms import StringField, TextAreaField, IntegerField, SelectField, SubmitField, RadioField, BooleanField, HiddenField
 from wtforms.validators import DataRequired, Length, Optional, NumberRange, Email, Regexp
 from flask_wtf import FlaskForm
 from src.utils.time_helpers import get_localized_now, ensure_timezone_aware, display_datetime, safe_compare, safe_less_than, safe_greater_than, safe_greater_than_equal, safe_less_than_equal, get_activity_status, is_activity_completed
 from src.utils import get_compatible_paginate
+from src.utils.pagination import keyset_paginate, coalesce_datetime
+from src.utils.activity_search import activity_search_clause
+from src.utils.recommendations import recommend_activities, invalidate_user_recommendations
+from src.utils.leaderboard import GLOBAL_BOARD, society_board, top_students, student_rank
 from sqlalchemy.orm import joinedload, defer
 import pytz
 import os
@@ -21,6 +26,9 @@ from collections import OrderedDict
 from flask_wtf.csrf import CSRFProtect
 from src import cache, limiter
 from src.utils.input_safety import sanitize_plain_text
+from src.utils.seat_reservation import try_reserve_seat, release_seat
+from src.utils.activity_stats import get_activity_stats
+from src.utils.unread_counters import get_unread_counts, mark_unread_counters_stale, refresh_unread_counts
 from itsdangerous import URLSafeTimedSerializer, BadSignature, SignatureExpired
 import qrcode
 
@@ -206,15 +214,6 @@ def _is_team_activity(activity):
     return bool(activity and (getattr(activity, 'registration_mode', 'individual') or 'individual') == 'team')
 
 
-def _count_activity_registered(activity_id):
-    return db.session.execute(
-        db.select(func.count()).select_from(Registration).filter(
-            Registration.activity_id == activity_id,
-            Registration.status.in_(['registered', 'attended'])
-        )
-    ).scalar() or 0
-
-
 def _count_activity_teams(activity_id):
     return db.session.execute(
         db.select(func.count()).select_from(ActivityTeam).filter(
@@ -263,68 +262,6 @@ def _find_team_by_code_or_token(activity_id, value):
         )
     ).scalar_one_or_none()
 
-def _ensure_activity_start_reminders(user_id):
-    """为学生生成活动开始前提醒：提前1天、3小时、1小时。"""
-    try:
-        now = get_localized_now()
-        reminders = [
-            ('1天', timedelta(days=1)),
-            ('3小时', timedelta(hours=3)),
-            ('1小时', timedelta(hours=1))
-        ]
-
-        registrations = db.session.execute(
-            db.select(Registration).filter(
-                Registration.user_id == user_id,
-                Registration.status.in_(['registered', 'attended'])
-            ).options(joinedload(Registration.activity))
-        ).scalars().all()
-
-        created = 0
-        for reg in registrations:
-            activity = reg.activity
-            if not activity or activity.status != 'active' or not activity.start_time:
-                continue
-
-            for label, delta in reminders:
-                reminder_time = activity.start_time - delta
-                if now < reminder_time:
-                    continue
-
-                title = f"活动即将开始提醒：{activity.title}"
-                content = f"你报名的活动《{activity.title}》将在{label}后开始，请提前安排时间。"
-
-                exists = db.session.execute(
-                    db.select(Notification).filter(
-                        Notification.title == title,
-                        Notification.content == content,
-                        Notification.created_by == user_id,
-                        Notification.is_public == False
-                    )
-                ).scalar_one_or_none()
-
-                if exists:
-                    continue
-
-                notice = Notification(
-                    title=title,
-                    content=content,
-                    is_important=True,
-                    created_at=now,
-                    created_by=user_id,
-                    expiry_date=activity.start_time + timedelta(days=1),
-                    is_public=False
-                )
-                db.session.add(notice)
-                created += 1
-
-        if created > 0:
-            db.session.commit()
-    except Exception as e:
-        db.session.rollback()
-        logger.error(f"生成活动开始提醒失败: {e}")
-
-
 def _create_registration_success_notification(user_id, activity):
     """在报名成功后给学生发送活动额外提示（若管理员配置了文案）。"""
     if not activity:
@@ -662,13 +599,12 @@ def activities():
 
         if keyword:
             keyword_like = f"%{keyword}%"
-            query = query.outerjoin(Society, Activity.society_id == Society.id).filter(
-                or_(
-                    Activity.title.ilike(keyword_like),
-                    Activity.description.ilike(keyword_like),
-                    Society.name.ilike(keyword_like)
-                )
-            )
+            # 活动标题/描述/地点走全文索引，社团名称表很小仍按 LIKE 匹配
+            search_clause = activity_search_clause(keyword)
+            matches = [Society.name.ilike(keyword_like)]
+            if search_clause is not None:
+                matches.append(search_clause)
+            query = query.outerjoin(Society, Activity.society_id == Society.id).filter(or_(*matches))
 
         # 根据状态筛选，使用北京时间进行比较
         if current_status == 'active':
@@ -735,9 +671,8 @@ def activity_detail(id):
         has_successful_participation = bool(registration and registration.status == 'attended')
         is_team_mode = _is_team_activity(activity)
 
-        registered_count = db.session.execute(db.select(func.count()).select_from(Registration).filter_by(activity_id=id, status='registered')).scalar() or 0
-        checked_in_count = db.session.execute(db.select(func.count()).select_from(Registration).filter_by(activity_id=id, status='attended')).scalar() or 0
-        total_registered = registered_count + checked_in_count
+        stats = get_activity_stats(id)
+        total_registered = stats.total_registered
 
         current_team = None
         current_team_members = []
@@ -769,7 +704,7 @@ def activity_detail(id):
                     .order_by(Registration.register_time.asc())
                 ).all()
 
-        team_count = _count_activity_teams(activity.id) if is_team_mode else 0
+        team_count = (stats.team_count or 0) if is_team_mode else 0
         team_max_count = max(0, int(getattr(activity, 'team_max_count', 0) or 0))
         can_create_team = is_team_mode and (team_max_count == 0 or team_count < team_max_count)
 
@@ -811,27 +746,16 @@ def activity_detail(id):
         registration_deadline_ts = _to_unix_ms(activity.registration_deadline)
 
         current_user_review = db.session.execute(db.select(ActivityReview).filter_by(activity_id=id, user_id=current_user.id)).scalar_one_or_none()
-        review_count = db.session.execute(
-            db.select(func.count()).select_from(ActivityReview).filter_by(activity_id=id)
-        ).scalar() or 0
-
-        reviews = db.session.execute(
-            db.select(ActivityReview)
-            .filter_by(activity_id=id)
-            .order_by(ActivityReview.created_at.desc())
-            .limit(5)
-        ).scalars().all()
+        review_count = stats.review_count or 0
 
-        agg_stats = None
+        reviews = []
         if review_count > 0:
-            agg_stats = db.session.execute(
-                db.select(
-                    func.avg(ActivityReview.rating),
-                    func.avg(ActivityReview.content_quality),
-                    func.avg(ActivityReview.organization),
-                    func.avg(ActivityReview.facility)
-                ).filter_by(activity_id=id)
-            ).one()
+            reviews = db.session.execute(
+                db.select(ActivityReview)
+                .filter_by(activity_id=id)
+                .order_by(ActivityReview.created_at.desc())
+                .limit(5)
+            ).scalars().all()
 
         beijing_tz = pytz.timezone('Asia/Shanghai')
         for review in reviews:
@@ -843,30 +767,31 @@ def activity_detail(id):
             else:
                 review.display_created_at = '未设置'
 
-        average_rating = float(agg_stats[0] or 0) if agg_stats else 0
-        avg_content_quality = float(agg_stats[1] or 0) if agg_stats else 0
-        avg_organization = float(agg_stats[2] or 0) if agg_stats else 0
-        avg_facility = float(agg_stats[3] or 0) if agg_stats else 0
+        average_rating = stats.average_rating
+        avg_content_quality = stats.avg_content_quality
+        avg_organization = stats.avg_organization
+        avg_facility = stats.avg_facility
 
         form = FlaskForm()
 
         poster_url = None
-        if activity.poster_image:
+        if activity.poster_hash:
+            poster_url = url_for('main.poster_image', activity_id=activity.id, v=activity.poster_version)
+        elif activity.poster_image:
             if 'banner' in activity.poster_image:
                 poster_url = url_for('static', filename=f'img/{activity.poster_image}')
             else:
                 poster_url = url_for('static', filename=f'uploads/posters/{activity.poster_image}')
         
-        # 获取活动当天的天气信息
+        # 获取活动当天的天气信息：只读后台预取的缓存，未命中时由前端异步加载
         weather_data = None
+        weather_async_url = None
         try:
-            from src.utils.weather_api import get_activity_weather
+            from src.utils.weather_api import activity_weather_target, get_activity_weather
             if activity.start_time:
-                weather_data = get_activity_weather(activity.start_time)
-                if weather_data:
-                    logger.info(f"获取活动天气数据成功: {weather_data.get('description', 'N/A')}")
-                else:
-                    logger.info("本次未获取到活动天气数据（已降级为无天气展示）")
+                weather_data = get_activity_weather(activity.start_time, cache_only=True)
+                if not weather_data and activity_weather_target(activity.start_time):
+                    weather_async_url = url_for('main.activity_weather', activity_id=activity.id, layout='student')
         except Exception as e:
             logger.warning(f"获取天气数据失败: {e}")
             weather_data = None
@@ -911,6 +836,7 @@ def activity_detail(id):
                               safe_less_than_equal=safe_less_than_equal,
                               poster_url=poster_url,
                               weather_data=weather_data,
+                              weather_async_url=weather_async_url,
                               activity_documents=accessible_documents,
                               locked_document_count=locked_document_count,
                               has_successful_participation=has_successful_participation,
@@ -940,7 +866,7 @@ def register_activity(id):
     """报名活动"""
     try:
         activity = db.session.execute(
-            db.select(Activity).where(Activity.id == id).with_for_update()
+            db.select(Activity).where(Activity.id == id).options(defer(Activity.poster_data))
         ).scalar_one_or_none()
         if not activity:
             return jsonify({'success': False, 'message': '活动不存在'})
@@ -958,15 +884,13 @@ def register_activity(id):
         payload = request.get_json(silent=True) or {}
         existing_reg = db.session.execute(db.select(Registration).filter_by(user_id=current_user.id, activity_id=id)).scalar_one_or_none()
         is_team_mode = _is_team_activity(activity)
+        if is_team_mode:
+            # 队伍数量/队伍人数上限仍按行锁串行校验；个人报名只依赖名额计数行
+            db.session.execute(db.select(Activity.id).where(Activity.id == id).with_for_update())
         if existing_reg:
             if existing_reg.status == 'registered':
                 return jsonify({'success': False, 'message': '您已报名此活动'})
             elif existing_reg.status == 'cancelled':
-                if activity.max_participants > 0:
-                    reg_count = _count_activity_registered(id)
-                    if reg_count >= activity.max_participants:
-                        return jsonify({'success': False, 'message': '该活动报名人数已满'})
-
                 team = None
                 if is_team_mode:
                     if existing_reg.team_id:
@@ -1007,7 +931,12 @@ def register_activity(id):
                 if student_info and activity.society_id:
                     _ensure_student_join_society(student_info, activity.society_id)
                 _create_registration_success_notification(current_user.id, activity)
+                if not try_reserve_seat(activity, current_user.id):
+                    db.session.rollback()
+                    return jsonify({'success': False, 'message': '该活动报名人数已满'})
                 db.session.commit()
+                cache.delete_memoized(_cached_registered_activity_ids, current_user.id)
+                invalidate_user_recommendations(current_user.id)
                 response_data = {'success': True, 'message': '已成功重新报名活动', 'team_mode': is_team_mode}
                 if is_team_mode and team:
                     response_data.update({
@@ -1018,11 +947,6 @@ def register_activity(id):
                     })
                 return jsonify(response_data)
 
-        if activity.max_participants > 0:
-            reg_count = _count_activity_registered(id)
-            if reg_count >= activity.max_participants:
-                return jsonify({'success': False, 'message': '该活动报名人数已满'})
-
         team = None
         if is_team_mode:
             team_limit = max(0, int(getattr(activity, 'team_max_count', 0) or 0))
@@ -1060,8 +984,13 @@ def register_activity(id):
 
         _create_registration_success_notification(current_user.id, activity)
 
+        if not try_reserve_seat(activity, current_user.id):
+            db.session.rollback()
+            return jsonify({'success': False, 'message': '该活动报名人数已满'})
+
         db.session.commit()
         cache.delete_memoized(_cached_registered_activity_ids, current_user.id)
+        invalidate_user_recommendations(current_user.id)
 
         response_data = {'success': True, 'message': '报名成功！', 'team_mode': is_team_mode}
         if is_team_mode and team:
@@ -1110,6 +1039,7 @@ def cancel_registration(id):
 
             registration.status = 'cancelled'
             registration.team_id = None
+            release_seat(id)
 
             if team:
                 remaining_regs = [
@@ -1128,9 +1058,11 @@ def cancel_registration(id):
                     db.session.delete(team)
         else:
             registration.status = 'cancelled'
+            release_seat(id)
 
         db.session.commit()
         cache.delete_memoized(_cached_registered_activity_ids, current_user.id)
+        invalidate_user_recommendations(current_user.id)
 
         return jsonify({'success': True, 'message': '已成功取消报名'})
     except Exception as e:
@@ -1181,11 +1113,6 @@ def join_activity_team(id):
         if current_members >= team_max_members:
             return jsonify({'success': False, 'message': '该队伍人数已满'})
 
-        if activity.max_participants > 0:
-            reg_count = _count_activity_registered(id)
-            if reg_count >= activity.max_participants:
-                return jsonify({'success': False, 'message': '该活动报名人数已满'})
-
         if existing_reg and existing_reg.status == 'cancelled':
             existing_reg.status = 'registered'
             existing_reg.register_time = now
@@ -1203,8 +1130,12 @@ def join_activity_team(id):
             _ensure_student_join_society(current_user.student_info, activity.society_id)
 
         _create_registration_success_notification(current_user.id, activity)
+        if not try_reserve_seat(activity, current_user.id):
+            db.session.rollback()
+            return jsonify({'success': False, 'message': '该活动报名人数已满'})
         db.session.commit()
         cache.delete_memoized(_cached_registered_activity_ids, current_user.id)
+        invalidate_user_recommendations(current_user.id)
 
         return jsonify({
             'success': True,
@@ -1400,8 +1331,10 @@ def remove_my_team_member(id, team_id):
 
         target_registration.status = 'cancelled'
         target_registration.team_id = None
+        release_seat(id)
         db.session.commit()
         cache.delete_memoized(_cached_registered_activity_ids, target_registration.user_id)
+        invalidate_user_recommendations(target_registration.user_id)
         flash('已将队员移出队伍并取消其本次报名', 'success')
         return redirect(url_for('student.activity_detail', id=id))
     except Exception as e:
@@ -1451,11 +1384,13 @@ def disband_my_team(id, team_id):
             reg.team_id = None
             affected_user_ids.append(reg.user_id)
 
+        release_seat(id, len(affected_user_ids))
         db.session.delete(team)
         db.session.commit()
 
         for uid in affected_user_ids:
             cache.delete_memoized(_cached_registered_activity_ids, uid)
+            invalidate_user_recommendations(uid)
 
         flash('队伍已解散，所有队员报名已取消', 'success')
         return redirect(url_for('student.activity_detail', id=id))
@@ -2021,8 +1956,14 @@ def points():
             return redirect(url_for('student.edit_profile'))
 
         page = request.args.get('page', 1, type=int)
-        query = db.select(PointsHistory).filter_by(student_id=student_info.id).order_by(PointsHistory.created_at.desc())
-        points_history = get_compatible_paginate(db, query, page=page, per_page=15, error_out=False)
+        query = db.select(PointsHistory).filter_by(student_id=student_info.id)
+        points_history = keyset_paginate(
+            query,
+            [(coalesce_datetime(PointsHistory.created_at), True), (PointsHistory.id, True)],
+            page=page,
+            per_page=15,
+            cursor=request.args.get('cursor')
+        )
 
         beijing_tz = pytz.timezone('Asia/Shanghai')
         for history in points_history.items:
@@ -2209,32 +2150,23 @@ def points_rank():
         db.select(StudentInfo).filter_by(user_id=current_user.id)
     ).scalar_one_or_none()
 
-    # 全站总积分榜
-    total_top_students = db.session.execute(
-        db.select(StudentInfo)
-        .join(User, User.id == StudentInfo.user_id)
-        .join(Role, Role.id == User.role_id)
-        .filter(Role.name == 'Student')
-        .order_by(StudentInfo.points.desc(), StudentInfo.id.asc())
-        .limit(100)
-    ).scalars().all()
+    # 全站总积分榜：前100与当前名次均由排行榜服务的有序结构给出
+    total_top = top_students(GLOBAL_BOARD, 100)
+    students_by_id = {
+        student.id: student
+        for student in db.session.execute(
+            db.select(StudentInfo).filter(StudentInfo.id.in_([sid for sid, _ in total_top]))
+        ).scalars().all()
+    } if total_top else {}
+    total_top_students = [students_by_id[sid] for sid, _ in total_top if sid in students_by_id]
 
     total_current_student_points = 0
     total_current_student_rank = None
     if student_info:
         total_current_student_points = int(student_info.points or 0)
-        higher_points_count = db.session.execute(
-            db.select(func.count(StudentInfo.id))
-            .join(User, User.id == StudentInfo.user_id)
-            .join(Role, Role.id == User.role_id)
-            .filter(
-                Role.name == 'Student',
-                func.coalesce(StudentInfo.points, 0) > total_current_student_points
-            )
-        ).scalar_one()
-        total_current_student_rank = int(higher_points_count or 0) + 1
+        total_current_student_rank, _ = student_rank(GLOBAL_BOARD, student_info.id)
 
-    # 多社团积分榜：按每个社团单独聚合 points_history.society_id
+    # 多社团积分榜：各社团积分来自该社团的 points_history，由排行榜服务增量维护
     societies = (
         db.session.execute(
             db.select(Society).filter(Society.id.in_(society_ids)).order_by(Society.name)
@@ -2242,44 +2174,36 @@ def points_rank():
         if society_ids else []
     )
 
+    society_entries = {society.id: top_students(society_board(society.id), 100) for society in societies}
+    missing_ids = {sid for entries in society_entries.values() for sid, _ in entries} - set(students_by_id)
+    if missing_ids:
+        students_by_id.update({
+            student.id: student
+            for student in db.session.execute(
+                db.select(StudentInfo).filter(StudentInfo.id.in_(missing_ids))
+            ).scalars().all()
+        })
+
     society_boards = []
     for society in societies:
-        rows = db.session.execute(
-            db.select(
-                StudentInfo,
-                func.coalesce(func.sum(PointsHistory.points), 0).label('society_points')
-            )
-            .outerjoin(
-                PointsHistory,
-                and_(
-                    PointsHistory.student_id == StudentInfo.id,
-                    PointsHistory.society_id == society.id
-                )
-            )
-            .join(User, User.id == StudentInfo.user_id)
-            .join(Role, Role.id == User.role_id)
-            .filter(
-                Role.name == 'Student',
-                or_(
-                    StudentInfo.society_id == society.id,
-                    StudentInfo.joined_societies.any(Society.id == society.id)
-                )
-            )
-            .group_by(StudentInfo.id)
-            .order_by(desc('society_points'), StudentInfo.id.asc())
-            .limit(100)
-        ).all()
-
         students = []
+        for sid, society_points in society_entries[society.id]:
+            student = students_by_id.get(sid)
+            if student is None:
+                continue
+            # 同一学生可能出现在多个社团榜，按榜单分别展示社团积分
+            students.append(SimpleNamespace(
+                real_name=student.real_name,
+                college=student.college,
+                grade=student.grade,
+                points=student.points,
+                society_points=society_points
+            ))
+
         current_student_points = 0
         current_student_rank = None
-        for idx, (student, society_points) in enumerate(rows, start=1):
-            points_value = int(society_points or 0)
-            setattr(student, 'society_points', points_value)
-            students.append(student)
-            if student_info and student.id == student_info.id:
-                current_student_points = points_value
-                current_student_rank = idx
+        if student_info:
+            current_student_rank, current_student_points = student_rank(society_board(society.id), student_info.id)
 
         society_boards.append({
             'society': society,
@@ -2297,62 +2221,9 @@ def points_rank():
     )
 
 def get_recommended_activities(user_id, limit=6):
-    """基于用户的历史参与记录和兴趣推荐活动"""
+    """基于用户的历史参与记录、高分评价和兴趣标签推荐活动（预计算 TF-IDF + 标签向量打分）"""
     try:
-        # 获取用户信息
-        student_info = db.session.execute(db.select(StudentInfo).filter_by(user_id=user_id)).scalar_one_or_none()
-        if not student_info:
-            return Activity.query.filter_by(status='active').order_by(Activity.created_at.desc()).limit(limit).all()
-        
-        # 获取用户历史参与的活动
-        participated_activities = Activity.query.join(
-            Registration, Activity.id == Registration.activity_id
-        ).filter(
-            Registration.user_id == user_id
-        ).all()
-        
-        # 如果用户没有参与过任何活动，返回最新活动
-        if not participated_activities:
-            return Activity.query.filter_by(status='active').order_by(Activity.created_at.desc()).limit(limit).all()
-        
-        # 获取用户评价过的活动
-        reviewed_activities = Activity.query.join(
-            ActivityReview, Activity.id == ActivityReview.activity_id
-        ).filter(
-            ActivityReview.user_id == user_id,
-            ActivityReview.rating >= 4  # 只考虑用户评价较高的活动
-        ).all()
-        
-        # 构建推荐查询
-        recommended = Activity.query.filter(
-            Activity.status == 'active',
-            Activity.id.notin_([a.id for a in participated_activities])  # 排除已参加的活动
-        )
-        
-        # 如果有高评分活动，优先推荐类似活动
-        if reviewed_activities:
-            # 这里可以根据活动标题、描述等进行相似度匹配
-            # 这是一个简化的实现，实际中可以使用更复杂的相似度算法
-            liked_keywords = set()
-            for activity in reviewed_activities:
-                liked_keywords.update(activity.title.split())
-                if activity.description:
-                    liked_keywords.update(activity.description.split())
-            
-            if liked_keywords:
-                recommended = recommended.filter(
-                    db.or_(
-                        *[Activity.title.ilike(f'%{keyword}%') for keyword in liked_keywords],
-                        *[Activity.description.ilike(f'%{keyword}%') for keyword in liked_keywords]
-                    )
-                )
-        
-        # 根据活动开始时间排序，优先推荐最近的活动
-        # 只推荐未结束的活动
-        now = get_localized_now()
-        recommended = recommended.filter(Activity.end_time > now).order_by(Activity.start_time.desc())
-        
-        return recommended.limit(limit).all()
+        return recommend_activities(user_id, limit=limit)
     except Exception as e:
         logger.error(f"Error in getting recommended activities: {e}")
         return []
@@ -2572,8 +2443,14 @@ def messages():
             ).update({Message.created_at: now}, synchronize_session=False)
             db.session.commit()
 
-        # 不使用复杂的连接，保持简单查询
-        messages = query.order_by(Message.created_at.desc()).paginate(page=page, per_page=10)
+        # 不使用复杂的连接，保持简单查询；按 (时间, id) 键集分页
+        messages = keyset_paginate(
+            query,
+            [(coalesce_datetime(Message.created_at), True), (Message.id, True)],
+            page=page,
+            per_page=10,
+            cursor=request.args.get('cursor')
+        )
         
         return render_template('student/messages.html', 
                               messages=messages, 
@@ -2707,6 +2584,7 @@ def mark_all_messages_read():
             Message.receiver_id == current_user.id,
             Message.is_read == False
         ).update({Message.is_read: True}, synchronize_session=False)
+        mark_unread_counters_stale([current_user.id])
         db.session.commit()
         flash(f'已标记 {updated} 条未读消息', 'success')
     except Exception as e:
@@ -2759,7 +2637,6 @@ def delete_message(id):
 @student_required
 def notifications():
     try:
-        _ensure_activity_start_reminders(current_user.id)
         page = request.args.get('page', 1, type=int)
         
         # 获取当前时间，确保带有时区信息
@@ -2783,14 +2660,28 @@ def notifications():
             Notification.title.isnot(None),
             Notification.content.isnot(None),
             ~Notification.id.in_(deleted_notification_ids_subq)
-        ).order_by(Notification.is_important.desc(), Notification.created_at.desc()).paginate(page=page, per_page=10)
+        )
+        notifications = keyset_paginate(
+            notifications,
+            [
+                (func.coalesce(Notification.is_important, False), True),
+                (coalesce_datetime(Notification.created_at), True),
+                (Notification.id, True),
+            ],
+            page=page,
+            per_page=10,
+            cursor=request.args.get('cursor')
+        )
         
-        # 获取当前用户已读通知的ID列表
-        read_notification_ids = db.session.query(NotificationRead.notification_id).filter(
-            NotificationRead.user_id == current_user.id,
-            or_(NotificationRead.is_deleted == False, NotificationRead.is_deleted.is_(None))
-        ).all()
-        read_notification_ids = [r[0] for r in read_notification_ids]
+        # 获取当前页通知中用户已读的ID列表
+        page_notification_ids = [n.id for n in notifications.items]
+        read_notification_ids = []
+        if page_notification_ids:
+            read_notification_ids = [r[0] for r in db.session.query(NotificationRead.notification_id).filter(
+                NotificationRead.user_id == current_user.id,
+                NotificationRead.notification_id.in_(page_notification_ids),
+                or_(NotificationRead.is_deleted == False, NotificationRead.is_deleted.is_(None))
+            ).all()]
         
         return render_template('student/notifications.html', 
                               notifications=notifications,
@@ -3017,7 +2908,18 @@ def delete_read_notifications():
 @student_required
 def get_unread_notifications():
     try:
-        _ensure_activity_start_reminders(current_user.id)
+        # 先按主键读取未读计数（过期或失效的计数行会先重算），无未读时跳过列表查询；
+        # 计数偏差由定时任务 flask reconcile-unread-counters 修正
+        unread_count, _ = get_unread_counts(current_user.id)
+        if unread_count <= 0:
+            response = jsonify({'success': True, 'notifications': [], 'unread_count': 0})
+            response.headers['Cache-Control'] = 'private, no-store, no-cache, must-revalidate, max-age=0'
+            response.headers['Pragma'] = 'no-cache'
+            response.headers['Expires'] = '0'
+            response.headers['CDN-Cache-Control'] = 'no-store'
+            response.headers['Surrogate-Control'] = 'no-store'
+            return response
+
         # 获取当前时间，确保带有时区信息
         now = ensure_timezone_aware(datetime.now())
         
@@ -3040,6 +2942,10 @@ def get_unread_notifications():
             )
         ).order_by(Notification.is_important.desc(), Notification.created_at.desc()).limit(20).all()
         
+        # 计数少于实际查到的未读通知，说明计数已偏差，立即重算
+        if unread_count < len(unread_notifications):
+            unread_count, _ = refresh_unread_counts(current_user.id)
+        
         # 格式化通知数据
         notifications_data = []
         for notification in unread_notifications:
@@ -3053,7 +2959,8 @@ def get_unread_notifications():
         
         response = jsonify({
             'success': True,
-            'notifications': notifications_data
+            'notifications': notifications_data,
+            'unread_count': unread_count
         })
         # 显式禁止浏览器与中间层缓存，避免跨页面切换读取旧通知状态
         response.headers['Cache-Control'] = 'private, no-store, no-cache, must-revalidate, max-age=0'
@@ -3078,11 +2985,8 @@ def unread_message_count():
         if hasattr(current_user, 'role') and current_user.role and current_user.role.name == 'Admin':
             return jsonify({'success': True, 'count': 0})
 
-        count = db.session.query(func.count(Message.id)).filter(
-            Message.receiver_id == current_user.id,
-            Message.is_read == False
-        ).scalar()
-        return jsonify({'success': True, 'count': count or 0})
+        _, count = get_unread_counts(current_user.id)
+        return jsonify({'success': True, 'count': count})
     except Exception as e:
         logger.error(f"Error getting unread message count: {e}")
         return jsonify({'success': False, 'count': 0, 'error': str(e)}), 500
@@ -16,12 +16,16 @@ from datetime import datetime, timedelta
 from email.utils import formatdate
 from urllib.parse import urlparse, quote
 from pathlib import Path
-from sqlalchemy import func
 from sqlalchemy.exc import IntegrityError
 from werkzeug.exceptions import HTTPException
 from flask_wtf.csrf import validate_csrf, generate_csrf
 from src.models import db, Activity, Tag, StudentInfo, SystemLog, Registration, AIChatHistory, AIChatSession, activity_tags, PointsHistory, User, Role, Message, Society
 from src.utils.time_helpers import get_beijing_time, ensure_timezone_aware, get_localized_now, safe_less_than, safe_greater_than, display_datetime
+from src.utils.seat_reservation import try_reserve_seat, release_seat, occupies_seat
+from src.utils.site_context import get_admin_stats, get_site_data_context
+from src.utils.llm_client import CircuitOpenError, get_llm_client
+from src.utils.stream_gate import get_stream_gate, relay_stream
+from src.utils.chat_history import clear_session_history, enforce_history_limit, history_page, prompt_history
 from src import csrf, limiter, cache # Import csrf
 
 utils_bp = Blueprint('utils', __name__)
@@ -485,9 +489,7 @@ def _decide_register_agent_action(user_message, pending_rows):
 
 
 def _perform_student_registration_by_ai(activity_id):
-    activity = db.session.execute(
-        db.select(Activity).where(Activity.id == activity_id).with_for_update()
-    ).scalar_one_or_none()
+    activity = db.session.get(Activity, activity_id)
     if not activity:
         return False, '活动不存在。', None
 
@@ -511,16 +513,6 @@ def _perform_student_registration_by_ai(activity_id):
     if existing and existing.status in ('registered', 'attended'):
         return True, '你已报名过该活动，无需重复提交。', activity
 
-    if activity.max_participants and int(activity.max_participants or 0) > 0:
-        reg_count = db.session.execute(
-            db.select(func.count()).select_from(Registration).filter(
-                Registration.activity_id == activity_id,
-                Registration.status.in_(['registered', 'attended'])
-            )
-        ).scalar() or 0
-        if reg_count >= int(activity.max_participants):
-            return False, '该活动报名人数已满。', activity
-
     if existing and existing.status == 'cancelled':
         existing.status = 'registered'
         existing.register_time = now
@@ -545,9 +537,14 @@ def _perform_student_registration_by_ai(activity_id):
     except Exception as side_effect_error:
         logger.warning(f"AI报名附加动作执行失败（已忽略）: {side_effect_error}")
 
+    if not try_reserve_seat(activity, current_user.id):
+        db.session.rollback()
+        return False, '该活动报名人数已满。', activity
+
     db.session.commit()
     try:
-        cache.delete_memoized(get_recommended_activities, current_user.id)
+        from src.utils.recommendations import invalidate_user_recommendations
+        invalidate_user_recommendations(current_user.id)
     except Exception as cache_error:
         logger.warning(f"AI报名成功后清理推荐缓存失败（已忽略）: {cache_error}")
     return True, '报名成功，已为你完成报名。', activity
@@ -817,6 +814,8 @@ def cancel_registration(activity_id, registration_id):
             return api_response(False, '报名信息与活动不匹配', status_code=400)
         
         # 更新状态为已取消
+        if occupies_seat(registration.status):
+            release_seat(activity_id)
         registration.status = 'cancelled'
         db.session.commit()
         
@@ -862,40 +861,9 @@ def _format_beijing_datetime(dt, fmt='%m-%d %H:%M'):
     return display_datetime(dt, 'Asia/Shanghai', fmt)
 
 def build_site_data_context(max_activities=20):
-    """构建站内活动与社团、标签映射的高度压缩上下文，极小化Token消耗。"""
+    """构建站内活动与社团、标签映射的高度压缩上下文，极小化Token消耗（按数据版本缓存，见 utils.site_context）。"""
     try:
-        from src.models import Society
-        # 1. 压缩社团数据
-        societies = db.session.execute(db.select(Society).filter_by(is_active=True)).scalars().all()
-        soc_lines = [f"{s.name}({s.code})" for s in societies]
-        
-        # 2. 获取标签热度并压缩
-        popular_tags = db.session.query(
-            Tag.name, db.func.count(activity_tags.c.activity_id).label('count')
-        ).join(activity_tags).group_by(Tag.id).order_by(db.text('count DESC')).limit(8).all()
-        pt_lines = [f"{t[0]}:{t[1]}" for t in popular_tags]
-
-        # 3. 获取最新活动并高密度压缩
-        activities = db.session.execute(
-            db.select(Activity).order_by(Activity.created_at.desc()).limit(max_activities)
-        ).scalars().all()
-
-        if not activities:
-            activity_lines = ["无数据"]
-        else:
-            activity_lines = []
-            for a in activities:
-                soc_name = a.society.name if getattr(a, 'society', None) else '无'
-                st = _format_beijing_datetime(a.start_time, '%m-%d %H:%M')
-                et = _format_beijing_datetime(a.end_time, '%m-%d %H:%M')
-                tag_names = ','.join([tag.name for tag in a.tags]) if getattr(a, 'tags', None) else '无'
-                activity_lines.append(f"[{a.id}]{a.title}|{soc_name}|{tag_names}|{a.status}|{st}至{et}")
-
-        return (
-            f"【社团库】{','.join(soc_lines)}\n"
-            f"【热标】{','.join(pt_lines)}\n"
-            f"【最新活动表(ID|名称|社团|标签|状态|起止时间，均为北京时间)】\n" + "\n".join(activity_lines)
-        )
+        return get_site_data_context(max_activities)
     except Exception as e:
         logger.error(f"构建站内数据上下文失败: {e}")
         return "数据暂不可用"
@@ -1096,13 +1064,14 @@ def ai_chat():
 {site_data_context}
 """
     else:  # 管理员用户
-        # 获取统计数据
-        total_activities = db.session.execute(db.select(func.count()).select_from(Activity)).scalar()
-        active_activities = db.session.execute(db.select(func.count()).select_from(Activity).filter_by(status='active')).scalar()
-        completed_activities = db.session.execute(db.select(func.count()).select_from(Activity).filter_by(status='completed')).scalar()
-        total_students = db.session.execute(db.select(func.count()).select_from(StudentInfo)).scalar()
-        total_registrations = db.session.execute(db.select(func.count()).select_from(Registration)).scalar()
-        attended_registrations = db.session.execute(db.select(func.count()).select_from(Registration).filter_by(status='checked_in')).scalar()
+        # 获取统计数据（短期缓存，见 utils.site_context）
+        admin_stats = get_admin_stats()
+        total_activities = admin_stats['total_activities']
+        active_activities = admin_stats['active_activities']
+        completed_activities = admin_stats['completed_activities']
+        total_students = admin_stats['total_students']
+        total_registrations = admin_stats['total_registrations']
+        attended_registrations = admin_stats['attended_registrations']
         
         # 获取活动参与度
         if total_registrations > 0:
@@ -1111,9 +1080,7 @@ def ai_chat():
             attendance_rate = "0%"
         
         # 最受欢迎的活动标签
-        popular_tags = db.session.query(
-            Tag.name, db.func.count(activity_tags.c.activity_id).label('count')
-        ).join(activity_tags).group_by(Tag.id).order_by(db.text('count DESC')).limit(5).all()
+        popular_tags = admin_stats['popular_tags']
         
         user_context = f"""
 用户角色：管理员
@@ -1146,14 +1113,8 @@ def ai_chat():
                 db.session.add(session)
                 db.session.commit()
             
-            # 获取该会话的历史消息
-            history_messages = AIChatHistory.query.filter_by(
-                session_id=session_id
-            ).order_by(AIChatHistory.timestamp).limit(20).all()
-            
-            # 将历史消息添加到messages列表
-            for msg in history_messages:
-                messages.append({"role": msg.role, "content": msg.content})
+            # 较早对话的摘要 + 最近若干条消息
+            messages = prompt_history(session, current_user.id)
         except Exception as e:
             logger.error(f"获取聊天历史记录失败: {str(e)}")
     
@@ -1225,40 +1186,75 @@ def ai_chat():
     # 获取Flask应用实例的引用，避免上下文问题
     app = current_app._get_current_object()  # 获取实际的应用对象而不是代理
 
+    # 单用户并发流与单 worker 流总数上限（见 utils.stream_gate）
+    lease, limit_message = get_stream_gate(app).acquire(current_user_id)
+    if lease is None:
+        logger.info(f"拒绝 AI 对话流: user_id={current_user_id}, {limit_message}")
+        # EventSource 读不到非 2xx 响应的内容，以 SSE 错误消息返回以便前端提示
+        response = Response(
+            f"retry: 10000\ndata: {json.dumps({'error': limit_message})}\n\n",
+            mimetype='text/event-stream'
+        )
+        response.headers['Cache-Control'] = 'no-cache, no-transform'
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+
+    llm_client = get_llm_client(app)
+    heartbeat_seconds = float(app.config.get('AI_STREAM_HEARTBEAT_SECONDS', 15))
+    buffer_chunks = int(app.config.get('AI_STREAM_BUFFER_CHUNKS', 64))
+
+    def iter_deltas(upstream):
+        for line in upstream.iter_lines():
+            if not line:
+                continue
+            line = line.decode('utf-8')
+            if not line.startswith('data: '):
+                continue
+            data = line[6:]  # 去掉 'data: ' 前缀
+            if data == '[DONE]':
+                return
+            try:
+                chunk = json.loads(data)
+            except json.JSONDecodeError:
+                continue
+            if 'choices' in chunk and len(chunk['choices']) > 0:
+                content = chunk['choices'][0].get('delta', {}).get('content', '')
+                if content:
+                    yield content
+
     def generate():
         nonlocal current_user_id, current_message, current_session_id
+        upstream = None
+        streaming = False
         try:
             # 先发送状态事件，尽快建立前端可见的流式连接，降低长思考时前置代理断连概率
             yield f"event: status\ndata: {json.dumps({'stage': 'connecting'})}\n\n"
             logger.info(f"发送 AI 请求: URL={url}, Headers={headers}, Payload={payload}")
-            response = requests.post(
+            upstream = llm_client.post(
                 url,
                 headers=headers,
                 json=payload,
                 timeout=(connect_timeout, read_timeout),
                 stream=True
             )
-            logger.info(f"AI API 响应状态码: {response.status_code}")
-            response.raise_for_status()
+            logger.info(f"AI API 响应状态码: {upstream.status_code}")
+            upstream.raise_for_status()
+            streaming = True
             
             full_response = ""
             
-            for line in response.iter_lines():
-                if line:
-                    line = line.decode('utf-8')
-                    if line.startswith('data: '):
-                        data = line[6:]  # 去掉 'data: ' 前缀
-                        if data == '[DONE]':
-                            break
-                        try:
-                            chunk = json.loads(data)
-                            if 'choices' in chunk and len(chunk['choices']) > 0:
-                                content = chunk['choices'][0].get('delta', {}).get('content', '')
-                                if content:
-                                    full_response += content
-                                    yield f"data: {json.dumps({'content': content})}\n\n"
-                        except json.JSONDecodeError:
-                            continue
+            # 上游由后台线程读取；客户端读得慢时暂停读取上游，长时间无输出时发送心跳注释
+            for content in relay_stream(iter_deltas(upstream), buffer_chunks, heartbeat_seconds):
+                lease.touch()
+                if content is None:
+                    yield ": ping\n\n"
+                    continue
+                full_response += content
+                yield f"data: {json.dumps({'content': content})}\n\n"
+
+            # 上游读取完整结束才计为成功
+            streaming = False
+            llm_client.record_success(text_model)
             
             # 响应结束，保存历史记录
             if current_session_id and full_response and current_user_id:
@@ -1293,6 +1289,9 @@ def ai_chat():
                         
                         # 更新会话最后更新时间
                         session.updated_at = datetime.now()
+                        db.session.flush()
+                        # 按用户设置的历史条数上限删除更早的消息
+                        enforce_history_limit(current_session_id, current_user_id)
                         db.session.commit()
                         logger.info(f"已保存聊天历史记录，会话ID: {current_session_id}")
                 except Exception as e:
@@ -1305,18 +1304,35 @@ def ai_chat():
         except requests.exceptions.RequestException as e:
             logger.error(f"AI API 调用失败: {str(e)}")
             error_message = 'AI 服务调用失败'
-            if isinstance(e, requests.exceptions.ReadTimeout):
-                error_message = 'AI 响应超时，请稍后重试'
+            stalled, streaming = streaming, False
+            if stalled:
+                # 响应头已到达、读取过程中中断或停滞（requests 把读超时包装为 ConnectionError 抛出），补记一次失败
+                llm_client.record_failure(text_model)
+            if isinstance(e, CircuitOpenError):
+                error_message = 'AI 服务暂时繁忙，请稍后重试'
             elif isinstance(e, requests.exceptions.ConnectTimeout):
                 error_message = 'AI 服务连接超时，请稍后重试'
+            elif isinstance(e, requests.exceptions.ReadTimeout) or (
+                    stalled and isinstance(e, requests.exceptions.ConnectionError)):
+                error_message = 'AI 响应超时，请稍后重试'
             yield f"data: {json.dumps({'error': error_message})}\n\n"
         except Exception as e:
             logger.error(f"处理 AI 响应时出错: {str(e)}")
             yield f"data: {json.dumps({'error': '处理 AI 响应时出错'})}\n\n"
+        finally:
+            # 客户端断开时也会走到这里：关闭上游连接，释放流名额
+            if streaming:
+                # 客户端断开等非上游原因中止读取，不算上游失败；同时结束可能在进行的半开探测
+                llm_client.record_success(text_model)
+            if upstream is not None:
+                upstream.close()
+            lease.release()
 
     response = Response(generate(), mimetype='text/event-stream')
     response.headers['Cache-Control'] = 'no-cache, no-transform'
     response.headers['X-Accel-Buffering'] = 'no'
+    # 生成器未开始迭代就被关闭时 finally 不会执行，由响应关闭回调兜底释放名额
+    response.call_on_close(lease.release)
     return response
 
 
@@ -1372,7 +1388,7 @@ def ai_chat_legacy_post():
             'temperature': 0.6,
         }
 
-        resp = requests.post(url, json=payload, headers=headers, timeout=30)
+        resp = get_llm_client().post(url, json=payload, headers=headers, timeout=30)
         if resp.status_code != 200:
             return jsonify({'success': False, 'error': f'AI服务暂不可用({resp.status_code})'}), 502
 
@@ -1406,7 +1422,7 @@ def utils_api_ai_chat():
 @login_required
 @limiter.limit('120/minute')
 def ai_chat_history_endpoint():
-    """获取AI聊天历史记录"""
+    """获取AI聊天历史记录（默认最新一页，cursor 为上一页返回的 next_cursor 时加载更早的消息）"""
     session_id = request.args.get('session_id')
     if not session_id:
         return jsonify({
@@ -1416,27 +1432,32 @@ def ai_chat_history_endpoint():
         }), 400
     
     try:
-        # 查询历史记录
-        history_messages = db.session.execute(db.select(AIChatHistory).filter_by(
-            session_id=session_id,
-            user_id=current_user.id
-        ).order_by(AIChatHistory.timestamp)).scalars().all()
+        # 按时间倒序分页查询，页内再按时间正序返回
+        pagination = history_page(
+            session_id,
+            current_user.id,
+            per_page=request.args.get('limit', type=int),
+            cursor=request.args.get('cursor')
+        )
         
         # 格式化消息
         messages = [
             {
+                'id': msg.id,
                 'role': msg.role,
                 'content': msg.content,
-                'timestamp': msg.timestamp.isoformat()
+                'timestamp': msg.timestamp.isoformat() if msg.timestamp else None
             }
-            for msg in history_messages
+            for msg in reversed(pagination.items)
         ]
         
         return jsonify({
             'success': True,
             'message': '成功获取历史记录',
             'data': messages,
-            'messages': messages
+            'messages': messages,
+            'has_more': pagination.has_next,
+            'next_cursor': pagination.next_cursor
         })
     except Exception as e:
         logger.error(f"获取AI聊天历史记录失败: {str(e)}")
@@ -1471,11 +1492,8 @@ def ai_chat_clear():
         })
     
     try:
-        # 删除历史记录
-        db.session.execute(db.delete(AIChatHistory).filter_by(
-            session_id=session_id,
-            user_id=current_user.id
-        ))
+        # 删除历史记录及会话摘要
+        clear_session_history(session_id, current_user.id)
         db.session.commit()
         
         return jsonify({
@@ -1521,13 +1539,8 @@ def utils_ai_chat_clear():
             # 直接尝试按session_id删除历史记录
             logger.info(f"未找到会话记录，尝试直接删除历史: 用户ID={current_user.id}, 会话ID={session_id}")
         
-        # 删除历史记录
-        result = db.session.execute(db.delete(AIChatHistory).filter_by(
-            session_id=session_id,
-            user_id=current_user.id
-        ))
-        
-        affected_rows = result.rowcount
+        # 删除历史记录及会话摘要
+        affected_rows = clear_session_history(session_id, current_user.id)
         db.session.commit()
         
         logger.info(f"成功清除用户 {current_user.id} 的会话 {session_id} 历史记录: {affected_rows} 条消息")
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+新活动订阅消息群发
+
+原先管理员点击“群发通知”会另起一个 Python 进程运行 scripts/publish_activity_notice.py：
+每次都完整启动应用（含建表与结构检查），再逐个用户串行调用微信接口，异常被直接吞掉。
+这里改为应用内的后台群发：
+    1. 提交时用一条 INSERT ... SELECT 把目标受众（社团活动为加入该社团的已绑定微信用户，全校活动为全部已绑定用户）
+       写入 activity_notice_recipients，生成一个群发批次；
+    2. 批次作为 ai_jobs 队列中的 activity_notice 任务执行（持久化、租约续期、进程中断后可被重新领取），
+       按批读取待发送的接收人，交给 WeChatClient.send_many 并发发送（并发数与每秒上限见 wechat_api）；
+    3. 每批发送前先把接收人标记为 sending 并提交，发送后写回结果、按接收人状态重算批次计数，管理页轮询批次进度。
+订阅消息发出后无法查询是否送达：任务中断（进程崩溃、租约过期被重新领取）时，停留在 sending 的接收人
+按“结果未知”记为失败、不再重发；重新领取的任务只发送仍为 pending 的接收人。批次较小，中断时结果未知的人数有限。
+"""
+
+import logging
+
+from sqlalchemy import and_, bindparam, literal
+
+from src import db
+from src.models import Activity, ActivityNoticeDispatch, ActivityNoticeRecipient, StudentInfo, User, student_societies
+from src.utils.ai_jobs import enqueue_job, register_job_kind
+from src.utils.time_helpers import display_datetime, get_localized_now
+from src.utils.wechat_api import get_wechat_client
+
+logger = logging.getLogger(__name__)
+
+NEW_ACTIVITY_TEMPLATE_ID = 'ESmqrDAYo8rVBDq5EL8YjbKGedpxOYuPQgIZ3Nz_EZ0'
+JOB_QUEUE = 'activity_notice'
+# 每批先标记 sending 再发送，批次越小，任务中断时结果未知的接收人越少
+BATCH_SIZE = 50
+ACTIVE_STATUSES = ('queued', 'running')
+
+
+def _audience_select(activity, dispatch_id):
+    stmt = db.select(literal(dispatch_id), User.id, literal('pending')).filter(
+        User.wx_openid.isnot(None),
+        User.active == True
+    )
+    if activity.society_id:
+        stmt = stmt.join(StudentInfo, StudentInfo.user_id == User.id).join(
+            student_societies,
+            (student_societies.c.student_id == StudentInfo.id) & (student_societies.c.society_id == activity.society_id)
+        )
+    return stmt.distinct()
+
+
+def active_dispatch(activity_id):
+    return db.session.execute(
+        db.select(ActivityNoticeDispatch).filter(
+            ActivityNoticeDispatch.activity_id == activity_id,
+            ActivityNoticeDispatch.status.in_(ACTIVE_STATUSES)
+        ).order_by(ActivityNoticeDispatch.id.desc()).limit(1)
+    ).scalar_one_or_none()
+
+
+def latest_dispatch(activity_id):
+    return db.session.execute(
+        db.select(ActivityNoticeDispatch).filter(
+            ActivityNoticeDispatch.activity_id == activity_id
+        ).order_by(ActivityNoticeDispatch.id.desc()).limit(1)
+    ).scalar_one_or_none()
+
+
+def dispatch_progress(dispatch):
+    if not dispatch:
+        return None
+    return {
+        'dispatch_id': dispatch.id,
+        'status': dispatch.status,
+        'total': dispatch.total,
+        'sent': dispatch.sent,
+        'failed': dispatch.failed,
+        'pending': max(dispatch.total - dispatch.sent - dispatch.failed, 0),
+        'message': dispatch.message or '',
+        'done': dispatch.status not in ACTIVE_STATUSES
+    }
+
+
+def create_activity_notice_dispatch(activity, created_by=None):
+    """生成群发批次并入队；同一活动已有进行中的批次时直接返回该批次。返回 (批次, 是否新建)。"""
+    # 锁住活动行，并发提交时串行执行“检查进行中批次 + 新建批次”，不会为同一活动建出两个批次
+    db.session.execute(db.select(Activity.id).filter(Activity.id == activity.id).with_for_update())
+    existing = active_dispatch(activity.id)
+    if existing:
+        return existing, False
+
+    dispatch = ActivityNoticeDispatch(activity_id=activity.id, created_by=created_by, status='queued')
+    db.session.add(dispatch)
+    db.session.flush()
+    db.session.execute(
+        db.insert(ActivityNoticeRecipient).from_select(
+            ['dispatch_id', 'user_id', 'status'], _audience_select(activity, dispatch.id)
+        )
+    )
+    dispatch.total = db.session.execute(
+        db.select(db.func.count(ActivityNoticeRecipient.id)).filter(ActivityNoticeRecipient.dispatch_id == dispatch.id)
+    ).scalar() or 0
+    if not dispatch.total:
+        dispatch.status = 'done'
+        dispatch.message = '没有可推送的用户'
+        dispatch.finished_at = get_localized_now()
+        db.session.commit()
+        return dispatch, True
+
+    # enqueue_job 负责提交，批次与任务一并落库
+    enqueue_job(JOB_QUEUE, f'notice_{dispatch.id}', {'dispatch_id': dispatch.id}, owner_id=created_by, initial_result={
+        'job_id': f'notice_{dispatch.id}',
+        'status': 'queued',
+        'success': True,
+        'done': False,
+        'message': '群发任务已提交'
+    })
+    return dispatch, True
+
+
+def _template_data(activity):
+    # thing1: 发起方, thing6: 活动名称, date2: 开始时间, thing4: 活动地点, number5: 名额限制
+    return {
+        "thing1": {"value": activity.society.name if activity.society else "智能社团+"},
+        "thing6": {"value": (activity.title or '')[:20]},
+        "date2": {"value": display_datetime(activity.start_time, None, '%Y-%m-%d %H:%M')},
+        "thing4": {"value": (activity.location or '地点详见详情页')[:20]},
+        "number5": {"value": str(activity.max_participants) if (activity.max_participants or 0) > 0 else "999"}
+    }
+
+
+def _refresh_counts(dispatch):
+    """按接收人状态重算批次的成功/失败数（重复执行结果不变）。"""
+    def count(status):
+        return db.select(db.func.count(ActivityNoticeRecipient.id)).filter(
+            ActivityNoticeRecipient.dispatch_id == dispatch.id,
+            ActivityNoticeRecipient.status == status
+        ).scalar_subquery()
+
+    db.session.execute(
+        db.update(ActivityNoticeDispatch).where(ActivityNoticeDispatch.id == dispatch.id).values(
+            sent=count('sent'), failed=count('failed')
+        )
+    )
+
+
+def _resolve_interrupted(dispatch):
+    """上次执行中断时停留在 sending 的接收人：无法确认是否已送达，记为失败，不再重发。"""
+    result = db.session.execute(
+        db.update(ActivityNoticeRecipient).where(
+            ActivityNoticeRecipient.dispatch_id == dispatch.id,
+            ActivityNoticeRecipient.status == 'sending'
+        ).values(status='failed', error='任务中断，发送结果未知，未重发').execution_options(synchronize_session=False)
+    )
+    if result.rowcount:
+        logger.warning(f"活动通知群发 dispatch={dispatch.id} 有 {result.rowcount} 个接收人发送结果未知，已记为失败")
+    return result.rowcount or 0
+
+
+def run_activity_notice_dispatch(job_id, payload):
+    """ai_jobs 任务处理函数：发送批次内所有待发送的接收人。"""
+    dispatch = db.session.get(ActivityNoticeDispatch, int(payload.get('dispatch_id')))
+    if not dispatch:
+        raise ValueError('群发批次不存在')
+    activity = db.session.get(Activity, dispatch.activity_id)
+    if not activity:
+        raise ValueError('活动不存在')
+    client = get_wechat_client()
+    if not client.access_token():
+        raise RuntimeError('无法获取微信 access_token')
+
+    dispatch.status = 'running'
+    dispatch.started_at = dispatch.started_at or get_localized_now()
+    _resolve_interrupted(dispatch)
+    _refresh_counts(dispatch)
+    db.session.commit()
+
+    page = f"pages/activity/activity?id={activity.id}"
+    data = _template_data(activity)
+    table = ActivityNoticeRecipient.__table__
+    # 只写回仍为 sending 的接收人：租约过期后被其他进程记为“结果未知”的不再覆盖
+    write_result = table.update().where(
+        and_(table.c.id == bindparam('rid'), table.c.status == 'sending')
+    ).values(status=bindparam('new_status'), error=bindparam('new_error'), sent_at=bindparam('new_sent_at'))
+
+    while True:
+        batch = db.session.execute(
+            db.select(ActivityNoticeRecipient.id, User.wx_openid).join(
+                User, User.id == ActivityNoticeRecipient.user_id
+            ).filter(
+                ActivityNoticeRecipient.dispatch_id == dispatch.id,
+                ActivityNoticeRecipient.status == 'pending'
+            ).order_by(ActivityNoticeRecipient.id).limit(BATCH_SIZE)
+        ).all()
+        if not batch:
+            break
+
+        # 先提交 sending 标记再发送：发送途中中断时这些接收人不会被当作 pending 再发一次
+        claimed = db.session.execute(
+            db.update(ActivityNoticeRecipient).where(
+                ActivityNoticeRecipient.id.in_([row.id for row in batch]),
+                ActivityNoticeRecipient.status == 'pending'
+            ).values(status='sending').execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        if claimed.rowcount != len(batch):
+            # 租约过期后任务已被其他进程重新领取并在处理同一批接收人：本进程不再发送，
+            # 本次标记的接收人由对方结束时按“结果未知”处理（本进程的任务结果也不会再写回）
+            logger.warning(f"活动通知群发 dispatch={dispatch.id} 已由其他进程处理，本次退出")
+            return {'job_id': job_id, 'status': 'running', 'success': True, 'done': False,
+                    'message': '群发任务已由其他进程接手'}
+
+        results = client.send_many([
+            {'openid': row.wx_openid, 'template_id': NEW_ACTIVITY_TEMPLATE_ID, 'page': page, 'data': data}
+            for row in batch
+        ])
+        now = get_localized_now()
+        updates = []
+        for row, result in zip(batch, results):
+            if result.get('success'):
+                updates.append({'rid': row.id, 'new_status': 'sent', 'new_error': None, 'new_sent_at': now})
+            else:
+                updates.append({
+                    'rid': row.id, 'new_status': 'failed',
+                    'new_error': str(result.get('msg') or '')[:255], 'new_sent_at': None
+                })
+        db.session.execute(write_result, updates)
+        _refresh_counts(dispatch)
+        db.session.commit()
+
+    # 与本进程同时处理过该批次的旧进程留下的 sending 接收人
+    _resolve_interrupted(dispatch)
+    _refresh_counts(dispatch)
+    db.session.commit()
+    db.session.refresh(dispatch)
+    dispatch.status = 'done'
+    dispatch.finished_at = get_localized_now()
+    db.session.commit()
+    logger.info(f"活动通知群发完成: activity={activity.id}, 成功 {dispatch.sent}, 失败 {dispatch.failed}")
+    return {
+        'job_id': job_id,
+        'status': 'success',
+        'success': True,
+        'done': True,
+        'message': f'群发完成：成功 {dispatch.sent}，失败 {dispatch.failed}'
+    }
+
+
+def _dispatch_failure(job_id, e):
+    message = f'群发失败: {e}'
+    try:
+        db.session.rollback()
+        db.session.execute(
+            db.update(ActivityNoticeDispatch).where(
+                ActivityNoticeDispatch.id == int(str(job_id).rsplit('_', 1)[-1]),
+                ActivityNoticeDispatch.status.in_(ACTIVE_STATUSES)
+            ).values(status='failed', message=message[:255], finished_at=get_localized_now())
+        )
+        db.session.commit()
+    except Exception as update_error:
+        logger.warning(f"更新群发批次失败状态出错 job_id={job_id}: {update_error}")
+    return {'job_id': job_id, 'status': 'failed', 'success': False, 'done': True, 'message': message}
+
+
+# 同时只执行一个群发批次，避免多个批次叠加超出微信接口频率
+register_job_kind(JOB_QUEUE, run_activity_notice_dispatch, _dispatch_failure, concurrency=1, ttl_seconds=24 * 3600, max_attempts=3)
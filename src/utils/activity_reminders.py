@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+活动开始提醒调度
+
+由定时任务（`flask dispatch-activity-reminders`，每分钟一次）按 Activity.start_time 时间窗扫描，
+替代原先在通知页/未读数接口中逐用户、逐报名生成提醒的做法。
+提醒分三档（开始前1天、3小时、1小时），每档只覆盖到下一档之前的时间窗，
+因此临近开始才报名的学生只会收到当前所在档位的提醒，不会一次收到多条。
+
+去重依赖 activity_reminders 表的唯一键 (user_id, activity_id, reminder_kind)：
+每个活动每档先用一条 INSERT ... SELECT 为全部报名人写入台账（冲突忽略），
+再用一条 INSERT ... SELECT 为本次新写入的台账行批量生成个人通知。
+"""
+
+import logging
+import uuid
+from datetime import timedelta
+
+from sqlalchemy import text
+
+from src import db
+from src.models import Activity
+from src.utils.time_helpers import get_localized_now
+from src.utils.unread_counters import increment_notification_unread_for_reminder_batch
+
+logger = logging.getLogger(__name__)
+
+# (档位标识, 文案中的时间描述, 开始前多久提醒)，按提前量从大到小排列
+REMINDER_KINDS = (
+    ('start_1d', '1天', timedelta(days=1)),
+    ('start_3h', '3小时', timedelta(hours=3)),
+    ('start_1h', '1小时', timedelta(hours=1)),
+)
+
+
+def _reminder_windows(now):
+    """返回 [(档位, 文案, 下界, 上界)]：活动开始时间落在 (下界, 上界] 内即应发送该档提醒。"""
+    windows = []
+    for index, (kind, label, delta) in enumerate(REMINDER_KINDS):
+        next_delta = REMINDER_KINDS[index + 1][2] if index + 1 < len(REMINDER_KINDS) else timedelta(0)
+        windows.append((kind, label, now + next_delta, now + delta))
+    return windows
+
+
+def _ledger_insert_sql(dialect):
+    select_sql = """
+        SELECT user_id, :activity_id, :reminder_kind, :batch_token, :now
+        FROM registrations
+        WHERE activity_id = :activity_id AND status IN ('registered', 'attended')
+    """
+    if dialect == 'postgresql':
+        return text(f"""
+            INSERT INTO activity_reminders (user_id, activity_id, reminder_kind, batch_token, created_at)
+            {select_sql}
+            ON CONFLICT (user_id, activity_id, reminder_kind) DO NOTHING
+        """)
+    return text(f"""
+        INSERT OR IGNORE INTO activity_reminders (user_id, activity_id, reminder_kind, batch_token, created_at)
+        {select_sql}
+    """)
+
+
+_NOTIFICATION_INSERT_SQL = text("""
+    INSERT INTO notification (title, content, is_important, created_at, created_by, expiry_date, is_public)
+    SELECT :title, :content, :is_important, :now, user_id, :expiry_date, :is_public
+    FROM activity_reminders
+    WHERE batch_token = :batch_token
+""")
+
+
+def dispatch_activity_start_reminders(now=None):
+    """扫描即将开始的活动并为报名人批量生成提醒通知，返回新生成的提醒数量。"""
+    now = now or get_localized_now()
+    dialect = db.session.get_bind().dialect.name
+    ledger_sql = _ledger_insert_sql(dialect)
+    created = 0
+    try:
+        for kind, label, lower, upper in _reminder_windows(now):
+            activities = db.session.execute(
+                db.select(Activity.id, Activity.title, Activity.start_time).filter(
+                    Activity.status == 'active',
+                    Activity.start_time > lower,
+                    Activity.start_time <= upper
+                )
+            ).all()
+            for activity_id, title, start_time in activities:
+                batch_token = uuid.uuid4().hex
+                inserted = db.session.execute(ledger_sql, {
+                    'activity_id': activity_id,
+                    'reminder_kind': kind,
+                    'batch_token': batch_token,
+                    'now': now,
+                }).rowcount or 0
+                if inserted <= 0:
+                    continue
+
+                expiry_date = start_time + timedelta(days=1)
+                db.session.execute(_NOTIFICATION_INSERT_SQL, {
+                    'title': f"活动即将开始提醒：{title}"[:100],
+                    'content': f"你报名的活动《{title}》将在{label}后开始，请提前安排时间。",
+                    'is_important': True,
+                    'now': now,
+                    'expiry_date': expiry_date,
+                    'is_public': False,
+                    'batch_token': batch_token,
+                })
+                increment_notification_unread_for_reminder_batch(batch_token, expiry_date)
+                created += inserted
+                logger.info(f"已生成活动开始提醒: activity_id={activity_id}, kind={kind}, count={inserted}")
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return created
@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+活动全文检索
+
+替代在 title/description/location 上做 ilike('%kw%') 的全表扫描。中文没有空格分词，
+这里统一在应用侧切词：连续汉字按单字+相邻二字（bigram）入索引，查询时按二字切分并要求全部命中；
+英文/数字按单词入索引，查询时按前缀匹配。索引按数据库选用不同实现：
+    PostgreSQL: activity_search 表的 tsvector 列 + GIN 索引，ts_rank_cd 排序（标题 > 地点 > 描述）
+    SQLite:     FTS5 虚拟表 activity_search_fts，bm25 排序
+    其他/索引不可用: 退化为 LIKE 匹配
+活动新建/编辑/删除通过 Session after_flush 钩子在同一事务内更新索引；
+批量 SQL 修改不会触发钩子，由 `flask reindex-activity-search` 全量重建。
+"""
+
+import html
+import logging
+import re
+
+from flask import current_app
+from sqlalchemy import Float, Integer, event, inspect, literal, or_, select, text
+
+from src import db
+from src.models import Activity
+
+logger = logging.getLogger(__name__)
+
+_CJK = '\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff'
+_TOKEN_RE = re.compile(f'([{_CJK}]+)|([^\\W_{_CJK}]+)')
+_TAG_RE = re.compile(r'<[^>]+>')
+INDEXED_FIELDS = ('title', 'location', 'description')
+MAX_QUERY_TOKENS = 16
+
+
+def _plain_text(value):
+    if not value:
+        return ''
+    return html.unescape(_TAG_RE.sub(' ', str(value))).lower()
+
+
+def index_tokens(value):
+    """把字段文本切为索引词：汉字单字+二字组合，其他按单词。"""
+    tokens = []
+    for cjk, word in _TOKEN_RE.findall(_plain_text(value)):
+        if cjk:
+            tokens.extend(cjk)
+            tokens.extend(cjk[i:i + 2] for i in range(len(cjk) - 1))
+        else:
+            tokens.append(word)
+    return tokens
+
+
+def query_terms(keyword):
+    """把搜索词切为 [(词, 是否前缀匹配)]；汉字按二字切分（单字词保留单字），其他按单词前缀。"""
+    terms = []
+    seen = set()
+    for cjk, word in _TOKEN_RE.findall(_plain_text(keyword)):
+        if cjk:
+            parts = [cjk] if len(cjk) == 1 else [cjk[i:i + 2] for i in range(len(cjk) - 1)]
+            items = [(part, False) for part in parts]
+        else:
+            items = [(word, True)]
+        for item in items:
+            if item not in seen:
+                seen.add(item)
+                terms.append(item)
+    return terms[:MAX_QUERY_TOKENS]
+
+
+class LikeSearchEngine(object):
+    """兜底实现：不建索引，按原始关键词 LIKE 匹配。"""
+
+    name = 'like'
+    ready = True
+
+    def ensure_schema(self, conn):
+        return True
+
+    def index_rows(self, conn, rows):
+        pass
+
+    def remove(self, conn, activity_ids):
+        pass
+
+    def clear(self, conn):
+        pass
+
+    def indexed_count(self, conn):
+        return None
+
+    def match_subquery(self, keyword, terms):
+        pattern = f'%{keyword}%'
+        return select(Activity.id.label('activity_id'), literal(0.0, type_=Float).label('rank')).filter(
+            or_(
+                Activity.title.ilike(pattern),
+                Activity.description.ilike(pattern),
+                Activity.location.ilike(pattern)
+            )
+        ).subquery()
+
+
+class PostgresSearchEngine(LikeSearchEngine):
+    name = 'postgresql'
+    ready = False
+
+    def ensure_schema(self, conn):
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS activity_search (
+                activity_id INTEGER PRIMARY KEY REFERENCES activities(id) ON DELETE CASCADE,
+                search_vector tsvector NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS idx_activity_search_vector ON activity_search USING GIN (search_vector)"))
+        return True
+
+    def index_rows(self, conn, rows):
+        if not rows:
+            return
+        # 以 tsvector 文本字面量写入（带位置与权重），不经过 PostgreSQL 解析器，避免数据库 locale 影响汉字切词
+        conn.execute(text("""
+            INSERT INTO activity_search (activity_id, search_vector, updated_at)
+            VALUES (:activity_id, CAST(:search_vector AS tsvector), CURRENT_TIMESTAMP)
+            ON CONFLICT (activity_id) DO UPDATE
+            SET search_vector = EXCLUDED.search_vector, updated_at = EXCLUDED.updated_at
+        """), [
+            {'activity_id': row[0], 'search_vector': _tsvector_literal(_index_params(row))}
+            for row in rows
+        ])
+
+    def remove(self, conn, activity_ids):
+        for activity_id in activity_ids:
+            conn.execute(text("DELETE FROM activity_search WHERE activity_id = :activity_id"), {'activity_id': activity_id})
+
+    def clear(self, conn):
+        conn.execute(text("DELETE FROM activity_search"))
+
+    def indexed_count(self, conn):
+        return conn.execute(text("SELECT COUNT(*) FROM activity_search")).scalar() or 0
+
+    def match_subquery(self, keyword, terms):
+        # 词仅由字母/数字/汉字组成，可安全地放入 tsquery 的引号字面量
+        tsquery = ' & '.join(f"'{term}'" + (':*' if prefix else '') for term, prefix in terms)
+        return text("""
+            SELECT activity_id, ts_rank_cd(search_vector, CAST(:tsquery AS tsquery)) AS rank
+            FROM activity_search
+            WHERE search_vector @@ CAST(:tsquery AS tsquery)
+        """).bindparams(tsquery=tsquery).columns(activity_id=Integer, rank=Float).subquery()
+
+
+class SqliteFtsSearchEngine(LikeSearchEngine):
+    name = 'sqlite'
+    ready = False
+
+    def ensure_schema(self, conn):
+        conn.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS activity_search_fts "
+            "USING fts5(title, location, description, tokenize='unicode61')"
+        ))
+        return True
+
+    def index_rows(self, conn, rows):
+        if not rows:
+            return
+        params = [_index_params(row, joined=True) for row in rows]
+        self.remove(conn, [p['activity_id'] for p in params])
+        conn.execute(text("""
+            INSERT INTO activity_search_fts (rowid, title, location, description)
+            VALUES (:activity_id, :title, :location, :description)
+        """), params)
+
+    def remove(self, conn, activity_ids):
+        for activity_id in activity_ids:
+            conn.execute(text("DELETE FROM activity_search_fts WHERE rowid = :activity_id"), {'activity_id': activity_id})
+
+    def clear(self, conn):
+        conn.execute(text("DELETE FROM activity_search_fts"))
+
+    def indexed_count(self, conn):
+        return conn.execute(text("SELECT COUNT(*) FROM activity_search_fts")).scalar() or 0
+
+    def match_subquery(self, keyword, terms):
+        match = ' '.join(f'"{term}"' + ('*' if prefix else '') for term, prefix in terms)
+        # bm25 越小越相关，取负值使 rank 越大越相关；列权重 标题:地点:描述 = 10:5:1
+        return text("""
+            SELECT rowid AS activity_id, -bm25(activity_search_fts, 10.0, 5.0, 1.0) AS rank
+            FROM activity_search_fts
+            WHERE activity_search_fts MATCH :match
+        """).bindparams(match=match).columns(activity_id=Integer, rank=Float).subquery()
+
+
+_ENGINE_CLASSES = {
+    'postgresql': PostgresSearchEngine,
+    'sqlite': SqliteFtsSearchEngine,
+    'like': LikeSearchEngine,
+}
+
+
+def _index_params(row, joined=False):
+    activity_id, title, location, description = row
+    params = {
+        'activity_id': activity_id,
+        'title': index_tokens(title),
+        'location': index_tokens(location),
+        'description': index_tokens(description),
+    }
+    if joined:
+        params.update({key: ' '.join(params[key]) for key in INDEXED_FIELDS})
+    return params
+
+
+def _tsvector_literal(params):
+    """生成 tsvector 字面量：'词':位置权重 ...；标题/地点/描述分别记为 A/B/C 权重。"""
+    positions = {}
+    position = 0
+    for field, weight in zip(INDEXED_FIELDS, 'ABC'):
+        for token in params[field]:
+            position = min(position + 1, 16383)
+            entries = positions.setdefault(token, [])
+            if len(entries) < 256:
+                entries.append(f'{position}{weight}')
+    return ' '.join(f"'{token}':{','.join(entries)}" for token, entries in positions.items())
+
+
+def get_search_engine(app=None):
+    """按配置 ACTIVITY_SEARCH_BACKEND（默认 auto=按数据库方言）返回检索实现。"""
+    app = app or current_app
+    engine = app.extensions.get('activity_search')
+    if engine is None:
+        backend = app.config.get('ACTIVITY_SEARCH_BACKEND', 'auto')
+        if backend == 'auto':
+            backend = db.engine.dialect.name
+        engine = _ENGINE_CLASSES.get(backend, LikeSearchEngine)()
+        app.extensions['activity_search'] = engine
+    return engine
+
+
+def _active_engine():
+    engine = get_search_engine()
+    return engine if engine.ready else _ENGINE_CLASSES['like']()
+
+
+def _select_rows(conn, activity_ids=None, after_id=None, limit=None):
+    stmt = select(Activity.id, Activity.title, Activity.location, Activity.description).order_by(Activity.id.asc())
+    if activity_ids is not None:
+        stmt = stmt.filter(Activity.id.in_(activity_ids))
+    if after_id is not None:
+        stmt = stmt.filter(Activity.id > after_id)
+    if limit:
+        stmt = stmt.limit(limit)
+    return [tuple(row) for row in conn.execute(stmt).all()]
+
+
+def reindex_activity_search(batch_size=200, conn=None):
+    """全量重建检索索引，返回索引的活动数量。"""
+    engine = get_search_engine()
+    if conn is None:
+        with db.engine.begin() as own_conn:
+            return reindex_activity_search(batch_size, own_conn)
+    engine.ensure_schema(conn)
+    engine.clear(conn)
+    indexed = 0
+    last_id = None
+    while True:
+        rows = _select_rows(conn, after_id=last_id, limit=batch_size)
+        if not rows:
+            break
+        engine.index_rows(conn, rows)
+        indexed += len(rows)
+        last_id = rows[-1][0]
+    engine.ready = True
+    return indexed
+
+
+def mark_activity_search_ready(app):
+    """结构版本已是最新（索引结构由 flask db-upgrade 建好）时，启动阶段直接启用检索实现，不访问数据库。"""
+    get_search_engine(app).ready = True
+
+
+def ensure_activity_search_index(app):
+    """启动时建好索引结构；索引为空而已有活动时（首次部署）全量回填。"""
+    engine = get_search_engine(app)
+    try:
+        with db.engine.begin() as conn:
+            engine.ensure_schema(conn)
+            engine.ready = True
+            if engine.indexed_count(conn) == 0 and conn.execute(select(Activity.id).limit(1)).first():
+                indexed = reindex_activity_search(conn=conn)
+                app.logger.info(f'已回填活动检索索引 {indexed} 条')
+    except Exception as e:
+        engine.ready = False
+        app.logger.warning(f'活动检索索引不可用，搜索将退化为 LIKE 匹配: {e}')
+
+
+def _collect_changes(session):
+    changed, removed = set(), set()
+    for obj in session.new:
+        if isinstance(obj, Activity):
+            changed.add(obj.id)
+    for obj in session.dirty:
+        if isinstance(obj, Activity):
+            state = inspect(obj)
+            if any(state.attrs[field].history.has_changes() for field in INDEXED_FIELDS):
+                changed.add(obj.id)
+    for obj in session.deleted:
+        if isinstance(obj, Activity):
+            removed.add(obj.id)
+    changed.discard(None)
+    return changed - removed, removed
+
+
+def _after_flush(session, flush_context):
+    engine = get_search_engine()
+    if not engine.ready or engine.name == 'like':
+        return
+    changed, removed = _collect_changes(session)
+    if not (changed or removed):
+        return
+    conn = session.connection()
+    if removed:
+        engine.remove(conn, removed)
+    if changed:
+        # 按已刷入的数据重新读取，避免在 flush 钩子中触发属性懒加载
+        engine.index_rows(conn, _select_rows(conn, activity_ids=sorted(changed)))
+
+
+def register_activity_search_listeners():
+    if not event.contains(db.session, 'after_flush', _after_flush):
+        event.listen(db.session, 'after_flush', _after_flush)
+
+
+def activity_search_clause(keyword):
+    """返回可加入活动查询的 WHERE 条件（Activity.id IN 命中集合）；关键词无有效词时返回 None。"""
+    keyword = (keyword or '').strip()
+    terms = query_terms(keyword)
+    if not terms:
+        return None
+    matched = _active_engine().match_subquery(keyword, terms)
+    return Activity.id.in_(select(matched.c.activity_id))
+
+
+def ranked_activity_search(keyword, stmt=None):
+    """返回按相关度排序的活动查询（相关度相同按创建时间倒序）；关键词无有效词时返回 None。"""
+    keyword = (keyword or '').strip()
+    terms = query_terms(keyword)
+    if not terms:
+        return None
+    matched = _active_engine().match_subquery(keyword, terms)
+    stmt = stmt if stmt is not None else db.select(Activity)
+    return stmt.join(matched, Activity.id == matched.c.activity_id).order_by(
+        matched.c.rank.desc(), Activity.created_at.desc(), Activity.id.desc()
+    )
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+活动统计读模型
+
+activity_stats 每个活动一行，保存报名/签到/取消人数、队伍数、评价数与评分合计。
+写入侧通过 Session after_flush 钩子，根据 Registration / ActivityTeam / ActivityReview 的变更
+在同一事务内增量更新计数；读取侧（学生详情页、后台活动详情/报名页）只需按主键读取一行。
+批量 SQL 删除等绕过 ORM 的写入不会触发钩子，由 `flask rebuild-activity-stats` 按聚合查询逐批加锁 upsert 修正。
+"""
+
+import logging
+from collections import defaultdict
+
+from sqlalchemy import bindparam, event, func, case, inspect, text
+from sqlalchemy.orm.attributes import NO_VALUE
+
+from src import db
+from src.models import Activity, ActivityStats, ActivityTeam, ActivityReview, Registration
+
+logger = logging.getLogger(__name__)
+
+STATUS_COLUMNS = {
+    'registered': 'registered_count',
+    'attended': 'attended_count',
+    'cancelled': 'cancelled_count',
+}
+RATING_COLUMNS = ('content_quality', 'organization', 'facility')
+COUNTER_COLUMNS = (
+    'registered_count', 'attended_count', 'cancelled_count', 'team_count',
+    'review_count', 'rating_sum',
+    'content_quality_sum', 'content_quality_count',
+    'organization_sum', 'organization_count',
+    'facility_sum', 'facility_count',
+)
+
+
+def _loaded(obj, key):
+    """读取已加载的属性值，避免在 flush 钩子中触发懒加载。"""
+    return inspect(obj).dict.get(key)
+
+
+def _history_pair(obj, key):
+    """返回 (旧值, 新值, 是否变更, 旧值是否已知)；旧值未加载时调用方应整体重算该活动。"""
+    state = inspect(obj)
+    history = state.attrs[key].history
+    if not history.has_changes():
+        return None, None, False, True
+    old = history.deleted[0] if history.deleted else None
+    new = history.added[0] if history.added else None
+    # 修改前未加载的属性在 committed_state 中记为 NO_VALUE；原值为 None 时 deleted 同样为空，需借此区分
+    return old, new, True, state.committed_state.get(key, None) is not NO_VALUE
+
+
+def _all_loaded(obj, keys):
+    loaded = inspect(obj).dict
+    return all(key in loaded for key in keys)
+
+
+def _review_deltas(obj, sign):
+    deltas = {'review_count': sign, 'rating_sum': sign * int(_loaded(obj, 'rating') or 0)}
+    for col in RATING_COLUMNS:
+        value = _loaded(obj, col)
+        if value is not None:
+            deltas[f'{col}_sum'] = sign * int(value)
+            deltas[f'{col}_count'] = sign
+    return deltas
+
+
+def _collect_deltas(session):
+    deltas = defaultdict(lambda: defaultdict(int))
+    recompute = set()
+    removed = set()
+
+    def add(activity_id, changes):
+        if not activity_id:
+            return
+        for col, value in changes.items():
+            if value:
+                deltas[activity_id][col] += value
+
+    for obj in session.new:
+        if isinstance(obj, Registration):
+            col = STATUS_COLUMNS.get(obj.status or 'registered')
+            if col:
+                add(obj.activity_id, {col: 1})
+        elif isinstance(obj, ActivityTeam):
+            add(obj.activity_id, {'team_count': 1})
+        elif isinstance(obj, ActivityReview):
+            add(obj.activity_id, _review_deltas(obj, 1))
+
+    for obj in session.dirty:
+        if not session.is_modified(obj, include_collections=False):
+            continue
+        if isinstance(obj, Registration):
+            old, new, changed, old_known = _history_pair(obj, 'status')
+            if not changed:
+                continue
+            if not old_known:
+                recompute.add(_loaded(obj, 'activity_id'))
+                continue
+            changes = defaultdict(int)
+            if STATUS_COLUMNS.get(old):
+                changes[STATUS_COLUMNS[old]] -= 1
+            if STATUS_COLUMNS.get(new):
+                changes[STATUS_COLUMNS[new]] += 1
+            add(_loaded(obj, 'activity_id'), changes)
+        elif isinstance(obj, ActivityReview):
+            changed_any = False
+            old_unknown = False
+            changes = defaultdict(int)
+            for key in ('rating',) + RATING_COLUMNS:
+                old, new, changed, old_known = _history_pair(obj, key)
+                if not changed:
+                    continue
+                changed_any = True
+                if not old_known:
+                    old_unknown = True
+                    break
+                if key == 'rating':
+                    changes['rating_sum'] += int(new or 0) - int(old or 0)
+                    continue
+                if old is not None:
+                    changes[f'{key}_sum'] -= int(old)
+                    changes[f'{key}_count'] -= 1
+                if new is not None:
+                    changes[f'{key}_sum'] += int(new)
+                    changes[f'{key}_count'] += 1
+            if old_unknown:
+                recompute.add(_loaded(obj, 'activity_id'))
+            elif changed_any:
+                add(_loaded(obj, 'activity_id'), changes)
+
+    for obj in session.deleted:
+        if isinstance(obj, Registration):
+            if not _all_loaded(obj, ('status',)):
+                recompute.add(_loaded(obj, 'activity_id'))
+                continue
+            col = STATUS_COLUMNS.get(_loaded(obj, 'status'))
+            if col:
+                add(_loaded(obj, 'activity_id'), {col: -1})
+        elif isinstance(obj, ActivityTeam):
+            add(_loaded(obj, 'activity_id'), {'team_count': -1})
+        elif isinstance(obj, ActivityReview):
+            # 评分未加载（如提交后已过期）时无法得知要扣减的值，删除后按最新数据重算
+            if not _all_loaded(obj, ('rating',) + RATING_COLUMNS):
+                recompute.add(_loaded(obj, 'activity_id'))
+                continue
+            add(_loaded(obj, 'activity_id'), _review_deltas(obj, -1))
+        elif isinstance(obj, Activity):
+            removed.add(_loaded(obj, 'id'))
+
+    recompute.discard(None)
+    for activity_id in recompute | removed:
+        deltas.pop(activity_id, None)
+    return deltas, recompute, removed
+
+
+def _compute_rows(activity_ids=None):
+    """分组聚合计算统计行；activity_ids 为空时计算全部活动。"""
+    reg_stmt = db.select(
+        Registration.activity_id,
+        func.sum(case((Registration.status == 'registered', 1), else_=0)),
+        func.sum(case((Registration.status == 'attended', 1), else_=0)),
+        func.sum(case((Registration.status == 'cancelled', 1), else_=0)),
+    ).group_by(Registration.activity_id)
+    team_stmt = db.select(ActivityTeam.activity_id, func.count()).group_by(ActivityTeam.activity_id)
+    review_stmt = db.select(
+        ActivityReview.activity_id,
+        func.count(),
+        func.coalesce(func.sum(ActivityReview.rating), 0),
+        func.coalesce(func.sum(ActivityReview.content_quality), 0),
+        func.count(ActivityReview.content_quality),
+        func.coalesce(func.sum(ActivityReview.organization), 0),
+        func.count(ActivityReview.organization),
+        func.coalesce(func.sum(ActivityReview.facility), 0),
+        func.count(ActivityReview.facility),
+    ).group_by(ActivityReview.activity_id)
+    activity_stmt = db.select(Activity.id)
+    if activity_ids:
+        ids = list(activity_ids)
+        reg_stmt = reg_stmt.filter(Registration.activity_id.in_(ids))
+        team_stmt = team_stmt.filter(ActivityTeam.activity_id.in_(ids))
+        review_stmt = review_stmt.filter(ActivityReview.activity_id.in_(ids))
+        activity_stmt = activity_stmt.filter(Activity.id.in_(ids))
+
+    rows = {aid: dict.fromkeys(COUNTER_COLUMNS, 0) for aid in db.session.execute(activity_stmt).scalars().all()}
+    for aid, registered, attended, cancelled in db.session.execute(reg_stmt).all():
+        if aid in rows:
+            rows[aid].update(registered_count=int(registered or 0), attended_count=int(attended or 0), cancelled_count=int(cancelled or 0))
+    for aid, team_count in db.session.execute(team_stmt).all():
+        if aid in rows:
+            rows[aid]['team_count'] = int(team_count or 0)
+    for aid, cnt, rating_sum, cq_sum, cq_cnt, org_sum, org_cnt, fac_sum, fac_cnt in db.session.execute(review_stmt).all():
+        if aid in rows:
+            rows[aid].update(
+                review_count=int(cnt or 0), rating_sum=int(rating_sum or 0),
+                content_quality_sum=int(cq_sum or 0), content_quality_count=int(cq_cnt or 0),
+                organization_sum=int(org_sum or 0), organization_count=int(org_cnt or 0),
+                facility_sum=int(fac_sum or 0), facility_count=int(fac_cnt or 0),
+            )
+    return rows
+
+
+def _upsert_sql(dialect):
+    columns = ', '.join(COUNTER_COLUMNS)
+    values = ', '.join(f':{c}' for c in COUNTER_COLUMNS)
+    if dialect == 'postgresql':
+        updates = ', '.join(f'{c} = EXCLUDED.{c}' for c in COUNTER_COLUMNS)
+        return text(f"""
+            INSERT INTO activity_stats (activity_id, {columns}, updated_at)
+            VALUES (:activity_id, {values}, CURRENT_TIMESTAMP)
+            ON CONFLICT (activity_id) DO UPDATE SET {updates}, updated_at = CURRENT_TIMESTAMP
+        """)
+    return text(f"""
+        INSERT OR REPLACE INTO activity_stats (activity_id, {columns}, updated_at)
+        VALUES (:activity_id, {values}, CURRENT_TIMESTAMP)
+    """)
+
+
+def _aggregate_upsert_sql(dialect):
+    """按聚合查询一次写入 :ids 中各活动的统计行（存在则覆盖）。"""
+    columns = ', '.join(COUNTER_COLUMNS)
+    # r: 报名状态计数，t: 队伍数，v: 评价计数与评分合计
+    aliases = dict.fromkeys(STATUS_COLUMNS.values(), 'r')
+    aliases['team_count'] = 't'
+    select_columns = ', '.join(f"COALESCE({aliases.get(c, 'v')}.{c}, 0)" for c in COUNTER_COLUMNS)
+    rating_aggregates = ',\n                   '.join(
+        f"COALESCE(SUM({col}), 0) AS {col}_sum, COUNT({col}) AS {col}_count" for col in RATING_COLUMNS
+    )
+    select_sql = f"""
+        SELECT a.id, {select_columns}, CURRENT_TIMESTAMP
+        FROM activities a
+        LEFT JOIN (
+            SELECT activity_id,
+                   SUM(CASE WHEN status = 'registered' THEN 1 ELSE 0 END) AS registered_count,
+                   SUM(CASE WHEN status = 'attended' THEN 1 ELSE 0 END) AS attended_count,
+                   SUM(CASE WHEN status = 'cancelled' THEN 1 ELSE 0 END) AS cancelled_count
+            FROM registrations WHERE activity_id IN :ids GROUP BY activity_id
+        ) r ON r.activity_id = a.id
+        LEFT JOIN (
+            SELECT activity_id, COUNT(*) AS team_count
+            FROM activity_teams WHERE activity_id IN :ids GROUP BY activity_id
+        ) t ON t.activity_id = a.id
+        LEFT JOIN (
+            SELECT activity_id, COUNT(*) AS review_count, COALESCE(SUM(rating), 0) AS rating_sum,
+                   {rating_aggregates}
+            FROM activity_reviews WHERE activity_id IN :ids GROUP BY activity_id
+        ) v ON v.activity_id = a.id
+        WHERE a.id IN :ids
+    """
+    if dialect == 'postgresql':
+        updates = ', '.join(f'{c} = EXCLUDED.{c}' for c in COUNTER_COLUMNS)
+        sql = f"""
+            INSERT INTO activity_stats (activity_id, {columns}, updated_at)
+            {select_sql}
+            ON CONFLICT (activity_id) DO UPDATE SET {updates}, updated_at = CURRENT_TIMESTAMP
+        """
+    else:
+        sql = f"INSERT OR REPLACE INTO activity_stats (activity_id, {columns}, updated_at) {select_sql}"
+    return text(sql).bindparams(bindparam('ids', expanding=True))
+
+
+def _after_flush(session, flush_context):
+    try:
+        deltas, recompute, removed = _collect_deltas(session)
+    except Exception as e:
+        logger.warning(f"收集活动统计增量失败（将由重建命令修正）: {e}")
+        return
+    if not (deltas or recompute or removed):
+        return
+
+    conn = session.connection()
+    dialect = conn.dialect.name
+    for activity_id in removed:
+        conn.execute(text("DELETE FROM activity_stats WHERE activity_id = :activity_id"), {'activity_id': activity_id})
+
+    missing = set(recompute)
+    for activity_id, changes in deltas.items():
+        changes = {col: value for col, value in changes.items() if value}
+        if not changes:
+            continue
+        assignments = ', '.join(f'{col} = {col} + :{col}' for col in changes)
+        result = conn.execute(
+            text(f"UPDATE activity_stats SET {assignments}, updated_at = CURRENT_TIMESTAMP WHERE activity_id = :activity_id"),
+            dict(changes, activity_id=activity_id)
+        )
+        if (result.rowcount or 0) == 0:
+            missing.add(activity_id)
+
+    if missing:
+        # 统计行尚不存在或旧值未知：在当前事务内按最新数据整体重算该活动
+        conn.execute(_aggregate_upsert_sql(dialect), {'ids': sorted(missing)})
+
+
+def register_activity_stats_listeners():
+    if not event.contains(db.session, 'after_flush', _after_flush):
+        event.listen(db.session, 'after_flush', _after_flush)
+
+
+def get_activity_stats(activity_id):
+    """读取活动统计行；不存在时按当前数据计算并回填。"""
+    stats = db.session.get(ActivityStats, activity_id)
+    if stats is not None:
+        return stats
+
+    rows = _compute_rows([activity_id])
+    values = rows.get(activity_id) or dict.fromkeys(COUNTER_COLUMNS, 0)
+    try:
+        # 独立连接回填，避免提交调用方会话导致已加载对象过期
+        with db.engine.begin() as conn:
+            conn.execute(_upsert_sql(conn.dialect.name), dict(values, activity_id=activity_id))
+    except Exception as e:
+        logger.warning(f"回填活动统计失败: activity_id={activity_id}, error={e}")
+    return ActivityStats(activity_id=activity_id, **values)
+
+
+# 每批锁定并重算的活动数，避免重建时长时间锁住全部统计行
+REBUILD_CHUNK_SIZE = 500
+
+
+def rebuild_activity_stats():
+    """按聚合查询重建全部活动统计，返回写入行数。
+
+    每批先锁定已有统计行，再用一条 INSERT ... SELECT 覆盖写入：并发事务的增量更新要么在加锁前提交、
+    已计入聚合结果，要么等待本批提交后再叠加，不会丢失。
+    """
+    ids = db.session.execute(db.select(Activity.id).order_by(Activity.id)).scalars().all()
+    dialect = db.session.get_bind().dialect.name
+    for start in range(0, len(ids), REBUILD_CHUNK_SIZE):
+        chunk = ids[start:start + REBUILD_CHUNK_SIZE]
+        db.session.execute(
+            db.select(ActivityStats.activity_id)
+            .filter(ActivityStats.activity_id.in_(chunk))
+            .order_by(ActivityStats.activity_id)
+            .with_for_update()
+        ).all()
+        db.session.execute(_aggregate_upsert_sql(dialect), {'ids': chunk})
+        db.session.commit()
+    # 活动已删除但统计行残留（SQLite 默认不执行外键级联）
+    db.session.execute(text("DELETE FROM activity_stats WHERE activity_id NOT IN (SELECT id FROM activities)"))
+    db.session.commit()
+    return len(ids)
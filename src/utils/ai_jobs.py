@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+AI 异步任务队列
+
+后台的 AI 文案、内容解析、海报生成原先每次提交都在 gunicorn 进程里新开一个守护线程，
+状态写在实例目录的 JSON 文件里：进程回收时任务丢失、没有并发上限、多节点部署时轮询可能查不到，
+且每次提交都要遍历整个目录清理过期文件。这里改为数据库任务表 ai_jobs：
+    - 提交：写入一行 queued 记录（job_id 与状态查询接口保持不变）；
+    - 执行：固定大小的工作线程池轮询领取任务。领取时检查该类任务的运行数上限（PostgreSQL 下用 advisory 锁串行化领取，
+      并 FOR UPDATE SKIP LOCKED），成功后写入租约；执行期间由心跳线程定期续租，进程退出后租约过期，任务会被其他工作线程重新领取；
+    - 失败：超时、连接错误、429/5xx 等可重试错误按指数退避重新排队，达到最大次数后写入失败结果；
+    - 清理：按 expires_at 索引删除过期记录，由工作线程池定时执行，不再在每次提交时扫描。
+工作线程池默认随 Web 进程懒启动（AI_JOB_INPROCESS_WORKERS），也可关闭后用 `flask run-ai-workers` 单独运行。
+队列本身与任务内容无关，活动通知群发等其他后台任务也通过 register_job_kind 接入。
+"""
+
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+import zlib
+from datetime import timedelta
+
+import requests
+from flask import current_app
+from sqlalchemy import and_, func, or_, text
+
+from src import db
+from src.models import AIJob
+from src.utils.time_helpers import get_localized_now
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCESS = 'success'
+FAILED = 'failed'
+
+BACKOFF_BASE_SECONDS = 5
+BACKOFF_MAX_SECONDS = 120
+IDLE_POLL_MAX_SECONDS = 15
+CLEANUP_INTERVAL_SECONDS = 60
+
+
+class JobKind(object):
+    def __init__(self, queue, handler, failure_payload, concurrency, ttl_seconds, max_attempts):
+        self.queue = queue
+        self.handler = handler
+        self.failure_payload = failure_payload
+        self.concurrency = concurrency
+        self.ttl_seconds = ttl_seconds
+        self.max_attempts = max_attempts
+
+
+_kinds = {}
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def register_job_kind(queue, handler, failure_payload, concurrency=2, ttl_seconds=20 * 60, max_attempts=2):
+    """注册一类任务。
+
+    handler(job_id, payload) 返回成功时的结果字典；
+    failure_payload(job_id, error) 返回最终失败时的结果字典。
+    """
+    _kinds[queue] = JobKind(queue, handler, failure_payload, concurrency, ttl_seconds, max_attempts)
+
+
+def _timestamp(now):
+    return now.isoformat() + 'Z'
+
+
+def _loads(value, default=None):
+    if not value:
+        return default
+    try:
+        return json.loads(value)
+    except Exception:
+        return default
+
+
+def _concurrency(kind):
+    overrides = current_app.config.get('AI_JOB_CONCURRENCY') or {}
+    return max(1, int(overrides.get(kind.queue, kind.concurrency)))
+
+
+def _lease_seconds():
+    return int(current_app.config.get('AI_JOB_LEASE_SECONDS', 120))
+
+
+def is_retryable_error(error):
+    """超时、连接失败、限流与服务端错误可重试；参数错误等直接失败。"""
+    if isinstance(error, (requests.exceptions.Timeout, requests.exceptions.ConnectionError)):
+        return True
+    if isinstance(error, requests.exceptions.HTTPError):
+        status = getattr(getattr(error, 'response', None), 'status_code', None)
+        return status == 429 or (status is not None and status >= 500)
+    return False
+
+
+def enqueue_job(queue, job_id, payload, owner_id=None, initial_result=None):
+    """写入一条排队任务并唤醒本进程的工作线程，返回 job_id。"""
+    kind = _kinds[queue]
+    now = get_localized_now()
+    db.session.add(AIJob(
+        id=job_id,
+        queue=queue,
+        owner_id=owner_id,
+        status=QUEUED,
+        payload=json.dumps(payload or {}, ensure_ascii=False),
+        result=json.dumps(initial_result or {}, ensure_ascii=False),
+        attempts=0,
+        max_attempts=kind.max_attempts,
+        available_at=now,
+        created_at=now,
+        updated_at=now,
+        expires_at=now + timedelta(seconds=kind.ttl_seconds)
+    ))
+    db.session.commit()
+    pool = ensure_ai_job_workers(current_app._get_current_object())
+    if pool:
+        pool.wake()
+    return job_id
+
+
+def get_job_result(job_id, owner_id=None):
+    """返回任务当前的结果字典；不存在、已过期或（指定 owner_id 时）不属于该用户时返回 None。"""
+    stmt = db.select(AIJob.result).filter(AIJob.id == str(job_id or ''), AIJob.expires_at > get_localized_now())
+    if owner_id is not None:
+        stmt = stmt.filter(AIJob.owner_id == owner_id)
+    result = db.session.execute(stmt).scalar_one_or_none()
+    payload = _loads(result)
+    if payload and not payload.get('done'):
+        # 轮询未完成任务时确保本进程工作线程在运行，接管被回收进程遗留的任务
+        ensure_ai_job_workers(current_app._get_current_object())
+    return payload
+
+
+def _claimable(queue, now):
+    return and_(
+        AIJob.queue == queue,
+        AIJob.attempts < AIJob.max_attempts,
+        or_(
+            and_(AIJob.status == QUEUED, AIJob.available_at <= now),
+            and_(AIJob.status == RUNNING, AIJob.lease_expires_at <= now)
+        )
+    )
+
+
+def claim_next_job(worker_id):
+    """按注册顺序逐类尝试领取一个任务，返回 job_id；各类任务均已满载或无任务时返回 None。"""
+    for queue, kind in list(_kinds.items()):
+        now = get_localized_now()
+        with db.engine.begin() as conn:
+            is_postgres = conn.dialect.name == 'postgresql'
+            if is_postgres:
+                # 同类任务的“计数 + 领取”串行化，保证跨进程的并发上限
+                conn.execute(text('SELECT pg_advisory_xact_lock(:key)'), {'key': zlib.crc32(f'ai_jobs:{queue}'.encode())})
+            running = conn.execute(
+                db.select(func.count(AIJob.id)).filter(
+                    AIJob.queue == queue,
+                    AIJob.status == RUNNING,
+                    AIJob.lease_expires_at > now
+                )
+            ).scalar() or 0
+            if running >= _concurrency(kind):
+                continue
+            stmt = db.select(AIJob.id).filter(_claimable(queue, now)).order_by(AIJob.available_at).limit(1)
+            if is_postgres:
+                stmt = stmt.with_for_update(skip_locked=True)
+            job_id = conn.execute(stmt).scalar()
+            if not job_id:
+                continue
+            claimed = conn.execute(
+                db.update(AIJob).where(AIJob.id == job_id, _claimable(queue, now)).values(
+                    status=RUNNING,
+                    lease_owner=worker_id,
+                    lease_expires_at=now + timedelta(seconds=_lease_seconds()),
+                    attempts=AIJob.attempts + 1,
+                    updated_at=now
+                )
+            ).rowcount
+            if claimed:
+                return job_id
+    return None
+
+
+def _store(job_id, worker_id, result, **values):
+    """仍持有租约时写回任务状态；租约已被他人接管则放弃写入。"""
+    now = get_localized_now()
+    with db.engine.begin() as conn:
+        return conn.execute(
+            db.update(AIJob).where(AIJob.id == job_id, AIJob.lease_owner == worker_id).values(
+                result=json.dumps(result, ensure_ascii=False),
+                updated_at=now,
+                **values
+            )
+        ).rowcount
+
+
+def run_job(job_id, worker_id):
+    """执行已领取的任务（需在应用上下文中调用）。"""
+    job = db.session.get(AIJob, job_id)
+    kind = _kinds.get(job.queue) if job else None
+    if not job or not kind:
+        return
+    payload = _loads(job.payload, {})
+    attempts, max_attempts = job.attempts, job.max_attempts
+    running_result = dict(_loads(job.result, {}) or {})
+    running_result.update({
+        'job_id': job_id,
+        'status': RUNNING,
+        'success': True,
+        'done': False,
+        'updated_at': _timestamp(get_localized_now())
+    })
+    db.session.remove()
+    _store(job_id, worker_id, running_result)
+
+    try:
+        result = kind.handler(job_id, payload)
+    except Exception as e:
+        db.session.rollback()
+        now = get_localized_now()
+        if attempts < max_attempts and is_retryable_error(e):
+            delay = min(BACKOFF_BASE_SECONDS * (2 ** (attempts - 1)), BACKOFF_MAX_SECONDS)
+            logger.warning(f"AI任务暂时失败，{delay}秒后重试 job_id={job_id}, attempt={attempts}: {e}")
+            running_result.update({
+                'status': QUEUED,
+                'message': f'任务暂时失败，{delay}秒后自动重试',
+                'updated_at': _timestamp(now)
+            })
+            _store(job_id, worker_id, running_result, status=QUEUED, lease_owner=None, lease_expires_at=None,
+                   available_at=now + timedelta(seconds=delay))
+        else:
+            logger.error(f"AI任务失败 job_id={job_id}, queue={kind.queue}: {e}")
+            _store(job_id, worker_id, kind.failure_payload(job_id, e), status=FAILED, lease_expires_at=None,
+                   expires_at=now + timedelta(seconds=kind.ttl_seconds))
+        return
+
+    now = get_localized_now()
+    _store(job_id, worker_id, result, status=SUCCESS, lease_expires_at=None,
+           expires_at=now + timedelta(seconds=kind.ttl_seconds))
+
+
+def renew_leases(worker_id):
+    """心跳：为本工作线程池持有的运行中任务续租。"""
+    now = get_localized_now()
+    with db.engine.begin() as conn:
+        return conn.execute(
+            db.update(AIJob).where(AIJob.lease_owner == worker_id, AIJob.status == RUNNING).values(
+                lease_expires_at=now + timedelta(seconds=_lease_seconds())
+            )
+        ).rowcount
+
+
+def cleanup_ai_jobs():
+    """把租约过期且已无重试次数的任务标记失败，并删除过期记录。返回删除数。"""
+    now = get_localized_now()
+    with db.engine.begin() as conn:
+        abandoned = conn.execute(
+            db.select(AIJob.id, AIJob.queue).filter(
+                AIJob.status == RUNNING,
+                AIJob.lease_expires_at <= now,
+                AIJob.attempts >= AIJob.max_attempts
+            )
+        ).all()
+    # 失败回调可能自行写库，放在单独的事务之外执行
+    for job_id, queue in abandoned:
+        kind = _kinds.get(queue)
+        result = kind.failure_payload(job_id, RuntimeError('任务执行中断')) if kind else {
+            'job_id': job_id, 'status': FAILED, 'success': False, 'done': True, 'message': '任务执行中断'
+        }
+        with db.engine.begin() as conn:
+            conn.execute(
+                db.update(AIJob).where(
+                    AIJob.id == job_id, AIJob.status == RUNNING, AIJob.lease_expires_at <= now
+                ).values(
+                    status=FAILED,
+                    result=json.dumps(result, ensure_ascii=False),
+                    lease_expires_at=None,
+                    updated_at=now
+                )
+            )
+    with db.engine.begin() as conn:
+        return conn.execute(db.delete(AIJob).where(AIJob.expires_at <= now)).rowcount
+
+
+class AIJobWorkerPool(object):
+    """固定大小的工作线程池 + 一个心跳/清理线程。"""
+
+    def __init__(self, app, size):
+        self.app = app
+        self.size = max(1, int(size))
+        self.pid = os.getpid()
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for index in range(self.size):
+            self._spawn(self._work_loop, f'ai-job-worker-{index}')
+        self._spawn(self._maintenance_loop, 'ai-job-heartbeat')
+        logger.info(f"AI任务工作线程池已启动: {self.worker_id}, 线程数 {self.size}")
+        return self
+
+    def _spawn(self, target, name):
+        thread = threading.Thread(target=target, name=name, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _work_loop(self):
+        poll_seconds = self.app.config.get('AI_JOB_POLL_SECONDS', 3)
+        idle_seconds = poll_seconds
+        while not self._stop.is_set():
+            try:
+                with self.app.app_context():
+                    job_id = claim_next_job(self.worker_id)
+                    if job_id:
+                        run_job(job_id, self.worker_id)
+                        idle_seconds = poll_seconds
+                        continue
+            except Exception as e:
+                logger.warning(f"AI任务工作线程异常: {e}")
+            # 空闲时逐步放慢轮询；本进程提交新任务会立即唤醒
+            if self._wake.wait(idle_seconds):
+                self._wake.clear()
+                idle_seconds = poll_seconds
+            else:
+                idle_seconds = min(idle_seconds * 2, IDLE_POLL_MAX_SECONDS)
+
+    def _maintenance_loop(self):
+        last_cleanup = 0
+        while not self._stop.is_set():
+            try:
+                with self.app.app_context():
+                    renew_leases(self.worker_id)
+                    if time.time() - last_cleanup >= CLEANUP_INTERVAL_SECONDS:
+                        removed = cleanup_ai_jobs()
+                        last_cleanup = time.time()
+                        if removed:
+                            logger.info(f"已清理过期AI任务 {removed} 条")
+                    interval = max(1, _lease_seconds() // 3)
+            except Exception as e:
+                logger.warning(f"AI任务心跳/清理失败: {e}")
+                interval = 10
+            self._stop.wait(interval)
+
+
+def ensure_ai_job_workers(app):
+    """Web 进程内懒启动工作线程池（AI_JOB_INPROCESS_WORKERS 关闭时返回 None）。"""
+    global _pool
+    if not app.config.get('AI_JOB_INPROCESS_WORKERS', True):
+        return None
+    # 按进程号判断，fork 出的子进程不会沿用父进程中已不存在的线程
+    if _pool is None or _pool.pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool.pid != os.getpid():
+                _pool = AIJobWorkerPool(app, app.config.get('AI_JOB_WORKERS', 2)).start()
+    return _pool
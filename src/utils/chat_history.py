@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+AI 聊天历史：分页、保留上限与滚动摘要
+
+ai_chat_history 原先只增不减：AIUserPreferences.max_history_count 只存不用，打开聊天窗口时
+/utils/ai_chat/history 一次 .all() 读出整个会话，发给模型的历史又是按时间正序取的“最早 20 条”。这里改为：
+    - 历史接口按会话与用户过滤（索引 idx_ai_chat_history_session_user_ts）后倒序做键集分页，每页返回时再按时间正序排列；
+    - 每次保存对话后按 max_history_count 保留会话最新的若干条，超出部分用一条 DELETE 批量删除；
+    - 定时任务（flask compact-ai-chat-history）把未摘要的消息中、除最近 AI_CHAT_PROMPT_MESSAGES 条之外的旧消息
+      连同已有摘要交给模型压缩成新的摘要，存到 AIChatSession.summary；
+    - 发给模型的上下文为“摘要 + 摘要之后最近 AI_CHAT_PROMPT_MESSAGES 条消息”，不再携带原始的全部历史。
+折叠阈值（AI_CHAT_PROMPT_MESSAGES + AI_CHAT_COMPACT_BATCH）默认小于保留上限，旧消息通常在被删除前已进入摘要；
+用户把保留上限设得更小时以保留上限为准。
+"""
+
+import logging
+import os
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import and_, func, or_
+
+from src import db
+from src.models import AIChatHistory, AIChatSession, AIUserPreferences
+from src.utils.llm_client import get_llm_client
+from src.utils.pagination import coalesce_datetime, keyset_paginate
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_HISTORY = 50
+# 单条消息写入摘要提示词时的最大字数
+SUMMARY_SOURCE_CHARS = 800
+
+SUMMARY_SYSTEM_PROMPT = (
+    '你负责压缩“团小智”与用户的对话记录。请把已有摘要与新增对话合并成一份新的摘要，'
+    '保留用户的身份与偏好、提到的活动/标签/时间、已给出的结论和尚未解决的问题，删去寒暄与重复内容。'
+    '使用第三人称、简体中文，直接输出摘要正文，不要加标题或解释。'
+)
+
+
+def _history_filter(session_id, user_id):
+    return and_(AIChatHistory.session_id == session_id, AIChatHistory.user_id == user_id)
+
+
+def _newest_first():
+    return (coalesce_datetime(AIChatHistory.timestamp).desc(), AIChatHistory.id.desc())
+
+
+def history_page(session_id, user_id, per_page=None, cursor=None):
+    """倒序键集分页读取会话历史，返回 KeysetPagination；next_cursor 指向更早的一页。"""
+    per_page = min(max(int(per_page or current_app.config.get('AI_CHAT_HISTORY_PAGE_SIZE', 50)), 1), 200)
+    query = db.select(AIChatHistory).filter(_history_filter(session_id, user_id))
+    # 游标只比较 id：id 与写入顺序一致，且 SQLite 下 func.now() 写入的秒级时间串与绑定参数格式不同，不宜做大小比较
+    return keyset_paginate(
+        query,
+        [(AIChatHistory.id, True)],
+        per_page=per_page,
+        cursor=cursor,
+        with_total=False
+    )
+
+
+def recent_messages(session_id, user_id, limit, after_id=None):
+    """会话最近的 limit 条消息（按时间正序），after_id 之前（已折叠进摘要）的不再返回。"""
+    if limit <= 0:
+        return []
+    stmt = db.select(AIChatHistory).filter(_history_filter(session_id, user_id))
+    if after_id:
+        stmt = stmt.filter(AIChatHistory.id > after_id)
+    rows = db.session.execute(stmt.order_by(*_newest_first()).limit(limit)).scalars().all()
+    return list(reversed(rows))
+
+
+def prompt_history(session, user_id):
+    """发给模型的历史消息：较早对话的摘要（如有）+ 摘要之后最近的若干条消息。"""
+    if session is None or session.user_id != user_id:
+        return []
+    messages = []
+    if session.summary:
+        messages.append({
+            'role': 'system',
+            'content': f'以下是本次会话较早对话的摘要，可作为回答的背景：\n{session.summary}'
+        })
+    limit = int(current_app.config.get('AI_CHAT_PROMPT_MESSAGES', 12))
+    for row in recent_messages(session.id, user_id, limit, after_id=session.summary_until_id):
+        messages.append({'role': row.role, 'content': row.content})
+    return messages
+
+
+def max_history_count(user_id):
+    preferences = db.session.get(AIUserPreferences, user_id)
+    limit = preferences.max_history_count if preferences and preferences.max_history_count else DEFAULT_MAX_HISTORY
+    # 至少保留最近一轮问答
+    return max(int(limit), 2)
+
+
+def enforce_history_limit(session_id, user_id, limit=None):
+    """只保留会话最新的 limit 条消息，返回删除条数（调用方负责提交）。"""
+    limit = max_history_count(user_id) if limit is None else limit
+    # 按索引倒序跳过最新的 limit 条，其余一条 DELETE 删除
+    stale_ids = (
+        db.select(AIChatHistory.id)
+        .filter(_history_filter(session_id, user_id))
+        .order_by(*_newest_first())
+        .offset(limit)
+        .scalar_subquery()
+    )
+    result = db.session.execute(
+        db.delete(AIChatHistory)
+        .where(AIChatHistory.id.in_(stale_ids))
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount or 0
+
+
+def clear_session_history(session_id, user_id):
+    """删除会话的全部消息并清空摘要，返回删除条数（调用方负责提交）。"""
+    result = db.session.execute(db.delete(AIChatHistory).filter_by(session_id=session_id, user_id=user_id))
+    db.session.execute(
+        db.update(AIChatSession)
+        .filter_by(id=session_id, user_id=user_id)
+        .values(summary=None, summary_until_id=None, summarized_at=None)
+    )
+    return result.rowcount or 0
+
+
+def _summarize(previous_summary, rows):
+    config = current_app.config
+    api_key = os.environ.get('ARK_API_KEY') or config.get('VOLCANO_API_KEY')
+    if not api_key:
+        raise ValueError('未配置ARK_API_KEY，无法压缩聊天历史')
+
+    transcript = []
+    for row in rows:
+        speaker = '用户' if row.role == 'user' else '团小智'
+        content = (row.content or '').strip()
+        if len(content) > SUMMARY_SOURCE_CHARS:
+            content = content[:SUMMARY_SOURCE_CHARS] + '…'
+        transcript.append(f'{speaker}：{content}')
+    user_prompt = f"已有摘要：\n{previous_summary or '（无）'}\n\n新增对话：\n" + '\n'.join(transcript)
+
+    max_chars = int(config.get('AI_CHAT_SUMMARY_MAX_CHARS', 1500))
+    payload = {
+        'model': config.get('AI_TEXT_MODEL', config.get('VOLCANO_MODEL', 'ep-20260320185026-9cc4w')),
+        'messages': [
+            {'role': 'system', 'content': SUMMARY_SYSTEM_PROMPT + f'摘要不超过{max_chars}字。'},
+            {'role': 'user', 'content': user_prompt}
+        ],
+        'temperature': 0.3,
+        'max_tokens': max_chars
+    }
+    headers = {'Content-Type': 'application/json', 'Authorization': f'Bearer {api_key}'}
+    response = get_llm_client().post(config.get('VOLCANO_API_URL'), json=payload, headers=headers, timeout=(8, 60))
+    response.raise_for_status()
+    summary = (response.json()['choices'][0]['message']['content'] or '').strip()
+    return summary[:max_chars]
+
+
+def compact_session(session_id):
+    """把会话中较早的未摘要消息折叠进摘要，返回是否更新了摘要。"""
+    config = current_app.config
+    keep = int(config.get('AI_CHAT_PROMPT_MESSAGES', 12))
+    batch = int(config.get('AI_CHAT_COMPACT_BATCH', 20))
+
+    session = db.session.get(AIChatSession, session_id)
+    if session is None:
+        return False
+    previous_until = session.summary_until_id or 0
+    rows = db.session.execute(
+        db.select(AIChatHistory)
+        .filter(_history_filter(session.id, session.user_id), AIChatHistory.id > previous_until)
+        .order_by(coalesce_datetime(AIChatHistory.timestamp), AIChatHistory.id)
+    ).scalars().all()
+    if len(rows) < keep + batch:
+        return False
+
+    folded = rows[:len(rows) - keep]
+    summary = _summarize(session.summary, folded)
+    if not summary:
+        return False
+
+    # 以原摘要位置为条件更新，并发执行时只有一个进程的结果生效
+    result = db.session.execute(
+        db.update(AIChatSession)
+        .where(AIChatSession.id == session.id)
+        .where(func.coalesce(AIChatSession.summary_until_id, 0) == previous_until)
+        .values(summary=summary, summary_until_id=max(row.id for row in folded), summarized_at=datetime.now())
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return bool(result.rowcount)
+
+
+def sessions_needing_compaction(limit=200):
+    """有新消息且未摘要消息数达到折叠阈值的会话ID。"""
+    config = current_app.config
+    threshold = int(config.get('AI_CHAT_PROMPT_MESSAGES', 12)) + int(config.get('AI_CHAT_COMPACT_BATCH', 20))
+    stmt = (
+        db.select(AIChatHistory.session_id)
+        .join(AIChatSession, AIChatSession.id == AIChatHistory.session_id)
+        .filter(
+            AIChatHistory.user_id == AIChatSession.user_id,
+            AIChatHistory.id > func.coalesce(AIChatSession.summary_until_id, 0),
+            or_(AIChatSession.summarized_at.is_(None), AIChatSession.updated_at > AIChatSession.summarized_at)
+        )
+        .group_by(AIChatHistory.session_id)
+        .having(func.count(AIChatHistory.id) >= threshold)
+        .limit(limit)
+    )
+    return db.session.execute(stmt).scalars().all()
+
+
+def compact_chat_histories(limit=200):
+    """定时任务入口：压缩需要折叠的会话并执行保留上限，返回 (更新摘要的会话数, 删除的消息数)。"""
+    compacted = 0
+    for session_id in sessions_needing_compaction(limit):
+        try:
+            if compact_session(session_id):
+                compacted += 1
+        except Exception as e:
+            db.session.rollback()
+            logger.warning(f"压缩AI聊天会话 {session_id} 失败: {e}")
+
+    # 补齐保存对话时未能执行（或用户调小上限后）的保留上限
+    removed = 0
+    user_limit = func.coalesce(func.max(AIUserPreferences.max_history_count), DEFAULT_MAX_HISTORY)
+    over_limit = db.session.execute(
+        db.select(AIChatHistory.session_id, AIChatHistory.user_id)
+        .outerjoin(AIUserPreferences, AIUserPreferences.user_id == AIChatHistory.user_id)
+        .group_by(AIChatHistory.session_id, AIChatHistory.user_id)
+        .having(func.count(AIChatHistory.id) > user_limit)
+    ).all()
+    for session_id, user_id in over_limit:
+        removed += enforce_history_limit(session_id, user_id)
+    db.session.commit()
+    return compacted, removed
@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+每日统计汇总
+
+后台统计页原先每次打开都按月/按天对 activities、registrations、users 做多次 COUNT 扫描。
+这里由定时任务（`flask rollup-daily-metrics`，每10分钟）把最近两天的计数汇总进 daily_metrics，
+键为 (metric, society_id, metric_date)，society_id=0 为全站；历史数据用 `flask backfill-daily-metrics` 一次性补齐。
+图表接口只需按日期范围对该表做一次索引查询。
+
+日期按库中时间戳取 date（与原统计口径一致），汇总为“删除区间后整体写入”，可重复执行。
+"""
+
+import logging
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import func
+
+from src import db
+from src.models import Activity, DailyMetric, Registration, StudentInfo, User, student_societies
+from src.utils.time_helpers import get_localized_now
+
+logger = logging.getLogger(__name__)
+
+SITE_WIDE = 0
+METRICS = ('activities_created', 'registrations', 'students_joined', 'users_joined')
+ROLLUP_RECENT_DAYS = 2
+BACKFILL_CHUNK_DAYS = 31
+
+
+def _as_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(str(value)[:10], '%Y-%m-%d').date()
+
+
+def _range_bounds(start_date, end_date):
+    return datetime.combine(start_date, datetime.min.time()), datetime.combine(end_date + timedelta(days=1), datetime.min.time())
+
+
+def _grouped_counts(date_column, society_column, count_column, lower, upper, joins=()):
+    stmt = db.select(func.date(date_column), society_column, func.count(count_column))
+    for target, onclause in joins:
+        stmt = stmt.join(target, onclause)
+    stmt = stmt.filter(date_column >= lower, date_column < upper).group_by(func.date(date_column), society_column)
+    return db.session.execute(stmt).all()
+
+
+def compute_daily_metrics(start_date, end_date):
+    """计算 [start_date, end_date] 内每天的各项计数，返回 {(metric, society_id, date): value}。"""
+    lower, upper = _range_bounds(start_date, end_date)
+    values = defaultdict(int)
+
+    def add(metric, rows):
+        for day, society_id, count in rows:
+            day = _as_date(day)
+            values[(metric, SITE_WIDE, day)] += count
+            if society_id:
+                values[(metric, society_id, day)] += count
+
+    add('activities_created', _grouped_counts(Activity.created_at, Activity.society_id, Activity.id, lower, upper))
+    add('registrations', _grouped_counts(
+        Registration.register_time, Activity.society_id, Registration.id, lower, upper,
+        joins=[(Activity, Registration.activity_id == Activity.id)]
+    ))
+
+    # 学生可同时属于主社团与多个已加入社团：逐个 (学生, 社团) 去重后计数
+    student_rows = db.session.execute(
+        db.select(func.date(User.created_at), User.id, StudentInfo.id, StudentInfo.society_id)
+        .join(StudentInfo, StudentInfo.user_id == User.id)
+        .filter(User.created_at >= lower, User.created_at < upper)
+    ).all()
+    if student_rows:
+        joined = defaultdict(set)
+        for student_id, society_id in db.session.execute(
+            db.select(student_societies.c.student_id, student_societies.c.society_id)
+            .filter(student_societies.c.student_id.in_([row[2] for row in student_rows]))
+        ).all():
+            joined[student_id].add(society_id)
+        for day, _, student_id, society_id in student_rows:
+            day = _as_date(day)
+            values[('students_joined', SITE_WIDE, day)] += 1
+            for sid in ({society_id} if society_id else set()) | joined[student_id]:
+                values[('students_joined', sid, day)] += 1
+
+    for day, count in db.session.execute(
+        db.select(func.date(User.created_at), func.count(User.id))
+        .filter(User.created_at >= lower, User.created_at < upper)
+        .group_by(func.date(User.created_at))
+    ).all():
+        values[('users_joined', SITE_WIDE, _as_date(day))] += count
+
+    return values
+
+
+def rollup_daily_metrics(start_date, end_date, commit=True):
+    """重算并写入 [start_date, end_date] 的汇总行，返回写入行数。"""
+    values = compute_daily_metrics(start_date, end_date)
+    db.session.execute(
+        db.delete(DailyMetric).where(DailyMetric.metric_date >= start_date, DailyMetric.metric_date <= end_date)
+    )
+    rows = [
+        {'metric': metric, 'society_id': society_id, 'metric_date': day, 'value': value}
+        for (metric, society_id, day), value in values.items() if value
+    ]
+    if rows:
+        db.session.execute(db.insert(DailyMetric), rows)
+    if commit:
+        db.session.commit()
+    return len(rows)
+
+
+def rollup_recent_daily_metrics(days=ROLLUP_RECENT_DAYS):
+    """定时任务入口：重算最近几天（含今天）的汇总，兼顾跨零点的迟到写入。"""
+    today = get_localized_now().date()
+    return rollup_daily_metrics(today - timedelta(days=days - 1), today)
+
+
+def backfill_daily_metrics(start_date=None, end_date=None):
+    """按月分段补齐历史汇总；未指定起点时从最早的活动/报名/用户记录开始。"""
+    end_date = end_date or get_localized_now().date()
+    if start_date is None:
+        earliest = [
+            db.session.execute(db.select(func.min(column))).scalar()
+            for column in (Activity.created_at, Registration.register_time, User.created_at)
+        ]
+        earliest = [_as_date(value) for value in earliest if value]
+        if not earliest:
+            return 0
+        start_date = min(earliest)
+
+    written = 0
+    chunk_start = start_date
+    while chunk_start <= end_date:
+        chunk_end = min(chunk_start + timedelta(days=BACKFILL_CHUNK_DAYS - 1), end_date)
+        written += rollup_daily_metrics(chunk_start, chunk_end)
+        logger.info(f"已汇总每日统计 {chunk_start} ~ {chunk_end}")
+        chunk_start = chunk_end + timedelta(days=1)
+    return written
+
+
+def read_daily_series(metrics, start_date, end_date, society_id=None):
+    """读取日期范围内的逐日序列：返回 (日期列表, {metric: [每日值]})，缺失日期补0。"""
+    society_id = society_id or SITE_WIDE
+    days = [start_date + timedelta(days=offset) for offset in range((end_date - start_date).days + 1)]
+    series = {metric: dict.fromkeys(days, 0) for metric in metrics}
+    for metric, day, value in db.session.execute(
+        db.select(DailyMetric.metric, DailyMetric.metric_date, DailyMetric.value).filter(
+            DailyMetric.metric.in_(list(metrics)),
+            DailyMetric.society_id == society_id,
+            DailyMetric.metric_date >= start_date,
+            DailyMetric.metric_date <= end_date
+        )
+    ).all():
+        series[metric][_as_date(day)] = value
+    return days, {metric: [by_day[day] for day in days] for metric, by_day in series.items()}
+
+
+def read_monthly_series(metrics, months, society_id=None, today=None):
+    """读取最近 months 个自然月（含本月）的月度合计：返回 (['YYYY-MM', ...], {metric: [每月值]})。"""
+    today = today or get_localized_now().date()
+    first = today.replace(day=1)
+    for _ in range(months - 1):
+        first = (first - timedelta(days=1)).replace(day=1)
+    days, daily = read_daily_series(metrics, first, today, society_id)
+    labels = []
+    for day in days:
+        label = day.strftime('%Y-%m')
+        if not labels or labels[-1] != label:
+            labels.append(label)
+    totals = {metric: dict.fromkeys(labels, 0) for metric in metrics}
+    for metric, values in daily.items():
+        for day, value in zip(days, values):
+            totals[metric][day.strftime('%Y-%m')] += value
+    return labels, {metric: [by_month[label] for label in labels] for metric, by_month in totals.items()}
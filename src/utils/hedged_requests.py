@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+对冲请求（hedged request）
+
+主接口失败或超时后再串行请求备用接口，最坏耗时是两者超时之和。HedgedFetcher 先发出主请求，
+若在对冲延迟内没有返回有效结果，就并行发出备用请求，取先到的有效结果；落后的请求不再等待
+（尚未开始的直接取消，已在执行的由线程池跑完并只记录统计）。
+对冲延迟由主接口近期延迟的 p90 决定（限定在 [min_delay, max_delay] 内），样本不足时用默认值；
+主接口近期错误率过高时不再等待，直接同时发出两个请求。
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+logger = logging.getLogger(__name__)
+
+
+class ProviderStats(object):
+    """单个接口的近期延迟与错误统计（滑动窗口）。"""
+
+    def __init__(self, window=100):
+        self._latencies = deque(maxlen=window)
+        self._outcomes = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+
+    def record(self, latency, ok):
+        with self._lock:
+            self.calls += 1
+            if ok:
+                self._latencies.append(latency)
+            else:
+                self.errors += 1
+            self._outcomes.append(bool(ok))
+
+    def percentile(self, q):
+        with self._lock:
+            samples = sorted(self._latencies)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+    def error_rate(self):
+        with self._lock:
+            if not self._outcomes:
+                return 0.0
+            return 1 - sum(self._outcomes) / len(self._outcomes)
+
+    def sample_count(self):
+        with self._lock:
+            return len(self._outcomes)
+
+    def snapshot(self):
+        p50, p90 = self.percentile(0.5), self.percentile(0.9)
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'recent_error_rate': round(self.error_rate(), 3),
+            'p50_ms': round(p50 * 1000) if p50 is not None else None,
+            'p90_ms': round(p90 * 1000) if p90 is not None else None
+        }
+
+
+class HedgedFetcher(object):
+    def __init__(self, default_delay=0.8, min_delay=0.2, max_delay=1.5, min_samples=10,
+                 error_rate_threshold=0.5, window=100, max_workers=8, thread_name_prefix='hedged'):
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.min_samples = min_samples
+        self.error_rate_threshold = error_rate_threshold
+        self.window = window
+        self.stats = {}
+        self._stats_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+
+    def provider_stats(self, name):
+        with self._stats_lock:
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = ProviderStats(self.window)
+            return stats
+
+    def hedge_delay(self, name):
+        stats = self.provider_stats(name)
+        if stats.sample_count() < self.min_samples:
+            return self.default_delay
+        if stats.error_rate() >= self.error_rate_threshold:
+            return 0.0
+        p90 = stats.percentile(0.9)
+        if p90 is None:
+            return self.default_delay
+        return min(max(p90, self.min_delay), self.max_delay)
+
+    def snapshot(self):
+        with self._stats_lock:
+            names = list(self.stats)
+        return {name: self.provider_stats(name).snapshot() for name in names}
+
+    def _timed(self, name, func):
+        stats = self.provider_stats(name)
+
+        def run():
+            started = time.monotonic()
+            try:
+                result = func()
+            except Exception as e:
+                stats.record(time.monotonic() - started, False)
+                logger.warning(f"{name} 请求异常: {e}")
+                return None
+            stats.record(time.monotonic() - started, bool(result))
+            return result
+        return run
+
+    def fetch(self, primary, secondary, timeout=None):
+        """
+        primary / secondary 为 (名称, 无参函数)，函数返回假值视为失败。
+        返回 (名称, 结果)；timeout 秒内（None 表示不限）两者都没有有效结果时返回 (None, None)。
+        """
+        deadline = time.monotonic() + timeout if timeout is not None else None
+
+        def remaining():
+            return None if deadline is None else max(deadline - time.monotonic(), 0)
+
+        primary_name, primary_func = primary
+        secondary_name, secondary_func = secondary
+        pending = {self._executor.submit(self._timed(primary_name, primary_func)): primary_name}
+
+        delay = self.hedge_delay(primary_name)
+        if remaining() is not None:
+            delay = min(delay, remaining())
+        done, _ = wait(list(pending), timeout=delay)
+        for future in done:
+            result = future.result()
+            if result:
+                return primary_name, result
+            pending.pop(future)
+
+        # 主请求在对冲延迟内未返回有效结果：发出备用请求，取先到的有效结果
+        pending[self._executor.submit(self._timed(secondary_name, secondary_func))] = secondary_name
+        while pending:
+            left = remaining()
+            if left is not None and left <= 0:
+                break
+            done, _ = wait(list(pending), timeout=left, return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                name = pending.pop(future)
+                result = future.result()
+                if result:
+                    for loser in pending:
+                        loser.cancel()
+                    return name, result
+        for loser in pending:
+            loser.cancel()
+        return None, None
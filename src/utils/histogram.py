@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+数据库侧分桶统计
+
+分布图原先把整张表读进 Python 再逐行分桶。这里生成单条分组查询：
+    PostgreSQL: GROUP BY width_bucket(value, ARRAY[e0, e1, ...])
+    其他数据库:  GROUP BY CASE WHEN value < e1 THEN 0 WHEN value < e2 THEN 1 ... END
+区间为左闭右开 [e_i, e_{i+1})，最后一个区间为 [e_n, +∞)，小于 e0 的值不计入。
+统计结果按 (图表名, 社团范围) 做短时缓存，后台反复刷新图表时不再重复扫描。
+"""
+
+import logging
+
+from flask import current_app
+from sqlalchemy import case, func
+from sqlalchemy.dialects import postgresql
+
+from src import cache, db
+
+logger = logging.getLogger(__name__)
+
+CACHE_PREFIX = 'distribution:'
+
+
+def _dialect_name():
+    try:
+        return db.session.get_bind().dialect.name
+    except Exception:
+        return db.engine.dialect.name
+
+
+def bucket_labels(edges):
+    """整数区间标签：['0-9', '10-29', ..., '1000+']。"""
+    return [f'{edges[i]}-{edges[i + 1] - 1}' for i in range(len(edges) - 1)] + [f'{edges[-1]}+']
+
+
+def bucket_expression(value, edges):
+    """返回 0 起始的桶序号表达式；edges 须升序。"""
+    if _dialect_name() == 'postgresql':
+        return func.width_bucket(value, postgresql.array(list(edges))) - 1
+    return case(
+        *[(value < edges[i + 1], i) for i in range(len(edges) - 1)],
+        else_=len(edges) - 1
+    )
+
+
+def histogram(value, edges, select_from, filters=()):
+    """一次分组查询统计各桶数量，返回长度为 len(edges) 的计数列表。"""
+    bucket = bucket_expression(value, edges).label('bucket')
+    stmt = db.select(bucket, func.count()).select_from(select_from).filter(value >= edges[0], *filters).group_by(bucket)
+    counts = [0] * len(edges)
+    for index, count in db.session.execute(stmt).all():
+        if index is not None and 0 <= index < len(counts):
+            counts[int(index)] = count
+    return counts
+
+
+def cached_distribution(name, scope_id, compute, timeout=None):
+    """按 (图表名, 社团范围) 缓存 compute() 的结果；缓存不可用时直接计算。"""
+    if timeout is None:
+        timeout = current_app.config.get('DISTRIBUTION_CACHE_SECONDS', 60)
+    key = f'{CACHE_PREFIX}{name}:{scope_id or 0}'
+    try:
+        cached = cache.get(key)
+    except Exception as e:
+        logger.debug(f"读取分布缓存失败: {key}, error={e}")
+        cached = None
+    if cached is not None:
+        return cached
+    result = compute()
+    try:
+        cache.set(key, result, timeout=timeout)
+    except Exception as e:
+        logger.debug(f"写入分布缓存失败: {key}, error={e}")
+    return result
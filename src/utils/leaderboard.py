@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+积分排行榜
+
+积分榜页面原先每次访问都要查全站前100、COUNT 比自己高分的人数，并逐个社团 SUM(points_history) 分组聚合。
+这里把排行榜维护在有序结构中：
+    global          全站总积分（student_info.points），成员为角色 Student 的学生
+    society:<id>    社团积分（该社团 points_history 之和），成员为该社团学生（含0分）
+配置 REDIS_URL 时使用 Redis 有序集合（多进程共享）；否则使用进程内有序列表，
+并以 points_history 最大 id 作为版本戳，发现其他进程写入了新积分时整体重建。
+
+积分变动通过 Session after_flush 钩子收集（StudentInfo.points 增减、新增带社团的 PointsHistory），
+提交成功后再增量写入排行榜；学生新增/删除、社团归属变化等结构性变更把相关榜单标记为需重建，
+下次读取时用一次聚合查询重建。`flask rebuild-leaderboards` 可全量重建。
+"""
+
+import bisect
+import logging
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import and_, event, func, inspect, or_
+
+from src import db
+from src.models import PointsHistory, Role, Society, StudentInfo, User
+
+logger = logging.getLogger(__name__)
+
+GLOBAL_BOARD = 'global'
+ALL_SOCIETY_BOARDS = 'society:*'
+_SESSION_KEY = 'leaderboard_changes'
+
+
+def society_board(society_id):
+    return f'society:{society_id}'
+
+
+class _MemoryBoard(object):
+    def __init__(self, pairs, version):
+        self.scores = {member: score for member, score in pairs}
+        # 按 (-分数, 学生id) 升序保存，排名/前N均可二分得到
+        self.order = sorted((-score, member) for member, score in self.scores.items())
+        self.version = version
+        self.built_at = time.time()
+
+    def incr(self, member, delta):
+        if member not in self.scores:
+            return False
+        old = self.scores[member]
+        index = bisect.bisect_left(self.order, (-old, member))
+        del self.order[index]
+        self.scores[member] = old + delta
+        bisect.insort(self.order, (-(old + delta), member))
+        return True
+
+    def remove(self, member):
+        score = self.scores.pop(member, None)
+        if score is not None:
+            del self.order[bisect.bisect_left(self.order, (-score, member))]
+
+    def rank(self, member):
+        score = self.scores.get(member)
+        if score is None:
+            return None, 0
+        # 分数严格高于自己的人数 + 1（同分同名次）
+        return bisect.bisect_left(self.order, (-score, float('-inf'))) + 1, score
+
+    def top(self, limit):
+        return [(member, -negative) for negative, member in self.order[:limit]]
+
+
+class MemoryLeaderboardBackend(object):
+    """进程内有序列表；以 points_history 最大 id 作为版本戳判断是否需要重建。"""
+
+    name = 'memory'
+
+    def __init__(self, max_age=300):
+        self.boards = {}
+        self.max_age = max_age
+        self.lock = threading.RLock()
+
+    def _current_version(self):
+        return db.session.execute(db.select(func.max(PointsHistory.id))).scalar() or 0
+
+    def _board(self, board):
+        version = self._current_version()
+        with self.lock:
+            current = self.boards.get(board)
+            if current is not None and current.version == version and time.time() - current.built_at < self.max_age:
+                return current
+        pairs = _load_board(board)
+        with self.lock:
+            current = _MemoryBoard(pairs, version)
+            self.boards[board] = current
+        return current
+
+    def top(self, board, limit):
+        return self._board(board).top(limit)
+
+    def rank(self, board, member):
+        return self._board(board).rank(member)
+
+    def apply(self, increments, removals, stale, new_history_ids):
+        with self.lock:
+            if ALL_SOCIETY_BOARDS in stale:
+                stale = stale | {name for name in self.boards if name.startswith('society:')}
+            for name in stale:
+                self.boards.pop(name, None)
+            for (name, member), delta in increments.items():
+                current = self.boards.get(name)
+                if current is not None and not current.incr(member, delta):
+                    self.boards.pop(name, None)
+            for member in removals:
+                current = self.boards.get(GLOBAL_BOARD)
+                if current is not None:
+                    current.remove(member)
+            if new_history_ids:
+                # 本进程写入的 id 恰好紧接在榜单版本之后时，增量结果即最新，推进版本戳；否则留待读取时重建
+                low, high = min(new_history_ids), max(new_history_ids)
+                contiguous = high - low + 1 == len(new_history_ids)
+                for current in self.boards.values():
+                    if contiguous and low == current.version + 1:
+                        current.version = high
+
+    def invalidate(self, boards=None):
+        with self.lock:
+            if boards is None:
+                self.boards.clear()
+            else:
+                for name in boards:
+                    self.boards.pop(name, None)
+
+
+class RedisLeaderboardBackend(object):
+    """Redis 有序集合：ZADD XX INCR 增量更新，ZCOUNT 求排名，ZREVRANGE 取前N。"""
+
+    name = 'redis'
+    key_prefix = 'leaderboard:'
+    meta_key = 'leaderboard:meta'
+
+    def __init__(self, client):
+        self.client = client
+
+    def _key(self, board):
+        return f'{self.key_prefix}{board}'
+
+    def _ensure(self, board):
+        if self.client.hexists(self.meta_key, board):
+            return
+        pairs = _load_board(board)
+        pipe = self.client.pipeline()
+        pipe.delete(self._key(board))
+        if pairs:
+            pipe.zadd(self._key(board), {str(member): score for member, score in pairs})
+        pipe.hset(self.meta_key, board, int(time.time()))
+        pipe.execute()
+
+    def top(self, board, limit):
+        self._ensure(board)
+        rows = self.client.zrevrange(self._key(board), 0, limit - 1, withscores=True)
+        return sorted(((int(member), int(score)) for member, score in rows), key=lambda item: (-item[1], item[0]))
+
+    def rank(self, board, member):
+        self._ensure(board)
+        score = self.client.zscore(self._key(board), str(member))
+        if score is None:
+            return None, 0
+        higher = self.client.zcount(self._key(board), f'({score}', '+inf')
+        return int(higher) + 1, int(score)
+
+    def apply(self, increments, removals, stale, new_history_ids):
+        pipe = self.client.pipeline()
+        if ALL_SOCIETY_BOARDS in stale:
+            society_fields = [field for field in self.client.hkeys(self.meta_key)
+                              if (field.decode() if isinstance(field, bytes) else field).startswith('society:')]
+            if society_fields:
+                pipe.hdel(self.meta_key, *society_fields)
+        named = [name for name in stale if name != ALL_SOCIETY_BOARDS]
+        if named:
+            pipe.hdel(self.meta_key, *named)
+        for (name, member), delta in increments.items():
+            # XX：只给已在榜单中的成员加分，非成员不会被误加入
+            pipe.zadd(self._key(name), {str(member): delta}, xx=True, incr=True)
+        for member in removals:
+            pipe.zrem(self._key(GLOBAL_BOARD), str(member))
+        pipe.execute()
+
+    def invalidate(self, boards=None):
+        if boards is None:
+            self.client.delete(self.meta_key)
+        else:
+            self.client.hdel(self.meta_key, *boards)
+
+
+def _load_board(board):
+    """从数据库聚合出榜单全部成员与分数（仅在重建时执行）。"""
+    student_role = db.select(User.id).join(Role, Role.id == User.role_id).filter(Role.name == 'Student')
+    if board == GLOBAL_BOARD:
+        rows = db.session.execute(
+            db.select(StudentInfo.id, func.coalesce(StudentInfo.points, 0))
+            .filter(StudentInfo.user_id.in_(student_role))
+        ).all()
+    else:
+        society_id = int(board.split(':', 1)[1])
+        rows = db.session.execute(
+            db.select(StudentInfo.id, func.coalesce(func.sum(PointsHistory.points), 0))
+            .outerjoin(
+                PointsHistory,
+                and_(PointsHistory.student_id == StudentInfo.id, PointsHistory.society_id == society_id)
+            )
+            .filter(
+                StudentInfo.user_id.in_(student_role),
+                or_(
+                    StudentInfo.society_id == society_id,
+                    StudentInfo.joined_societies.any(Society.id == society_id)
+                )
+            )
+            .group_by(StudentInfo.id)
+        ).all()
+    return [(int(member), int(score or 0)) for member, score in rows]
+
+
+def get_leaderboard(app=None):
+    app = app or current_app
+    backend = app.extensions.get('leaderboard')
+    if backend is None:
+        redis_url = (app.config.get('LEADERBOARD_REDIS_URL') or '').strip()
+        if redis_url:
+            import redis
+            backend = RedisLeaderboardBackend(redis.Redis.from_url(redis_url))
+        else:
+            backend = MemoryLeaderboardBackend(app.config.get('LEADERBOARD_MAX_AGE', 300))
+        app.extensions['leaderboard'] = backend
+    return backend
+
+
+def top_students(board, limit=100):
+    """返回 [(student_info_id, 分数)]，分数从高到低、同分按学生id升序。"""
+    return get_leaderboard().top(board, limit)
+
+
+def student_rank(board, student_info_id):
+    """返回 (名次, 分数)；不在榜单中时名次为 None。"""
+    return get_leaderboard().rank(board, student_info_id)
+
+
+def rebuild_leaderboards():
+    backend = get_leaderboard()
+    backend.invalidate()
+    boards = [GLOBAL_BOARD] + [society_board(sid) for sid in db.session.execute(db.select(Society.id)).scalars().all()]
+    for board in boards:
+        backend.top(board, 1)
+    return len(boards)
+
+
+def _pending(session):
+    return session.info.setdefault(_SESSION_KEY, {'increments': {}, 'removals': set(), 'stale': set(), 'history_ids': []})
+
+
+def _collection_changes(obj, key):
+    history = inspect(obj).attrs[key].history
+    return list(history.added or ()) + list(history.deleted or ())
+
+
+def _after_flush(session, flush_context):
+    try:
+        pending = _pending(session)
+        increments, stale = pending['increments'], pending['stale']
+        for obj in session.new:
+            if isinstance(obj, StudentInfo):
+                stale.add(GLOBAL_BOARD)
+                stale.add(ALL_SOCIETY_BOARDS)
+            elif isinstance(obj, PointsHistory):
+                pending['history_ids'].append(obj.id)
+                if obj.society_id and obj.points:
+                    key = (society_board(obj.society_id), obj.student_id)
+                    increments[key] = increments.get(key, 0) + int(obj.points)
+        for obj in session.dirty:
+            if isinstance(obj, StudentInfo):
+                history = inspect(obj).attrs['points'].history
+                if history.has_changes():
+                    if history.deleted and history.added:
+                        delta = int(history.added[0] or 0) - int(history.deleted[0] or 0)
+                        key = (GLOBAL_BOARD, obj.id)
+                        increments[key] = increments.get(key, 0) + delta
+                    else:
+                        stale.add(GLOBAL_BOARD)
+                society_history = inspect(obj).attrs['society_id'].history
+                if society_history.has_changes():
+                    stale.update(society_board(sid) for sid in (society_history.added or ()) + (society_history.deleted or ()) if sid)
+                for society in _collection_changes(obj, 'joined_societies'):
+                    stale.add(society_board(society.id))
+            elif isinstance(obj, PointsHistory):
+                stale.add(ALL_SOCIETY_BOARDS)
+            elif isinstance(obj, User) and inspect(obj).attrs['role_id'].history.has_changes():
+                stale.update({GLOBAL_BOARD, ALL_SOCIETY_BOARDS})
+        for obj in session.deleted:
+            if isinstance(obj, StudentInfo):
+                pending['removals'].add(obj.id)
+                stale.add(ALL_SOCIETY_BOARDS)
+            elif isinstance(obj, PointsHistory):
+                stale.add(ALL_SOCIETY_BOARDS)
+    except Exception as e:
+        logger.warning(f"收集排行榜变更失败（将在重建时修正）: {e}")
+        _pending(session)['stale'].update({GLOBAL_BOARD, ALL_SOCIETY_BOARDS})
+
+
+def _after_commit(session):
+    pending = session.info.pop(_SESSION_KEY, None)
+    if not pending:
+        return
+    increments = {key: delta for key, delta in pending['increments'].items() if delta}
+    if not (increments or pending['removals'] or pending['stale'] or pending['history_ids']):
+        return
+    try:
+        get_leaderboard().apply(increments, pending['removals'], pending['stale'], pending['history_ids'])
+    except Exception as e:
+        logger.warning(f"更新排行榜失败（将在重建时修正）: {e}")
+        try:
+            get_leaderboard().invalidate()
+        except Exception:
+            pass
+
+
+def _after_soft_rollback(session, previous_transaction):
+    if previous_transaction.nested:
+        # 仅回滚了保存点：已收集的增量无法区分，改为整体重建
+        pending = session.info.get(_SESSION_KEY)
+        if pending:
+            pending['increments'].clear()
+            pending['stale'].update({GLOBAL_BOARD, ALL_SOCIETY_BOARDS})
+        return
+    session.info.pop(_SESSION_KEY, None)
+
+
+def register_leaderboard_listeners():
+    for name, listener in (
+        ('after_flush', _after_flush),
+        ('after_commit', _after_commit),
+        ('after_soft_rollback', _after_soft_rollback),
+    ):
+        if not event.contains(db.session, name, listener):
+            event.listen(db.session, name, listener)
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+LLM 生成结果缓存
+
+教育助手会反复收到相同的实验讲解提示词，后台“生成活动描述”“生成回复草稿”也常以相同输入重跑，
+每次都要花几秒并消耗上游额度。这里按 (模型, 规范化后的消息, temperature, 其他生成参数) 的哈希缓存生成结果：
+    - 存在 Flask-Caching 后端（配置 REDIS_URL 时跨进程共享），键为 llm_cache:<sha256>；
+    - 各接口的缓存秒数见 LLM_CACHE_TTLS，未列出或为 0 的接口不缓存；LLM_CACHE_ENABLED 可整体关闭；
+    - 调用方可以请求刷新（refresh）：跳过读取、重新生成并覆盖缓存；
+    - 响应带 Cache-Status 头（RFC 9211），如 "llm-cache; hit"、"llm-cache; fwd=miss; stored"，便于按访问日志统计命中率。
+消息规范化只消除不影响语义的差异：Unicode NFC、换行符、行尾空白、连续空格与首尾空白。
+"""
+
+import hashlib
+import json
+import logging
+import re
+import unicodedata
+
+from flask import current_app, request
+
+from src import cache
+
+logger = logging.getLogger(__name__)
+
+CACHE_NAME = 'llm-cache'
+KEY_PREFIX = 'llm_cache:'
+
+_SPACES = re.compile(r'[ \t　]+')
+
+# 缓存状态 -> Cache-Status 参数
+_STATUS_PARAMS = {
+    'hit': 'hit',
+    'miss': 'fwd=miss; stored',
+    'miss_not_stored': 'fwd=miss',
+    'refresh': 'fwd=request; stored',
+    'refresh_not_stored': 'fwd=request',
+    'bypass': 'fwd=bypass',
+}
+
+
+def normalize_message_content(content):
+    text = unicodedata.normalize('NFC', str(content or ''))
+    text = text.replace('\r\n', '\n').replace('\r', '\n')
+    lines = [_SPACES.sub(' ', line).rstrip() for line in text.split('\n')]
+    return '\n'.join(lines).strip()
+
+
+def llm_cache_key(model, messages, temperature, **params):
+    """返回请求的缓存键；params 为其他影响输出的生成参数（如 max_tokens）。"""
+    normalized = [
+        {'role': str(m.get('role') or '').strip().lower(), 'content': normalize_message_content(m.get('content'))}
+        for m in messages
+    ]
+    material = {
+        'model': model,
+        'messages': normalized,
+        'temperature': round(float(temperature or 0), 3),
+        'params': {k: v for k, v in sorted(params.items()) if v is not None}
+    }
+    digest = hashlib.sha256(
+        json.dumps(material, ensure_ascii=False, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    ).hexdigest()
+    return f'{KEY_PREFIX}{digest}'
+
+
+def llm_cache_ttl(endpoint):
+    """接口的缓存秒数；0 表示该接口不缓存。"""
+    config = current_app.config
+    if not config.get('LLM_CACHE_ENABLED', True):
+        return 0
+    return int((config.get('LLM_CACHE_TTLS') or {}).get(endpoint) or 0)
+
+
+def get_cached_completion(endpoint, key):
+    if not llm_cache_ttl(endpoint):
+        return None
+    try:
+        return cache.get(key)
+    except Exception as e:
+        logger.warning(f"读取 LLM 缓存失败: {e}")
+        return None
+
+
+def store_completion(endpoint, key, content):
+    """写入缓存，返回是否写入（接口未开启缓存或内容为空时不写）。"""
+    ttl = llm_cache_ttl(endpoint)
+    if not ttl or not content:
+        return False
+    try:
+        cache.set(key, content, timeout=ttl)
+        return True
+    except Exception as e:
+        logger.warning(f"写入 LLM 缓存失败: {e}")
+        return False
+
+
+def store_generated(endpoint, key, content, refresh=False):
+    """写入新生成的结果，返回对应的缓存状态。"""
+    if not llm_cache_ttl(endpoint):
+        return 'bypass'
+    stored = store_completion(endpoint, key, content)
+    if refresh:
+        return 'refresh' if stored else 'refresh_not_stored'
+    return 'miss' if stored else 'miss_not_stored'
+
+
+def cached_completion(endpoint, key, compute, refresh=False):
+    """
+    命中时直接返回缓存结果，否则调用 compute() 生成并写入缓存。
+    返回 (内容, 缓存状态)，缓存状态用于 cache_status_header。
+    """
+    if not refresh:
+        content = get_cached_completion(endpoint, key)
+        if content is not None:
+            return content, 'hit'
+    content = compute()
+    return content, store_generated(endpoint, key, content, refresh)
+
+
+def cache_status_header(status):
+    return f'{CACHE_NAME}; {_STATUS_PARAMS.get(status, "fwd=bypass")}'
+
+
+def refresh_requested(payload=None):
+    """请求是否要求跳过缓存重新生成：请求体 refresh 为真，或带 Cache-Control: no-cache。"""
+    if payload and payload.get('refresh'):
+        return True
+    cache_control = (request.headers.get('Cache-Control') or '').lower()
+    return 'no-cache' in cache_control or 'no-store' in cache_control
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+出站 LLM（火山方舟 Ark）请求客户端
+
+各处 AI 调用原先直接 requests.post：每次请求重新建立 TCP+TLS 连接，上游变慢时每个 worker 都各自
+卡在自己的超时里。这里改为进程内共享的 LLMClient：
+    - 共享 requests.Session，按 LLM_HTTP_POOL_SIZE 保留 keep-alive 连接；
+    - 按模型熔断：连续 LLM_BREAKER_FAILURES 次超时/连接失败/5xx 后熔断，熔断期间直接抛出 CircuitOpenError
+      （ConnectionError 的子类，原有的异常处理照常生效）；LLM_BREAKER_RESET_SECONDS 秒后半开，
+      只放行一个探测请求，成功则恢复、失败则继续熔断；
+    - 按模型记录近期延迟（流式请求为收到响应头的耗时）与错误率，管理员可在 /admin/ai/llm-stats 查看当前 worker 的统计。
+本地联调与压测可用 scripts/mock_ark_server.py 启动模拟的 Ark 服务，并把 VOLCANO_API_URL / ARK_IMAGE_API_URL 指向它。
+"""
+
+import logging
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from flask import current_app
+
+from src.utils.hedged_requests import ProviderStats
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """熔断期间拒绝发出请求。"""
+
+
+class CircuitBreaker(object):
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_seconds=30):
+        self.failure_threshold = max(1, int(failure_threshold))
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.rejected = 0
+        self._opened_at = 0.0
+        self._probe_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            now = time.monotonic()
+            if self.state == self.OPEN and now - self._opened_at >= self.reset_seconds:
+                self.state = self.HALF_OPEN
+                self._probe_at = now
+                return True
+            # 半开状态只放行一个探测请求；探测请求迟迟没有结果时再放行一个
+            if self.state == self.HALF_OPEN and now - self._probe_at >= self.reset_seconds:
+                self._probe_at = now
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != self.CLOSED:
+                logger.info("LLM 请求熔断恢复")
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+                if self.state == self.CLOSED:
+                    logger.warning(f"LLM 请求连续失败 {self.failures} 次，熔断 {self.reset_seconds} 秒")
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def retry_after(self):
+        with self._lock:
+            if self.state != self.OPEN:
+                return 0
+            return max(0, int(self.reset_seconds - (time.monotonic() - self._opened_at)) + 1)
+
+    def snapshot(self):
+        return {
+            'state': self.state,
+            'consecutive_failures': self.failures,
+            'rejected': self.rejected,
+            'retry_after': self.retry_after()
+        }
+
+
+class LLMClient(object):
+    def __init__(self, pool_size=20, failure_threshold=5, reset_seconds=30, window=100):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.window = window
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(1, int(pool_size)))
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self._breakers = {}
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, name):
+        with self._lock:
+            breaker = self._breakers.get(name)
+            if breaker is None:
+                breaker = self._breakers[name] = CircuitBreaker(self.failure_threshold, self.reset_seconds)
+                self._stats[name] = ProviderStats(self.window)
+            return breaker, self._stats[name]
+
+    @staticmethod
+    def model_key(url, payload):
+        return (payload or {}).get('model') or urlparse(url).path
+
+    def post(self, url, json=None, headers=None, timeout=None, stream=False, **kwargs):
+        """与 requests.post 用法相同；按请求体中的 model 熔断与统计。熔断期间抛出 CircuitOpenError。
+
+        stream=True 时收到响应头只说明连接建立，成功与否要等读取结束才知道：
+        状态码正常时不在这里计成功，由调用方读完后调用 record_success，读取中断时调用 record_failure。
+        """
+        name = self.model_key(url, json)
+        breaker, stats = self._entry(name)
+        if not breaker.allow():
+            raise CircuitOpenError(f"LLM 服务熔断中（{name}），约 {breaker.retry_after()} 秒后重试")
+
+        started = time.monotonic()
+        try:
+            response = self.session.post(url, json=json, headers=headers, timeout=timeout, stream=stream, **kwargs)
+        except requests.exceptions.RequestException:
+            stats.record(time.monotonic() - started, False)
+            breaker.record_failure()
+            raise
+
+        stats.record(time.monotonic() - started, response.status_code < 400)
+        if response.status_code >= 500:
+            breaker.record_failure()
+        elif not stream:
+            # 4xx 属于请求参数或限流问题，不代表上游不可用
+            breaker.record_success()
+        return response
+
+    def record_success(self, model):
+        """流式响应读取完成时由调用方补记。"""
+        breaker, _ = self._entry(model)
+        breaker.record_success()
+
+    def record_failure(self, model):
+        """流式响应在读取过程中中断、停滞等失败时由调用方补记。"""
+        breaker, stats = self._entry(model)
+        stats.record(0, False)
+        breaker.record_failure()
+
+    def snapshot(self):
+        with self._lock:
+            names = list(self._breakers)
+        result = {}
+        for name in names:
+            breaker, stats = self._entry(name)
+            result[name] = dict(stats.snapshot(), breaker=breaker.snapshot())
+        return result
+
+
+def get_llm_client(app=None):
+    """返回当前应用共享的 LLMClient（按进程创建一次）。"""
+    app = app or current_app
+    client = app.extensions.get('llm_client')
+    if client is None:
+        client = LLMClient(
+            pool_size=app.config.get('LLM_HTTP_POOL_SIZE', 20),
+            failure_threshold=app.config.get('LLM_BREAKER_FAILURES', 5),
+            reset_seconds=app.config.get('LLM_BREAKER_RESET_SECONDS', 30)
+        )
+        app.extensions['llm_client'] = client
+    return client
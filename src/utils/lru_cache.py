@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+进程内有界缓存
+
+模块级 dict 做缓存会随键无限增长，且过期条目只在被再次读取时才清除。
+LRUTTLCache 同时按条目数（超出时淘汰最久未使用的条目）和存活时间约束，线程安全。
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUTTLCache(object):
+    def __init__(self, maxsize=256, ttl=300):
+        self.maxsize = max(1, int(maxsize))
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return default
+            value, expires_at = item
+            if expires_at <= time.monotonic():
+                del self._items[key]
+                return default
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._items[key] = (value, expires_at)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
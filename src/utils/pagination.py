@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+键集（游标）分页
+
+OFFSET/LIMIT 分页越往后越慢，且每页都要 COUNT(*)。keyset_paginate 以 (排序键..., id) 作为游标：
+“下一页/上一页”按游标做 WHERE (key, id) < (:key, :id) 的定位查询，与页深无关；
+直接跳到第N页时仍按 OFFSET 查询，但只多取一行判断是否有下一页。
+总数为可选项，按查询语句与参数缓存（默认60秒），不再每页重新统计。
+
+返回对象兼容 Flask-SQLAlchemy Pagination 的常用属性（items/page/pages/total/has_next/iter_pages 等），
+模板只需在上一页/下一页链接上附带 cursor=pagination.prev_cursor / next_cursor。
+"""
+
+import base64
+import hashlib
+import json
+import logging
+import math
+from datetime import date, datetime
+
+from flask import current_app
+from sqlalchemy import and_, func, literal, or_
+from sqlalchemy.sql import Select
+
+from src import cache, db
+
+logger = logging.getLogger(__name__)
+
+# 可为空的时间排序键统一用该值兜底（配合 func.coalesce 使用），保证游标比较结果确定
+EPOCH = datetime(1970, 1, 1)
+
+
+def coalesce_datetime(column):
+    return func.coalesce(column, EPOCH)
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {'$dt': value.isoformat()}
+    if isinstance(value, date):
+        return {'$d': value.isoformat()}
+    return value
+
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        if '$dt' in value:
+            return datetime.fromisoformat(value['$dt'])
+        if '$d' in value:
+            return date.fromisoformat(value['$d'])
+    return value
+
+
+def encode_cursor(direction, values):
+    payload = json.dumps({'d': direction, 'v': [_encode_value(v) for v in values]}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, key_count):
+    """解析游标，返回 (方向, 值列表)；格式不正确时返回 None（按页码分页处理）。"""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+        direction = payload.get('d')
+        values = [_decode_value(v) for v in payload.get('v') or []]
+        if direction not in ('a', 'b') or len(values) != key_count:
+            return None
+        return direction, values
+    except Exception:
+        logger.info(f"忽略无效的分页游标: {cursor[:64]}")
+        return None
+
+
+def _seek_predicate(sort_keys, values, forward):
+    """构造 (k1, k2, ...) 在显示顺序中位于游标之后(forward)或之前的条件。"""
+    # 显式绑定为参数：布尔等字面量不允许直接参与 < / > 比较
+    bound = [literal(value, type_=expr.type) for (expr, _), value in zip(sort_keys, values)]
+    clauses = []
+    for index, (expr, descending) in enumerate(sort_keys):
+        value = bound[index]
+        after = (expr < value) if descending else (expr > value)
+        before = (expr > value) if descending else (expr < value)
+        equal_prefix = [sort_keys[j][0] == bound[j] for j in range(index)]
+        clauses.append(and_(*equal_prefix, after if forward else before))
+    return or_(*clauses)
+
+
+def _count_cache_key(statement):
+    compiled = statement.compile(dialect=db.engine.dialect)
+    params = sorted((k, repr(v)) for k, v in compiled.params.items())
+    digest = hashlib.md5(f"{compiled}|{params}".encode('utf-8')).hexdigest()
+    return f"keyset_count:{digest}"
+
+
+def cached_count(query, timeout=None):
+    """统计查询总数并按语句+参数缓存，避免每次翻页都执行 COUNT(*)。"""
+    statement = query.order_by(None) if isinstance(query, Select) else query.order_by(None).statement
+    count_stmt = db.select(func.count()).select_from(statement.subquery())
+    if timeout is None:
+        timeout = current_app.config.get('PAGINATION_COUNT_CACHE_SECONDS', 60)
+    cache_key = None
+    try:
+        cache_key = _count_cache_key(count_stmt)
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+    except Exception as e:
+        logger.debug(f"读取分页总数缓存失败: {e}")
+    total = int(db.session.execute(count_stmt).scalar() or 0)
+    if cache_key and timeout:
+        try:
+            cache.set(cache_key, total, timeout=timeout)
+        except Exception as e:
+            logger.debug(f"写入分页总数缓存失败: {e}")
+    return total
+
+
+class KeysetPagination(object):
+    def __init__(self, items, page, per_page, total, next_cursor, prev_cursor):
+        self.items = items
+        self.page = page
+        self.per_page = per_page
+        self.total = total
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    @property
+    def pages(self):
+        if self.total is None:
+            return max(self.page + (1 if self.next_cursor else 0), 1)
+        return int(math.ceil(self.total / float(self.per_page))) if self.per_page else 0
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.page > 1 or self.prev_cursor is not None
+
+    @property
+    def next_num(self):
+        return self.page + 1 if self.has_next else None
+
+    @property
+    def prev_num(self):
+        return max(self.page - 1, 1) if self.has_prev else None
+
+    def iter_pages(self, left_edge=2, left_current=2, right_current=5, right_edge=2):
+        last = 0
+        pages = self.pages
+        for num in range(1, pages + 1):
+            if (num <= left_edge or
+                    (self.page - left_current - 1 < num < self.page + right_current) or
+                    num > pages - right_edge):
+                if last + 1 != num:
+                    yield None
+                yield num
+                last = num
+
+    def __iter__(self):
+        return iter(self.items)
+
+
+def keyset_paginate(query, sort_keys, page=1, per_page=20, cursor=None, with_total=True, count_timeout=None):
+    """按 (排序键..., id) 游标分页。
+
+    Args:
+        query: db.select(Model) 或 Model.query，调用方无需也不应预先 order_by
+        sort_keys: [(列或表达式, 是否降序), ...]，最后一项应为唯一的主键；可为空的列请用 coalesce_datetime 等兜底
+        page: 页码，仅用于展示与无游标时的 OFFSET 定位
+        cursor: 上一页/下一页链接携带的游标
+        with_total: 是否统计（并缓存）总数；小程序等无限滚动场景可关闭
+    """
+    page = max(int(page or 1), 1)
+    per_page = max(int(per_page or 1), 1)
+    decoded = decode_cursor(cursor, len(sort_keys))
+    direction = decoded[0] if decoded else None
+    backward = direction == 'b'
+
+    exprs = [expr for expr, _ in sort_keys]
+    ordering = []
+    for expr, descending in sort_keys:
+        ordering.append(expr.asc() if descending == backward else expr.desc())
+
+    stmt = query.order_by(None).add_columns(*exprs)
+    if decoded:
+        stmt = stmt.filter(_seek_predicate(sort_keys, decoded[1], forward=not backward))
+    stmt = stmt.order_by(*ordering)
+    if not decoded and page > 1:
+        stmt = stmt.offset((page - 1) * per_page)
+    stmt = stmt.limit(per_page + 1)
+
+    rows = db.session.execute(stmt).all() if isinstance(stmt, Select) else stmt.all()
+    has_more = len(rows) > per_page
+    rows = list(rows[:per_page])
+    if backward:
+        rows.reverse()
+
+    items = [row[0] for row in rows]
+    keys = [tuple(row[1:]) for row in rows]
+    if direction == 'b':
+        has_prev, has_next = has_more, bool(keys)
+        if not has_more:
+            page = 1
+    elif direction == 'a':
+        has_prev, has_next = bool(keys), has_more
+    else:
+        has_prev, has_next = page > 1 and bool(keys), has_more
+
+    next_cursor = encode_cursor('a', keys[-1]) if has_next and keys else None
+    prev_cursor = encode_cursor('b', keys[0]) if has_prev and keys else None
+    total = cached_count(query, count_timeout) if with_total else None
+    return KeysetPagination(items, page, per_page, total, next_cursor, prev_cursor)
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+活动海报衍生图
+
+列表页、小程序列表与分享海报不需要原图（手机拍摄常有数MB），这里按固定宽度档位
+（320/640/1280）生成 WebP / JPEG 缩略图，并以 源图摘要 + 宽度 + 格式 为键缓存在磁盘:
+    <POSTER_DERIVATIVE_DIR>/<sha[:2]>/<sha>_w<width>.<ext>
+源图内容不变则衍生图永不过期；上传时后台预生成，未命中时在首次请求时生成。
+"""
+
+import logging
+import os
+import tempfile
+import threading
+from io import BytesIO
+
+from flask import current_app
+from PIL import Image, ImageOps
+
+from src.utils.poster_store import get_poster_store
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVE_WIDTHS = (320, 640, 1280)
+DERIVATIVE_FORMATS = {
+    'webp': ('WEBP', 'image/webp'),
+    'jpeg': ('JPEG', 'image/jpeg'),
+}
+DERIVATIVE_QUALITY = 80
+
+
+def snap_width(width):
+    """把任意请求宽度归到最接近且不小于它的档位，避免任意宽度撑爆缓存。"""
+    try:
+        width = int(width)
+    except (TypeError, ValueError):
+        return None
+    if width <= 0:
+        return None
+    for candidate in DERIVATIVE_WIDTHS:
+        if width <= candidate:
+            return candidate
+    return DERIVATIVE_WIDTHS[-1]
+
+
+def negotiate_format(accept_mimetypes):
+    """根据 Accept 头选择输出格式：显式声明 image/webp 时用 WebP，否则 JPEG（*/* 不算支持）。"""
+    for mimetype, quality in (accept_mimetypes or ()):
+        if mimetype == 'image/webp' and quality > 0:
+            return 'webp'
+    return 'jpeg'
+
+
+def _derivative_root(app=None):
+    app = app or current_app
+    return app.config.get('POSTER_DERIVATIVE_DIR') or os.path.join(app.config['POSTER_STORE_DIR'], 'derived')
+
+
+def derivative_path(digest, width, fmt, app=None):
+    return os.path.join(_derivative_root(app), digest[:2], f"{digest}_w{width}.{fmt}")
+
+
+def _render(data, width, fmt):
+    pil_format, _ = DERIVATIVE_FORMATS[fmt]
+    with Image.open(BytesIO(data)) as source:
+        # JPEG 可在解码阶段直接按比例缩小，大图解码耗时与内存明显下降
+        source.draft('RGB', (width, width * 4))
+        image = ImageOps.exif_transpose(source)
+        if image.width > width:
+            height = max(1, round(image.height * width / image.width))
+            image = image.resize((width, height), Image.LANCZOS)
+
+        has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+        if fmt == 'jpeg':
+            if has_alpha:
+                rgba = image.convert('RGBA')
+                background = Image.new('RGB', rgba.size, (255, 255, 255))
+                background.paste(rgba, mask=rgba.split()[-1])
+                image = background
+            else:
+                image = image.convert('RGB')
+            options = {'quality': DERIVATIVE_QUALITY, 'optimize': True, 'progressive': True}
+        else:
+            image = image.convert('RGBA' if has_alpha else 'RGB')
+            options = {'quality': DERIVATIVE_QUALITY, 'method': 4}
+
+        output = BytesIO()
+        image.save(output, pil_format, **options)
+        return output.getvalue()
+
+
+def _write_atomic(target, payload):
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target), prefix='.tmp_')
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            fh.write(payload)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, target)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def get_poster_derivative(digest, width, fmt, source=None, app=None):
+    """返回衍生图的 (路径, MIME类型)；缓存未命中时从源图生成。width 需为档位宽度。"""
+    if fmt not in DERIVATIVE_FORMATS or width not in DERIVATIVE_WIDTHS:
+        raise ValueError(f'不支持的海报衍生规格: width={width}, format={fmt}')
+    target = derivative_path(digest, width, fmt, app)
+    if not os.path.isfile(target):
+        if source is None:
+            source = get_poster_store(app).read(digest)
+        _write_atomic(target, _render(source, width, fmt))
+    return target, DERIVATIVE_FORMATS[fmt][1]
+
+
+def warm_poster_derivatives(digest, app=None):
+    """一次读取源图，生成全部档位与格式的衍生图，返回生成/命中的数量。"""
+    source = get_poster_store(app).read(digest)
+    produced = 0
+    for width in DERIVATIVE_WIDTHS:
+        for fmt in DERIVATIVE_FORMATS:
+            try:
+                get_poster_derivative(digest, width, fmt, source=source, app=app)
+                produced += 1
+            except Exception as e:
+                logger.warning(f"生成海报衍生图失败: hash={digest}, width={width}, format={fmt}, error={e}")
+    return produced
+
+
+def warm_poster_derivatives_async(digest):
+    """上传后在后台线程预生成衍生图，不阻塞请求。"""
+    app_ref = current_app._get_current_object()
+
+    def _run():
+        with app_ref.app_context():
+            try:
+                warm_poster_derivatives(digest, app=app_ref)
+            except Exception as e:
+                logger.warning(f"后台预生成海报衍生图失败: hash={digest}, error={e}")
+
+    worker = threading.Thread(target=_run, daemon=True)
+    worker.start()
+    return worker
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+活动海报内容寻址存储
+
+海报字节按 SHA-256 摘要存放（同一图片只存一份），活动表只保存摘要与MIME类型，
+避免普通 Activity 查询把海报二进制带出数据库。存储后端可插拔，默认使用本地文件系统：
+    <POSTER_STORE_DIR>/<sha[:2]>/<sha[2:4]>/<sha>
+其他后端（如对象存储）可通过 register_poster_backend 注册，并在配置 POSTER_STORE_BACKEND 中选用。
+"""
+
+import hashlib
+import logging
+import os
+import tempfile
+
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+_BACKEND_FACTORIES = {}
+
+
+class LocalPosterBackend(object):
+    """本地文件系统后端：写入临时文件后原子重命名，重复写入同一摘要直接跳过。"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def path_for(self, digest):
+        return os.path.join(self.root, digest[:2], digest[2:4], digest)
+
+    def exists(self, digest):
+        return os.path.isfile(self.path_for(digest))
+
+    def put(self, digest, data):
+        target = self.path_for(digest)
+        if os.path.isfile(target):
+            return target
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target), prefix='.tmp_')
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                fh.write(data)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, target)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return target
+
+    def read(self, digest):
+        with open(self.path_for(digest), 'rb') as fh:
+            return fh.read()
+
+    def size(self, digest):
+        return os.path.getsize(self.path_for(digest))
+
+    def iter_chunks(self, digest, chunk_size=64 * 1024):
+        with open(self.path_for(digest), 'rb') as fh:
+            while True:
+                chunk = fh.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+
+
+def register_poster_backend(name, factory):
+    """注册存储后端；factory(app) 返回实现 exists/put/read/size/iter_chunks 的对象。"""
+    _BACKEND_FACTORIES[name] = factory
+
+
+register_poster_backend('local', lambda app: LocalPosterBackend(app.config['POSTER_STORE_DIR']))
+
+
+def get_poster_store(app=None):
+    app = app or current_app
+    store = app.extensions.get('poster_store')
+    if store is None:
+        backend_name = app.config.get('POSTER_STORE_BACKEND', 'local')
+        factory = _BACKEND_FACTORIES.get(backend_name)
+        if factory is None:
+            raise RuntimeError(f'未知的海报存储后端: {backend_name}')
+        store = factory(app)
+        app.extensions['poster_store'] = store
+    return store
+
+
+def poster_digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def save_poster_bytes(data):
+    """写入海报字节并返回其 SHA-256 摘要。"""
+    digest = poster_digest(data)
+    get_poster_store().put(digest, data)
+    return digest
+
+
+def set_activity_poster(activity, data, mimetype, filename=None):
+    """写入存储并更新活动的海报摘要/MIME类型，不再把字节写入 activities 表。"""
+    digest = save_poster_bytes(data)
+    activity.poster_hash = digest
+    activity.poster_mimetype = mimetype or 'image/png'
+    activity.poster_data = None
+    if filename:
+        activity.poster_image = filename
+    return digest
+
+
+def read_activity_poster(activity):
+    """读取活动海报字节：优先内容寻址存储，其次尚未迁移的旧 poster_data 列。"""
+    digest = getattr(activity, 'poster_hash', None)
+    if digest:
+        try:
+            return get_poster_store().read(digest)
+        except Exception as e:
+            logger.warning(f"读取海报存储失败: activity_id={activity.id}, hash={digest}, error={e}")
+    return getattr(activity, 'poster_data', None)
+
+
+def drain_legacy_poster_blobs(batch_size=20):
+    """一次性迁移：把 activities.poster_data 中的旧海报写入存储并清空该列，返回迁移数量。"""
+    from src import db
+    from src.models import Activity
+
+    migrated = 0
+    last_id = 0
+    while True:
+        ids = db.session.execute(
+            db.select(Activity.id)
+            .filter(Activity.poster_data.is_not(None), Activity.id > last_id)
+            .order_by(Activity.id.asc())
+            .limit(batch_size)
+        ).scalars().all()
+        if not ids:
+            break
+        for activity_id in ids:
+            last_id = activity_id
+            data, mimetype, existing_hash = db.session.execute(
+                db.select(Activity.poster_data, Activity.poster_mimetype, Activity.poster_hash)
+                .filter(Activity.id == activity_id)
+            ).one()
+            if not data:
+                continue
+            digest = save_poster_bytes(data)
+            if existing_hash and existing_hash != digest:
+                logger.warning(f"活动 {activity_id} 的旧海报与已有摘要不一致，以旧列数据为准: {existing_hash} -> {digest}")
+            db.session.execute(
+                db.update(Activity)
+                .where(Activity.id == activity_id)
+                .values(poster_hash=digest, poster_mimetype=mimetype or 'image/png', poster_data=None)
+            )
+            migrated += 1
+        db.session.commit()
+    return migrated
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+活动推荐引擎
+
+旧实现把学生历史活动描述拆词后拼成一个巨大的 OR ilike 查询，条件数随参与记录增长。
+这里改为预计算打分：
+    1. 后台按 RECOMMENDATION_REFRESH_SECONDS 周期重建模型：对全部活动的标题/描述切词
+       （与全文检索相同的中文二字切分）并加入标签特征，计算 TF-IDF 词表与 IDF，
+       再把“可推荐活动”（进行中且未结束）的向量按行归一化成 NumPy 矩阵常驻内存；
+    2. 学生兴趣向量 = 参与/签到/高分评价过的活动向量加权和 + 学生自选标签；
+    3. 推荐 = 候选矩阵 · 兴趣向量 取余弦分数 Top-N，结果按用户缓存。
+模型在进程内存中，多进程部署时各进程独立刷新；过期后先返回旧模型结果并在后台线程重建。
+"""
+
+import logging
+import math
+import threading
+import time
+from collections import Counter, defaultdict
+
+import numpy as np
+from flask import current_app
+
+from src import cache, db
+from src.models import Activity, ActivityReview, Registration, StudentInfo, activity_tags, student_tags
+from src.utils.activity_search import index_tokens
+from src.utils.time_helpers import get_localized_now
+
+logger = logging.getLogger(__name__)
+
+MAX_TERMS = 5000
+TITLE_WEIGHT = 2
+TAG_WEIGHT = 3
+HISTORY_WEIGHTS = {'registered': 1.0, 'attended': 1.5}
+REVIEW_BONUS = 1.0
+USER_CACHE_PREFIX = 'recommend:user:'
+USER_CACHE_SECONDS = 300
+
+_model = None
+_model_lock = threading.Lock()
+_refreshing = threading.Event()
+
+
+class RecommendationModel(object):
+    def __init__(self, vocab, idf, candidate_ids, matrix, built_at):
+        self.vocab = vocab
+        self.idf = idf
+        self.candidate_ids = candidate_ids
+        self.matrix = matrix
+        self.built_at = built_at
+        self.version = f"{int(built_at)}:{len(candidate_ids)}"
+
+    def vectorize(self, features):
+        """把特征计数转成归一化的 TF-IDF 向量；未收录的特征忽略。"""
+        vector = np.zeros(len(self.vocab), dtype=np.float32)
+        for feature, count in features.items():
+            column = self.vocab.get(feature)
+            if column is not None:
+                vector[column] = (1.0 + math.log(count)) * self.idf[column]
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+
+def _activity_features(title, description, tag_ids):
+    features = Counter()
+    for token in index_tokens(title):
+        if len(token) > 1:
+            features[token] += TITLE_WEIGHT
+    for token in index_tokens(description):
+        if len(token) > 1:
+            features[token] += 1
+    for tag_id in tag_ids:
+        features[f'#tag:{tag_id}'] += TAG_WEIGHT
+    return features
+
+
+def _load_activity_features(activity_ids=None):
+    stmt = db.select(Activity.id, Activity.title, Activity.description, Activity.status, Activity.end_time)
+    tag_stmt = db.select(activity_tags.c.activity_id, activity_tags.c.tag_id)
+    if activity_ids is not None:
+        stmt = stmt.filter(Activity.id.in_(activity_ids))
+        tag_stmt = tag_stmt.filter(activity_tags.c.activity_id.in_(activity_ids))
+    tags = defaultdict(list)
+    for activity_id, tag_id in db.session.execute(tag_stmt).all():
+        tags[activity_id].append(tag_id)
+    rows = {}
+    for activity_id, title, description, status, end_time in db.session.execute(stmt).all():
+        rows[activity_id] = (_activity_features(title, description, tags[activity_id]), status, end_time)
+    return rows
+
+
+def build_recommendation_model():
+    """从数据库全量构建推荐模型。"""
+    rows = _load_activity_features()
+    document_frequency = Counter()
+    for features, _, _ in rows.values():
+        document_frequency.update(features.keys())
+
+    total = max(len(rows), 1)
+    terms = [term for term, _ in document_frequency.most_common(MAX_TERMS)]
+    vocab = {term: index for index, term in enumerate(terms)}
+    idf = np.array(
+        [math.log((1 + total) / (1 + document_frequency[term])) + 1.0 for term in terms],
+        dtype=np.float32
+    )
+
+    now = get_localized_now()
+    model = RecommendationModel(vocab, idf, np.zeros(0, dtype=np.int64), np.zeros((0, len(vocab)), dtype=np.float32), time.time())
+    candidates = [
+        (activity_id, features) for activity_id, (features, status, end_time) in rows.items()
+        if status == 'active' and end_time and end_time > now
+    ]
+    if candidates:
+        model.candidate_ids = np.array([activity_id for activity_id, _ in candidates], dtype=np.int64)
+        model.matrix = np.vstack([model.vectorize(features) for _, features in candidates])
+    return model
+
+
+def _refresh_in_background(app):
+    def _run():
+        global _model
+        try:
+            with app.app_context():
+                model = build_recommendation_model()
+                with _model_lock:
+                    _model = model
+                logger.info(f"推荐模型已刷新: 候选活动 {len(model.candidate_ids)} 个, 特征 {len(model.vocab)} 维")
+        except Exception as e:
+            logger.warning(f"后台刷新推荐模型失败: {e}")
+        finally:
+            _refreshing.clear()
+
+    threading.Thread(target=_run, daemon=True).start()
+
+
+def get_recommendation_model():
+    """返回当前模型：首次同步构建，过期则继续使用旧模型并在后台刷新。"""
+    global _model
+    refresh_seconds = current_app.config.get('RECOMMENDATION_REFRESH_SECONDS', 600)
+    model = _model
+    if model is None:
+        with _model_lock:
+            if _model is None:
+                _model = build_recommendation_model()
+            model = _model
+    elif time.time() - model.built_at > refresh_seconds and not _refreshing.is_set():
+        _refreshing.set()
+        _refresh_in_background(current_app._get_current_object())
+    return model
+
+
+def reset_recommendation_model():
+    global _model
+    with _model_lock:
+        _model = None
+
+
+def _student_affinity(model, user_id, student_info_id):
+    """学生兴趣向量：历史活动向量按参与程度加权求和，再叠加学生自选标签。"""
+    weights = defaultdict(float)
+    for activity_id, status in db.session.execute(
+        db.select(Registration.activity_id, Registration.status).filter(
+            Registration.user_id == user_id,
+            Registration.status.in_(list(HISTORY_WEIGHTS))
+        )
+    ).all():
+        weights[activity_id] = max(weights[activity_id], HISTORY_WEIGHTS[status])
+    for (activity_id,) in db.session.execute(
+        db.select(ActivityReview.activity_id).filter(
+            ActivityReview.user_id == user_id,
+            ActivityReview.rating >= 4
+        )
+    ).all():
+        weights[activity_id] += REVIEW_BONUS
+
+    affinity = np.zeros(len(model.vocab), dtype=np.float32)
+    if weights:
+        for activity_id, (features, _, _) in _load_activity_features(list(weights)).items():
+            affinity += weights[activity_id] * model.vectorize(features)
+
+    tag_features = Counter({
+        f'#tag:{tag_id}': TAG_WEIGHT
+        for (tag_id,) in db.session.execute(
+            db.select(student_tags.c.tag_id).filter(student_tags.c.student_id == student_info_id)
+        ).all()
+    })
+    if tag_features:
+        affinity += model.vectorize(tag_features)
+
+    norm = np.linalg.norm(affinity)
+    return (affinity / norm if norm > 0 else affinity), set(weights)
+
+
+def _rank_for_user(model, user_id, student_info_id, size):
+    if not len(model.candidate_ids):
+        return []
+    affinity, seen = _student_affinity(model, user_id, student_info_id)
+    if not affinity.any():
+        return []
+    scores = model.matrix @ affinity
+    if seen:
+        scores[np.isin(model.candidate_ids, list(seen))] = 0.0
+    positive = int(np.count_nonzero(scores > 0))
+    if positive == 0:
+        return []
+    size = min(size, positive)
+    top = np.argpartition(-scores, size - 1)[:size]
+    top = top[np.argsort(-scores[top], kind='stable')]
+    return [int(model.candidate_ids[index]) for index in top]
+
+
+def invalidate_user_recommendations(user_id):
+    try:
+        cache.delete(f'{USER_CACHE_PREFIX}{user_id}')
+    except Exception as e:
+        logger.debug(f"清理推荐缓存失败: user_id={user_id}, error={e}")
+
+
+def _latest_active(limit, exclude_ids=()):
+    stmt = db.select(Activity).filter(Activity.status == 'active')
+    if exclude_ids:
+        stmt = stmt.filter(Activity.id.notin_(list(exclude_ids)))
+    return db.session.execute(stmt.order_by(Activity.created_at.desc()).limit(limit)).scalars().all()
+
+
+def recommend_activities(user_id, limit=6):
+    """返回推荐给用户的活动列表（按余弦分数从高到低）；无兴趣数据时返回最新活动。"""
+    student_info_id = db.session.execute(
+        db.select(StudentInfo.id).filter_by(user_id=user_id)
+    ).scalar_one_or_none()
+    if not student_info_id:
+        return _latest_active(limit)
+
+    model = get_recommendation_model()
+    cache_key = f'{USER_CACHE_PREFIX}{user_id}'
+    cached = cache.get(cache_key)
+    if cached and cached.get('version') == model.version:
+        ranked_ids = cached['ids']
+    else:
+        # 多取几倍，读取时再剔除刚报名或已结束的活动，避免每次报名都重算
+        ranked_ids = _rank_for_user(model, user_id, student_info_id, limit * 3)
+        cache.set(cache_key, {'version': model.version, 'ids': ranked_ids}, timeout=USER_CACHE_SECONDS)
+
+    registered_ids = set(db.session.execute(
+        db.select(Registration.activity_id).filter(
+            Registration.user_id == user_id,
+            Registration.status.in_(['registered', 'attended'])
+        )
+    ).scalars().all())
+    candidate_ids = [activity_id for activity_id in ranked_ids if activity_id not in registered_ids]
+    if not candidate_ids:
+        return _latest_active(limit, registered_ids)
+
+    now = get_localized_now()
+    activities = {
+        activity.id: activity
+        for activity in db.session.execute(
+            db.select(Activity).filter(
+                Activity.id.in_(candidate_ids),
+                Activity.status == 'active',
+                Activity.end_time > now
+            )
+        ).scalars().all()
+    }
+    return [activities[activity_id] for activity_id in candidate_ids if activity_id in activities][:limit]
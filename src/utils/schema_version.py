@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+数据库结构版本
+
+原先每个进程启动（每个 gunicorn worker、每个调用 create_app 的脚本/cron 命令）都会执行 db.create_all()
+和 scripts/ensure_db_structure.py：后者用 inspector 反射每张表的列，再逐项判断是否需要 ALTER/回填，
+启动耗时随表数量增长。这里改为：
+    - schema_version 表记录已应用的结构版本；启动时只执行一条 SELECT，版本为最新时跳过全部反射与补齐；
+    - 结构补齐（create_all + ensure_db_structure + 检索索引）集中到显式的 `flask db-upgrade`，部署时在重启服务前执行；
+    - 版本落后时按 SCHEMA_AUTO_UPGRADE 决定启动时自动补齐（开发环境默认开启）或仅记录错误提示执行 db-upgrade。
+修改模型或 ensure_db_structure 的补齐内容时，需同步递增 SCHEMA_VERSION。
+"""
+
+import time
+
+from sqlalchemy import text
+
+from src import db
+
+# 每次新增表/字段或修改 ensure_db_structure 的补齐内容时递增
+SCHEMA_VERSION = 2
+# PostgreSQL advisory 锁键，防止多个进程同时执行补齐
+UPGRADE_LOCK_KEY = 0x5C4E3A01
+
+
+def current_schema_version():
+    """读取已应用的结构版本；版本表不存在（全新库或旧库）时返回 None。"""
+    try:
+        with db.engine.connect() as conn:
+            return conn.execute(text('SELECT version FROM schema_version WHERE id = 1')).scalar()
+    except Exception:
+        return None
+
+
+def _stamp(version):
+    from src.models import SchemaVersion
+
+    stamp = db.session.get(SchemaVersion, 1)
+    if stamp is None:
+        db.session.add(SchemaVersion(id=1, version=version))
+    else:
+        stamp.version = version
+    db.session.commit()
+
+
+def _apply_schema(app):
+    from scripts.ensure_db_structure import ensure_db_structure
+
+    db.create_all()
+    ensure_db_structure(app, db)
+
+
+def upgrade_schema(app, force=False):
+    """补齐数据库结构并写入版本戳，返回 (原版本, 新版本)。版本已是最新且未指定 force 时不做任何改动。"""
+    lock_conn = None
+    if db.engine.dialect.name == 'postgresql':
+        # 会话级锁：其余进程等待补齐完成后重新读取版本，不重复执行
+        lock_conn = db.engine.connect()
+        lock_conn.execute(text('SELECT pg_advisory_lock(:key)'), {'key': UPGRADE_LOCK_KEY})
+    try:
+        previous = current_schema_version()
+        if previous == SCHEMA_VERSION and not force:
+            return previous, previous
+        _apply_schema(app)
+        _stamp(SCHEMA_VERSION)
+        app.logger.info(f'数据库结构已升级: {previous} -> {SCHEMA_VERSION}')
+        return previous, SCHEMA_VERSION
+    finally:
+        if lock_conn is not None:
+            lock_conn.execute(text('SELECT pg_advisory_unlock(:key)'), {'key': UPGRADE_LOCK_KEY})
+            lock_conn.close()
+
+
+def check_schema_on_boot(app):
+    """启动时的结构检查：版本为最新时只有一条 SELECT；返回结构是否可用。"""
+    from src.utils.activity_search import mark_activity_search_ready
+
+    started = time.perf_counter()
+    version = current_schema_version()
+    if version is not None and version >= SCHEMA_VERSION:
+        if version > SCHEMA_VERSION:
+            app.logger.warning(f'数据库结构版本 {version} 高于代码版本 {SCHEMA_VERSION}，请确认部署的代码是否为最新')
+        mark_activity_search_ready(app)
+        app.logger.info(f'数据库结构版本 {version} 已是最新，跳过结构检查（{(time.perf_counter() - started) * 1000:.1f}ms）')
+        return True
+    if not app.config.get('SCHEMA_AUTO_UPGRADE', True):
+        app.logger.error(f'数据库结构版本落后（当前 {version}，需要 {SCHEMA_VERSION}），请执行 flask db-upgrade')
+        return False
+    try:
+        previous, upgraded = upgrade_schema(app)
+        if previous == upgraded:
+            # 等锁期间已由其他进程完成升级
+            mark_activity_search_ready(app)
+        return True
+    except Exception as e:
+        app.logger.error(f'启动时升级数据库结构失败: {e}')
+        return False
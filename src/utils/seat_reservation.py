@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+活动名额预留
+
+报名时不再锁定 activities 整行再 COUNT(*) 报名表，而是对 activity_seats 计数行执行一次条件更新:
+    UPDATE activity_seats SET reserved = reserved + 1
+    WHERE activity_id = :id AND (:capacity = 0 OR reserved < :capacity)
+受影响行数为1即预留成功。预留与报名记录写在同一事务中，事务回滚时计数一并回滚，因此不会超额报名。
+管理员修改报名状态同样经过预留/释放；其余旁路写入（直接删除报名等）造成的计数偏差由 reconcile_activity_seats
+定时按报名记录重算修正，备份导入后也在同一事务中重算。
+"""
+
+import logging
+from datetime import datetime
+
+import pytz
+from sqlalchemy import bindparam, text
+
+from src import db
+from src.models import Activity, ActivitySeat
+
+logger = logging.getLogger(__name__)
+
+# 占用名额的报名状态
+SEAT_STATUSES = ('registered', 'attended')
+
+
+def _dialect_name():
+    try:
+        return db.session.get_bind().dialect.name
+    except Exception:
+        return db.engine.dialect.name
+
+
+def _activity_capacity(activity):
+    return max(0, int(getattr(activity, 'max_participants', 0) or 0))
+
+
+def _increment_reserved(activity_id, capacity):
+    result = db.session.execute(
+        text("""
+            UPDATE activity_seats
+            SET reserved = reserved + 1, capacity = :capacity, updated_at = CURRENT_TIMESTAMP
+            WHERE activity_id = :activity_id AND (:capacity = 0 OR reserved < :capacity)
+        """),
+        {'activity_id': activity_id, 'capacity': capacity}
+    )
+    return (result.rowcount or 0) == 1
+
+
+def _seat_row_exists(activity_id):
+    return db.session.execute(
+        text("SELECT 1 FROM activity_seats WHERE activity_id = :activity_id"),
+        {'activity_id': activity_id}
+    ).first() is not None
+
+
+def _seed_seat_row(activity_id, capacity, user_id):
+    """首次使用时按当前报名记录初始化计数行（幂等，已存在则忽略）。
+
+    本次报名人的记录可能已随autoflush写入，初始化时将其排除，由随后的条件更新计入。
+    """
+    select_sql = """
+        SELECT :activity_id, :capacity, COUNT(*), CURRENT_TIMESTAMP, CURRENT_TIMESTAMP
+        FROM registrations
+        WHERE activity_id = :activity_id AND status IN ('registered', 'attended') AND user_id != :user_id
+    """
+    if _dialect_name() == 'postgresql':
+        sql = f"""
+            INSERT INTO activity_seats (activity_id, capacity, reserved, reconciled_at, updated_at)
+            {select_sql}
+            ON CONFLICT (activity_id) DO NOTHING
+        """
+    else:
+        sql = f"""
+            INSERT OR IGNORE INTO activity_seats (activity_id, capacity, reserved, reconciled_at, updated_at)
+            {select_sql}
+        """
+    db.session.execute(text(sql), {'activity_id': activity_id, 'capacity': capacity, 'user_id': user_id})
+
+
+def try_reserve_seat(activity, user_id):
+    """为 user_id 的报名预留一个活动名额，成功返回True；名额已满返回False。
+
+    调用方需在同一事务中写入报名记录并提交；失败时应回滚事务。
+    为缩短计数行的行锁持有时间，建议在提交前最后一步调用。
+    """
+    if not activity or not activity.id:
+        return False
+    capacity = _activity_capacity(activity)
+    if _increment_reserved(activity.id, capacity):
+        return True
+    if _seat_row_exists(activity.id):
+        return False
+    _seed_seat_row(activity.id, capacity, user_id)
+    return _increment_reserved(activity.id, capacity)
+
+
+def release_seat(activity_id, count=1):
+    """释放名额（取消报名、移出队伍等），计数不会小于0。"""
+    count = int(count or 0)
+    if not activity_id or count <= 0:
+        return
+    db.session.execute(
+        text("""
+            UPDATE activity_seats
+            SET reserved = CASE WHEN reserved > :count THEN reserved - :count ELSE 0 END,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE activity_id = :activity_id
+        """),
+        {'activity_id': activity_id, 'count': count}
+    )
+
+
+def occupies_seat(status):
+    return status in SEAT_STATUSES
+
+
+_CAPACITY_SQL = "CASE WHEN COALESCE(a.max_participants, 0) > 0 THEN a.max_participants ELSE 0 END"
+_RESERVED_SQL = (
+    "SELECT COUNT(*) FROM registrations r "
+    "WHERE r.activity_id = {activity} AND r.status IN ('registered', 'attended')"
+)
+# 每批锁定并重算的活动数，避免全量对账时长时间锁住全部计数行
+RECONCILE_CHUNK_SIZE = 500
+
+
+def _expanding(sql):
+    return text(sql).bindparams(bindparam('ids', expanding=True))
+
+
+def _reconcile_chunk(ids, now):
+    # 先按主键顺序锁定计数行：正在预留名额的事务提交后才能取得锁，随后的 COUNT 可见其报名记录；
+    # 对账提交前新的预留也会等待，计数不会被覆盖丢失（SQLite 下单条 UPDATE 本身即原子执行）
+    db.session.execute(
+        db.select(ActivitySeat.activity_id)
+        .filter(ActivitySeat.activity_id.in_(ids))
+        .order_by(ActivitySeat.activity_id)
+        .with_for_update()
+    ).all()
+
+    corrected = db.session.execute(
+        _expanding(f"""
+            UPDATE activity_seats
+            SET reserved = ({_RESERVED_SQL.format(activity='activity_seats.activity_id')}),
+                capacity = (SELECT {_CAPACITY_SQL} FROM activities a WHERE a.id = activity_seats.activity_id),
+                updated_at = CURRENT_TIMESTAMP
+            WHERE activity_id IN :ids
+              AND (reserved != ({_RESERVED_SQL.format(activity='activity_seats.activity_id')})
+                   OR capacity != (SELECT {_CAPACITY_SQL} FROM activities a WHERE a.id = activity_seats.activity_id))
+        """),
+        {'ids': ids}
+    ).rowcount or 0
+
+    insert_sql = f"""
+        INSERT INTO activity_seats (activity_id, capacity, reserved, reconciled_at, updated_at)
+        SELECT a.id, {_CAPACITY_SQL}, ({_RESERVED_SQL.format(activity='a.id')}), :now, CURRENT_TIMESTAMP
+        FROM activities a
+        WHERE a.id IN :ids
+          AND NOT EXISTS (SELECT 1 FROM activity_seats s WHERE s.activity_id = a.id)
+    """
+    if _dialect_name() == 'postgresql':
+        insert_sql += " ON CONFLICT (activity_id) DO NOTHING"
+    else:
+        insert_sql = insert_sql.replace('INSERT INTO', 'INSERT OR IGNORE INTO', 1)
+    corrected += db.session.execute(_expanding(insert_sql), {'ids': ids, 'now': now}).rowcount or 0
+
+    db.session.execute(
+        _expanding("UPDATE activity_seats SET reconciled_at = :now WHERE activity_id IN :ids"),
+        {'ids': ids, 'now': now}
+    )
+    return corrected
+
+
+def reconcile_activity_seats(activity_ids=None, commit=True):
+    """按报名记录重算名额计数，返回修正的行数。
+
+    每批活动在锁定计数行后用一条 UPDATE 按 registrations 子查询重算，与并发预留互不覆盖。
+    commit=False 时由调用方统一提交（如备份导入在同一事务中重建计数）。
+    """
+    activity_stmt = db.select(Activity.id).order_by(Activity.id)
+    if activity_ids:
+        activity_stmt = activity_stmt.filter(Activity.id.in_([int(i) for i in activity_ids]))
+    ids = db.session.execute(activity_stmt).scalars().all()
+
+    now = datetime.now(pytz.utc).replace(tzinfo=None)
+    corrected = 0
+    for start in range(0, len(ids), RECONCILE_CHUNK_SIZE):
+        corrected += _reconcile_chunk(ids[start:start + RECONCILE_CHUNK_SIZE], now)
+        if commit:
+            db.session.commit()
+
+    # 活动已删除但计数行残留（SQLite 默认不执行外键级联）
+    orphan_sql = "DELETE FROM activity_seats WHERE activity_id NOT IN (SELECT id FROM activities)"
+    params = {}
+    if activity_ids:
+        orphan_sql += " AND activity_id IN :ids"
+        params['ids'] = [int(i) for i in activity_ids]
+    corrected += db.session.execute(_expanding(orphan_sql) if params else text(orphan_sql), params).rowcount or 0
+
+    if corrected:
+        logger.info(f"名额计数对账修正 {corrected} 行")
+    if commit:
+        db.session.commit()
+    return corrected
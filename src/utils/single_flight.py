@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+按键合并并发回源（single-flight）
+
+同一个键的缓存同时失效时，只允许一个调用方回源，其余调用方等待其结果写入缓存：
+    - 进程内：每个键一把线程锁，后到的线程在锁上等待，拿到锁后先重新查缓存；
+    - 跨进程：用 Flask-Caching 的 add（Redis 下为 SET NX）抢占回源锁，未抢到的进程轮询缓存直到结果写入或超时。
+SimpleCache 后端下 add 只在本进程内有效，此时退化为仅进程内合并。
+"""
+
+import logging
+import threading
+import time
+
+from src import cache
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight(object):
+    def __init__(self, namespace, lock_seconds=10, wait_seconds=3.0, poll_interval=0.1):
+        self.namespace = namespace
+        self.lock_seconds = lock_seconds
+        self.wait_seconds = wait_seconds
+        self.poll_interval = poll_interval
+        self._guard = threading.Lock()
+        self._locks = {}
+
+    def _acquire_local(self, key):
+        with self._guard:
+            entry = self._locks.get(key)
+            if entry is None:
+                entry = self._locks[key] = [threading.Lock(), 0]
+            entry[1] += 1
+        entry[0].acquire()
+        return entry
+
+    def _release_local(self, key, entry):
+        entry[0].release()
+        with self._guard:
+            entry[1] -= 1
+            if entry[1] <= 0:
+                self._locks.pop(key, None)
+
+    def _try_remote_lock(self, lock_key):
+        try:
+            return bool(cache.add(lock_key, 1, timeout=self.lock_seconds))
+        except Exception as e:
+            # 共享缓存不可用时不阻塞回源
+            logger.debug(f"获取回源锁失败 {lock_key}: {e}")
+            return True
+
+    def _remote_lock_held(self, lock_key):
+        try:
+            return bool(cache.get(lock_key))
+        except Exception:
+            return False
+
+    def do(self, key, loader, lookup):
+        """
+        lookup() 查缓存，命中返回值、未命中返回 None；loader() 回源并负责写缓存，返回结果。
+        同一键同时只有一个 loader 在执行；等待方超时仍未等到结果时返回 None。
+        """
+        entry = self._acquire_local(key)
+        try:
+            value = lookup()
+            if value is not None:
+                return value
+            lock_key = f'{self.namespace}:flight:{key}'
+            if self._try_remote_lock(lock_key):
+                try:
+                    return loader()
+                finally:
+                    try:
+                        cache.delete(lock_key)
+                    except Exception:
+                        pass
+
+            # 其他进程正在回源，等待其写入缓存
+            deadline = time.monotonic() + self.wait_seconds
+            while time.monotonic() < deadline:
+                time.sleep(self.poll_interval)
+                value = lookup()
+                if value is not None:
+                    return value
+                if not self._remote_lock_held(lock_key):
+                    break
+            return lookup()
+        finally:
+            self._release_local(key, entry)
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+AI 对话的站内数据上下文快照
+
+build_site_data_context 原先在每条 AI 消息上都重新查询社团、标签热度和最新活动，并逐个活动懒加载
+society/tags（N+1），管理员对话还要再执行六次 COUNT。这里把上下文文本渲染一次后缓存：
+    - 数据版本号保存在共享缓存（配置 REDIS_URL 时跨进程共享）中，Activity/Society/Tag 的写入
+      （含活动标签变化）在事务提交后（after_commit）换成新的版本号；
+    - 快照按 (版本号, 活动条数) 缓存，版本号变化后自然失效；重建时一次性预加载活动的社团与标签；
+    - 管理员统计包含报名数，报名写入不换版本号，因此单独以 SITE_CONTEXT_ADMIN_STATS_SECONDS 短期缓存；
+    - 快照另有 SITE_CONTEXT_CACHE_SECONDS 的存活上限，兜底未配置共享缓存时其他进程写入的变化。
+"""
+
+import logging
+import uuid
+
+from flask import current_app
+from sqlalchemy import event, func
+from sqlalchemy.orm import joinedload, selectinload
+
+from src import cache, db
+from src.models import Activity, Registration, Society, StudentInfo, Tag, activity_tags
+from src.utils.time_helpers import display_datetime
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = 'site_context:version'
+_SESSION_KEY = 'site_context_dirty'
+_WATCHED_MODELS = (Activity, Society, Tag)
+POPULAR_TAG_LIMIT = 8
+
+
+def _format_beijing_datetime(dt, fmt='%m-%d %H:%M'):
+    """统一将活动时间按北京时间格式化，避免AI上下文出现UTC时间。"""
+    if not dt:
+        return '-'
+    return display_datetime(dt, 'Asia/Shanghai', fmt)
+
+
+def site_data_version():
+    version = cache.get(VERSION_KEY)
+    if version:
+        return version
+    cache.add(VERSION_KEY, uuid.uuid4().hex, timeout=0)
+    return cache.get(VERSION_KEY) or 'unversioned'
+
+
+def bump_site_data_version():
+    cache.set(VERSION_KEY, uuid.uuid4().hex, timeout=0)
+
+
+def _popular_tags(limit=POPULAR_TAG_LIMIT):
+    return db.session.execute(
+        db.select(Tag.name, func.count(activity_tags.c.activity_id).label('count'))
+        .join(activity_tags, activity_tags.c.tag_id == Tag.id)
+        .group_by(Tag.id, Tag.name)
+        .order_by(func.count(activity_tags.c.activity_id).desc())
+        .limit(limit)
+    ).all()
+
+
+def render_site_data_context(max_activities=20):
+    """查询并渲染站内数据上下文文本（社团、热门标签、最新活动）。"""
+    societies = db.session.execute(db.select(Society).filter_by(is_active=True)).scalars().all()
+    soc_lines = [f"{s.name}({s.code})" for s in societies]
+
+    pt_lines = [f"{name}:{count}" for name, count in _popular_tags()]
+
+    activities = db.session.execute(
+        db.select(Activity).options(
+            joinedload(Activity.society), selectinload(Activity.tags)
+        ).order_by(Activity.created_at.desc()).limit(max_activities)
+    ).unique().scalars().all()
+
+    if not activities:
+        activity_lines = ["无数据"]
+    else:
+        activity_lines = []
+        for a in activities:
+            soc_name = a.society.name if a.society else '无'
+            st = _format_beijing_datetime(a.start_time, '%m-%d %H:%M')
+            et = _format_beijing_datetime(a.end_time, '%m-%d %H:%M')
+            tag_names = ','.join([tag.name for tag in a.tags]) if a.tags else '无'
+            activity_lines.append(f"[{a.id}]{a.title}|{soc_name}|{tag_names}|{a.status}|{st}至{et}")
+
+    return (
+        f"【社团库】{','.join(soc_lines)}\n"
+        f"【热标】{','.join(pt_lines)}\n"
+        f"【最新活动表(ID|名称|社团|标签|状态|起止时间，均为北京时间)】\n" + "\n".join(activity_lines)
+    )
+
+
+def get_site_data_context(max_activities=20):
+    """返回当前数据版本下的站内数据上下文，未命中时重建并缓存。"""
+    key = f'site_context:{site_data_version()}:{int(max_activities)}'
+    text = cache.get(key)
+    if text is None:
+        text = render_site_data_context(max_activities)
+        cache.set(key, text, timeout=current_app.config.get('SITE_CONTEXT_CACHE_SECONDS', 600))
+    return text
+
+
+def compute_admin_stats():
+    activity_counts = dict(db.session.execute(
+        db.select(Activity.status, func.count(Activity.id)).group_by(Activity.status)
+    ).all())
+    registration_counts = dict(db.session.execute(
+        db.select(Registration.status, func.count(Registration.id)).group_by(Registration.status)
+    ).all())
+    return {
+        'total_activities': sum(activity_counts.values()),
+        'active_activities': activity_counts.get('active', 0),
+        'completed_activities': activity_counts.get('completed', 0),
+        'total_students': db.session.execute(db.select(func.count()).select_from(StudentInfo)).scalar() or 0,
+        'total_registrations': sum(registration_counts.values()),
+        'attended_registrations': registration_counts.get('checked_in', 0),
+        'popular_tags': [(name, count) for name, count in _popular_tags(5)]
+    }
+
+
+def get_admin_stats():
+    """管理员对话使用的平台统计（短期缓存）。"""
+    key = f'site_context:admin_stats:{site_data_version()}'
+    stats = cache.get(key)
+    if stats is None:
+        stats = compute_admin_stats()
+        cache.set(key, stats, timeout=current_app.config.get('SITE_CONTEXT_ADMIN_STATS_SECONDS', 60))
+    return stats
+
+
+def _after_flush(session, flush_context):
+    if session.info.get(_SESSION_KEY):
+        return
+    for collection in (session.new, session.dirty, session.deleted):
+        if any(isinstance(obj, _WATCHED_MODELS) for obj in collection):
+            session.info[_SESSION_KEY] = True
+            return
+
+
+def _after_commit(session):
+    if not session.info.pop(_SESSION_KEY, None):
+        return
+    try:
+        bump_site_data_version()
+    except Exception as e:
+        logger.warning(f"更新站内数据版本失败: {e}")
+
+
+def _after_soft_rollback(session, previous_transaction):
+    if not previous_transaction.nested:
+        session.info.pop(_SESSION_KEY, None)
+
+
+def register_site_context_listeners():
+    for name, listener in (
+        ('after_flush', _after_flush),
+        ('after_commit', _after_commit),
+        ('after_soft_rollback', _after_soft_rollback),
+    ):
+        if not event.contains(db.session, name, listener):
+            event.listen(db.session, name, listener)
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+AI 对话流式响应的并发闸门与转发
+
+每个 SSE 对话在整个生成过程中（最长到上游读超时）占用一个连接：
+    - StreamGate 限制单个用户同时进行的流数（AI_STREAM_MAX_PER_USER）以及单个 worker 承载的流总数
+      （AI_STREAM_MAX_PER_WORKER）。配置 REDIS_URL 时用户名额记在 Redis 有序集合中（多进程共享，
+      成员为名额令牌、分数为到期时间，进程崩溃遗留的名额到期自动清除）；否则只在进程内计数；
+    - relay_stream 在后台线程读取上游，经有界队列转交给响应生成器：客户端读得慢时队列写满，
+      读取线程随之暂停读取上游（背压）；队列中已到达的小片段合并为一次输出；
+      上游长时间无输出时产出 None，由调用方发送心跳注释，避免代理因空闲断开连接。
+专用的 gevent 入口见项目根目录 stream_wsgi.py，其中线程与队列都是协程，少量 worker 即可承载大量并发流。
+"""
+
+import logging
+import queue
+import threading
+import time
+import uuid
+
+from flask import current_app
+
+logger = logging.getLogger(__name__)
+
+_ITEM = 'item'
+_END = 'end'
+_ERROR = 'error'
+
+
+class MemoryStreamSlots(object):
+    """进程内的用户名额记录：{user_id: {令牌: 到期时间}}。"""
+
+    name = 'memory'
+
+    def __init__(self):
+        self._slots = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, user_id, limit, ttl):
+        now = time.monotonic()
+        with self._lock:
+            slots = self._slots.setdefault(user_id, {})
+            for token, expires_at in list(slots.items()):
+                if expires_at <= now:
+                    del slots[token]
+            if len(slots) >= limit:
+                return None
+            token = uuid.uuid4().hex
+            slots[token] = now + ttl
+            return token
+
+    def touch(self, user_id, token, ttl):
+        with self._lock:
+            slots = self._slots.get(user_id)
+            if slots and token in slots:
+                slots[token] = time.monotonic() + ttl
+
+    def release(self, user_id, token):
+        with self._lock:
+            slots = self._slots.get(user_id)
+            if slots is None:
+                return
+            slots.pop(token, None)
+            if not slots:
+                del self._slots[user_id]
+
+    def active(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            return sum(1 for expires_at in self._slots.get(user_id, {}).values() if expires_at > now)
+
+
+class RedisStreamSlots(object):
+    """Redis 有序集合：先清除过期令牌、加入新令牌，再按名次判断是否超出上限（超出则撤回）。"""
+
+    name = 'redis'
+    key_prefix = 'ai_stream:slots:'
+
+    def __init__(self, client):
+        self.client = client
+
+    def _key(self, user_id):
+        return f'{self.key_prefix}{user_id}'
+
+    def acquire(self, user_id, limit, ttl):
+        key = self._key(user_id)
+        now = time.time()
+        token = uuid.uuid4().hex
+        pipe = self.client.pipeline()
+        pipe.zremrangebyscore(key, '-inf', now)
+        pipe.zadd(key, {token: now + ttl})
+        pipe.zrank(key, token)
+        pipe.expire(key, int(ttl) + 60)
+        _, _, rank, _ = pipe.execute()
+        # 名次按到期时间排序，新令牌到期最晚；并发申请时可能都被撤回，但不会超发
+        if rank is None or rank >= limit:
+            self.client.zrem(key, token)
+            return None
+        return token
+
+    def touch(self, user_id, token, ttl):
+        key = self._key(user_id)
+        pipe = self.client.pipeline()
+        pipe.zadd(key, {token: time.time() + ttl}, xx=True)
+        pipe.expire(key, int(ttl) + 60)
+        pipe.execute()
+
+    def release(self, user_id, token):
+        self.client.zrem(self._key(user_id), token)
+
+    def active(self, user_id):
+        return int(self.client.zcount(self._key(user_id), f'({time.time()}', '+inf'))
+
+
+class StreamLease(object):
+    """一次流式响应占用的名额；release 可重复调用。"""
+
+    def __init__(self, gate, user_id, token):
+        self.gate = gate
+        self.user_id = user_id
+        self.token = token
+        self._last_touch = time.monotonic()
+        self._released = False
+        self._lock = threading.Lock()
+
+    def touch(self):
+        """延长用户名额的到期时间（按 touch_interval 节流）。"""
+        if self._released or self.token is None:
+            return
+        now = time.monotonic()
+        if now - self._last_touch < self.gate.touch_interval:
+            return
+        self._last_touch = now
+        try:
+            self.gate.slots.touch(self.user_id, self.token, self.gate.slot_ttl)
+        except Exception as e:
+            logger.warning(f"续期 AI 对话流名额失败: {e}")
+
+    def release(self):
+        with self._lock:
+            if self._released:
+                return
+            self._released = True
+        self.gate._release(self)
+
+
+class StreamGate(object):
+    def __init__(self, slots, max_per_user=2, max_per_worker=200, slot_ttl=300, touch_interval=15):
+        self.slots = slots
+        self.max_per_user = max(1, int(max_per_user))
+        self.max_per_worker = max(1, int(max_per_worker))
+        self.slot_ttl = slot_ttl
+        self.touch_interval = touch_interval
+        self._worker_slots = threading.BoundedSemaphore(self.max_per_worker)
+        self._active_lock = threading.Lock()
+        self.active = 0
+
+    def acquire(self, user_id):
+        """申请一个流名额，返回 (StreamLease, None)；名额不足时返回 (None, 提示信息)。"""
+        if not self._worker_slots.acquire(blocking=False):
+            return None, 'AI 服务繁忙，请稍后再试'
+        try:
+            token = self.slots.acquire(user_id, self.max_per_user, self.slot_ttl)
+        except Exception as e:
+            # 共享存储不可用时只保留 worker 级上限，不阻断对话
+            logger.warning(f"申请 AI 对话流名额失败: {e}")
+            token = ''
+        if token is None:
+            self._worker_slots.release()
+            return None, f'你已有 {self.max_per_user} 个对话正在生成，请等待完成后再发送'
+        with self._active_lock:
+            self.active += 1
+        return StreamLease(self, user_id, token or None), None
+
+    def _release(self, lease):
+        with self._active_lock:
+            self.active -= 1
+        self._worker_slots.release()
+        if lease.token is None:
+            return
+        try:
+            self.slots.release(lease.user_id, lease.token)
+        except Exception as e:
+            logger.warning(f"释放 AI 对话流名额失败: {e}")
+
+
+def get_stream_gate(app=None):
+    app = app or current_app
+    gate = app.extensions.get('ai_stream_gate')
+    if gate is None:
+        redis_url = (app.config.get('AI_STREAM_REDIS_URL') or '').strip()
+        if redis_url:
+            import redis
+            slots = RedisStreamSlots(redis.Redis.from_url(redis_url))
+        else:
+            slots = MemoryStreamSlots()
+        gate = StreamGate(
+            slots,
+            max_per_user=app.config.get('AI_STREAM_MAX_PER_USER', 2),
+            max_per_worker=app.config.get('AI_STREAM_MAX_PER_WORKER', 200),
+            slot_ttl=app.config.get('AI_STREAM_SLOT_SECONDS', 300),
+            touch_interval=app.config.get('AI_STREAM_HEARTBEAT_SECONDS', 15)
+        )
+        app.extensions['ai_stream_gate'] = gate
+    return gate
+
+
+def relay_stream(source, buffer_size=64, heartbeat_seconds=15, max_batch_chars=2048):
+    """
+    在后台线程迭代 source（字符串片段），按客户端消费速度转交。
+    产出合并后的字符串；heartbeat_seconds 内没有新片段时产出 None。source 抛出的异常在此重新抛出。
+    调用方结束迭代后应关闭上游连接，使仍阻塞在读取上的后台线程退出。
+    """
+    chunks = queue.Queue(maxsize=max(1, int(buffer_size)))
+    stopped = threading.Event()
+
+    def put(kind, value=None):
+        while not stopped.is_set():
+            try:
+                chunks.put((kind, value), timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def pump():
+        try:
+            for item in source:
+                if item and not put(_ITEM, item):
+                    return
+            put(_END)
+        except Exception as e:
+            if not stopped.is_set():
+                put(_ERROR, e)
+
+    threading.Thread(target=pump, name='ai-stream-relay', daemon=True).start()
+
+    pending = None
+    try:
+        while True:
+            if pending is not None:
+                kind, value = pending
+                pending = None
+            else:
+                try:
+                    kind, value = chunks.get(timeout=heartbeat_seconds)
+                except queue.Empty:
+                    yield None
+                    continue
+            if kind == _END:
+                return
+            if kind == _ERROR:
+                raise value
+
+            # 合并已经到达的片段，减少小包写出次数
+            parts = [value]
+            size = len(value)
+            while size < max_batch_chars:
+                try:
+                    item = chunks.get_nowait()
+                except queue.Empty:
+                    break
+                if item[0] != _ITEM:
+                    pending = item
+                    break
+                parts.append(item[1])
+                size += len(item[1])
+            yield ''.join(parts)
+    finally:
+        stopped.set()
@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+用户未读计数
+
+user_unread_counters 每个用户一行，保存未读通知数与未读消息数。
+写入侧通过 Session after_flush 钩子增量维护：
+    - 新建公开通知：所有计数行 +1；新建个人通知（is_public=False）：created_by 用户 +1
+    - 新建 NotificationRead：按本次标记的、对该用户可见且未过期的通知数量减少
+    - 消息新建/已读状态变化/删除：接收人的未读消息数相应增减
+无法增量处理的变更（删除通知、修改可见性、绕过ORM的批量删除/更新）将受影响的计数行标记为 stale，
+通知过期也会让计数失真，因此每行记录已计入通知中最早的过期时间；读取时发现 stale 或已过期即按原查询重算。
+`flask reconcile-unread-counters` 定时在行锁内重算全部计数行，修正其余偏差。
+"""
+
+import logging
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import DateTime, event, func, inspect, text, bindparam, and_, or_
+
+from src import db
+from src.models import Message, Notification, NotificationRead, UserUnreadCounter
+
+logger = logging.getLogger(__name__)
+
+NOTIFICATION_VISIBILITY_FIELDS = ('is_public', 'created_by', 'expiry_date', 'title', 'content')
+
+
+def _utcnow():
+    return datetime.utcnow()
+
+
+def _loaded(obj, key):
+    """读取已加载的属性值，避免在 flush 钩子中触发懒加载。"""
+    return inspect(obj).dict.get(key)
+
+
+def _history(obj, key):
+    """返回 (旧值, 新值, 是否变更, 旧值是否已知)。"""
+    history = inspect(obj).attrs[key].history
+    if not history.has_changes():
+        return None, None, False, True
+    old = history.deleted[0] if history.deleted else None
+    new = history.added[0] if history.added else None
+    return old, new, True, bool(history.deleted)
+
+
+def _counts_as_unread(notification, now):
+    if _loaded(notification, 'title') is None or _loaded(notification, 'content') is None:
+        return False
+    expiry = _loaded(notification, 'expiry_date')
+    return expiry is None or expiry.replace(tzinfo=None) >= now
+
+
+def _collect_changes(session, now):
+    plan = {
+        'stale_all': False,
+        'stale_users': set(),
+        'public_new': [],  # 新公开通知的过期时间列表
+        'private_new': defaultdict(list),  # user_id -> 新个人通知的过期时间列表
+        'reads': defaultdict(set),  # user_id -> 新标记的通知ID
+        'message_deltas': defaultdict(int),
+    }
+
+    def stale_notification_scope(public_values, owners):
+        if any(public_values):
+            plan['stale_all'] = True
+        else:
+            plan['stale_users'].update(u for u in owners if u)
+
+    for obj in session.new:
+        if isinstance(obj, Notification):
+            if not _counts_as_unread(obj, now):
+                continue
+            expiry = _loaded(obj, 'expiry_date')
+            expiry = expiry.replace(tzinfo=None) if expiry else None
+            if _loaded(obj, 'is_public') is False:
+                owner = _loaded(obj, 'created_by')
+                if owner:
+                    plan['private_new'][owner].append(expiry)
+            else:
+                plan['public_new'].append(expiry)
+        elif isinstance(obj, NotificationRead):
+            user_id = _loaded(obj, 'user_id')
+            notification_id = _loaded(obj, 'notification_id')
+            if user_id and notification_id:
+                plan['reads'][user_id].add(notification_id)
+        elif isinstance(obj, Message):
+            if not _loaded(obj, 'is_read'):
+                receiver = _loaded(obj, 'receiver_id')
+                if receiver:
+                    plan['message_deltas'][receiver] += 1
+
+    for obj in session.dirty:
+        if not session.is_modified(obj, include_collections=False):
+            continue
+        if isinstance(obj, Notification):
+            changed = False
+            public_values = [_loaded(obj, 'is_public') is not False]
+            owners = {_loaded(obj, 'created_by')}
+            for key in NOTIFICATION_VISIBILITY_FIELDS:
+                old, new, key_changed, _ = _history(obj, key)
+                if not key_changed:
+                    continue
+                changed = True
+                if key == 'is_public':
+                    public_values.append(old is not False)
+                elif key == 'created_by':
+                    owners.add(old)
+            if changed:
+                stale_notification_scope(public_values, owners)
+        elif isinstance(obj, NotificationRead):
+            old_user, _, user_changed, _ = _history(obj, 'user_id')
+            _, _, target_changed, _ = _history(obj, 'notification_id')
+            if user_changed or target_changed:
+                plan['stale_users'].update((old_user, _loaded(obj, 'user_id')))
+        elif isinstance(obj, Message):
+            receiver = _loaded(obj, 'receiver_id')
+            old_receiver, _, receiver_changed, _ = _history(obj, 'receiver_id')
+            if receiver_changed:
+                plan['stale_users'].update(u for u in (old_receiver, receiver) if u)
+                continue
+            old, new, changed, old_known = _history(obj, 'is_read')
+            if not changed:
+                continue
+            if not old_known:
+                plan['stale_users'].add(receiver)
+            elif bool(old) != bool(new):
+                plan['message_deltas'][receiver] += -1 if new else 1
+
+    for obj in session.deleted:
+        if isinstance(obj, Notification):
+            stale_notification_scope([_loaded(obj, 'is_public') is not False], {_loaded(obj, 'created_by')})
+        elif isinstance(obj, NotificationRead):
+            plan['stale_users'].add(_loaded(obj, 'user_id'))
+        elif isinstance(obj, Message):
+            receiver = _loaded(obj, 'receiver_id')
+            if 'is_read' not in inspect(obj).dict:
+                plan['stale_users'].add(receiver)
+            elif not _loaded(obj, 'is_read'):
+                plan['message_deltas'][receiver] -= 1
+
+    plan['stale_users'].discard(None)
+    plan['message_deltas'].pop(None, None)
+    return plan
+
+
+def _increment_notification_sql(where=''):
+    """未读通知 +1，并把计数行的最早过期时间更新为 min(原值, 新通知过期时间)。"""
+    return text(f"""
+        UPDATE user_unread_counters
+        SET notification_unread = notification_unread + 1,
+            notification_expires_at = CASE
+                WHEN CAST(:expiry AS TIMESTAMP) IS NULL THEN notification_expires_at
+                WHEN notification_expires_at IS NULL OR notification_expires_at > :expiry THEN :expiry
+                ELSE notification_expires_at
+            END
+        {where}
+    """).bindparams(bindparam('expiry', type_=DateTime))
+
+
+_VISIBLE_READ_COUNT_SQL = text("""
+    SELECT COUNT(*) FROM notification
+    WHERE id IN :ids
+      AND (is_public = :true OR (is_public = :false AND created_by = :user_id))
+      AND (expiry_date IS NULL OR expiry_date >= :now)
+      AND title IS NOT NULL AND content IS NOT NULL
+""").bindparams(bindparam('ids', expanding=True))
+
+
+def _after_flush(session, flush_context):
+    now = _utcnow()
+    try:
+        plan = _collect_changes(session, now)
+    except Exception as e:
+        logger.warning(f"收集未读计数变更失败（将由对账命令修正）: {e}")
+        return
+    if not (plan['stale_all'] or plan['stale_users'] or plan['public_new'] or plan['private_new']
+            or plan['reads'] or plan['message_deltas']):
+        return
+
+    conn = session.connection()
+    if plan['stale_all']:
+        conn.execute(text("UPDATE user_unread_counters SET stale = :true"), {'true': True})
+        return
+
+    if plan['stale_users']:
+        conn.execute(
+            text("UPDATE user_unread_counters SET stale = :true WHERE user_id IN :user_ids")
+            .bindparams(bindparam('user_ids', expanding=True)),
+            {'true': True, 'user_ids': sorted(plan['stale_users'])}
+        )
+
+    for expiry in plan['public_new']:
+        conn.execute(_increment_notification_sql(), {'expiry': expiry})
+    for user_id, expiries in plan['private_new'].items():
+        for expiry in expiries:
+            conn.execute(_increment_notification_sql("WHERE user_id = :user_id"), {'expiry': expiry, 'user_id': user_id})
+
+    for user_id, notification_ids in plan['reads'].items():
+        visible = conn.execute(_VISIBLE_READ_COUNT_SQL, {
+            'ids': sorted(notification_ids), 'user_id': user_id, 'now': now, 'true': True, 'false': False
+        }).scalar() or 0
+        if visible:
+            conn.execute(text("""
+                UPDATE user_unread_counters
+                SET notification_unread = CASE WHEN notification_unread > :count THEN notification_unread - :count ELSE 0 END
+                WHERE user_id = :user_id
+            """), {'count': visible, 'user_id': user_id})
+
+    for user_id, delta in plan['message_deltas'].items():
+        if not delta:
+            continue
+        conn.execute(text("""
+            UPDATE user_unread_counters
+            SET message_unread = CASE WHEN message_unread + :delta < 0 THEN 0 ELSE message_unread + :delta END
+            WHERE user_id = :user_id
+        """), {'delta': delta, 'user_id': user_id})
+
+
+def register_unread_counter_listeners():
+    if not event.contains(db.session, 'after_flush', _after_flush):
+        event.listen(db.session, 'after_flush', _after_flush)
+
+
+def _visible_notifications_filter(user_id, now):
+    return and_(
+        or_(
+            Notification.is_public == True,
+            and_(Notification.is_public == False, Notification.created_by == user_id)
+        ),
+        or_(Notification.expiry_date == None, Notification.expiry_date >= now),
+        Notification.title.isnot(None),
+        Notification.content.isnot(None),
+    )
+
+
+def _recount_values(user_id, now):
+    """按原始查询计算未读计数的标量子查询；user_id 可为计数表的列（逐行关联）或具体值。"""
+    unread_filter = and_(
+        _visible_notifications_filter(user_id, now),
+        ~db.select(NotificationRead.id).filter(
+            NotificationRead.notification_id == Notification.id,
+            NotificationRead.user_id == user_id
+        ).correlate_except(NotificationRead).exists()
+    )
+    return {
+        'notification_unread': db.select(func.count(Notification.id)).filter(unread_filter).scalar_subquery(),
+        'notification_expires_at': db.select(func.min(Notification.expiry_date)).filter(unread_filter).scalar_subquery(),
+        'message_unread': db.select(func.count(Message.id)).filter(
+            Message.receiver_id == user_id,
+            Message.is_read == False
+        ).scalar_subquery(),
+    }
+
+
+def _lock_counter_rows(conn, user_ids):
+    """按主键顺序锁定计数行：持锁期间增量更新需等待，随后的重算可见此前已提交的变更，不会互相覆盖。"""
+    conn.execute(
+        db.select(UserUnreadCounter.user_id)
+        .filter(UserUnreadCounter.user_id.in_(user_ids))
+        .order_by(UserUnreadCounter.user_id)
+        .with_for_update()
+    ).all()
+
+
+def _insert_placeholder_sql(dialect):
+    sql = """
+        INSERT INTO user_unread_counters
+            (user_id, notification_unread, message_unread, stale, updated_at)
+        VALUES (:user_id, 0, 0, :true, :now)
+    """
+    if dialect == 'postgresql':
+        return text(sql + " ON CONFLICT (user_id) DO NOTHING")
+    return text(sql.replace('INSERT INTO', 'INSERT OR IGNORE INTO', 1))
+
+
+def refresh_unread_counts(user_id):
+    """按原始查询重算并回填某用户的未读计数，返回 (未读通知数, 未读消息数)。"""
+    now = _utcnow()
+    try:
+        # 独立连接回填，避免提交调用方会话。计数行缺失时先提交一行失效占位，
+        # 之后的增量更新都会落在该行上，再在行锁内用一条 UPDATE 按子查询重算
+        with db.engine.begin() as conn:
+            conn.execute(_insert_placeholder_sql(conn.dialect.name), {'user_id': user_id, 'true': True, 'now': now})
+        with db.engine.begin() as conn:
+            _lock_counter_rows(conn, [user_id])
+            conn.execute(
+                db.update(UserUnreadCounter)
+                .where(UserUnreadCounter.user_id == user_id)
+                .values(stale=False, reconciled_at=now, updated_at=now, **_recount_values(user_id, now))
+            )
+            row = conn.execute(
+                db.select(UserUnreadCounter.notification_unread, UserUnreadCounter.message_unread)
+                .filter(UserUnreadCounter.user_id == user_id)
+            ).one()
+        return int(row.notification_unread or 0), int(row.message_unread or 0)
+    except Exception as e:
+        logger.warning(f"回填未读计数失败: user_id={user_id}, error={e}")
+    row = db.session.execute(db.select(*_recount_values(user_id, now).values())).one()
+    return int(row[0] or 0), int(row[2] or 0)
+
+
+def get_unread_counts(user_id):
+    """读取用户的 (未读通知数, 未读消息数)；计数行缺失、被标记失效或有通知已过期时重算。"""
+    row = db.session.execute(
+        db.select(
+            UserUnreadCounter.notification_unread,
+            UserUnreadCounter.message_unread,
+            UserUnreadCounter.notification_expires_at,
+            UserUnreadCounter.stale
+        ).filter(UserUnreadCounter.user_id == user_id)
+    ).first()
+    if row is None or row.stale or (row.notification_expires_at and row.notification_expires_at < _utcnow()):
+        return refresh_unread_counts(user_id)
+    return int(row.notification_unread or 0), int(row.message_unread or 0)
+
+
+def mark_unread_counters_stale(user_ids=None):
+    """绕过ORM的批量删除/更新后调用：user_ids 为空时标记全部计数行失效。"""
+    stmt = db.update(UserUnreadCounter).values(stale=True)
+    if user_ids is not None:
+        ids = [int(u) for u in user_ids if u]
+        if not ids:
+            return
+        stmt = stmt.where(UserUnreadCounter.user_id.in_(ids))
+    db.session.execute(stmt)
+
+
+def increment_notification_unread_for_reminder_batch(batch_token, expiry_date):
+    """活动开始提醒以 INSERT ... SELECT 批量写入通知，需在同一事务内为该批次的接收人计数 +1。"""
+    db.session.execute(
+        _increment_notification_sql(
+            "WHERE user_id IN (SELECT user_id FROM activity_reminders WHERE batch_token = :batch_token)"
+        ),
+        {'batch_token': batch_token, 'expiry': expiry_date}
+    )
+
+
+# 每批锁定并重算的计数行数，避免对账时长时间锁住全部计数行
+RECONCILE_CHUNK_SIZE = 1000
+
+
+def reconcile_unread_counters():
+    """重算全部已有计数行，返回修正的行数。
+
+    每批计数行先加行锁，再用一条 UPDATE 按关联子查询重算，与并发的增量更新互不覆盖。
+    """
+    user_ids = db.session.execute(
+        db.select(UserUnreadCounter.user_id).order_by(UserUnreadCounter.user_id)
+    ).scalars().all()
+    corrected = 0
+    for start in range(0, len(user_ids), RECONCILE_CHUNK_SIZE):
+        chunk = user_ids[start:start + RECONCILE_CHUNK_SIZE]
+        now = _utcnow()
+        _lock_counter_rows(db.session, chunk)
+        values = _recount_values(UserUnreadCounter.user_id, now)
+        in_chunk = UserUnreadCounter.user_id.in_(chunk)
+        result = db.session.execute(
+            db.update(UserUnreadCounter)
+            .where(in_chunk)
+            .where(or_(
+                UserUnreadCounter.stale == True,
+                UserUnreadCounter.notification_unread != values['notification_unread'],
+                UserUnreadCounter.message_unread != values['message_unread'],
+            ))
+            .values(stale=False, notification_unread=values['notification_unread'],
+                    message_unread=values['message_unread'])
+            .execution_options(synchronize_session=False)
+        )
+        corrected += result.rowcount or 0
+        db.session.execute(
+            db.update(UserUnreadCounter)
+            .where(in_chunk)
+            .values(notification_expires_at=values['notification_expires_at'], reconciled_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+    if corrected:
+        logger.info(f"未读计数对账修正 {corrected} 行")
+    return corrected
@@ -5,25 +5,43 @@ import requests
 import logging
 from datetime import datetime, timedelta
 import json
-import time
 import pytz
+from src import cache
 from src.config import Config
+from src.utils.hedged_requests import HedgedFetcher
+from src.utils.lru_cache import LRUTTLCache
+from src.utils.single_flight import SingleFlight
 from src.utils.time_helpers import get_localized_now
 
 logger = logging.getLogger(__name__)
 
 WEATHER_HTTP_TIMEOUT = (1.5, 2.5)
+# 页面请求等待天气的整体上限（主接口与对冲的备用接口合计）
 WEATHER_FALLBACK_BUDGET_SECONDS = 2.2
+# 共享缓存（Flask-Caching）中天气数据与“未取到”标记的存活时间
 WEATHER_CACHE_TTL_SECONDS = {
     'base': 300,
     'all': 900
 }
-_WEATHER_CACHE = {}
-_WEATHER_MISS_CACHE = {}
 WEATHER_MISS_TTL_SECONDS = {
     'base': 300,
     'all': 1800
 }
+# 进程内一级缓存的存活时间：较短，使各 worker 尽快看到后台预取写入共享缓存的新数据
+WEATHER_LOCAL_TTL_SECONDS = 60
+# 展示天气的日期范围：活动日期距今 -1 ~ 5 天
+WEATHER_FORECAST_DAYS = 5
+WEATHER_PAST_DAYS = 1
+
+# 两级缓存：一级为进程内 LRU（条目数与存活时间有界），二级为 Flask-Caching（配置 Redis 时跨 worker 共享），
+# 之后才是数据库每日缓存 WeatherDailyCache 与第三方接口
+_WEATHER_CACHE = LRUTTLCache(maxsize=Config.WEATHER_LOCAL_CACHE_SIZE, ttl=WEATHER_LOCAL_TTL_SECONDS)
+_WEATHER_MISS_CACHE = LRUTTLCache(maxsize=Config.WEATHER_LOCAL_CACHE_SIZE, ttl=WEATHER_LOCAL_TTL_SECONDS)
+# 同一城市+日期并发未命中时只回源一次；等待时长覆盖一次完整的主接口+备用接口请求
+_WEATHER_FLIGHT = SingleFlight('weather', lock_seconds=10, wait_seconds=WEATHER_FALLBACK_BUDGET_SECONDS + 3)
+_WEATHER_MISS = object()
+# 高德为主、OpenWeather 为备用的对冲请求；对冲延迟取高德近期延迟的 p90
+_WEATHER_HEDGE = HedgedFetcher(default_delay=0.8, min_delay=0.3, max_delay=1.5, max_workers=8, thread_name_prefix='weather')
 
 
 def _resolve_weather_date(activity_date=None):
@@ -47,39 +65,57 @@ def _weather_cache_key(city_adcode, extensions, activity_date=None):
     return f"{city_adcode}:{extensions}:{date_key}"
 
 
-def _weather_cache_get(key):
-    item = _WEATHER_CACHE.get(key)
-    if not item:
-        return None
-    if item['expires_at'] <= time.time():
-        _WEATHER_CACHE.pop(key, None)
+def _shared_cache_get(key):
+    try:
+        return cache.get(key)
+    except Exception as e:
+        logger.debug(f"读取共享天气缓存失败: {e}")
         return None
-    return item['data']
+
+
+def _shared_cache_set(key, value, timeout):
+    try:
+        cache.set(key, value, timeout=timeout)
+    except Exception as e:
+        logger.debug(f"写入共享天气缓存失败: {e}")
+
+
+def _weather_cache_get(key):
+    data = _WEATHER_CACHE.get(key)
+    if data:
+        return data
+    data = _shared_cache_get(f'weather:data:{key}')
+    if data:
+        _WEATHER_CACHE.set(key, data)
+    return data
 
 
 def _weather_cache_set(key, data, extensions):
     if not data:
         return
     ttl = WEATHER_CACHE_TTL_SECONDS.get(extensions, 300)
-    _WEATHER_CACHE[key] = {
-        'data': data,
-        'expires_at': time.time() + ttl
-    }
+    _WEATHER_CACHE.set(key, data, ttl=min(ttl, WEATHER_LOCAL_TTL_SECONDS))
+    _shared_cache_set(f'weather:data:{key}', data, ttl)
+    _WEATHER_MISS_CACHE.delete(key)
+    try:
+        cache.delete(f'weather:miss:{key}')
+    except Exception:
+        pass
 
 
 def _weather_miss_hit(key):
-    expires_at = _WEATHER_MISS_CACHE.get(key)
-    if not expires_at:
-        return False
-    if expires_at <= time.time():
-        _WEATHER_MISS_CACHE.pop(key, None)
-        return False
-    return True
+    if _WEATHER_MISS_CACHE.get(key):
+        return True
+    if _shared_cache_get(f'weather:miss:{key}'):
+        _WEATHER_MISS_CACHE.set(key, True)
+        return True
+    return False
 
 
 def _weather_miss_set(key, extensions):
     ttl = WEATHER_MISS_TTL_SECONDS.get(extensions, 300)
-    _WEATHER_MISS_CACHE[key] = time.time() + ttl
+    _WEATHER_MISS_CACHE.set(key, True, ttl=min(ttl, WEATHER_LOCAL_TTL_SECONDS))
+    _shared_cache_set(f'weather:miss:{key}', 1, ttl)
 
 
 def _get_db_weather_cache(city_adcode, extensions, activity_date=None):
@@ -492,7 +528,74 @@ def openweather_to_weather_icon(openweather_icon):
     }
     return icon_map.get(openweather_icon, 'wi-na')
 
-def get_weather_data_with_fallback(city_adcode=CHONGQING_ADCODE, extensions='base', activity_date=None):
+def store_weather_cache(city_adcode, extensions, activity_date, weather_data):
+    """写入进程内缓存与数据库每日缓存。"""
+    cache_key = _weather_cache_key(city_adcode, extensions, activity_date)
+    _weather_cache_set(cache_key, weather_data, extensions)
+    _save_db_weather_cache(city_adcode, extensions, activity_date, weather_data)
+
+
+def get_cached_weather(city_adcode=CHONGQING_ADCODE, extensions='base', activity_date=None):
+    """只读缓存（进程内缓存，其次数据库每日缓存），不访问第三方接口。"""
+    cache_key = _weather_cache_key(city_adcode, extensions, activity_date)
+    cached = _weather_cache_get(cache_key)
+    if cached:
+        return cached
+
+    db_cached = _get_db_weather_cache(city_adcode, extensions, activity_date)
+    if db_cached:
+        _weather_cache_set(cache_key, db_cached, extensions)
+        return db_cached
+    return None
+
+
+def _fallback_weather(extensions, activity_date):
+    # 将高德的extensions参数转换为OpenWeather的日期参数
+    if extensions == 'all' and activity_date:
+        # 预报天气
+        return get_openweather_data('Chongqing', activity_date)
+    # 实况天气
+    return get_openweather_data('Chongqing', None)
+
+
+def weather_provider_stats():
+    """本进程内各天气接口的调用次数、错误数与延迟分位（驱动对冲延迟）。"""
+    return _WEATHER_HEDGE.snapshot()
+
+
+def fetch_weather_with_fallback(city_adcode=CHONGQING_ADCODE, extensions='base', activity_date=None,
+                                budget_seconds=WEATHER_FALLBACK_BUDGET_SECONDS, amap_data=None):
+    """
+    直接请求第三方接口（不读写缓存）：先发出高德请求，对冲延迟内未返回有效结果时并行请求 OpenWeather，取先到的有效结果。
+
+    budget_seconds 为整体等待上限，超出即放弃（None 表示不限，用于后台预取）；
+    amap_data 可传入已取到的高德数据（同一次预报适用于多个日期时复用），False 表示高德已请求失败、直接走备用接口。
+    """
+    if amap_data is not None:
+        if amap_data:
+            weather_data = dict(amap_data)
+            weather_data['api_source'] = 'amap'
+            return weather_data
+        return _fallback_weather(extensions, activity_date)
+
+    provider, weather_data = _WEATHER_HEDGE.fetch(
+        ('amap', lambda: get_weather_data(city_adcode, extensions, allow_fallback=False)),
+        ('openweather', lambda: _fallback_weather(extensions, activity_date)),
+        timeout=budget_seconds
+    )
+    if not weather_data:
+        logger.error("所有天气API都失败，无法获取天气数据")
+        return None
+    if provider == 'amap':
+        weather_data = dict(weather_data)
+        weather_data['api_source'] = 'amap'
+        logger.info("高德API获取天气数据成功")
+    else:
+        logger.info("备用OpenWeather API获取天气数据成功")
+    return weather_data
+
+
+def get_weather_data_with_fallback(city_adcode=CHONGQING_ADCODE, extensions='base', activity_date=None, cache_only=False):
     """
     获取天气数据，高德API失败时自动切换到OpenWeather API
     
@@ -500,70 +603,65 @@ def get_weather_data_with_fallback(city_adcode=CHONGQING_ADCODE, extensions='bas
         city_adcode (str): 城市区域编码，默认为重庆
         extensions (str): 气象类型，base=实况天气，all=预报天气
         activity_date (datetime): 活动日期，用于OpenWeather API
+        cache_only (bool): 只读缓存，未命中时直接返回None
     
     Returns:
         dict: 天气数据字典
     """
-    cache_key = _weather_cache_key(city_adcode, extensions, activity_date)
+    cached = get_cached_weather(city_adcode, extensions, activity_date)
+    if cached or cache_only:
+        return cached
 
+    cache_key = _weather_cache_key(city_adcode, extensions, activity_date)
     if _weather_miss_hit(cache_key):
         return None
 
-    cached = _weather_cache_get(cache_key)
-    if cached:
-        return cached
+    def lookup():
+        if _weather_miss_hit(cache_key):
+            return _WEATHER_MISS
+        return _weather_cache_get(cache_key)
 
-    db_cached = _get_db_weather_cache(city_adcode, extensions, activity_date)
-    if db_cached:
-        _weather_cache_set(cache_key, db_cached, extensions)
-        return db_cached
+    def loader():
+        weather_data = fetch_weather_with_fallback(city_adcode, extensions, activity_date)
+        if weather_data:
+            store_weather_cache(city_adcode, extensions, activity_date, weather_data)
+            return weather_data
+        _weather_miss_set(cache_key, extensions)
+        return _WEATHER_MISS
 
-    started_at = time.time()
+    weather_data = _WEATHER_FLIGHT.do(cache_key, loader, lookup)
+    return None if weather_data is _WEATHER_MISS else weather_data
 
-    # 首先尝试高德API
-    logger.info("尝试使用高德API获取天气数据...")
-    weather_data = get_weather_data(city_adcode, extensions, allow_fallback=False)
-    
-    if weather_data:
-        weather_data['api_source'] = 'amap'
-        _weather_cache_set(cache_key, weather_data, extensions)
-        _save_db_weather_cache(city_adcode, extensions, activity_date, weather_data)
-        logger.info("高德API获取天气数据成功")
-        return weather_data
-    
-    # 高德API失败，尝试OpenWeather API
-    elapsed = time.time() - started_at
-    if elapsed >= WEATHER_FALLBACK_BUDGET_SECONDS:
-        logger.warning(f"天气主接口已耗时{elapsed:.2f}s，跳过备用接口以避免阻塞页面渲染")
-        _weather_miss_set(cache_key, extensions)
-        return None
 
-    logger.warning("高德API失败，尝试使用OpenWeather API作为备用...")
-    
-    # 将高德的extensions参数转换为OpenWeather的日期参数
-    if extensions == 'all' and activity_date:
-        # 预报天气
-        fallback_data = get_openweather_data('Chongqing', activity_date)
-    else:
-        # 实况天气
-        fallback_data = get_openweather_data('Chongqing', None)
-    
-    if fallback_data:
-        _weather_cache_set(cache_key, fallback_data, extensions)
-        _save_db_weather_cache(city_adcode, extensions, activity_date, fallback_data)
-        logger.info("备用OpenWeather API获取天气数据成功")
-        return fallback_data
+def activity_weather_target(activity_start_time):
+    """
+    计算活动天气的查询参数
+
+    Returns:
+        tuple: (北京时间的开始时间, 距今天数, extensions)；超出展示范围时返回None
+    """
+    if not activity_start_time:
+        return None
+    beijing_tz = pytz.timezone('Asia/Shanghai')
+    if activity_start_time.tzinfo is None:
+        localized_activity_start_time = pytz.utc.localize(activity_start_time).astimezone(beijing_tz)
     else:
-        _weather_miss_set(cache_key, extensions)
-        logger.error("所有天气API都失败，无法获取天气数据")
+        localized_activity_start_time = activity_start_time.astimezone(beijing_tz)
+
+    days_diff = (localized_activity_start_time.date() - _get_beijing_now().date()).days
+    if days_diff > WEATHER_FORECAST_DAYS or days_diff < -WEATHER_PAST_DAYS:
         return None
+    # 活动是今天或昨天取实况天气，未来取预报天气
+    return localized_activity_start_time, days_diff, 'base' if days_diff <= 0 else 'all'
+
 
-def get_activity_weather(activity_start_time):
+def get_activity_weather(activity_start_time, cache_only=False):
     """
     获取活动当天的天气信息（带备用API支持）
     
     Args:
         activity_start_time (datetime): 活动开始时间
+        cache_only (bool): 只读缓存（由后台预取写入），未命中时返回None，不阻塞页面渲染
     
     Returns:
         dict: 天气数据字典，如果超过预报范围则返回None
@@ -573,33 +671,17 @@ def get_activity_weather(activity_start_time):
         return None
     
     try:
-        beijing_tz = pytz.timezone('Asia/Shanghai')
-        if activity_start_time.tzinfo is None:
-            localized_activity_start_time = pytz.utc.localize(activity_start_time).astimezone(beijing_tz)
-        else:
-            localized_activity_start_time = activity_start_time.astimezone(beijing_tz)
-
-        now = _get_beijing_now()
-        current_date = now.date()
-        activity_date = localized_activity_start_time.date()
-        
-        # 计算活动距离今天的天数
-        days_diff = (activity_date - current_date).days
-        
-        # 如果活动超过5天，不显示天气信息
-        if days_diff > 5:
-            logger.info(f"活动日期{activity_date}超过5天预报范围，不显示天气信息")
-            return None
-        
-        # 如果活动是过去超过1天的，也不显示天气信息（避免显示不准确的当前天气）
-        if days_diff < -1:
-            logger.info(f"活动日期{activity_date}为过去日期且超过1天，不显示天气信息")
+        target = activity_weather_target(activity_start_time)
+        if not target:
+            logger.info(f"活动时间{activity_start_time}不在天气展示范围内，不显示天气信息")
             return None
+        localized_activity_start_time, days_diff, extensions = target
+        activity_date = localized_activity_start_time.date()
         
         # 判断是获取实况还是预报天气
-        if activity_date <= current_date:
+        if extensions == 'base':
             # 活动是今天或昨天，获取实况天气
-            weather_data = get_weather_data_with_fallback(CHONGQING_ADCODE, 'base', None)
+            weather_data = get_weather_data_with_fallback(CHONGQING_ADCODE, 'base', None, cache_only=cache_only)
             is_forecast = False
             if days_diff == 0:
                 forecast_note = "当日天气"
@@ -607,7 +689,7 @@ def get_activity_weather(activity_start_time):
                 forecast_note = "近期天气"
         else:
             # 活动是未来，获取预报天气
-            weather_data = get_weather_data_with_fallback(CHONGQING_ADCODE, 'all', activity_start_time)
+            weather_data = get_weather_data_with_fallback(CHONGQING_ADCODE, 'all', activity_start_time, cache_only=cache_only)
             is_forecast = True
             
             if days_diff == 1:
@@ -618,7 +700,8 @@ def get_activity_weather(activity_start_time):
                 forecast_note = f"{days_diff}天后天气预报"
         
         if weather_data:
-            # 添加活动相关信息
+            # 添加活动相关信息（复制一份，避免改动缓存中的对象）
+            weather_data = dict(weather_data)
             weather_data['activity_date'] = localized_activity_start_time.strftime('%Y-%m-%d')
             weather_data['activity_time'] = localized_activity_start_time.strftime('%H:%M')
             weather_data['is_forecast'] = is_forecast
@@ -633,7 +716,8 @@ def get_activity_weather(activity_start_time):
             
             return weather_data
         else:
-            logger.warning(f"无法获取活动日期 {activity_date} 的天气数据")
+            if not cache_only:
+                logger.warning(f"无法获取活动日期 {activity_date} 的天气数据")
             return None
             
     except Exception as e:
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+活动天气后台预取
+
+活动详情页原先同步调用 get_activity_weather：缓存未命中时先请求高德、失败再请求 OpenWeather，
+最长约 2.2 秒的预算内页面一直阻塞。这里由定时任务（flask prefetch-activity-weather）按固定间隔，
+对所有地点与开始时间已知、且在天气展示范围内的活动，刷新对应日期的天气并写入 WeatherDailyCache；
+详情页只读缓存，未命中时由前端异步请求 /activity/<id>/weather 补齐。
+目前天气均按重庆市查询，同一日期的活动共用一条缓存，因此每个日期只请求一次；
+高德预报一次返回多日数据，多个未来日期共用同一次请求结果。
+"""
+
+import logging
+from datetime import timedelta
+
+from src import db
+from src.models import Activity
+from src.utils.time_helpers import get_localized_now
+from src.utils.weather_api import (
+    CHONGQING_ADCODE, WEATHER_FORECAST_DAYS, WEATHER_PAST_DAYS,
+    activity_weather_target, fetch_weather_with_fallback, get_weather_data, store_weather_cache
+)
+
+logger = logging.getLogger(__name__)
+
+
+def upcoming_weather_targets(now=None):
+    """返回需要预取的天气目标：{(extensions, 北京日期): 该日期任一活动的开始时间}。"""
+    now = now or get_localized_now()
+    start_times = db.session.execute(
+        db.select(Activity.start_time).filter(
+            Activity.status == 'active',
+            Activity.start_time.isnot(None),
+            Activity.location.isnot(None),
+            Activity.location != '',
+            # 多放宽一天，精确范围按北京日期由 activity_weather_target 判断
+            Activity.start_time >= now - timedelta(days=WEATHER_PAST_DAYS + 1),
+            Activity.start_time < now + timedelta(days=WEATHER_FORECAST_DAYS + 1)
+        ).distinct()
+    ).scalars().all()
+
+    targets = {}
+    for start_time in start_times:
+        target = activity_weather_target(start_time)
+        if not target:
+            continue
+        localized_start_time, _, extensions = target
+        targets.setdefault((extensions, localized_start_time.date()), start_time)
+    return targets
+
+
+def prefetch_activity_weather(now=None):
+    """刷新近期活动的天气缓存，返回写入的缓存条数。"""
+    targets = upcoming_weather_targets(now)
+    if not targets:
+        return 0
+
+    refreshed = 0
+    if any(extensions == 'base' for extensions, _ in targets):
+        weather_data = fetch_weather_with_fallback(CHONGQING_ADCODE, 'base', None, budget_seconds=None)
+        if weather_data:
+            store_weather_cache(CHONGQING_ADCODE, 'base', None, weather_data)
+            refreshed += 1
+
+    forecast_targets = sorted(
+        (weather_date, start_time) for (extensions, weather_date), start_time in targets.items() if extensions == 'all'
+    )
+    if forecast_targets:
+        amap_forecast = get_weather_data(CHONGQING_ADCODE, 'all', allow_fallback=False)
+        for weather_date, start_time in forecast_targets:
+            weather_data = fetch_weather_with_fallback(
+                CHONGQING_ADCODE, 'all', start_time, budget_seconds=None, amap_data=amap_forecast or False
+            )
+            if weather_data:
+                store_weather_cache(CHONGQING_ADCODE, 'all', start_time, weather_data)
+                refreshed += 1
+            else:
+                logger.warning(f"预取 {weather_date} 的天气失败")
+    return refreshed
@@ -1,48 +1,198 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+微信小程序服务端接口
+
+原实现每次发送都新建一个 requests 连接、逐个串行调用；access_token 过期时多个进程/线程会同时去刷新，
+互相覆盖缓存，甚至使刚取到的 token 失效。这里改为进程内共享的 WeChatClient：
+    - 共享 requests.Session，按 WECHAT_HTTP_POOL_SIZE 复用 keep-alive 连接；
+    - access_token 刷新走 utils.single_flight（进程内线程锁 + 跨进程缓存 add 抢占刷新锁），
+      其余调用方等待新 token 写入缓存，不重复请求；token 被微信判定失效时只清除同一个 token 后重取一次；
+    - send_many() 以 WECHAT_SEND_CONCURRENCY 个线程并发发送，并受 WECHAT_SEND_QPS 每秒上限约束（同一进程内所有发送共用该上限）。
+模块级 get_wechat_access_token / send_subscribe_message 保持原有调用方式。
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
+from requests.adapters import HTTPAdapter
 from flask import current_app
+
 from src import cache
+from src.utils.single_flight import SingleFlight
 
-def get_wechat_access_token():
-    token = cache.get("wechat_access_token")
-    if token:
+logger = logging.getLogger(__name__)
+
+TOKEN_CACHE_KEY = 'wechat_access_token'
+TOKEN_LOCK_SECONDS = 10
+TOKEN_WAIT_SECONDS = 6
+# access_token 无效/过期
+TOKEN_INVALID_ERRCODES = (40001, 40014, 42001)
+
+_TOKEN_FLIGHT = SingleFlight(TOKEN_CACHE_KEY, lock_seconds=TOKEN_LOCK_SECONDS, wait_seconds=TOKEN_WAIT_SECONDS)
+
+
+class RateLimiter(object):
+    """线程安全的匀速限流：相邻两次放行至少间隔 1/rate 秒。"""
+
+    def __init__(self, rate_per_second):
+        self.interval = 1.0 / rate_per_second if rate_per_second and rate_per_second > 0 else 0
+        self._next_at = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next_at - now
+            self._next_at = max(now, self._next_at) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+class WeChatClient(object):
+    def __init__(self, appid, secret, pool_size=10, timeout=5, qps=20, concurrency=8):
+        self.appid = appid
+        self.secret = secret
+        self.timeout = timeout
+        self.concurrency = max(1, int(concurrency))
+        self.limiter = RateLimiter(qps)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=max(int(pool_size), self.concurrency))
+        self.session.mount('https://', adapter)
+
+    # ---- access_token ----
+
+    def _fetch_token(self):
+        resp = self.session.get(
+            'https://api.weixin.qq.com/cgi-bin/token',
+            params={'grant_type': 'client_credential', 'appid': self.appid, 'secret': self.secret},
+            timeout=self.timeout
+        ).json()
+        token = resp.get('access_token')
+        if not token:
+            logger.error(f"获取微信 access_token 失败: {resp}")
+            return None
+        # 比微信的 7200 秒略短，提前刷新
+        cache.set(TOKEN_CACHE_KEY, token, timeout=max(int(resp.get('expires_in') or 7200) - 200, 60))
+        return token
+
+    def access_token(self):
+        """返回有效的 access_token；缓存失效时只有一个调用方去刷新，其余等待。"""
+        token = cache.get(TOKEN_CACHE_KEY)
+        if token:
+            return token
+        if not self.appid or not self.secret:
+            return None
+        attempts = []
+
+        def load():
+            attempts.append(1)
+            try:
+                return self._fetch_token()
+            except Exception as e:
+                logger.error(f"获取微信 access_token 失败: {e}")
+                return None
+
+        token = None
+        for _ in range(2):
+            token = _TOKEN_FLIGHT.do('token', load, lambda: cache.get(TOKEN_CACHE_KEY))
+            # 自己刷新失败时不再重试；等待的其他进程刷新失败并释放了锁时，再争抢一次
+            if token or attempts:
+                break
         return token
-        
-    appid = current_app.config.get('WX_APPID')
-    secret = current_app.config.get('WX_APPSECRET')
-    if not appid or not secret:
-        return None
-        
-    url = f"https://api.weixin.qq.com/cgi-bin/token?grant_type=client_credential&appid={appid}&secret={secret}"
-    try:
-        resp = requests.get(url, timeout=5).json()
-        if "access_token" in resp:
-            # Cache for slightly less than 7200 seconds
-            cache.set("wechat_access_token", resp["access_token"], timeout=7000)
-            return resp["access_token"]
-    except Exception as e:
-        current_app.logger.error(f"Failed to get wechat token: {e}")
-        
-    return None
+
+    def invalidate_token(self, token):
+        """仅当缓存中仍是这个失效的 token 时才清除，避免误删别人刚刷新的新 token。"""
+        if token and cache.get(TOKEN_CACHE_KEY) == token:
+            cache.delete(TOKEN_CACHE_KEY)
+
+    # ---- 订阅消息 ----
+
+    def send_subscribe_message(self, openid, template_id, page, data):
+        for attempt in range(2):
+            token = self.access_token()
+            if not token:
+                return {'success': False, 'msg': '无 access_token'}
+            self.limiter.acquire()
+            try:
+                resp = self.session.post(
+                    'https://api.weixin.qq.com/cgi-bin/message/subscribe/send',
+                    params={'access_token': token},
+                    json={
+                        "touser": openid,
+                        "template_id": template_id,
+                        "page": page,
+                        "data": data,
+                        "miniprogram_state": "developer"  # formal / trial / developer
+                    },
+                    timeout=self.timeout
+                ).json()
+            except Exception as e:
+                return {'success': False, 'msg': str(e)}
+            errcode = resp.get('errcode')
+            if errcode == 0:
+                return {'success': True, 'msg': 'ok'}
+            if errcode in TOKEN_INVALID_ERRCODES and attempt == 0:
+                self.invalidate_token(token)
+                continue
+            return {'success': False, 'msg': str(resp), 'errcode': errcode}
+        return {'success': False, 'msg': 'access_token 无效'}
+
+    def send_many(self, messages, concurrency=None):
+        """并发发送多条订阅消息，返回与 messages 顺序一致的结果列表。
+
+        messages: [{'openid', 'template_id', 'page', 'data'}, ...]
+        """
+        messages = list(messages)
+        if not messages:
+            return []
+        # 先在当前线程取好 token，避免各发送线程同时触发刷新
+        self.access_token()
+        app = current_app._get_current_object()
+
+        def _send(message):
+            with app.app_context():
+                try:
+                    return self.send_subscribe_message(
+                        message['openid'], message['template_id'], message.get('page'), message.get('data')
+                    )
+                except Exception as e:
+                    return {'success': False, 'msg': str(e)}
+
+        workers = min(max(1, int(concurrency or self.concurrency)), len(messages))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(_send, messages))
+
+
+def get_wechat_client(app=None):
+    """返回当前应用共享的 WeChatClient（按进程创建一次）。"""
+    app = app or current_app
+    client = app.extensions.get('wechat_client')
+    if client is None:
+        client = WeChatClient(
+            app.config.get('WX_APPID'),
+            app.config.get('WX_APPSECRET'),
+            pool_size=app.config.get('WECHAT_HTTP_POOL_SIZE', 10),
+            timeout=app.config.get('WECHAT_HTTP_TIMEOUT', 5),
+            qps=app.config.get('WECHAT_SEND_QPS', 20),
+            concurrency=app.config.get('WECHAT_SEND_CONCURRENCY', 8)
+        )
+        app.extensions['wechat_client'] = client
+    return client
+
+
+def get_wechat_access_token():
+    return get_wechat_client().access_token()
+
 
 def send_subscribe_message(openid, template_id, page, data):
-    token = get_wechat_access_token()
-    if not token:
-        return {'success': False, 'msg': '无 access_token'}
-        
-    url = f"https://api.weixin.qq.com/cgi-bin/message/subscribe/send?access_token={token}"
-    payload = {
-        "touser": openid,
-        "template_id": template_id,
-        "page": page,
-        "data": data,
-        "miniprogram_state": "developer" # formal / trial / developer
-    }
-    
-    try:
-        resp = requests.post(url, json=payload, timeout=5).json()
-        if resp.get('errcode') == 0:
-            return {'success': True, 'msg': 'ok'}
-        else:
-            return {'success': False, 'msg': str(resp)}
-    except Exception as e:
-        return {'success': False, 'msg': str(e)}
+    return get_wechat_client().send_subscribe_message(openid, template_id, page, data)
+
+
+def send_many(messages, concurrency=None):
+    return get_wechat_client().send_many(messages, concurrency=concurrency)
@@ -0,0 +1,23 @@
+"""
+AI 对话流式接口（/utils/api/ai_chat）的 gevent 入口。
+
+主服务使用同步 worker，每个进行中的对话会独占一个 worker 直到生成结束；
+Nginx 把流式接口单独转发到以本入口启动的 gevent worker，少量进程即可承载大量并发流：
+    gunicorn -k gevent --workers 2 --worker-connections 500 --bind 127.0.0.1:8083 stream_wsgi:app
+"""
+import os
+
+from gevent import monkey
+
+monkey.patch_all()
+
+from psycogreen.gevent import patch_psycopg
+
+patch_psycopg()
+
+# 每个 worker 承载的并发流远多于同步 worker，相应保留更多到 Ark 的 keep-alive 连接
+os.environ.setdefault('LLM_HTTP_POOL_SIZE', '200')
+
+from src import create_app
+
+app = create_app('production')